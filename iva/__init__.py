@@ -0,0 +1,10 @@
+"""Python tooling around the DeepStream IVA lab pipelines.
+
+The lab itself lives in ``main.py`` (an exported notebook). This package
+holds the reusable pieces that sit next to those pipelines: metadata
+schema, recording/replay, analytics and measurement helpers.
+"""
+
+from .meta import FrameMeta, ObjectMeta
+
+__all__ = ["FrameMeta", "ObjectMeta"]
@@ -0,0 +1,546 @@
+"""Merge nvmsgbroker event streams from many nodes and roll them up.
+
+With streams sharded over machines (:mod:`iva.shard`), every node's
+nvmsgbroker sends its own payloads – the ``logs.txt`` of section 10 or
+Kafka messages – and they reach a central consumer out of order.
+:class:`Aggregator` takes batches of events per node and
+
+* merges them into one stream ordered by event time with
+  :class:`iva.shard.OrderedMerger`: each node's watermark is its newest
+  event minus ``lateness``; silent nodes stop holding the merge back after
+  ``idle_timeout``; events behind the merged stream are counted as late;
+* rolls the merged stream up incrementally into :class:`WindowedCounts`
+  (events per class per camera per minute by default); a window is final
+  once the watermark has passed its end;
+* serves rollups, recent events and counters over a local HTTP API
+  (:class:`AggregateServer`: ``/rollups``, ``/events``, ``/stats``).
+
+Payloads in the DeepStream schema are parsed by :func:`parse_payload`
+(full schema, one object per message, and minimal schema with
+``objects`` as ``"id|left|top|right|bottom|label"`` strings).
+:class:`LogTailSource` follows a broker log file; :class:`LineBroker` is a
+local stand-in broker that nodes connect to over TCP and publish one JSON
+payload per line. ``python -m iva.aggregate --bench`` drives the service
+with synthetic nodes to measure sustained events/sec.
+"""
+
+import calendar
+import json
+import queue
+import random
+import socket
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from .shard import OrderedMerger
+
+NS = 10**9
+
+# Object sub-keys of the full DeepStream schema that name the class.
+SCHEMA_CLASSES = ("vehicle", "person", "face", "bicycle", "roadsign")
+
+# (event time ns, node, sensor id, class name, object id)
+Event = Tuple[int, str, str, str, str]
+
+
+# -- payload parsing -------------------------------------------------------
+
+_second_cache: Dict[str, int] = {}
+
+
+def parse_timestamp(text: str) -> int:
+    """``2019-05-17T09:23:59.123Z`` (UTC) to ns since the epoch."""
+    head = text[:19]
+    base = _second_cache.get(head)
+    if base is None:
+        if len(_second_cache) > 4096:
+            _second_cache.clear()
+        base = calendar.timegm(time.strptime(head, "%Y-%m-%dT%H:%M:%S")) * NS
+        _second_cache[head] = base
+    frac = text[20:].rstrip("Z")
+    if text[19:20] == "." and frac:
+        return base + int(frac[:9].ljust(9, "0"))
+    return base
+
+
+def format_timestamp(ns: int) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ns // NS)) + \
+        ".%03dZ" % (ns % NS // 1000000)
+
+
+def parse_payload(payload: dict, node: str = "") -> List[Event]:
+    """Events in one DeepStream-schema payload (full or minimal)."""
+    ts = parse_timestamp(payload["@timestamp"])
+    if "objects" in payload:
+        sensor = str(payload.get("sensorId", ""))
+        events = []
+        for entry in payload["objects"]:
+            fields = entry.split("|")
+            label = fields[5] if len(fields) > 5 else ""
+            events.append((ts, node, sensor, label, fields[0]))
+        return events
+    sensor = str(payload.get("sensor", {}).get("id", ""))
+    obj = payload.get("object", {})
+    cls = next((k for k in SCHEMA_CLASSES if k in obj), "")
+    return [(ts, node, sensor, cls, str(obj.get("id", "")))]
+
+
+def iter_json_objects(text: str, decoder=json.JSONDecoder()) -> Tuple[List[dict], int]:
+    """Concatenated (possibly pretty-printed) JSON objects; returns (objects, consumed)."""
+    objects = []
+    pos = 0
+    n = len(text)
+    while True:
+        while pos < n and text[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= n:
+            return objects, pos
+        try:
+            obj, end = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return objects, pos  # incomplete tail, wait for more
+        objects.append(obj)
+        pos = end
+
+
+# -- rollups ---------------------------------------------------------------
+
+@dataclass
+class Rollup:
+    window_start: int
+    sensor: str
+    cls: str
+    count: int
+    final: bool
+
+    def as_dict(self) -> Dict[str, object]:
+        return {"window_start": format_timestamp(self.window_start), "camera": self.sensor,
+                "class": self.cls, "count": self.count, "final": self.final}
+
+
+class WindowedCounts:
+    """Tumbling-window counts per ``(sensor, class)``, updated per event.
+
+    Events must arrive in time order (the merged stream). Windows whose
+    end is at or below the watermark are closed and kept for ``retain``
+    windows.
+    """
+
+    def __init__(self, window: float = 60.0, retain: int = 1440):
+        self.window_ns = int(window * NS)
+        self.retain = retain
+        self.open: Dict[int, Dict[Tuple[str, str], int]] = {}
+        self.closed: Deque[Tuple[int, Dict[Tuple[str, str], int]]] = deque(maxlen=retain)
+
+    def add(self, t: int, sensor: str, cls: str) -> None:
+        start = t - t % self.window_ns
+        counts = self.open.get(start)
+        if counts is None:
+            counts = self.open[start] = {}
+        key = (sensor, cls)
+        counts[key] = counts.get(key, 0) + 1
+
+    def close_until(self, watermark: int) -> int:
+        """Close windows ending at or before ``watermark``; returns how many."""
+        done = sorted(s for s in self.open if s + self.window_ns <= watermark)
+        for start in done:
+            self.closed.append((start, self.open.pop(start)))
+        return len(done)
+
+    def query(self, since: Optional[int] = None, sensor: Optional[str] = None,
+              cls: Optional[str] = None) -> List[Rollup]:
+        rows = []
+        windows = [(s, c, True) for s, c in self.closed] + \
+                  [(s, c, False) for s, c in sorted(self.open.items())]
+        for start, counts, final in windows:
+            if since is not None and start + self.window_ns <= since:
+                continue
+            for (s, c), n in sorted(counts.items()):
+                if (sensor is None or s == sensor) and (cls is None or c == cls):
+                    rows.append(Rollup(start, s, c, n, final))
+        return rows
+
+
+# -- aggregator ------------------------------------------------------------
+
+class Aggregator:
+    """Ordered merge plus incremental rollups over per-node event batches."""
+
+    def __init__(self, window: float = 60.0, lateness: float = 2.0, idle_timeout: float = 5.0,
+                 recent: int = 1000, clock: Callable[[], float] = time.monotonic):
+        self.merger = OrderedMerger(key=lambda e: e[0], lateness_ns=int(lateness * NS),
+                                    idle_timeout=idle_timeout, clock=clock)
+        self.rollups = WindowedCounts(window)
+        self.recent: Deque[Event] = deque(maxlen=recent)
+        self.consumers: List[Callable[[Event], None]] = []
+        self.ingested = 0
+        self.emitted = 0
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def ingest(self, node: str, events: Iterable[Event]) -> None:
+        with self._lock:
+            push = self.merger.push
+            n = 0
+            for e in events:
+                push(node, e, e[0])
+                n += 1
+            self.ingested += n
+
+    def advance(self) -> int:
+        """Release merged events into the rollups; returns how many."""
+        with self._lock:
+            ready = self.merger.pop_ready()
+            add = self.rollups.add
+            for e in ready:
+                add(e[0], e[2], e[3])
+            self.recent.extend(ready[-self.recent.maxlen:])
+            wm = self.merger.watermark()
+            if wm is None:
+                wm = self.merger.released_until + 1
+            self.rollups.close_until(wm)
+            self.emitted += len(ready)
+        for consumer in self.consumers:
+            for e in ready:
+                consumer(e)
+        return len(ready)
+
+    def query(self, **filters) -> List[Dict[str, object]]:
+        with self._lock:
+            return [r.as_dict() for r in self.rollups.query(**filters)]
+
+    def recent_events(self, limit: int = 100) -> List[Dict[str, object]]:
+        with self._lock:
+            events = list(self.recent)[-limit:]
+        return [{"time": format_timestamp(e[0]), "node": e[1], "camera": e[2], "class": e[3],
+                 "object_id": e[4]} for e in events]
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            wm = self.merger.watermark()
+            elapsed = time.monotonic() - self._started
+            return {"ingested": self.ingested, "emitted": self.emitted,
+                    "late": self.merger.late, "pending": self.merger.pending,
+                    "watermark": format_timestamp(wm) if wm and wm > 0 else None,
+                    "open_windows": len(self.rollups.open),
+                    "events_per_sec": round(self.ingested / elapsed, 1) if elapsed > 0 else 0.0}
+
+
+def run(aggregator: Aggregator, inbox: "queue.Queue", stop: threading.Event,
+        tick: float = 0.05) -> None:
+    """Drain ``(node, events)`` batches from ``inbox`` and advance the merge."""
+    next_tick = time.monotonic() + tick
+    while not stop.is_set():
+        try:
+            node, events = inbox.get(timeout=tick)
+            aggregator.ingest(node, events)
+        except queue.Empty:
+            pass
+        if time.monotonic() >= next_tick:
+            aggregator.advance()
+            next_tick = time.monotonic() + tick
+    aggregator.advance()
+
+
+# -- sources ---------------------------------------------------------------
+
+class LogTailSource:
+    """Follow a broker log file (``logs.txt``) and queue its events."""
+
+    def __init__(self, path: str, node: str, inbox: "queue.Queue", poll: float = 0.2,
+                 from_start: bool = True):
+        self.path = path
+        self.node = node
+        self.inbox = inbox
+        self.poll = poll
+        self.from_start = from_start
+
+    def run(self, stop: threading.Event) -> None:
+        buf = ""
+        with open(self.path) as fp:
+            if not self.from_start:
+                fp.seek(0, 2)
+            while not stop.is_set():
+                chunk = fp.read(1 << 20)
+                if not chunk:
+                    stop.wait(self.poll)
+                    continue
+                buf += chunk
+                objects, used = iter_json_objects(buf)
+                buf = buf[used:]
+                events = []
+                for payload in objects:
+                    events.extend(parse_payload(payload, self.node))
+                if events:
+                    self.inbox.put((self.node, events))
+
+
+class LineBroker:
+    """Local stand-in broker: nodes connect over TCP and send JSON lines.
+
+    The first line of a connection names the node (``{"node": "n1"}``);
+    every following line is one DeepStream payload. The events of each
+    socket read are queued right away, so a slow publisher's events are
+    not held back until more arrive. Lines that are not valid payloads are
+    counted in ``rejected`` and skipped.
+    """
+
+    def __init__(self, inbox: "queue.Queue", host: str = "127.0.0.1", port: int = 0):
+        self.inbox = inbox
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._sock.getsockname()
+
+    def start(self) -> "LineBroker":
+        t = threading.Thread(target=self._accept, name="iva-broker", daemon=True)
+        t.start()
+        self._threads.append(t)
+        return self
+
+    def _accept(self) -> None:
+        self._sock.settimeout(0.2)
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            t = threading.Thread(target=self._serve, args=(conn,), daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _serve(self, conn: socket.socket) -> None:
+        node: Optional[str] = None
+        buf = b""
+        conn.settimeout(0.2)
+        with conn:
+            while not self._stop.is_set():
+                try:
+                    chunk = conn.recv(1 << 20)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                if not chunk:
+                    break
+                lines = (buf + chunk).split(b"\n")
+                buf = lines.pop()
+                node = self._handle(node, lines)
+                if node is None:
+                    return  # no valid node line: drop the connection
+            if buf.strip() and node is not None:
+                self._handle(node, [buf])
+
+    def _handle(self, node: Optional[str], lines: List[bytes]) -> Optional[str]:
+        """Queue the events of complete ``lines``; returns the connection's node."""
+        loads = json.loads
+        batch: List[Event] = []
+        rejected = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                payload = loads(line)
+                if node is None:
+                    node = str(payload["node"])
+                    continue
+                batch.extend(parse_payload(payload, node))
+            except (ValueError, KeyError, TypeError, AttributeError, IndexError):
+                rejected += 1
+                if node is None:
+                    break
+        if rejected:
+            with self._lock:
+                self.rejected += rejected
+        if batch:
+            self.inbox.put((node, batch))
+        return node
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._sock.close()
+
+
+def publish(address: Tuple[str, int], node: str, payloads: Iterable[dict]) -> int:
+    """Connect to a :class:`LineBroker` as ``node`` and send payloads."""
+    sent = 0
+    with socket.create_connection(address) as sock, sock.makefile("w") as fp:
+        fp.write(json.dumps({"node": node}) + "\n")
+        for payload in payloads:
+            fp.write(json.dumps(payload, separators=(",", ":")) + "\n")
+            sent += 1
+    return sent
+
+
+def synthetic_payloads(node: str, cameras: int, rate: float, seconds: float,
+                       start_ns: int, max_delay: float = 1.0, seed: int = 0,
+                       objects_per_message: int = 4) -> List[dict]:
+    """Minimal-schema payloads of one node, delivered with up to ``max_delay`` skew."""
+    rng = random.Random("%s:%d" % (node, seed))
+    labels = ("Vehicle", "Person", "Bicycle", "Roadsign")
+    count = int(rate * seconds / objects_per_message)
+    out = []
+    for i in range(count):
+        t = start_ns + int(i * seconds * NS / count) - int(rng.uniform(0, max_delay) * NS)
+        objs = ["%d|10|10|50|50|%s" % (rng.randrange(1000), rng.choice(labels))
+                for _ in range(objects_per_message)]
+        out.append({"@timestamp": format_timestamp(t),
+                    "sensorId": "%s-cam%d" % (node, rng.randrange(cameras)), "objects": objs})
+    return out
+
+
+# -- HTTP API --------------------------------------------------------------
+
+class AggregateServer:
+    """``/rollups?camera=&class=&since=``, ``/events?limit=`` and ``/stats``."""
+
+    def __init__(self, aggregator: Aggregator, host: str = "127.0.0.1", port: int = 8088):
+        agg = aggregator
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                args = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                if url.path == "/rollups":
+                    since = args.get("since")
+                    result = agg.query(
+                        since=parse_timestamp(since) if since else None,
+                        sensor=args.get("camera"), cls=args.get("class"))
+                elif url.path == "/events":
+                    result = agg.recent_events(int(args.get("limit", 100)))
+                elif url.path == "/stats":
+                    result = agg.stats()
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(result).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self):
+        return self._httpd.server_address
+
+    def start(self) -> "AggregateServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        name="iva-aggregate", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def bench(nodes: int = 4, cameras: int = 8, rate: float = 100000.0, seconds: float = 5.0,
+          lateness: float = 1.5) -> Dict[str, object]:
+    """Push pre-parsed synthetic events from ``nodes`` through the aggregator.
+
+    Measures the merge and rollup path; payload parsing happens before the
+    clock starts (it runs on the per-connection broker threads in service).
+    """
+    start = time.time_ns()
+    per_node = {}
+    for n in range(nodes):
+        node = "node%d" % n
+        events = []
+        for payload in synthetic_payloads(node, cameras, rate / nodes, seconds, start,
+                                          max_delay=lateness * 0.8):
+            events.extend(parse_payload(payload, node))
+        per_node[node] = events
+    agg = Aggregator(lateness=lateness)
+    batch = 512
+    t0 = time.perf_counter()
+    offsets = {node: 0 for node in per_node}
+    while any(offsets[n] < len(e) for n, e in per_node.items()):
+        for node, events in per_node.items():
+            i = offsets[node]
+            if i < len(events):
+                agg.ingest(node, events[i:i + batch])
+                offsets[node] = i + batch
+        agg.advance()
+    for node in per_node:
+        agg.merger.remove_input(node)
+    agg.advance()
+    elapsed = time.perf_counter() - t0
+    total = sum(len(e) for e in per_node.values())
+    return {"events": total, "seconds": round(elapsed, 3),
+            "events_per_sec": round(total / elapsed), "emitted": agg.emitted,
+            "late": agg.merger.late, "rollup_rows": len(agg.query())}
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Aggregate nvmsgbroker events across nodes.")
+    parser.add_argument("--log", action="append", default=[], metavar="NODE=PATH",
+                        help="follow a broker log file (e.g. deepstream-test4 logs.txt)")
+    parser.add_argument("--listen", metavar="HOST:PORT", help="run the stand-in TCP broker")
+    parser.add_argument("--http", type=int, default=8088, help="API port")
+    parser.add_argument("--window", type=float, default=60.0)
+    parser.add_argument("--lateness", type=float, default=2.0)
+    parser.add_argument("--bench", action="store_true", help="measure merge+rollup throughput")
+    parser.add_argument("--rate", type=float, default=100000.0)
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        print(json.dumps(bench(rate=args.rate)))
+        return 0
+
+    inbox: "queue.Queue" = queue.Queue(maxsize=10000)
+    agg = Aggregator(window=args.window, lateness=args.lateness)
+    stop = threading.Event()
+    threads = []
+    for spec in args.log:
+        node, _, path = spec.partition("=")
+        src = LogTailSource(path, node, inbox)
+        threads.append(threading.Thread(target=src.run, args=(stop,), daemon=True))
+    broker = None
+    if args.listen:
+        host, _, port = args.listen.rpartition(":")
+        broker = LineBroker(inbox, host or "127.0.0.1", int(port)).start()
+    server = AggregateServer(agg, port=args.http).start()
+    for t in threads:
+        t.start()
+    print("API on http://%s:%d/rollups" % server.address[:2])
+    try:
+        run(agg, inbox, stop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.stop()
+        if broker is not None:
+            broker.stop()
+            print("broker rejected %d malformed lines" % broker.rejected)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
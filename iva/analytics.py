@@ -0,0 +1,424 @@
+"""Track-aware counting, line crossing and zone dwell.
+
+``osd_sink_pad_buffer_probe`` in the lab recounts vehicles and persons on
+every frame, so one car parked for a minute counts 1800 times.
+:class:`AnalyticsEngine` is a metadata consumer that follows tracker ids
+instead:
+
+* unique counts – each ``(source, object_id)`` is counted once per class;
+* line crossing – a :class:`Line` from ``p1`` to ``p2`` counts footpoints
+  that move across the segment, ``in`` when crossing from its left to its
+  right (image coordinates, y down) and ``out`` the other way;
+* zone dwell – a :class:`Zone` polygon counts entries, keeps occupancy and
+  records how long each track stayed inside (entry to exit, or to its last
+  sighting when the track is dropped).
+
+Per stream the state of live tracks lives in :class:`TrackTable`: numpy
+arrays indexed by a slot per track (last footpoint, class, line sides,
+zone membership and entry time), a dict from tracker id to slot, and a
+free list, so updating a track is O(1) amortized and a frame is a few
+vectorized operations over its objects. Tracks unseen for ``max_age``
+frames are swept and their slots reused.
+
+Zones and lines are read from JSON, per source id or ``"*"`` for all::
+
+    {"*": {"zones": [{"name": "gate", "polygon": [[100, 400], [600, 400],
+                                                  [600, 720], [100, 720]]}],
+           "lines": [{"name": "stop", "p1": [0, 500], "p2": [1280, 500]}]}}
+
+``python -m iva.analytics recording.jsonl.gz --rois rois.json`` runs the
+engine over a :mod:`iva.replay` recording.
+"""
+
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .meta import FrameMeta, class_label
+
+NS = 10**9
+
+Point = Tuple[float, float]
+
+
+@dataclass(frozen=True)
+class Zone:
+    name: str
+    polygon: Tuple[Point, ...]
+
+    @classmethod
+    def from_dict(cls, d) -> "Zone":
+        return cls(d["name"], tuple((float(x), float(y)) for x, y in d["polygon"]))
+
+
+@dataclass(frozen=True)
+class Line:
+    name: str
+    p1: Point
+    p2: Point
+
+    @classmethod
+    def from_dict(cls, d) -> "Line":
+        return cls(d["name"], tuple(map(float, d["p1"])), tuple(map(float, d["p2"])))
+
+
+@dataclass
+class AnalyticsEvent:
+    kind: str  # "new", "cross", "enter", "exit"
+    source_id: int
+    object_id: int
+    class_id: int
+    pts: int
+    name: str = ""
+    direction: str = ""
+    dwell: float = 0.0  # seconds, for "exit"
+
+
+def points_in_polygon(xs: np.ndarray, ys: np.ndarray, polygon: Sequence[Point]) -> np.ndarray:
+    """Even-odd test of many points against one polygon."""
+    inside = np.zeros(len(xs), dtype=bool)
+    n = len(polygon)
+    for i in range(n):
+        x1, y1 = polygon[i]
+        x2, y2 = polygon[(i + 1) % n]
+        if y1 == y2:
+            continue
+        straddles = (y1 > ys) != (y2 > ys)
+        x_cross = x1 + (ys - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= straddles & (xs < x_cross)
+    return inside
+
+
+class PolygonZones:
+    """Zone membership by testing every polygon in turn.
+
+    Cost grows with zones x edges per point; for many zones per camera use
+    :class:`iva.zone_index.GridZoneIndex` instead.
+    """
+
+    def __init__(self, zones: Sequence[Zone]):
+        self.zones = list(zones)
+
+    def contains(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        """``[len(xs), len(zones)]`` boolean membership."""
+        out = np.zeros((len(xs), len(self.zones)), dtype=bool)
+        for j, zone in enumerate(self.zones):
+            out[:, j] = points_in_polygon(xs, ys, zone.polygon)
+        return out
+
+
+class TrackTable:
+    """Compact per-stream state of live tracks, one array row per slot."""
+
+    def __init__(self, num_zones: int, num_lines: int, capacity: int = 64):
+        self.num_zones = num_zones
+        self.num_lines = num_lines
+        self.slot_of: Dict[int, int] = {}
+        self.free: List[int] = []
+        self.high = 0
+        self._alloc(capacity)
+
+    def _alloc(self, capacity: int) -> None:
+        old = getattr(self, "capacity", 0)
+        self.capacity = capacity
+
+        def grow(name, shape, dtype):
+            arr = np.zeros(shape, dtype)
+            if old:
+                arr[:old] = getattr(self, name)
+            setattr(self, name, arr)
+
+        grow("object_id", capacity, np.int64)
+        grow("class_id", capacity, np.int32)
+        grow("x", capacity, np.float32)
+        grow("y", capacity, np.float32)
+        grow("last_frame", capacity, np.int64)
+        grow("last_pts", capacity, np.int64)
+        grow("live", capacity, bool)
+        grow("side", (capacity, self.num_lines), np.int8)
+        grow("inside", (capacity, self.num_zones), bool)
+        grow("entered_pts", (capacity, self.num_zones), np.int64)
+
+    def lookup(self, object_ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Slots for ``object_ids``, allocating new ones; returns (slots, is_new)."""
+        slots = np.empty(len(object_ids), dtype=np.int64)
+        new = np.zeros(len(object_ids), dtype=bool)
+        slot_of = self.slot_of
+        for i, oid in enumerate(object_ids):
+            slot = slot_of.get(oid)
+            if slot is None:
+                if self.free:
+                    slot = self.free.pop()
+                else:
+                    if self.high == self.capacity:
+                        self._alloc(self.capacity * 2)
+                    slot = self.high
+                    self.high += 1
+                slot_of[oid] = slot
+                new[i] = True
+            slots[i] = slot
+        fresh = slots[new]
+        self.live[fresh] = True
+        self.object_id[fresh] = np.asarray(object_ids, dtype=np.int64)[new]
+        self.side[fresh] = 0
+        self.inside[fresh] = False
+        return slots, new
+
+    def expire(self, frame_num: int, max_age: int) -> np.ndarray:
+        """Free slots unseen for more than ``max_age`` frames; returns them."""
+        n = self.high
+        stale = np.nonzero(self.live[:n] & (frame_num - self.last_frame[:n] > max_age))[0]
+        for slot in stale:
+            del self.slot_of[int(self.object_id[slot])]
+            self.free.append(int(slot))
+        self.live[stale] = False
+        return stale
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+
+@dataclass
+class DwellStats:
+    entries: int = 0
+    exits: int = 0
+    total: float = 0.0
+    longest: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.exits if self.exits else 0.0
+
+
+@dataclass
+class StreamAnalytics:
+    zones: List[Zone]
+    lines: List[Line]
+    table: TrackTable
+    hit_test: object
+    unique: Counter = field(default_factory=Counter)
+    crossings: Dict[Tuple[str, str, int], int] = field(default_factory=Counter)
+    dwell: Dict[Tuple[str, int], DwellStats] = field(default_factory=dict)
+    frames: int = 0
+    updates: int = 0
+
+
+class AnalyticsEngine:
+    """Incremental per-stream analytics over tracked objects.
+
+    ``rois`` maps a source id (or ``"*"``) to ``{"zones": [...], "lines": [...]}``.
+    ``hit_test_factory`` builds the zone membership tester for a stream's
+    zones; it must offer ``contains(xs, ys) -> [n, zones]``.
+    """
+
+    def __init__(self, rois: Optional[Dict[str, Dict]] = None, max_age: int = 30,
+                 sweep_every: int = 30,
+                 hit_test_factory: Callable[[Sequence[Zone]], object] = PolygonZones):
+        self.rois = rois or {}
+        self.max_age = max_age
+        self.sweep_every = sweep_every
+        self.hit_test_factory = hit_test_factory
+        self.streams: Dict[int, StreamAnalytics] = {}
+        self.listeners: List[Callable[[AnalyticsEvent], None]] = []
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> "AnalyticsEngine":
+        with open(path) as fp:
+            return cls(json.load(fp), **kwargs)
+
+    def stream(self, source_id: int) -> StreamAnalytics:
+        st = self.streams.get(source_id)
+        if st is None:
+            roi = self.rois.get(str(source_id), self.rois.get("*", {}))
+            zones = [Zone.from_dict(z) for z in roi.get("zones", [])]
+            lines = [Line.from_dict(l) for l in roi.get("lines", [])]
+            st = self.streams[source_id] = StreamAnalytics(
+                zones, lines, TrackTable(len(zones), len(lines)),
+                self.hit_test_factory(zones) if zones else None)
+        return st
+
+    def _emit(self, event: AnalyticsEvent, out: List[AnalyticsEvent]) -> None:
+        out.append(event)
+        for listener in self.listeners:
+            listener(event)
+
+    def update(self, frame: FrameMeta) -> List[AnalyticsEvent]:
+        """Fold one frame into the stream state; returns the events it caused."""
+        st = self.stream(frame.source_id)
+        table = st.table
+        events: List[AnalyticsEvent] = []
+        st.frames += 1
+        objs = [o for o in frame.objects if o.object_id >= 0]
+        if objs:
+            ids = [o.object_id for o in objs]
+            cls = np.fromiter((o.class_id for o in objs), np.int32, len(objs))
+            fx = np.fromiter((o.left + o.width / 2.0 for o in objs), np.float32, len(objs))
+            fy = np.fromiter((o.top + o.height for o in objs), np.float32, len(objs))
+            slots, new = table.lookup(ids)
+            st.updates += len(objs)
+            for i in np.nonzero(new)[0]:
+                st.unique[int(cls[i])] += 1
+                self._emit(AnalyticsEvent("new", frame.source_id, ids[i], int(cls[i]),
+                                          frame.pts), events)
+            # New tracks start where they are first seen.
+            px = np.where(new, fx, table.x[slots])
+            py = np.where(new, fy, table.y[slots])
+            if st.lines:
+                self._lines(st, frame, slots, ids, cls, px, py, fx, fy, events)
+            if st.zones:
+                self._zones(st, frame, slots, ids, cls, fx, fy, events)
+            table.x[slots] = fx
+            table.y[slots] = fy
+            table.class_id[slots] = cls
+            table.last_frame[slots] = frame.frame_num
+            table.last_pts[slots] = frame.pts
+        if st.frames % self.sweep_every == 0:
+            self._sweep(st, frame, events)
+        return events
+
+    __call__ = update
+
+    def _lines(self, st, frame, slots, ids, cls, px, py, fx, fy, events) -> None:
+        table = st.table
+        for j, line in enumerate(st.lines):
+            (ax, ay), (bx, by) = line.p1, line.p2
+            dx, dy = bx - ax, by - ay
+            side = np.sign(dx * (fy - ay) - dy * (fx - ax)).astype(np.int8)
+            prev = table.side[slots, j]
+            changed = (prev != 0) & (side != 0) & (side != prev)
+            if changed.any():
+                # The move must cross the segment itself, not its extension.
+                mx, my = fx - px, fy - py
+                denom = dx * my - dy * mx
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    t = ((px - ax) * my - (py - ay) * mx) / denom
+                changed &= (t >= 0) & (t <= 1)
+                for i in np.nonzero(changed)[0]:
+                    # side > 0 is the right of p1->p2 with y pointing down.
+                    direction = "out" if side[i] < 0 else "in"
+                    st.crossings[(line.name, direction, int(cls[i]))] += 1
+                    self._emit(AnalyticsEvent("cross", frame.source_id, ids[i], int(cls[i]),
+                                              frame.pts, line.name, direction), events)
+            keep = side != 0
+            table.side[slots[keep], j] = side[keep]
+
+    def _zones(self, st, frame, slots, ids, cls, fx, fy, events) -> None:
+        table = st.table
+        now = st.hit_test.contains(fx, fy)
+        before = table.inside[slots]
+        entered = now & ~before
+        exited = before & ~now
+        if entered.any():
+            rows, cols = np.nonzero(entered)
+            table.entered_pts[slots[rows], cols] = frame.pts
+            for i, j in zip(rows, cols):
+                name = st.zones[j].name
+                self._dwell(st, name, int(cls[i])).entries += 1
+                self._emit(AnalyticsEvent("enter", frame.source_id, ids[i], int(cls[i]),
+                                          frame.pts, name), events)
+        if exited.any():
+            rows, cols = np.nonzero(exited)
+            for i, j in zip(rows, cols):
+                since = table.entered_pts[slots[i], j]
+                self._exit(st, frame.source_id, ids[i], int(cls[i]), j, since,
+                           int(table.last_pts[slots[i]]), events)
+        table.inside[slots] = now
+
+    def _dwell(self, st, zone: str, class_id: int) -> DwellStats:
+        key = (zone, class_id)
+        stats = st.dwell.get(key)
+        if stats is None:
+            stats = st.dwell[key] = DwellStats()
+        return stats
+
+    def _exit(self, st, source_id, object_id, class_id, zone_index, since, until, events) -> None:
+        name = st.zones[zone_index].name
+        seconds = max(0, until - since) / NS
+        stats = self._dwell(st, name, class_id)
+        stats.exits += 1
+        stats.total += seconds
+        stats.longest = max(stats.longest, seconds)
+        self._emit(AnalyticsEvent("exit", source_id, object_id, class_id, until, name,
+                                  dwell=seconds), events)
+
+    def _sweep(self, st, frame, events) -> None:
+        table = st.table
+        n = table.high
+        stale = table.live[:n] & (frame.frame_num - table.last_frame[:n] > self.max_age)
+        if st.zones and stale.any():
+            # Tracks that vanish inside a zone leave at their last sighting.
+            rows, cols = np.nonzero(table.inside[:n] & stale[:, None])
+            for slot, j in zip(rows, cols):
+                self._exit(st, frame.source_id, int(table.object_id[slot]),
+                           int(table.class_id[slot]), j, table.entered_pts[slot, j],
+                           int(table.last_pts[slot]), events)
+        table.expire(frame.frame_num, self.max_age)
+
+    def occupancy(self, source_id: int) -> Dict[str, int]:
+        st = self.stream(source_id)
+        n = st.table.high
+        live = st.table.live[:n]
+        counts = st.table.inside[:n][live].sum(axis=0) if n else np.zeros(len(st.zones), int)
+        return {z.name: int(c) for z, c in zip(st.zones, counts)}
+
+    def summary_text(self, source_id: int) -> str:
+        """OSD line with unique counts, in place of the lab's per-frame counts."""
+        st = self.stream(source_id)
+        parts = ["%s Count=%d" % (class_label(c), n) for c, n in sorted(st.unique.items())]
+        for (name, direction, c), n in sorted(st.crossings.items()):
+            parts.append("%s %s %s=%d" % (name, direction, class_label(c), n))
+        return " ".join(parts)
+
+    def report(self) -> Dict[str, object]:
+        out = {}
+        for sid, st in sorted(self.streams.items()):
+            out[str(sid)] = {
+                "frames": st.frames,
+                "live_tracks": len(st.table),
+                "unique": {class_label(c): n for c, n in sorted(st.unique.items())},
+                "crossings": [{"line": l, "direction": d, "class": class_label(c), "count": n}
+                              for (l, d, c), n in sorted(st.crossings.items())],
+                "dwell": [{"zone": z, "class": class_label(c), "entries": s.entries,
+                           "exits": s.exits, "mean_s": round(s.mean, 2),
+                           "max_s": round(s.longest, 2)}
+                          for (z, c), s in sorted(st.dwell.items())],
+                "occupancy": self.occupancy(sid),
+            }
+        return out
+
+
+def main(argv=None) -> int:
+    import argparse
+    import time
+
+    from .replay import ReplaySource
+
+    parser = argparse.ArgumentParser(description="Run track analytics over a recording.")
+    parser.add_argument("recording")
+    parser.add_argument("--rois", help="zones/lines JSON")
+    parser.add_argument("--max-age", type=int, default=30)
+    parser.add_argument("--index", choices=("brute", "grid"), default="brute",
+                        help="zone hit-test: per-polygon, or iva.zone_index grid")
+    args = parser.parse_args(argv)
+
+    kwargs = {"max_age": args.max_age}
+    if args.index == "grid":
+        from .zone_index import GridZoneIndex
+        kwargs["hit_test_factory"] = GridZoneIndex
+    engine = (AnalyticsEngine.from_file(args.rois, **kwargs) if args.rois
+              else AnalyticsEngine(**kwargs))
+    start = time.perf_counter()
+    stats = ReplaySource(args.recording, speed=None, preload=True).run(engine)
+    elapsed = time.perf_counter() - start
+    print(json.dumps(engine.report(), indent=2))
+    updates = sum(st.updates for st in engine.streams.values())
+    print("frames=%d track updates=%d (%.0f/s)" % (stats.frames, updates,
+                                                   updates / elapsed if elapsed else 0.0))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
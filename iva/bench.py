@@ -0,0 +1,510 @@
+"""Headless benchmark runner for the lab workloads.
+
+``main.py`` runs each exercise with ``get_ipython().system(...)`` and
+hard-coded paths, so nothing can be rerun or compared later. Here the
+section 4–11 workloads are named :class:`BenchCase` entries in
+:data:`CASES` (``test1`` … ``test4``, ``mux``, ``dsexample``,
+``dewarper`` and the section 11 multi-stream ``deepstream-app`` run,
+``app4``) with paths relative to the ``DeepStream_Release`` root.
+
+Frames are counted from what the workload prints anyway: the per-frame
+line of the test apps, the periodic ``last-message`` of an
+``fpsdisplaysink`` tap for ``gst-launch-1.0`` pipelines, and the
+``**PERF:`` lines of ``deepstream-app``. Nothing is printed per buffer, so
+the measurement does not slow the pipeline down.
+
+Each run produces a versioned JSON bundle holding the environment
+(host, GPU, driver, GStreamer, git revision), a SHA-256 of every config
+file the case reads, and per case: frames, wall time, fps, frame-interval
+percentiles (time between frames leaving the pipeline, averaged over each
+report window for the periodic counters) and CPU/GPU/decoder
+utilization. These are throughput numbers; per-element latency is measured
+with :mod:`iva.latency`. :func:`compare` diffs two bundles and flags fps
+drops and frame-interval increases beyond a tolerance.
+
+:class:`ShellExecutor` runs the real commands; :class:`StubExecutor`
+returns deterministic synthetic numbers so the runner, bundle format and
+comparison can be exercised in CPU-only CI::
+
+    python -m iva.bench run test1 test2 --root DeepStream_Release --out base.json
+    python -m iva.bench run --stub --out ci.json
+    python -m iva.bench compare base.json new.json --fps-tolerance 0.05
+"""
+
+import hashlib
+import json
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .pipeline import OUTPUT_HEADLESS, PipelineBuilder
+
+BUNDLE_FORMAT = "iva-bench"
+BUNDLE_VERSION = 2  # 2: ``latency_ms`` renamed to ``frame_interval_ms``
+
+# How a case's output is turned into frame counts (see :class:`FrameLog`).
+COUNT_LINES = "lines"        # one matching line per frame
+COUNT_RENDERED = "rendered"  # group 1 is a running frame count
+COUNT_PERF = "perf"          # deepstream-app ``**PERF:`` per-stream fps
+
+# Printed by the deepstream-test apps once per frame.
+APP_FRAME_PATTERN = r"Frame Number ="
+# ``fpsdisplaysink`` posts its counters once per ``fps-update-interval``;
+# ``gst-launch-1.0 -v`` prints them as a property notification.
+GST_FRAME_PATTERN = r"bench: last-message = rendered: (\d+)"
+BENCH_TAP = ("fpsdisplaysink name=bench text-overlay=false video-sink=fakesink "
+             "sync=false fps-update-interval=1000")
+# Printed every ``perf-measurement-interval-sec`` with enable-perf-measurement=1.
+PERF_PATTERN = r"^\*\*PERF:"
+
+SAMPLE_720P = "samples/streams/sample_720p.h264"
+APP_CONFIG_4 = ("samples/configs/deepstream-app/"
+                "source4_720p_dec_infer-resnet_tracker_sgie_tiled_display_int8.txt")
+
+
+@dataclass
+class BenchCase:
+    name: str
+    section: str
+    command: str  # shell command, run from ``cwd``; paths relative to the root
+    cwd: str = "."
+    configs: Sequence[str] = ()
+    frame_pattern: str = APP_FRAME_PATTERN
+    counter: str = COUNT_LINES
+    build: Optional[str] = None
+    description: str = ""
+
+
+def _app_case(n: int, section: str, configs: Sequence[str], description: str) -> BenchCase:
+    app_dir = "sources/apps/deepstream-test%d" % n
+    return BenchCase(
+        name="test%d" % n, section=section,
+        command="./deepstream-test%d-app ../../../%s" % (n, SAMPLE_720P),
+        cwd=app_dir, configs=["%s/%s" % (app_dir, c) for c in configs],
+        build="make -C %s" % app_dir, description=description)
+
+
+def _mux_command() -> str:
+    desc = PipelineBuilder(
+        sources=["samples/streams/1.264", "samples/streams/2.264"],
+        pgie_config="samples/configs/deepstream-app/config_infer_primary.txt",
+        output=OUTPUT_HEADLESS).describe()
+    # Count the batches leaving inference.
+    desc = desc.replace("fakesink sync=false async=false", BENCH_TAP, 1)
+    return "gst-launch-1.0 -v " + desc
+
+
+CASES: Dict[str, BenchCase] = {c.name: c for c in (
+    _app_case(1, "4", ["dstest1_pgie_config.txt"], "decode + primary detector + OSD"),
+    _app_case(2, "5", ["dstest2_pgie_config.txt", "dstest2_sgie1_config.txt",
+                       "dstest2_sgie2_config.txt", "dstest2_sgie3_config.txt",
+                       "dstest2_tracker_config.txt"],
+              "primary detector, tracker and three secondary classifiers"),
+    _app_case(3, "6", ["dstest3_pgie_config.txt"], "uridecodebin sources + primary detector"),
+    _app_case(4, "10", ["dstest4_pgie_config.txt", "dstest4_msgconv_config.txt"],
+              "primary detector + nvmsgconv/nvmsgbroker"),
+    BenchCase(
+        name="mux", section="7", command=_mux_command(),
+        configs=["samples/configs/deepstream-app/config_infer_primary.txt"],
+        frame_pattern=GST_FRAME_PATTERN, counter=COUNT_RENDERED,
+        description="two streams batched by nvstreammux into one nvinfer"),
+    BenchCase(
+        name="dsexample", section="8",
+        command=("gst-launch-1.0 -v filesrc location=samples/streams/car1.mp4 ! decodebin ! "
+                 'nvvidconv ! "video/x-raw(memory:NVMM), format=(string)RGBA" ! '
+                 "dsexample processing-width=160 processing-height=120 ! nvosd ! tee name=t ! "
+                 'queue ! nvvidconv ! "video/x-raw, format=(string)RGBA" ! videoconvert ! '
+                 "x264enc ! qtmux ! filesink location=out_dsmotion.mp4 t. ! queue ! %s"
+                 % BENCH_TAP),
+        frame_pattern=GST_FRAME_PATTERN, counter=COUNT_RENDERED,
+        build="make -C sources/gst-plugins/gst-dsexample -f Makefile_cpp",
+        description="custom dsexample motion plugin"),
+    BenchCase(
+        name="dewarper", section="9",
+        command=("gst-launch-1.0 -v filesrc location=sources/apps/deepstream-test5/sample_cam6.mp4 ! "
+                 "qtdemux ! h264parse ! nvdec_h264 ! nvvidconv ! nvdewarper "
+                 "config-file=sources/apps/deepstream-test5/config_dewarper.txt ! m.sink_0 "
+                 "nvstreammux name=m width=960 height=752 batch-size=4 ! %s"
+                 % BENCH_TAP),
+        configs=["sources/apps/deepstream-test5/config_dewarper.txt"],
+        frame_pattern=GST_FRAME_PATTERN, counter=COUNT_RENDERED,
+        description="360-degree dewarping into four surfaces"),
+    BenchCase(
+        name="app4", section="11",
+        command="deepstream-app -c %s" % os.path.relpath(APP_CONFIG_4, "samples"),
+        cwd="samples", configs=[APP_CONFIG_4],
+        frame_pattern=PERF_PATTERN, counter=COUNT_PERF,
+        description="deepstream-app, four 720p streams, detector, tracker and SGIEs"),
+)}
+
+
+@dataclass
+class CaseResult:
+    name: str
+    frames: int = 0
+    wall_s: float = 0.0
+    fps: float = 0.0
+    frame_interval_ms: Dict[str, float] = field(default_factory=dict)
+    utilization: Dict[str, float] = field(default_factory=dict)
+    config_hashes: Dict[str, Optional[str]] = field(default_factory=dict)
+    returncode: int = 0
+    runs: int = 1
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "frames": self.frames, "wall_s": round(self.wall_s, 4),
+            "fps": round(self.fps, 3), "frame_interval_ms": self.frame_interval_ms,
+            "utilization": self.utilization, "config_hashes": self.config_hashes,
+            "returncode": self.returncode, "runs": self.runs,
+        }
+
+
+def file_hash(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as fp:
+            return hashlib.sha256(fp.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def _percentiles(values: Sequence[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+    n = len(values)
+    return {
+        "p50": round(values[n // 2], 3),
+        "p90": round(values[min(n - 1, int(n * 0.9))], 3),
+        "p99": round(values[min(n - 1, int(n * 0.99))], 3),
+        "max": round(values[-1], 3),
+    }
+
+
+class FrameLog:
+    """Running frame count of a case, fed one output line at a time.
+
+    Every matching line adds a ``(time, frames)`` sample; fps and the
+    frame-interval percentiles come from consecutive samples, so the
+    interval of a periodic counter is the mean over its report window.
+    """
+
+    _STREAM_FPS = re.compile(r"([\d.]+) \([\d.]+\)")
+
+    def __init__(self, pattern: str, counter: str = COUNT_LINES):
+        if counter not in (COUNT_LINES, COUNT_RENDERED, COUNT_PERF):
+            raise ValueError("unknown frame counter %r" % counter)
+        self.pattern = re.compile(pattern)
+        self.counter = counter
+        self.samples: List[Tuple[float, float]] = []
+
+    def feed(self, line: str, now: float) -> None:
+        m = self.pattern.search(line)
+        if m is None:
+            return
+        last_t, last_n = self.samples[-1] if self.samples else (now, 0.0)
+        if self.counter == COUNT_LINES:
+            frames = last_n + 1
+        elif self.counter == COUNT_RENDERED:
+            frames = float(m.group(1))
+        else:
+            # Current fps per stream, "**PERF: 29.97 (29.88)\t30.01 (29.90)";
+            # the header line "**PERF: FPS 0 (Avg)" has none.
+            rates = [float(v) for v in self._STREAM_FPS.findall(line[m.end():])]
+            if not rates:
+                return
+            frames = last_n + sum(rates) * (now - last_t) if self.samples else 0.0
+        self.samples.append((now, frames))
+
+    @property
+    def frames(self) -> int:
+        return int(round(self.samples[-1][1])) if self.samples else 0
+
+    def fps(self) -> float:
+        if len(self.samples) < 2:
+            return 0.0
+        (t0, n0), (t1, n1) = self.samples[0], self.samples[-1]
+        return (n1 - n0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def intervals_ms(self) -> List[float]:
+        return [(t1 - t0) * 1e3 / (n1 - n0)
+                for (t0, n0), (t1, n1) in zip(self.samples, self.samples[1:]) if n1 > n0]
+
+
+class GpuSampler:
+    """Average GPU, decoder and memory use from ``nvidia-smi`` while running."""
+
+    QUERY = "utilization.gpu,utilization.decoder,memory.used"
+
+    def __init__(self, interval_ms: int = 500):
+        self.interval_ms = interval_ms
+        self.samples: List[List[float]] = []
+        self._proc = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "GpuSampler":
+        try:
+            self._proc = subprocess.Popen(
+                ["nvidia-smi", "--query-gpu=" + self.QUERY, "--format=csv,noheader,nounits",
+                 "-lms", str(self.interval_ms)],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        except OSError:
+            return self
+        self._thread = threading.Thread(target=self._read, daemon=True)
+        self._thread.start()
+        return self
+
+    def _read(self) -> None:
+        for line in self._proc.stdout:
+            try:
+                self.samples.append([float(v) for v in line.split(",")])
+            except ValueError:
+                continue
+
+    def stop(self) -> Dict[str, float]:
+        if self._proc is None:
+            return {}
+        self._proc.terminate()
+        self._proc.wait()
+        self._thread.join(timeout=1.0)
+        if not self.samples:
+            return {}
+        cols = list(zip(*self.samples))
+        mean = [sum(c) / len(c) for c in cols]
+        return {"gpu_pct": round(mean[0], 1), "dec_pct": round(mean[1], 1),
+                "mem_mib": round(max(cols[2]), 1)}
+
+
+class Executor:
+    def run(self, case: BenchCase) -> CaseResult:
+        raise NotImplementedError
+
+
+class ShellExecutor(Executor):
+    """Run a case's command under ``root`` and time the frames it reports."""
+
+    def __init__(self, root: str = ".", timeout: float = 600.0, build: bool = False,
+                 env: Optional[Dict[str, str]] = None):
+        self.root = root
+        self.timeout = timeout
+        self.build = build
+        self.env = env
+
+    def run(self, case: BenchCase) -> CaseResult:
+        root = os.path.abspath(self.root)
+        if self.build and case.build:
+            subprocess.run(case.build, shell=True, cwd=root, check=True,
+                           stdout=subprocess.DEVNULL)
+        log = FrameLog(case.frame_pattern, case.counter)
+        sampler = GpuSampler().start()
+        usage0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.monotonic()
+        # Line-buffer the child so each report is timed when it is printed.
+        command = ("stdbuf -oL " if shutil.which("stdbuf") else "") + case.command
+        proc = subprocess.Popen(command, shell=True, cwd=os.path.join(root, case.cwd),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, env=self.env)
+        timer = threading.Timer(self.timeout, proc.kill)
+        timer.start()
+        try:
+            for line in proc.stdout:
+                log.feed(line, time.monotonic())
+            returncode = proc.wait()
+        finally:
+            timer.cancel()
+        wall = time.monotonic() - start
+        usage1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+        utilization = sampler.stop()
+        cpu = (usage1.ru_utime - usage0.ru_utime) + (usage1.ru_stime - usage0.ru_stime)
+        utilization["cpu_pct"] = round(100.0 * cpu / wall, 1) if wall > 0 else 0.0
+
+        # fps over the streaming part only, so model load does not count.
+        return CaseResult(
+            name=case.name, frames=log.frames, wall_s=wall, fps=log.fps(),
+            frame_interval_ms=_percentiles(log.intervals_ms()), utilization=utilization,
+            config_hashes={c: file_hash(os.path.join(root, c)) for c in case.configs},
+            returncode=returncode)
+
+
+class StubExecutor(Executor):
+    """Deterministic synthetic results for CI machines without a GPU."""
+
+    def __init__(self, seed: int = 0, frames: int = 300, slowdown: Optional[Dict[str, float]] = None):
+        self.seed = seed
+        self.frames = frames
+        self.slowdown = slowdown or {}
+
+    def run(self, case: BenchCase) -> CaseResult:
+        rng = random.Random("%s:%d" % (case.name, self.seed))
+        fps = rng.uniform(30.0, 240.0) / self.slowdown.get(case.name, 1.0)
+        intervals = [rng.gauss(1e3 / fps, 0.05e3 / fps) for _ in range(self.frames - 1)]
+        return CaseResult(
+            name=case.name, frames=self.frames, wall_s=self.frames / fps + 2.0, fps=fps,
+            frame_interval_ms=_percentiles(intervals),
+            utilization={"cpu_pct": round(rng.uniform(20, 90), 1)},
+            config_hashes={c: None for c in case.configs})
+
+
+def _command_output(cmd: Sequence[str]) -> Optional[str]:
+    try:
+        return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment(root: str = ".") -> Dict[str, Optional[str]]:
+    gst = _command_output(["gst-launch-1.0", "--version"])
+    return {
+        "host": socket.gethostname(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "gpu": _command_output(["nvidia-smi", "--query-gpu=name,driver_version,memory.total",
+                                "--format=csv,noheader"]),
+        "gstreamer": gst.splitlines()[0] if gst else None,
+        "git": _command_output(["git", "-C", os.path.abspath(root), "rev-parse", "HEAD"]),
+        "cuda_visible_devices": os.environ.get("CUDA_VISIBLE_DEVICES"),
+    }
+
+
+def run_cases(names: Sequence[str], executor: Executor, repeat: int = 1,
+              root: str = ".") -> Dict[str, object]:
+    """Run cases and return a bundle; with ``repeat`` the median-fps run is kept."""
+    results = {}
+    for name in names:
+        runs = [executor.run(CASES[name]) for _ in range(repeat)]
+        runs.sort(key=lambda r: r.fps)
+        best = runs[len(runs) // 2]
+        best.runs = repeat
+        results[name] = best.as_dict()
+    return {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "executor": type(executor).__name__,
+        "env": environment(root),
+        "cases": results,
+    }
+
+
+def load_bundle(path: str) -> Dict[str, object]:
+    with open(path) as fp:
+        bundle = json.load(fp)
+    if bundle.get("format") != BUNDLE_FORMAT:
+        raise ValueError("%s is not a benchmark bundle" % path)
+    if bundle.get("version", 0) > BUNDLE_VERSION:
+        raise ValueError("%s has unsupported bundle version %s" % (path, bundle["version"]))
+    if bundle.get("version", 0) < 2:
+        for case in bundle["cases"].values():
+            case["frame_interval_ms"] = case.pop("latency_ms", {})
+    return bundle
+
+
+@dataclass
+class Finding:
+    case: str
+    metric: str
+    base: Optional[float]
+    new: Optional[float]
+    kind: str  # "regression", "improvement", "config-changed", "missing", "failed"
+
+    def __str__(self) -> str:
+        if self.base is None or self.new is None:
+            return "%-10s %-11s %-14s" % (self.case, self.metric, self.kind)
+        change = (self.new - self.base) / self.base * 100 if self.base else 0.0
+        return "%-10s %-11s %-14s %10.2f -> %10.2f (%+.1f%%)" % (
+            self.case, self.metric, self.kind, self.base, self.new, change)
+
+
+def compare(base: Dict[str, object], new: Dict[str, object],
+            fps_tolerance: float = 0.05, interval_tolerance: float = 0.10) -> List[Finding]:
+    """Differences between two bundles beyond the given relative tolerances."""
+    findings = []
+    for name, b in base["cases"].items():
+        n = new["cases"].get(name)
+        if n is None:
+            findings.append(Finding(name, "-", None, None, "missing"))
+            continue
+        if n["returncode"] != 0:
+            findings.append(Finding(name, "returncode", b["returncode"], n["returncode"], "failed"))
+        if b["config_hashes"] != n["config_hashes"]:
+            findings.append(Finding(name, "configs", None, None, "config-changed"))
+        if b["fps"] > 0:
+            delta = (n["fps"] - b["fps"]) / b["fps"]
+            if delta < -fps_tolerance:
+                findings.append(Finding(name, "fps", b["fps"], n["fps"], "regression"))
+            elif delta > fps_tolerance:
+                findings.append(Finding(name, "fps", b["fps"], n["fps"], "improvement"))
+        for q in ("p50", "p99"):
+            ib, in_ = b["frame_interval_ms"].get(q), n["frame_interval_ms"].get(q)
+            if not ib or in_ is None:
+                continue
+            delta = (in_ - ib) / ib
+            if delta > interval_tolerance:
+                findings.append(Finding(name, "interval_" + q, ib, in_, "regression"))
+            elif delta < -interval_tolerance:
+                findings.append(Finding(name, "interval_" + q, ib, in_, "improvement"))
+    return findings
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run and compare lab benchmarks.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="list the benchmark cases")
+    r = sub.add_parser("run", help="run cases and write a result bundle")
+    r.add_argument("cases", nargs="*", help="case names (default: all)")
+    r.add_argument("--root", default="DeepStream_Release")
+    r.add_argument("--out", default="bench.json")
+    r.add_argument("--repeat", type=int, default=1)
+    r.add_argument("--timeout", type=float, default=600.0)
+    r.add_argument("--build", action="store_true", help="build apps/plugins first")
+    r.add_argument("--stub", action="store_true", help="synthetic results, no GPU needed")
+    c = sub.add_parser("compare", help="flag regressions between two bundles")
+    c.add_argument("base")
+    c.add_argument("new")
+    c.add_argument("--fps-tolerance", type=float, default=0.05)
+    c.add_argument("--interval-tolerance", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "list":
+        for case in CASES.values():
+            print("%-10s section %-3s %s" % (case.name, case.section, case.description))
+        return 0
+
+    if args.cmd == "run":
+        names = args.cases or list(CASES)
+        unknown = [n for n in names if n not in CASES]
+        if unknown:
+            parser.error("unknown case(s): %s" % ", ".join(unknown))
+        executor = (StubExecutor() if args.stub else
+                    ShellExecutor(args.root, timeout=args.timeout, build=args.build))
+        bundle = run_cases(names, executor, repeat=args.repeat, root=args.root)
+        with open(args.out, "w") as fp:
+            json.dump(bundle, fp, indent=2, sort_keys=True)
+        for name, res in bundle["cases"].items():
+            print("%-10s frames=%-6d fps=%8.2f p50=%s rc=%d" % (
+                name, res["frames"], res["fps"], res["frame_interval_ms"].get("p50"),
+                res["returncode"]))
+        return 0
+
+    findings = compare(load_bundle(args.base), load_bundle(args.new),
+                       args.fps_tolerance, args.interval_tolerance)
+    for f in findings:
+        print(f)
+    bad = [f for f in findings if f.kind in ("regression", "failed", "missing")]
+    print("%d regression(s)" % len(bad))
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,326 @@
+"""Event-triggered clip recording from the compressed stream.
+
+Instead of encoding every frame to ``out_test*.mp4``, a
+:class:`ClipRecorder` keeps the last few seconds of H.264 access units of
+one stream – tapped after ``h264parse``, before decode – in a ring bounded
+by time and bytes. When a metadata rule fires (for example
+:class:`ZoneEntryRule`, a vehicle entering a zone) the ring is written out
+from the last keyframe before the pre-roll window, the clip keeps growing
+with live access units until the post-roll window has passed, and is then
+closed. Nothing is decoded or re-encoded; memory per stream is the ring.
+
+Metadata reaches the rule after decode and inference, later than the
+access units reach the ring. Triggers are therefore placed by the frame
+``pts``, not by arrival time, and the pre-roll must also cover that
+pipeline latency.
+"""
+
+import os
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Optional, Sequence, Set, Tuple
+
+from .meta import FrameMeta
+
+NS = 10**9
+
+
+@dataclass
+class AccessUnit:
+    pts: int
+    data: bytes
+    keyframe: bool
+
+
+class PrerollBuffer:
+    """Ring of access units bounded by duration and size.
+
+    The head is always a keyframe, so whatever is in the ring can be
+    decoded on its own; trimming drops a whole GOP prefix at a time.
+    """
+
+    def __init__(self, max_duration: float = 10.0, max_bytes: int = 16 << 20):
+        self.max_duration_ns = int(max_duration * NS)
+        self.max_bytes = max_bytes
+        self.units: Deque[AccessUnit] = deque()
+        self.bytes = 0
+
+    def push(self, au: AccessUnit) -> None:
+        if not self.units and not au.keyframe:
+            return  # wait for a decodable start
+        self.units.append(au)
+        self.bytes += len(au.data)
+        self._trim()
+
+    def _trim(self) -> None:
+        units = self.units
+        while len(units) > 1 and (
+                self.bytes > self.max_bytes
+                or units[-1].pts - units[0].pts > self.max_duration_ns):
+            self._pop()
+            # Drop the rest of that GOP; never keep a head that needs a reference.
+            while units and not units[0].keyframe:
+                self._pop()
+
+    def _pop(self) -> None:
+        au = self.units.popleft()
+        self.bytes -= len(au.data)
+
+    def since(self, pts: int) -> Sequence[AccessUnit]:
+        """Units from the last keyframe at or before ``pts`` to the newest."""
+        start = 0
+        for i, au in enumerate(self.units):
+            if au.pts > pts:
+                break
+            if au.keyframe:
+                start = i
+        return list(self.units)[start:]
+
+    @property
+    def duration(self) -> float:
+        if len(self.units) < 2:
+            return 0.0
+        return (self.units[-1].pts - self.units[0].pts) / NS
+
+
+class ClipWriter:
+    """Interface of a clip sink: one instance per clip."""
+
+    def write(self, au: AccessUnit) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+
+class AnnexBClipWriter(ClipWriter):
+    """Write the access units as a raw H.264 byte-stream file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fp = open(path, "wb")
+
+    def write(self, au: AccessUnit) -> None:
+        self._fp.write(au.data)
+
+    def close(self) -> None:
+        self._fp.close()
+
+
+class Mp4ClipWriter(ClipWriter):
+    """Mux access units into MP4 with ``appsrc ! h264parse ! qtmux ! filesink``."""
+
+    def __init__(self, path: str):
+        import gi
+        gi.require_version("Gst", "1.0")
+        from gi.repository import Gst
+
+        Gst.init(None)
+        self._Gst = Gst
+        self.path = path
+        self._pipeline = Gst.parse_launch(
+            'appsrc name=src format=time caps="video/x-h264, stream-format=byte-stream, '
+            'alignment=au" ! h264parse ! qtmux ! filesink location="%s"' % path)
+        self._src = self._pipeline.get_by_name("src")
+        self._base: Optional[int] = None
+        self._pipeline.set_state(Gst.State.PLAYING)
+
+    def write(self, au: AccessUnit) -> None:
+        Gst = self._Gst
+        if self._base is None:
+            self._base = au.pts
+        buf = Gst.Buffer.new_wrapped(au.data)
+        buf.pts = au.pts - self._base
+        if not au.keyframe:
+            buf.set_flags(Gst.BufferFlags.DELTA_UNIT)
+        self._src.emit("push-buffer", buf)
+
+    def close(self) -> None:
+        Gst = self._Gst
+        self._src.emit("end-of-stream")
+        bus = self._pipeline.get_bus()
+        bus.timed_pop_filtered(10 * Gst.SECOND,
+                               Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        self._pipeline.set_state(Gst.State.NULL)
+
+
+WriterFactory = Callable[[str], ClipWriter]
+Rule = Callable[[FrameMeta], bool]
+
+
+class ClipRecorder:
+    """Pre-roll ring plus trigger handling for one stream.
+
+    :meth:`push` runs on the parser's streaming thread and :meth:`trigger`
+    on the thread that sees the metadata; a lock serializes them around
+    the ring and the open writer.
+    """
+
+    def __init__(self, out_dir: str, source_id: int = 0,
+                 pre_roll: float = 5.0, post_roll: float = 5.0,
+                 max_bytes: int = 16 << 20,
+                 writer_factory: WriterFactory = Mp4ClipWriter,
+                 extension: str = ".mp4"):
+        self.out_dir = out_dir
+        self.source_id = source_id
+        self.pre_roll_ns = int(pre_roll * NS)
+        self.post_roll_ns = int(post_roll * NS)
+        # Room for the pre-roll plus inference latency before a trigger lands.
+        self.ring = PrerollBuffer(pre_roll * 2 + 2.0, max_bytes)
+        self.writer_factory = writer_factory
+        self.extension = extension
+        self.clips: list = []
+        self._writer: Optional[ClipWriter] = None
+        self._end_pts = 0
+        self._lock = threading.Lock()
+
+    @property
+    def recording(self) -> bool:
+        return self._writer is not None
+
+    def push(self, au: AccessUnit) -> None:
+        """Feed the next access unit of the stream, in decode order."""
+        with self._lock:
+            self.ring.push(au)
+            if self._writer is None:
+                return
+            if not (au.pts > self._end_pts and au.keyframe):
+                self._writer.write(au)
+                return
+            # Cut at a keyframe so the next clip can start cleanly.
+            writer, self._writer = self._writer, None
+        writer.close()  # may wait for the muxer; not under the lock
+
+    def trigger(self, pts: int) -> None:
+        """Record ``pts - pre_roll`` .. ``pts + post_roll`` (extends a running clip)."""
+        end = pts + self.post_roll_ns
+        with self._lock:
+            if self._writer is not None:
+                self._end_pts = max(self._end_pts, end)
+                return
+            backlog = self.ring.since(pts - self.pre_roll_ns)
+            if not backlog:
+                return
+            path = os.path.join(self.out_dir, "clip_src%d_%d%s" % (
+                self.source_id, backlog[0].pts, self.extension))
+            os.makedirs(self.out_dir, exist_ok=True)
+            self._writer = self.writer_factory(path)
+            self._end_pts = end
+            self.clips.append(path)
+            for au in backlog:
+                self._writer.write(au)
+
+    def close(self) -> None:
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+
+class ClipRecorderBank:
+    """One :class:`ClipRecorder` per source, driven by metadata rules.
+
+    Use :meth:`parser_probe` on the ``h264parse`` src pad of each source
+    and pass the bank as a metadata consumer (e.g. to
+    :func:`iva.meta.meta_probe`).
+    """
+
+    def __init__(self, out_dir: str, rules: Sequence[Rule], **recorder_kwargs):
+        self.out_dir = out_dir
+        self.rules = list(rules)
+        self._kwargs = recorder_kwargs
+        self.recorders: Dict[int, ClipRecorder] = {}
+        self._lock = threading.Lock()
+
+    def recorder(self, source_id: int) -> ClipRecorder:
+        with self._lock:
+            rec = self.recorders.get(source_id)
+            if rec is None:
+                rec = self.recorders[source_id] = ClipRecorder(
+                    self.out_dir, source_id, **self._kwargs)
+            return rec
+
+    def push(self, source_id: int, au: AccessUnit) -> None:
+        self.recorder(source_id).push(au)
+
+    def on_frame(self, frame: FrameMeta) -> None:
+        # Every rule sees every frame: stateful rules such as ZoneEntryRule
+        # must track objects even when an earlier rule already fired.
+        fired = [rule(frame) for rule in self.rules]
+        if any(fired):
+            self.recorder(frame.source_id).trigger(frame.pts)
+
+    __call__ = on_frame
+
+    def close(self) -> None:
+        for rec in list(self.recorders.values()):
+            rec.close()
+
+    def parser_probe(self, source_id: int):
+        """Buffer probe copying each access unit of ``source_id`` into its ring."""
+        from gi.repository import Gst
+
+        recorder = self.recorder(source_id)
+
+        def probe(pad, info, u_data=None):
+            buf = info.get_buffer()
+            if buf is None:
+                return Gst.PadProbeReturn.OK
+            ok, mapinfo = buf.map(Gst.MapFlags.READ)
+            if ok:
+                try:
+                    data = bytes(mapinfo.data)
+                finally:
+                    buf.unmap(mapinfo)
+                keyframe = not buf.has_flags(Gst.BufferFlags.DELTA_UNIT)
+                recorder.push(AccessUnit(buf.pts, data, keyframe))
+            return Gst.PadProbeReturn.OK
+        return probe
+
+
+def _inside(x: float, y: float, polygon: Sequence[Tuple[float, float]]) -> bool:
+    """Even-odd point-in-polygon test."""
+    inside = False
+    n = len(polygon)
+    for i in range(n):
+        x1, y1 = polygon[i]
+        x2, y2 = polygon[(i + 1) % n]
+        if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            inside = not inside
+    return inside
+
+
+class ZoneEntryRule:
+    """Fires when a tracked object's footpoint enters ``polygon``.
+
+    Each ``(source_id, object_id)`` fires at most once while it stays
+    inside; leaving (or dropping out of the metadata) and re-entering fires
+    again.
+    """
+
+    def __init__(self, polygon: Sequence[Tuple[float, float]],
+                 class_ids: Optional[Sequence[int]] = None,
+                 source_ids: Optional[Sequence[int]] = None):
+        self.polygon = list(polygon)
+        self.class_ids = set(class_ids) if class_ids is not None else None
+        self.source_ids = set(source_ids) if source_ids is not None else None
+        self._inside: Set[Tuple[int, int]] = set()
+
+    def __call__(self, frame: FrameMeta) -> bool:
+        if self.source_ids is not None and frame.source_id not in self.source_ids:
+            return False
+        fired = False
+        seen = set()
+        for obj in frame.objects:
+            if obj.object_id < 0:
+                continue
+            if self.class_ids is not None and obj.class_id not in self.class_ids:
+                continue
+            key = (frame.source_id, obj.object_id)
+            if _inside(*obj.footpoint, self.polygon):
+                seen.add(key)
+                if key not in self._inside:
+                    fired = True
+        self._inside = {k for k in self._inside if k[0] != frame.source_id} | seen
+        return fired
@@ -0,0 +1,134 @@
+"""Reading and editing DeepStream key-file configs.
+
+DeepStream configs (``dstest1_pgie_config.txt``, ``config_dewarper.txt``,
+the ``deepstream-app`` configs) are GLib key files: ``[group]`` headers,
+``key=value`` lines, ``#`` comments and ``;``-separated lists. Keys that
+appear before the first header (as in the section 4.2 excerpt) belong to
+the ``""`` group.
+"""
+
+import re
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Union
+
+_GROUP_RE = re.compile(r"^\s*\[([^\]]+)\]\s*$")
+
+
+class DSConfig:
+    """Parsed key file with typed getters."""
+
+    def __init__(self, groups: "OrderedDict[str, Dict[str, str]]", path: Optional[str] = None):
+        self.groups = groups
+        self.path = path
+
+    @classmethod
+    def read(cls, path: str) -> "DSConfig":
+        with open(path) as fp:
+            return cls.parse(fp.read(), path)
+
+    @classmethod
+    def parse(cls, text: str, path: Optional[str] = None) -> "DSConfig":
+        groups: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        current = groups.setdefault("", {})
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            m = _GROUP_RE.match(line)
+            if m:
+                current = groups.setdefault(m.group(1).strip(), {})
+                continue
+            key, sep, value = stripped.partition("=")
+            if sep:
+                current[key.strip()] = value.strip()
+        if not groups[""]:
+            del groups[""]
+        return cls(groups, path)
+
+    def has_group(self, group: str) -> bool:
+        return group in self.groups
+
+    def group_names(self, prefix: str = "") -> List[str]:
+        return [g for g in self.groups if g.startswith(prefix)]
+
+    def get(self, group: str, key: str, default: Optional[str] = None) -> Optional[str]:
+        return self.groups.get(group, {}).get(key, default)
+
+    def get_int(self, group: str, key: str, default: Optional[int] = None) -> Optional[int]:
+        value = self.get(group, key)
+        return int(value) if value is not None else default
+
+    def get_float(self, group: str, key: str, default: Optional[float] = None) -> Optional[float]:
+        value = self.get(group, key)
+        return float(value) if value is not None else default
+
+    def get_bool(self, group: str, key: str, default: bool = False) -> bool:
+        value = self.get(group, key)
+        if value is None:
+            return default
+        return value.lower() in ("1", "true", "yes")
+
+    def get_list(self, group: str, key: str, default: Optional[Sequence[str]] = None) -> List[str]:
+        value = self.get(group, key)
+        if value is None:
+            return list(default or [])
+        return [v.strip() for v in value.split(";") if v.strip()]
+
+    def property(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        """Look up ``key`` in ``[property]``, falling back to the header-less group."""
+        value = self.get("property", key)
+        return value if value is not None else self.get("", key, default)
+
+
+def format_value(value: Union[str, int, float, bool, Sequence]) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return ";".join(format_value(v) for v in value)
+    return str(value)
+
+
+def set_key(path: str, group: str, key: str, value) -> None:
+    """Set ``key`` in ``group`` of the file at ``path``, keeping everything else.
+
+    Comments, ordering and untouched keys are preserved. The key is added
+    at the end of the group (and the group at the end of the file) when
+    missing. ``group=""`` addresses the keys before the first header.
+    """
+    with open(path) as fp:
+        lines = fp.read().splitlines()
+    text = "%s=%s" % (key, format_value(value))
+
+    current = ""
+    group_end = None
+    replaced = False
+    for i, line in enumerate(lines):
+        m = _GROUP_RE.match(line)
+        if m:
+            if current == group and group_end is None:
+                group_end = i
+            current = m.group(1).strip()
+            continue
+        stripped = line.strip()
+        if current == group and not stripped.startswith("#"):
+            k, sep, _ = stripped.partition("=")
+            if sep and k.strip() == key:
+                lines[i] = text
+                replaced = True
+                break
+    if not replaced:
+        if current == group and group_end is None:
+            group_end = len(lines)
+        if group_end is not None:
+            # Insert after the group's last non-blank line.
+            while group_end > 0 and not lines[group_end - 1].strip():
+                group_end -= 1
+            lines.insert(group_end, text)
+        else:
+            if lines and lines[-1].strip():
+                lines.append("")
+            lines.extend(["[%s]" % group, text])
+    with open(path, "w") as fp:
+        fp.write("\n".join(lines) + "\n")
@@ -0,0 +1,438 @@
+"""CPU inference that reads nvinfer configs, for GPU-less test boxes and degraded serving.
+
+Sections 4–6 cannot run at all without a GPU. :class:`CpuInfer` takes the
+same nvinfer config file and honours the keys that decide what the
+pipeline's metadata looks like:
+
+* the model: ``onnx-file`` (ONNX Runtime), ``model-file`` + ``proto-file``
+  (OpenCV DNN, Caffe), or a ``.npz`` :class:`iva.precision.NumpyModel`;
+* preprocessing (:mod:`iva.preprocess`): ``net-scale-factor``,
+  ``offsets``, ``model-color-format``, ``maintain-aspect-ratio``,
+  ``scaling-filter`` and ``input-dims``/``uff-input-dims`` (default
+  3x368x640, as ResNet10);
+* ``batch-size``, ``output-blob-names``, ``num-detected-classes`` and
+  ``class-thresholds``;
+* ``parse-func`` (1 or 4: DetectNet/ResNet coverage + bbox, decoded by
+  :mod:`iva.detectnet`), or ``parse-func=0`` with
+  ``parse-bbox-func-name`` naming a Python parser registered with
+  :func:`register_parser` (the C++ ``custom-lib-path`` cannot be loaded);
+* ``network-type=1`` classifiers (SGIEs): softmax arg-max over
+  ``classifier-threshold`` with labels from ``labelfile-path``.
+
+Frames are split into ``batch-size`` batches that run on a thread pool
+(ONNX Runtime and OpenCV release the GIL while computing), and results
+come back as :class:`iva.meta.ObjectMeta` so every consumer in ``iva``
+works unchanged.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import DSConfig
+from .detectnet import blob_names, parse
+from .meta import FrameMeta, ObjectMeta
+from .preprocess import Preprocessor
+from .startup import _resolve
+
+DEFAULT_DIMS = (3, 368, 640)
+DETECTNET_PARSE_FUNCS = (1, 4)
+
+# Python equivalents of custom C++ bbox parsers, by parse-bbox-func-name.
+# A parser takes (outputs, config, thresholds) and returns one list of
+# (class_id, confidence, left, top, width, height) per batch image, in
+# network input pixels.
+PARSERS: Dict[str, Callable] = {}
+
+
+def register_parser(name: str):
+    def wrap(fn):
+        PARSERS[name] = fn
+        return fn
+    return wrap
+
+
+@register_parser("parse_bbox_custom_resnet")
+def _parse_resnet(outputs, config: "InferConfig", thresholds):
+    """The section 6 ``nvdsparsebbox`` sample: plain DetectNet decoding."""
+    bbox_blob, cov_blob = blob_names(";".join(config.output_blobs))
+    return [[(int(c), float(p), *map(float, b))
+             for c, p, b in zip(objs.class_id, objs.confidence, objs.boxes)]
+            for objs in parse(outputs[cov_blob], outputs[bbox_blob], thresholds,
+                              config.width, config.height)]
+
+
+@dataclass
+class InferConfig:
+    """The nvinfer keys the CPU path needs, resolved relative to the config file."""
+
+    path: str
+    model: str
+    proto: Optional[str] = None
+    scale: float = 1.0
+    offsets: Tuple[float, ...] = (0.0, 0.0, 0.0)
+    bgr: bool = False
+    channels: int = 3
+    height: int = DEFAULT_DIMS[1]
+    width: int = DEFAULT_DIMS[2]
+    batch_size: int = 1
+    output_blobs: List[str] = field(default_factory=list)
+    num_classes: int = 4
+    thresholds: List[float] = field(default_factory=lambda: [0.2])
+    parse_func: int = 4
+    parse_bbox_func: Optional[str] = None
+    classifier: bool = False
+    classifier_threshold: float = 0.5
+    labels: List[List[str]] = field(default_factory=list)
+    unique_id: int = 1
+    maintain_aspect: bool = False
+    interpolation: str = "nearest"
+
+    @classmethod
+    def from_file(cls, path: str) -> "InferConfig":
+        cfg = DSConfig.read(path)
+        prop = cfg.property
+        model = None
+        for key in ("onnx-file", "model-file"):
+            if prop(key):
+                model = _resolve(path, prop(key))
+                break
+        if model is None:
+            raise ValueError("%s: no onnx-file or model-file" % path)
+        dims_text = prop("input-dims") or prop("uff-input-dims")
+        dims = tuple(int(v) for v in dims_text.split(";")[:3]) if dims_text else DEFAULT_DIMS
+        group = "property" if cfg.has_group("property") else ""
+        num_classes = int(prop("num-detected-classes", "4"))
+        thresholds = [float(v) for v in cfg.get_list(group, "class-thresholds")] or [0.2]
+        # A short list is valid: the last value covers the remaining classes.
+        thresholds = (thresholds + [thresholds[-1]] * num_classes)[:num_classes]
+        for c in range(num_classes):
+            # DeepStream 4.0 per-class groups override the list.
+            t = cfg.get_float("class-attrs-%d" % c, "threshold")
+            if t is not None:
+                thresholds[c] = t
+        labels = []
+        if prop("labelfile-path") and os.path.exists(_resolve(path, prop("labelfile-path"))):
+            with open(_resolve(path, prop("labelfile-path"))) as fp:
+                labels = [line.strip().split(";") for line in fp if line.strip()]
+        return cls(
+            path=path, model=model,
+            proto=_resolve(path, prop("proto-file")) if prop("proto-file") else None,
+            scale=float(prop("net-scale-factor", "1.0")),
+            offsets=tuple(float(v) for v in cfg.get_list(group, "offsets")) or (0.0, 0.0, 0.0),
+            bgr=int(prop("model-color-format", "0")) == 1,
+            channels=dims[0], height=dims[1], width=dims[2],
+            batch_size=int(prop("batch-size", "1")),
+            output_blobs=cfg.get_list(group, "output-blob-names"),
+            num_classes=num_classes,
+            thresholds=thresholds,
+            parse_func=int(prop("parse-func", "4")),
+            parse_bbox_func=prop("parse-bbox-func-name"),
+            classifier=int(prop("network-type", "0")) == 1,
+            classifier_threshold=float(prop("classifier-threshold", "0.5")),
+            labels=labels,
+            unique_id=int(prop("gie-unique-id", "1")),
+            maintain_aspect=prop("maintain-aspect-ratio", "0") == "1",
+            # nvinfer's default scaling-filter=0 is nearest neighbour.
+            interpolation="nearest" if prop("scaling-filter", "0") == "0" else "bilinear",
+        )
+
+
+# -- runtimes ---------------------------------------------------------------
+
+class OnnxRuntime:
+    def __init__(self, config: InferConfig, threads: int = 1):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            config.model, options, providers=["CPUExecutionProvider"])
+        self.input = self.session.get_inputs()[0].name
+        self.outputs = config.output_blobs or [o.name for o in self.session.get_outputs()]
+
+    def run(self, batch: np.ndarray) -> Dict[str, np.ndarray]:
+        return dict(zip(self.outputs, self.session.run(self.outputs, {self.input: batch})))
+
+
+class OpenCVRuntime:
+    """OpenCV DNN over the Caffe model; one ``Net`` per thread, as it is not thread-safe."""
+
+    def __init__(self, config: InferConfig, threads: int = 1):
+        import cv2
+
+        self.cv2 = cv2
+        self.config = config
+        self.local = threading.local()
+
+    def _net(self):
+        net = getattr(self.local, "net", None)
+        if net is None:
+            net = self.local.net = self.cv2.dnn.readNetFromCaffe(self.config.proto,
+                                                                 self.config.model)
+        return net
+
+    def run(self, batch: np.ndarray) -> Dict[str, np.ndarray]:
+        net = self._net()
+        net.setInput(batch)
+        names = self.config.output_blobs or net.getUnconnectedOutLayersNames()
+        return dict(zip(names, net.forward(names)))
+
+
+class NumpyRuntime:
+    def __init__(self, config: InferConfig, threads: int = 1):
+        from .precision import NumpyModel
+
+        bbox, cov = blob_names(";".join(config.output_blobs))
+        self.model = NumpyModel(NumpyModel.load(config.model).w, bbox, cov)
+
+    def run(self, batch: np.ndarray) -> Dict[str, np.ndarray]:
+        return self.model.forward(batch)
+
+
+def load_runtime(config: InferConfig, threads: int = 1):
+    ext = os.path.splitext(config.model)[1].lower()
+    if ext == ".onnx":
+        return OnnxRuntime(config, threads)
+    if ext == ".npz":
+        return NumpyRuntime(config, threads)
+    if ext == ".caffemodel":
+        return OpenCVRuntime(config, threads)
+    raise ValueError("no CPU runtime for %s" % config.model)
+
+
+# -- preprocessing ----------------------------------------------------------
+
+def image_format(image: np.ndarray) -> str:
+    """``rgba`` / ``rgb`` for ``HxWx4`` / ``HxWx3``, ``nv12`` for a 2-D ``(H*3/2)xW`` plane."""
+    if image.ndim == 2:
+        return "nv12"
+    return "rgba" if image.shape[2] == 4 else "rgb"
+
+
+def make_preprocessor(config: InferConfig, batch: Optional[int] = None) -> Preprocessor:
+    return Preprocessor(config.height, config.width, batch or config.batch_size,
+                        config.scale, config.offsets, config.bgr,
+                        letterbox=config.maintain_aspect, interpolation=config.interpolation)
+
+
+def preprocess(images: Sequence[np.ndarray], config: InferConfig,
+               pre: Optional[Preprocessor] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Images to a ``[N, C, H, W]`` network batch plus per-image box transforms.
+
+    ``y = net-scale-factor * (x - offsets)``, as nvinfer computes it. The
+    batch is a view of ``pre``'s reused buffer when given.
+    """
+    pre = pre or make_preprocessor(config, len(images))
+    shapes = {im.shape for im in images}
+    rois = np.array([[0, 0, im.shape[1], im.shape[0] * 2 // 3 if im.ndim == 2 else im.shape[0]]
+                     for im in images], np.float32)
+    if len(shapes) == 1:
+        batch = pre.run(np.stack(images), image_format(images[0]))
+    else:
+        # Mixed sizes: one call per image, each into its own slot.
+        batch = np.empty((len(images), 3, config.height, config.width), np.float32)
+        for i, im in enumerate(images):
+            batch[i] = pre.run(im[None], image_format(im))[0]
+    return batch, pre.transforms(rois)
+
+
+# -- inference --------------------------------------------------------------
+
+@dataclass
+class CpuInferStats:
+    frames: int = 0
+    batches: int = 0
+    objects: int = 0
+    preprocess_s: float = 0.0
+    infer_s: float = 0.0
+    parse_s: float = 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        per = 1e3 / max(self.frames, 1)
+        return {"frames": self.frames, "batches": self.batches, "objects": self.objects,
+                "preprocess_ms_per_frame": round(self.preprocess_s * per, 3),
+                "infer_ms_per_frame": round(self.infer_s * per, 3),
+                "parse_ms_per_frame": round(self.parse_s * per, 3)}
+
+
+class CpuInfer:
+    """Batched nvinfer stand-in: ``infer(images)`` returns objects per image."""
+
+    def __init__(self, config, workers: int = 2, runtime=None, threads_per_worker: int = 1):
+        self.config = config if isinstance(config, InferConfig) else InferConfig.from_file(config)
+        self.runtime = runtime or load_runtime(self.config, threads_per_worker)
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpu-infer")
+        self.stats = CpuInferStats()
+        self._lock = threading.Lock()
+        # One preprocessor (and so one reused input buffer) per pool thread.
+        self._local = threading.local()
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self) -> "CpuInfer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _parse(self, outputs: Dict[str, np.ndarray], n: int) -> List[list]:
+        cfg = self.config
+        if cfg.classifier:
+            prob = next(iter(outputs.values())).reshape(n, -1)
+            best = prob.argmax(axis=1)
+            return [[(int(k), float(prob[i, k]))] if prob[i, k] >= cfg.classifier_threshold else []
+                    for i, k in enumerate(best)]
+        if cfg.parse_func in DETECTNET_PARSE_FUNCS:
+            return PARSERS["parse_bbox_custom_resnet"](outputs, cfg, cfg.thresholds)
+        if cfg.parse_func == 0 and cfg.parse_bbox_func in PARSERS:
+            return PARSERS[cfg.parse_bbox_func](outputs, cfg, cfg.thresholds)
+        raise ValueError("parse-func=%d (%s) has no CPU parser"
+                                  % (cfg.parse_func, cfg.parse_bbox_func))
+
+    def _run_batch(self, images: Sequence[np.ndarray]) -> List[Tuple[list, np.ndarray]]:
+        """``(parsed objects, box transform)`` per image."""
+        t0 = time.perf_counter()
+        pre = getattr(self._local, "pre", None)
+        if pre is None:
+            pre = self._local.pre = make_preprocessor(self.config)
+        batch, transforms = preprocess(images, self.config, pre)
+        t1 = time.perf_counter()
+        outputs = self.runtime.run(batch)
+        t2 = time.perf_counter()
+        parsed = self._parse(outputs, len(images))
+        t3 = time.perf_counter()
+        with self._lock:
+            s = self.stats
+            s.frames += len(images)
+            s.batches += 1
+            s.objects += sum(len(p) for p in parsed)
+            s.preprocess_s += t1 - t0
+            s.infer_s += t2 - t1
+            s.parse_s += t3 - t2
+        return list(zip(parsed, transforms))
+
+    @staticmethod
+    def _to_objects(parsed: list, transform: np.ndarray) -> List[ObjectMeta]:
+        """Network-pixel boxes back to frame pixels (see ``Preprocessor.transforms``)."""
+        left, top, sx, sy, ox, oy = (float(v) for v in transform)
+        return [ObjectMeta(c, left + (l - ox) * sx, top + (t - oy) * sy, w * sx, h * sy,
+                           confidence=p)
+                for c, p, l, t, w, h in parsed]
+
+    def infer(self, images: Sequence[np.ndarray]) -> List[List[ObjectMeta]]:
+        """Detect on frame-sized images; boxes come back in frame pixels."""
+        size = self.config.batch_size
+        futures = [self.pool.submit(self._run_batch, images[i:i + size])
+                   for i in range(0, len(images), size)]
+        return [self._to_objects(parsed, transform)
+                for future in futures for parsed, transform in future.result()]
+
+    def _label(self, parsed: list) -> Optional[Tuple[str, float]]:
+        if not parsed:
+            return None
+        k, p = parsed[0]
+        labels = self.config.labels[0] if self.config.labels else []
+        return labels[k] if k < len(labels) else str(k), p
+
+    def classify(self, crops: Sequence[np.ndarray]) -> List[Optional[Tuple[str, float]]]:
+        """Label per crop for ``network-type=1`` configs (``None`` under the threshold)."""
+        size = self.config.batch_size
+        futures = [self.pool.submit(self._run_batch, crops[i:i + size])
+                   for i in range(0, len(crops), size)]
+        return [self._label(parsed) for future in futures for parsed, _ in future.result()]
+
+    def classify_batch(self, batch: np.ndarray) -> List[Optional[Tuple[str, float]]]:
+        """Label per item of an already preprocessed ``[N, C, H, W]`` batch.
+
+        For callers that assemble their own batches, such as
+        :class:`iva.crop_batcher.CropBatcher`; runs on the calling thread.
+        """
+        t0 = time.perf_counter()
+        outputs = self.runtime.run(batch)
+        t1 = time.perf_counter()
+        parsed = self._parse(outputs, len(batch))
+        t2 = time.perf_counter()
+        with self._lock:
+            s = self.stats
+            s.frames += len(batch)
+            s.batches += 1
+            s.infer_s += t1 - t0
+            s.parse_s += t2 - t1
+        return [self._label(p) for p in parsed]
+
+    def frames(self, images: Iterable[Tuple[int, int, int, np.ndarray]],
+               window: int = 0) -> Iterator[FrameMeta]:
+        """``FrameMeta`` for ``(source_id, frame_num, pts, image)`` tuples, in order.
+
+        Up to ``window`` batches (default: one per worker) are in flight.
+        """
+        window = window or self.workers
+        size = self.config.batch_size
+        pending: List[Tuple[list, object]] = []
+        chunk: list = []
+
+        def drain(limit: int) -> Iterator[FrameMeta]:
+            while len(pending) > limit:
+                items, future = pending.pop(0)
+                for (sid, num, pts, image), (parsed, transform) in zip(items, future.result()):
+                    height = image.shape[0] * 2 // 3 if image.ndim == 2 else image.shape[0]
+                    yield FrameMeta(sid, num, pts, width=image.shape[1], height=height,
+                                    objects=self._to_objects(parsed, transform))
+
+        for item in images:
+            chunk.append(item)
+            if len(chunk) == size:
+                pending.append((chunk, self.pool.submit(self._run_batch, [c[3] for c in chunk])))
+                chunk = []
+                yield from drain(window)
+        if chunk:
+            pending.append((chunk, self.pool.submit(self._run_batch, [c[3] for c in chunk])))
+        yield from drain(0)
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+
+    from .precision import synthetic_frames
+
+    parser = argparse.ArgumentParser(description="Run an nvinfer config on the CPU.")
+    parser.add_argument("config")
+    parser.add_argument("--frames", help=".npy of HxWx3/HxWx4 uint8 frames; synthetic when omitted")
+    parser.add_argument("--count", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--batch-size", type=int, help="override batch-size")
+    args = parser.parse_args(argv)
+
+    config = InferConfig.from_file(args.config)
+    if args.batch_size:
+        config.batch_size = args.batch_size
+    if args.frames:
+        images = np.load(args.frames)
+    else:
+        planar = synthetic_frames(args.count, 720, 1280) / config.scale
+        rgb = planar.transpose(0, 2, 3, 1).astype(np.uint8)
+        # nvvideoconvert hands probes RGBA; keep the same layout.
+        images = np.ascontiguousarray(
+            np.concatenate([rgb, np.full(rgb.shape[:3] + (1,), 255, np.uint8)], axis=3))
+    with CpuInfer(config, workers=args.workers) as engine:
+        start = time.perf_counter()
+        count = sum(1 for _ in engine.frames((0, i, i, img) for i, img in enumerate(images)))
+        elapsed = time.perf_counter() - start
+        report = engine.stats.as_dict()
+    report.update(workers=args.workers, batch_size=config.batch_size,
+                  fps=round(count / elapsed, 1) if elapsed else 0.0)
+    print(json.dumps(report))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,435 @@
+"""Cross-frame object crop batching for the secondary classifiers.
+
+The section 5 SGIEs (ResNet18 car colour, make and type) classify 224x224
+crops of the vehicles the primary detector found. Handling crops frame by
+frame leaves the SGIE engines mostly empty – a frame holds a few cars, the
+engine takes ``batch-size=16`` – and resizes crops of wildly different
+sizes one at a time. :class:`CropBatcher` instead:
+
+* collects the crops of every frame of a mux batch, filtered like nvinfer
+  (``operate-on-class-ids``, ``input-object-min-width/height``);
+* buckets them by source size (the longer side: <=64, <=128, <=256 and
+  larger px by default), so a batch mostly holds crops at a similar scale
+  factor – what the GPU scaler's cost follows – and the per-bucket cost
+  report shows whether size matters on the CPU path;
+* emits a batch as soon as one bucket fills the engine batch, and when the
+  oldest waiting crop reaches ``deadline_ms`` sends a partial batch led by
+  its bucket and topped up from the nearest buckets;
+* resizes each batch with one :class:`iva.preprocess.Preprocessor` call
+  per contributing mux batch, straight into the engine input tensor;
+* counts the crops still pending per frame and calls ``on_frame_done``
+  once all crops of a frame are classified, so a frame (and its labels)
+  is released downstream only when complete.
+
+Crops reference the mux batch array until they are batched, up to
+``deadline_ms`` later. An ``NvBufSurface`` mapped in a probe is only valid
+until the probe returns: pass an owned array, or ``copy_frames=True`` to
+copy the frames that have crops when they are queued.
+
+:class:`CropBatchStats` reports batch fill, queue wait and per-crop
+preprocess/inference cost. ``python -m iva.crop_batcher`` compares it
+with per-frame and per-mux-batch batching on synthetic streams.
+"""
+
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import DSConfig
+from .meta import FrameMeta, ObjectMeta
+from .metrics import LatencyHistogram
+from .preprocess import Preprocessor
+
+DEFAULT_BUCKETS = (64, 128, 256)
+WAIT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.25)
+
+
+@dataclass
+class Crop:
+    """One object waiting for the classifier, with the mux batch it came from."""
+
+    frames: np.ndarray
+    index: int
+    fmt: str
+    roi: Tuple[float, float, float, float]
+    obj: ObjectMeta
+    source_id: int
+    frame_num: int
+    bucket: int
+    arrived: float
+
+
+@dataclass
+class CropBatchStats:
+    batch_size: int
+    buckets: Tuple[int, ...]
+    batches: int = 0
+    crops: int = 0
+    # Why each batch left: a bucket filled it, the deadline hit, or flush().
+    full: int = 0
+    deadline: int = 0
+    flushed: int = 0
+    fill: Dict[int, int] = field(default_factory=dict)
+    preprocess_s: float = 0.0
+    infer_s: float = 0.0
+    bucket_crops: Dict[int, int] = field(default_factory=dict)
+    bucket_preprocess_s: Dict[int, float] = field(default_factory=dict)
+    wait: LatencyHistogram = field(default_factory=lambda: LatencyHistogram(WAIT_BUCKETS))
+
+    def bucket_name(self, b: int) -> str:
+        return "<=%d" % self.buckets[b] if b < len(self.buckets) else \
+            ">%d" % (self.buckets[-1] if self.buckets else 0)
+
+    def as_dict(self) -> Dict[str, object]:
+        per = 1e6 / max(self.crops, 1)
+        return {
+            "batches": self.batches, "crops": self.crops,
+            "mean_fill": round(self.crops / max(self.batches * self.batch_size, 1), 3),
+            "fill": {str(k): v for k, v in sorted(self.fill.items())},
+            "full": self.full, "deadline": self.deadline, "flushed": self.flushed,
+            "preprocess_us_per_crop": round(self.preprocess_s * per, 1),
+            "infer_us_per_crop": round(self.infer_s * per, 1),
+            "wait_ms": {k: round(self.wait.quantile(q) * 1e3, 2)
+                        for k, q in (("p50", 0.5), ("p95", 0.95))},
+            "buckets": {self.bucket_name(b): {
+                "crops": n,
+                "preprocess_us_per_crop": round(self.bucket_preprocess_s[b] * 1e6 / n, 1)}
+                for b, n in sorted(self.bucket_crops.items())},
+        }
+
+
+def _format(frames: np.ndarray) -> str:
+    """Layout of a ``[N, ...]`` mux batch, as :func:`iva.cpu_infer.image_format`."""
+    if frames.ndim == 3:
+        return "nv12"
+    return "rgba" if frames.shape[3] == 4 else "rgb"
+
+
+class CropBatcher:
+    """Batches object crops across frames and mux batches for one SGIE.
+
+    ``run(tensor, crops)`` is called with each ``[K, 3, H, W]`` batch (a
+    view of a reused buffer, valid during the call) and its crops, on the
+    thread that called :meth:`add`, :meth:`poll` or :meth:`flush`.
+    ``on_frame_done(source_id, frame_num)`` follows on the same thread
+    for every frame whose last crop was in that batch (from :meth:`add`
+    directly for frames without crops). ``buckets`` are upper bounds on
+    the longer crop side; ``()`` disables bucketing. ``clock`` is the time
+    base of ``deadline_ms``.
+    """
+
+    def __init__(self, run: Callable[[np.ndarray, List[Crop]], None], batch_size: int,
+                 height: int = 224, width: int = 224, deadline_ms: float = 20.0,
+                 buckets: Sequence[int] = DEFAULT_BUCKETS,
+                 class_ids: Optional[Sequence[int]] = None,
+                 min_size: Tuple[int, int] = (0, 0), pre: Optional[Preprocessor] = None,
+                 on_frame_done: Optional[Callable[[int, int], None]] = None,
+                 copy_frames: bool = False,
+                 clock: Callable[[], float] = time.monotonic):
+        self.run = run
+        self.on_frame_done = on_frame_done
+        self.copy_frames = copy_frames
+        self.batch_size = batch_size
+        self.deadline = deadline_ms / 1e3
+        self.buckets = tuple(sorted(buckets))
+        self.class_ids = None if class_ids is None else frozenset(class_ids)
+        self.min_size = min_size
+        # nvinfer's default scaling-filter=0 is nearest neighbour.
+        self.pre = pre or Preprocessor(height, width, batch_size, letterbox=True,
+                                       interpolation="nearest")
+        if self.pre.batch < batch_size:
+            raise ValueError("preprocessor batch %d < %d" % (self.pre.batch, batch_size))
+        self.clock = clock
+        self.tensor = np.empty((batch_size, 3, self.pre.height, self.pre.width), np.float32)
+        self.pending: List[Deque[Crop]] = [deque() for _ in range(len(self.buckets) + 1)]
+        # (source_id, frame_num) -> crops not yet classified.
+        self.outstanding: Dict[Tuple[int, int], int] = {}
+        self.stats = CropBatchStats(batch_size, self.buckets)
+
+    @classmethod
+    def from_config(cls, path: str, engine=None, name: Optional[str] = None,
+                    deadline_ms: float = 20.0, buckets: Sequence[int] = DEFAULT_BUCKETS,
+                    clock: Callable[[], float] = time.monotonic, **kwargs) -> "CropBatcher":
+        """A batcher that labels objects with a ``network-type=1`` nvinfer config.
+
+        Uses ``engine`` (a :class:`iva.cpu_infer.CpuInfer`) or builds one
+        from ``path``; labels land in ``ObjectMeta.labels[name]`` (default
+        ``sgie<gie-unique-id>``). Other keyword arguments (``on_frame_done``,
+        ``copy_frames``) go to the constructor.
+        """
+        from .cpu_infer import CpuInfer, make_preprocessor
+
+        engine = engine or CpuInfer(path, workers=1)
+        config = engine.config
+        prop = DSConfig.read(path).property
+        class_ids = [int(v) for v in (prop("operate-on-class-ids") or "").split(";") if v]
+        name = name or "sgie%d" % config.unique_id
+
+        def run(tensor: np.ndarray, crops: List[Crop]) -> None:
+            for crop, result in zip(crops, engine.classify_batch(tensor)):
+                if result is not None:
+                    crop.obj.labels[name] = result[0]
+
+        return cls(run, config.batch_size, deadline_ms=deadline_ms, buckets=buckets,
+                   class_ids=class_ids or None,
+                   min_size=(int(prop("input-object-min-width", "0")),
+                             int(prop("input-object-min-height", "0"))),
+                   pre=make_preprocessor(config), clock=clock, **kwargs)
+
+    # -- intake ------------------------------------------------------------
+
+    def _bucket(self, size: float) -> int:
+        return int(np.searchsorted(self.buckets, size))
+
+    def add(self, frames: np.ndarray, metas: Sequence[FrameMeta],
+            now: Optional[float] = None) -> int:
+        """Queue the objects of one mux batch; returns the number of batches sent.
+
+        ``frames[i]`` is the image of ``metas[i]`` (``[N, H, W, 4|3]`` or
+        NV12 ``[N, H*3/2, W]``, uint8). The array is referenced, not
+        copied, until its crops are batched – unless ``copy_frames``, then
+        the frames that have crops are copied here, once.
+        """
+        now = self.clock() if now is None else now
+        fmt = _format(frames)
+        frame_h = frames.shape[1] * 2 // 3 if fmt == "nv12" else frames.shape[1]
+        frame_w = frames.shape[2]
+        min_w, min_h = self.min_size
+        queued: List[Tuple[int, int, Tuple[float, float, float, float], ObjectMeta]] = []
+        for i, meta in enumerate(metas):
+            count = 0
+            for obj in meta.objects:
+                if self.class_ids is not None and obj.class_id not in self.class_ids:
+                    continue
+                left, top = max(obj.left, 0.0), max(obj.top, 0.0)
+                w = min(obj.left + obj.width, frame_w) - left
+                h = min(obj.top + obj.height, frame_h) - top
+                if w < max(min_w, 1) or h < max(min_h, 1):
+                    continue
+                queued.append((self._bucket(max(w, h)), i, (left, top, w, h), obj))
+                count += 1
+            if count:
+                key = (meta.source_id, meta.frame_num)
+                self.outstanding[key] = self.outstanding.get(key, 0) + count
+            elif self.on_frame_done is not None:
+                self.on_frame_done(meta.source_id, meta.frame_num)
+        if queued and self.copy_frames:
+            used = sorted({i for _, i, _, _ in queued})
+            remap = {i: k for k, i in enumerate(used)}
+            frames = frames[used]  # fancy indexing copies
+            queued = [(b, remap[i], roi, obj) for b, i, roi, obj in queued]
+            metas = [metas[i] for i in used]
+        for b, i, roi, obj in queued:
+            meta = metas[i]
+            self.pending[b].append(Crop(frames, i, fmt, roi, obj,
+                                        meta.source_id, meta.frame_num, b, now))
+        sent = 0
+        for b, queue in enumerate(self.pending):
+            while len(queue) >= self.batch_size:
+                self._emit([queue.popleft() for _ in range(self.batch_size)], "full", now)
+                sent += 1
+        return sent + self.poll(now)
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self.pending)
+
+    def pending_crops(self, source_id: int, frame_num: int) -> int:
+        """Crops of one frame still waiting for the classifier."""
+        return self.outstanding.get((source_id, frame_num), 0)
+
+    # -- batch formation ---------------------------------------------------
+
+    def _oldest(self) -> Optional[int]:
+        heads = [(q[0].arrived, b) for b, q in enumerate(self.pending) if q]
+        return min(heads)[1] if heads else None
+
+    def _take(self, lead: int) -> List[Crop]:
+        """Up to a batch of crops: ``lead`` first, then the nearest buckets."""
+        order = sorted(range(len(self.pending)), key=lambda b: (abs(b - lead), b))
+        crops: List[Crop] = []
+        for b in order:
+            queue = self.pending[b]
+            while queue and len(crops) < self.batch_size:
+                crops.append(queue.popleft())
+        return crops
+
+    def next_deadline(self) -> Optional[float]:
+        """Clock time at which :meth:`poll` will next send a batch, for a timer."""
+        lead = self._oldest()
+        return None if lead is None else self.pending[lead][0].arrived + self.deadline
+
+    def poll(self, now: Optional[float] = None) -> int:
+        """Send partial batches whose oldest crop has waited ``deadline_ms``."""
+        now = self.clock() if now is None else now
+        sent = 0
+        while True:
+            lead = self._oldest()
+            if lead is None or self.pending[lead][0].arrived + self.deadline > now:
+                return sent
+            self._emit(self._take(lead), "deadline", now)
+            sent += 1
+
+    def flush(self, now: Optional[float] = None) -> int:
+        """Send everything still queued (end of stream)."""
+        now = self.clock() if now is None else now
+        sent = 0
+        while len(self):
+            self._emit(self._take(self._oldest()), "flushed", now)
+            sent += 1
+        return sent
+
+    def _emit(self, crops: List[Crop], reason: str, now: float) -> None:
+        k = len(crops)
+        t0 = time.perf_counter()
+        # One preprocess call per contributing mux batch, each into its slice.
+        groups: Dict[int, List[int]] = {}
+        for j, crop in enumerate(crops):
+            groups.setdefault(id(crop.frames), []).append(j)
+        order = [j for members in groups.values() for j in members]
+        crops = [crops[j] for j in order]
+        start = 0
+        for members in groups.values():
+            group = crops[start:start + len(members)]
+            self.pre.run(group[0].frames, group[0].fmt,
+                         np.array([c.roi for c in group], np.float32),
+                         np.array([c.index for c in group], np.intp),
+                         out=self.tensor[start:start + len(group)])
+            start += len(group)
+        t1 = time.perf_counter()
+        self.run(self.tensor[:k], crops)
+        t2 = time.perf_counter()
+        done = []
+        for crop in crops:
+            key = (crop.source_id, crop.frame_num)
+            left = self.outstanding[key] - 1
+            if left:
+                self.outstanding[key] = left
+            else:
+                del self.outstanding[key]
+                done.append(key)
+        if self.on_frame_done is not None:
+            for source_id, frame_num in done:
+                self.on_frame_done(source_id, frame_num)
+
+        s = self.stats
+        s.batches += 1
+        s.crops += k
+        setattr(s, reason, getattr(s, reason) + 1)
+        s.fill[k] = s.fill.get(k, 0) + 1
+        s.preprocess_s += t1 - t0
+        s.infer_s += t2 - t1
+        # Mixed batches split their preprocess time by crop count.
+        for crop in crops:
+            s.bucket_crops[crop.bucket] = s.bucket_crops.get(crop.bucket, 0) + 1
+            s.bucket_preprocess_s[crop.bucket] = \
+                s.bucket_preprocess_s.get(crop.bucket, 0.0) + (t1 - t0) / k
+            s.wait.observe(max(now - crop.arrived, 0.0))
+
+
+# -- benchmark --------------------------------------------------------------
+
+def synthetic_streams(streams: int, batches: int, objects: Tuple[int, int] = (0, 6),
+                      height: int = 720, width: int = 1280, seed: int = 0):
+    """``(frames, metas)`` mux batches of random vehicles, 16-640 px, log-uniform."""
+    from .preprocess import synthetic
+
+    rng = np.random.default_rng(seed)
+    frames = synthetic(streams, height, width, "rgba", seed)
+    for n in range(batches):
+        metas = []
+        for sid in range(streams):
+            count = int(rng.integers(objects[0], objects[1] + 1))
+            size = np.exp(rng.uniform(np.log(16), np.log(640), (count, 1)))
+            wh = np.minimum(size * rng.uniform(0.6, 1.6, (count, 2)), [width, height])
+            xy = rng.uniform(0, 1, (count, 2)) * ([width, height] - wh)
+            metas.append(FrameMeta(sid, n, n, width=width, height=height,
+                                   objects=[ObjectMeta(0, *map(float, (x, y, w, h)), confidence=0.9)
+                                            for (x, y), (w, h) in zip(xy, wh)]))
+        yield frames, metas
+
+
+def bench(streams: int = 8, batches: int = 30, batch_size: int = 16, deadline_ms: float = 50.0,
+          interval_ms: float = 33.3, config: Optional[str] = None,
+          seed: int = 0) -> List[Dict[str, object]]:
+    """Per-frame, per-mux-batch and cross-batch bucketed crop batching on the same streams.
+
+    Mux batches arrive every ``interval_ms`` of simulated time and a timer
+    polls at every deadline in between. Without ``config`` the classifier
+    is a fixed launch cost plus a linear layer over channel means.
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.standard_normal((3, 6)).astype(np.float32)
+    engine = None
+    if config:
+        from .cpu_infer import CpuInfer
+
+        engine = CpuInfer(config, workers=1)
+
+    def make(deadline, buckets):
+        if engine is not None:
+            return CropBatcher.from_config(config, engine, deadline_ms=deadline, buckets=buckets)
+
+        def run(tensor, crops):
+            time.sleep(0.0005)  # fixed launch cost per engine call
+            tensor.mean(axis=(2, 3)) @ weights
+        return CropBatcher(run, batch_size, deadline_ms=deadline, buckets=buckets)
+
+    rows = []
+    for case, deadline, buckets, scope in (
+            ("per-frame", 0.0, (), "frame"),
+            ("per-mux-batch", 0.0, (), "mux"),
+            ("cross-batch bucketed", deadline_ms, DEFAULT_BUCKETS, "stream")):
+        batcher = make(deadline, buckets)
+        start = time.perf_counter()
+
+        def advance(now):
+            due = batcher.next_deadline()
+            while due is not None and due <= now:
+                batcher.poll(due)
+                due = batcher.next_deadline()
+
+        for n, (frames, metas) in enumerate(synthetic_streams(streams, batches, seed=seed)):
+            now = n * interval_ms / 1e3
+            advance(now)
+            if scope == "frame":
+                for i, meta in enumerate(metas):
+                    batcher.add(frames[i:i + 1], [meta], now)
+                    batcher.flush(now)
+            else:
+                batcher.add(frames, metas, now)
+                if scope == "mux":
+                    batcher.flush(now)
+        advance(batches * interval_ms / 1e3)
+        batcher.flush(batches * interval_ms / 1e3)
+        elapsed = time.perf_counter() - start
+        row = {"case": case, "streams": streams, "batch_size": batcher.batch_size}
+        row.update(batcher.stats.as_dict())
+        row["total_us_per_crop"] = round(elapsed * 1e6 / max(batcher.stats.crops, 1), 1)
+        rows.append(row)
+    if engine is not None:
+        engine.close()
+    return rows
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Benchmark SGIE crop batching.")
+    parser.add_argument("--config", help="network-type=1 nvinfer config to run on the CPU")
+    parser.add_argument("--streams", type=int, default=8)
+    parser.add_argument("--batches", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--deadline-ms", type=float, default=50.0)
+    args = parser.parse_args(argv)
+    for row in bench(args.streams, args.batches, args.batch_size, args.deadline_ms,
+                     config=args.config):
+        print(json.dumps(row))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,290 @@
+"""Decode a stream once and share the frames between several analyses.
+
+In section 11.5 (and in deployments) one camera often drives several
+pipelines – detector + SGIEs, the dsexample motion plugin, the dewarper –
+and each builds its own ``filesrc ! h264parse ! nvdec_h264`` chain, so the
+same stream is decoded once per analysis. Two ways to decode once:
+
+* :class:`DecodeService` – one GStreamer pipeline per stream that ends in
+  ``tee``. Consumers subscribe at runtime with a bin description; each gets
+  its own leaky ``queue`` and a ``videorate`` cap on its frame rate, so a
+  slow consumer drops frames instead of stalling the others. Decoded
+  buffers are shared by reference (tee does not copy). The decoder runs
+  while at least one consumer is subscribed.
+* :class:`FrameFanout` – the same for in-process Python consumers: frames
+  are published once into pooled buffers, every consumer receives a
+  reference-counted :class:`SharedFrame`, and the buffer goes back to the
+  pool when the last consumer releases it.
+"""
+
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+import numpy as np
+
+from .pipeline import decode_chain
+
+NS = 10**9
+
+
+# -- GStreamer decode service --------------------------------------------
+
+@dataclass
+class Subscription:
+    location: str
+    name: str
+    max_fps: Optional[int]
+    bin: object = None
+    tee_pad: object = None
+
+
+class DecodeService:
+    """One decode pipeline per stream, shared by all subscribed consumers."""
+
+    def __init__(self, queue_buffers: int = 4):
+        import gi
+        gi.require_version("Gst", "1.0")
+        from gi.repository import Gst
+
+        Gst.init(None)
+        self._Gst = Gst
+        self.queue_buffers = queue_buffers
+        self._pipelines: Dict[str, object] = {}
+        self._subs: Dict[str, List[Subscription]] = {}
+        self._lock = threading.Lock()
+        self._count = 0
+
+    @staticmethod
+    def describe(location: str) -> str:
+        return "%s ! tee name=t allow-not-linked=true" % decode_chain(location)
+
+    def branch_description(self, chain: str, max_fps: Optional[int]) -> str:
+        desc = "queue leaky=downstream max-size-buffers=%d" % self.queue_buffers
+        if max_fps:
+            desc += " ! videorate drop-only=true max-rate=%d" % max_fps
+        return desc + " ! " + chain
+
+    def subscribe(self, location: str, chain: str,
+                  max_fps: Optional[int] = None) -> Subscription:
+        """Attach ``chain`` (a bin description) to the decoded frames of ``location``."""
+        Gst = self._Gst
+        with self._lock:
+            pipeline = self._pipelines.get(location)
+            if pipeline is None:
+                pipeline = Gst.parse_launch(self.describe(location))
+                self._pipelines[location] = pipeline
+                self._subs[location] = []
+            self._count += 1
+            sub = Subscription(location, "consumer%d" % self._count, max_fps)
+            sub.bin = Gst.parse_bin_from_description(
+                self.branch_description(chain, max_fps), True)
+            sub.bin.set_name(sub.name)
+            pipeline.add(sub.bin)
+            tee = pipeline.get_by_name("t")
+            sub.tee_pad = tee.get_request_pad("src_%u")
+            sub.tee_pad.link(sub.bin.get_static_pad("sink"))
+            self._subs[location].append(sub)
+            if len(self._subs[location]) == 1:
+                pipeline.set_state(Gst.State.PLAYING)
+            else:
+                sub.bin.sync_state_with_parent()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        """Detach a consumer; the decoder stops with the last one."""
+        Gst = self._Gst
+        with self._lock:
+            subs = self._subs.get(sub.location, [])
+            if sub not in subs:
+                return
+            subs.remove(sub)
+            pipeline = self._pipelines[sub.location]
+            if not subs:
+                pipeline.set_state(Gst.State.NULL)
+                del self._pipelines[sub.location]
+                del self._subs[sub.location]
+                return
+
+        def unlink(pad, info):
+            tee = pad.get_parent_element()
+            pad.unlink(sub.bin.get_static_pad("sink"))
+            tee.release_request_pad(pad)
+            sub.bin.set_state(Gst.State.NULL)
+            pipeline.remove(sub.bin)
+            return Gst.PadProbeReturn.REMOVE
+
+        # Detach between buffers so the tee never pushes into a dead branch.
+        sub.tee_pad.add_probe(Gst.PadProbeType.IDLE, unlink)
+
+    def consumers(self, location: str) -> int:
+        return len(self._subs.get(location, ()))
+
+    def stop(self) -> None:
+        with self._lock:
+            for pipeline in self._pipelines.values():
+                pipeline.set_state(self._Gst.State.NULL)
+            self._pipelines.clear()
+            self._subs.clear()
+
+
+# -- in-process fan-out ----------------------------------------------------
+
+class FramePool:
+    """Preallocated frame buffers of one shape, recycled after release."""
+
+    def __init__(self, shape, dtype=np.uint8, size: int = 8):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self._free: List[np.ndarray] = [np.empty(self.shape, self.dtype)
+                                        for _ in range(size)]
+        self._lock = threading.Lock()
+        self.allocated = size
+
+    def acquire(self) -> np.ndarray:
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        return np.empty(self.shape, self.dtype)
+
+    def release(self, array: np.ndarray) -> None:
+        with self._lock:
+            self._free.append(array)
+
+
+class SharedFrame:
+    """A decoded frame shared by several consumers.
+
+    ``data`` must be treated as read-only. Every consumer that receives
+    the frame calls :meth:`release` once when done with it.
+    """
+
+    __slots__ = ("data", "pts", "source_id", "_refs", "_pool", "_lock")
+
+    def __init__(self, data: np.ndarray, pts: int, source_id: int,
+                 refs: int, pool: Optional[FramePool]):
+        self.data = data
+        self.pts = pts
+        self.source_id = source_id
+        self._refs = refs
+        self._pool = pool
+        self._lock = threading.Lock()
+
+    @property
+    def refs(self) -> int:
+        return self._refs
+
+    def release(self) -> None:
+        with self._lock:
+            self._refs -= 1
+            last = self._refs == 0
+        if last and self._pool is not None:
+            self._pool.release(self.data)
+
+
+@dataclass
+class Consumer:
+    name: str
+    max_fps: Optional[float]
+    depth: int
+    queue: Deque[SharedFrame] = field(default_factory=deque)
+    last_pts: Optional[int] = None
+    delivered: int = 0
+    skipped: int = 0   # rate-limited, never queued
+    dropped: int = 0   # queued but overwritten because the consumer lagged
+
+
+class FrameFanout:
+    """Publish each decoded frame once to many rate-limited consumers."""
+
+    def __init__(self, shape, dtype=np.uint8, pool_size: int = 8, source_id: int = 0):
+        self.pool = FramePool(shape, dtype, pool_size)
+        self.source_id = source_id
+        self.consumers: Dict[str, Consumer] = {}
+        self._cond = threading.Condition()
+        self.published = 0
+
+    def subscribe(self, name: str, max_fps: Optional[float] = None,
+                  depth: int = 2) -> Consumer:
+        with self._cond:
+            consumer = self.consumers[name] = Consumer(name, max_fps, depth)
+        return consumer
+
+    def unsubscribe(self, name: str) -> None:
+        with self._cond:
+            consumer = self.consumers.pop(name, None)
+            pending = list(consumer.queue) if consumer is not None else []
+            if consumer is not None:
+                consumer.queue.clear()
+            # Wake a get() blocked on this consumer so it returns None now.
+            self._cond.notify_all()
+        for frame in pending:
+            frame.release()
+
+    def _wants(self, consumer: Consumer, pts: int) -> bool:
+        if not consumer.max_fps or consumer.last_pts is None:
+            return True
+        return pts - consumer.last_pts >= NS / consumer.max_fps * 0.999
+
+    def publish(self, frame: np.ndarray, pts: int) -> int:
+        """Copy ``frame`` into a pooled buffer once and queue it for consumers.
+
+        Returns how many consumers received it.
+        """
+        with self._cond:
+            targets = [c for c in self.consumers.values() if self._wants(c, pts)]
+            for c in self.consumers.values():
+                if c not in targets:
+                    c.skipped += 1
+            if not targets:
+                return 0
+            buf = self.pool.acquire()
+            np.copyto(buf, frame)
+            shared = SharedFrame(buf, pts, self.source_id, len(targets), self.pool)
+            evicted = []
+            for c in targets:
+                c.last_pts = pts
+                if len(c.queue) >= c.depth:
+                    evicted.append(c.queue.popleft())
+                    c.dropped += 1
+                c.queue.append(shared)
+            self.published += 1
+            self._cond.notify_all()
+        for old in evicted:
+            old.release()
+        return len(targets)
+
+    def get(self, name: str, timeout: Optional[float] = None) -> Optional[SharedFrame]:
+        """Next frame for consumer ``name`` (call ``release()`` on it when done).
+
+        Returns None on timeout and once ``name`` is unsubscribed.
+        """
+        with self._cond:
+            consumer = self.consumers.get(name)
+            if consumer is None:
+                return None
+            if not self._cond.wait_for(lambda: consumer.queue or name not in self.consumers,
+                                       timeout):
+                return None
+            if not consumer.queue:
+                return None
+            frame = consumer.queue.popleft()
+            consumer.delivered += 1
+            return frame
+
+    def run_consumer(self, name: str, handler: Callable[[SharedFrame], None],
+                     stop: threading.Event, poll: float = 0.1) -> None:
+        """Loop ``handler`` over frames of ``name`` until ``stop`` is set or
+        ``name`` is unsubscribed."""
+        while not stop.is_set():
+            frame = self.get(name, timeout=poll)
+            if frame is None:
+                if name not in self.consumers:
+                    return
+                continue
+            try:
+                handler(frame)
+            finally:
+                frame.release()
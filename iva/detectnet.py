@@ -0,0 +1,142 @@
+"""DetectNet-style output parsing, as nvinfer's ``parse-func=4``.
+
+The section 4 primary detector (ResNet10) emits two blobs
+(``output-blob-names=conv2d_bbox;conv2d_cov/Sigmoid``): a coverage map
+``[classes, grid_h, grid_w]`` and box offsets ``[4 * classes, grid_h,
+grid_w]`` on a 16-pixel grid. Every cell whose coverage reaches the class
+threshold proposes one rectangle; the proposals are then clustered. This
+is the same decoding as the section 6 ``nvdsparsebbox`` sample, done for a
+whole batch with array operations.
+
+nvinfer clusters with OpenCV ``groupRectangles``; :func:`parse` does the
+same with ``cluster="group"`` (needs OpenCV) and greedy NMS by default.
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+STRIDE = 16
+BBOX_NORM = 35.0
+
+
+@dataclass
+class ParsedObjects:
+    """Detections of one image: parallel arrays, boxes as left, top, width, height."""
+
+    class_id: np.ndarray
+    confidence: np.ndarray
+    boxes: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.confidence)
+
+    def to_object_meta(self) -> list:
+        from .meta import ObjectMeta
+
+        return [ObjectMeta(int(c), float(b[0]), float(b[1]), float(b[2]), float(b[3]),
+                           confidence=float(p))
+                for c, p, b in zip(self.class_id, self.confidence, self.boxes)]
+
+
+def decode(cov: np.ndarray, bbox: np.ndarray, thresholds, stride: int = STRIDE,
+           bbox_norm: float = BBOX_NORM):
+    """Grid proposals for a batch.
+
+    ``cov`` is ``[N, C, H, W]`` and ``bbox`` ``[N, 4C, H, W]``. Returns flat
+    arrays ``(image, class_id, confidence, x1, y1, x2, y2)`` in network
+    input pixels.
+    """
+    n, c, h, w = cov.shape
+    thr = np.broadcast_to(np.asarray(thresholds, np.float32).reshape(-1), (c,))
+    img, cls, gy, gx = np.nonzero(cov >= thr[None, :, None, None])
+    conf = cov[img, cls, gy, gx]
+    cx = (gx * stride + 0.5) / bbox_norm
+    cy = (gy * stride + 0.5) / bbox_norm
+    off = bbox.reshape(n, c, 4, h, w)[img, cls, :, gy, gx]
+    x1 = (off[:, 0] - cx) * -bbox_norm
+    y1 = (off[:, 1] - cy) * -bbox_norm
+    x2 = (off[:, 2] + cx) * bbox_norm
+    y2 = (off[:, 3] + cy) * bbox_norm
+    return img, cls, conf, x1, y1, x2, y2
+
+
+def nms(x1, y1, x2, y2, scores, iou: float = 0.5) -> np.ndarray:
+    """Indices kept by greedy non-maximum suppression, highest score first."""
+    order = np.argsort(-scores, kind="stable")
+    area = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    keep = []
+    while len(order):
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        iw = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        ih = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = iw * ih
+        union = area[i] + area[rest] - inter
+        order = rest[inter <= iou * np.maximum(union, 1e-9)]
+    return np.asarray(keep, np.int64)
+
+
+def _group(x1, y1, x2, y2, scores, group_threshold: int, eps: float):
+    import cv2
+
+    rects = [[int(a), int(b), int(c - a), int(d - b)] for a, b, c, d in zip(x1, y1, x2, y2)]
+    grouped, _ = cv2.groupRectangles(rects, group_threshold, eps)
+    if not len(grouped):
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32)
+    grouped = np.asarray(grouped, np.float32)
+    # groupRectangles drops scores; keep the best proposal score under each group.
+    conf = np.zeros(len(grouped), np.float32)
+    for k, (l, t, w, h) in enumerate(grouped):
+        inside = (x1 >= l - w * eps) & (y1 >= t - h * eps) & \
+                 (x2 <= l + w * (1 + eps)) & (y2 <= t + h * (1 + eps))
+        conf[k] = scores[inside].max() if inside.any() else 0.0
+    return grouped, conf
+
+
+def parse(cov: np.ndarray, bbox: np.ndarray, thresholds=0.2, width: Optional[int] = None,
+          height: Optional[int] = None, cluster: str = "nms", iou: float = 0.5,
+          group_threshold: int = 1, eps: float = 0.2, stride: int = STRIDE,
+          bbox_norm: float = BBOX_NORM) -> List[ParsedObjects]:
+    """Objects per image of a batch, boxes clipped to ``width`` x ``height``."""
+    if cov.ndim == 3:
+        cov, bbox = cov[None], bbox[None]
+    n, _, h, w = cov.shape
+    width = width or w * stride
+    height = height or h * stride
+    img, cls, conf, x1, y1, x2, y2 = decode(cov, bbox, thresholds, stride, bbox_norm)
+    x1, x2 = np.clip(x1, 0, width - 1), np.clip(x2, 0, width - 1)
+    y1, y2 = np.clip(y1, 0, height - 1), np.clip(y2, 0, height - 1)
+    ok = (x2 > x1) & (y2 > y1)
+    img, cls, conf, x1, y1, x2, y2 = (a[ok] for a in (img, cls, conf, x1, y1, x2, y2))
+    out = []
+    for i in range(n):
+        classes, confs, boxes = [], [], []
+        for c in np.unique(cls[img == i]):
+            sel = np.nonzero((img == i) & (cls == c))[0]
+            if cluster == "group":
+                b, p = _group(x1[sel], y1[sel], x2[sel], y2[sel], conf[sel], group_threshold, eps)
+            else:
+                k = sel[nms(x1[sel], y1[sel], x2[sel], y2[sel], conf[sel], iou)]
+                b = np.stack([x1[k], y1[k], x2[k] - x1[k], y2[k] - y1[k]], axis=1)
+                p = conf[k]
+            classes.append(np.full(len(p), c, np.int32))
+            confs.append(p)
+            boxes.append(b)
+        if classes:
+            out.append(ParsedObjects(np.concatenate(classes), np.concatenate(confs).astype(np.float32),
+                                     np.concatenate(boxes).astype(np.float32)))
+        else:
+            out.append(ParsedObjects(np.zeros(0, np.int32), np.zeros(0, np.float32),
+                                     np.zeros((0, 4), np.float32)))
+    return out
+
+
+def blob_names(value: Optional[str], default: Sequence[str] = ("conv2d_bbox", "conv2d_cov/Sigmoid")):
+    """``(bbox, coverage)`` blob names from ``output-blob-names``."""
+    names = [v for v in (value or "").split(";") if v] or list(default)
+    bbox = next((v for v in names if "bbox" in v), names[0])
+    cov = next((v for v in names if "cov" in v), names[-1])
+    return bbox, cov
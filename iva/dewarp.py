@@ -0,0 +1,414 @@
+"""CPU reference dewarper for 360° (fisheye) camera feeds.
+
+Mirrors the parameters of ``nvdewarper``'s ``config_dewarper.txt``
+(section 9): every ``[surfaceN]`` group has a ``projection-type``
+(1 = PushBroom, 2 = VertRadCyl), ``width``/``height``, ``top-angle`` and
+``bottom-angle``, ``pitch``/``yaw``/``roll`` and the lens ``focal-length``
+in pixels per radian; ``[property]`` gives the ``output-width`` and
+``output-height`` every surface is scaled to.
+
+The projections follow the usual definitions rather than NVIDIA's exact
+kernels, so output is close to, not bit-identical with, the GPU plugin:
+
+* the lens is an equidistant fisheye, ``r = focal_length * theta``,
+  centred on the input frame;
+* VertRadCyl is a vertical cylinder: columns are linear in azimuth, rows
+  are rectilinear (``tan``) in elevation between bottom- and top-angle;
+* PushBroom sweeps a straight line: columns are rectilinear in azimuth,
+  rows are linear in elevation between bottom- and top-angle;
+* the view is rotated by roll (about the view axis), then pitch, then yaw
+  about the lens axis – a ceiling camera uses ``pitch=90`` to look at the
+  horizon and ``yaw`` to pan around the room.
+
+Remap tables are computed once per parameter set and kept in a
+:class:`RemapCache`: in memory, and on disk as ``.npy`` files named by a
+hash of the parameters and memory-mapped on load, so startup and config
+reloads do not recompute them. :meth:`RemapTable.apply` does vectorised
+bilinear sampling with numpy.
+"""
+
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import DSConfig
+
+PROJECTION_PUSHBROOM = 1
+PROJECTION_VERTRADCYL = 2
+PROJECTION_NAMES = {PROJECTION_PUSHBROOM: "PushBroom",
+                    PROJECTION_VERTRADCYL: "VertRadCyl"}
+
+# Bumped whenever the table math changes so stale cache files are ignored.
+TABLE_VERSION = 1
+
+
+@dataclass(frozen=True)
+class SurfaceParams:
+    projection_type: int
+    width: int
+    height: int
+    top_angle: float
+    bottom_angle: float
+    pitch: float = 0.0
+    yaw: float = 0.0
+    roll: float = 0.0
+    focal_length: float = 0.0
+    surface_index: int = 0
+
+    @classmethod
+    def from_group(cls, group: Dict[str, str]) -> "SurfaceParams":
+        def f(key, default=None):
+            value = group.get(key)
+            if value is None:
+                if default is None:
+                    raise ValueError("dewarper surface is missing %r" % key)
+                return default
+            return float(value)
+
+        return cls(
+            projection_type=int(f("projection-type")),
+            width=int(f("width")),
+            height=int(f("height")),
+            top_angle=f("top-angle"),
+            bottom_angle=f("bottom-angle"),
+            pitch=f("pitch", 0.0),
+            yaw=f("yaw", 0.0),
+            roll=f("roll", 0.0),
+            focal_length=f("focal-length"),
+            surface_index=int(f("surface-index", 0.0)),
+        )
+
+    def replace(self, **changes) -> "SurfaceParams":
+        d = asdict(self)
+        d.update(changes)
+        return SurfaceParams(**d)
+
+
+@dataclass
+class DewarperConfig:
+    output_width: int
+    output_height: int
+    surfaces: List[SurfaceParams]
+    # N of the ``[surfaceN]`` group each entry of ``surfaces`` came from.
+    numbers: List[int] = field(default_factory=list)
+
+    def surface(self, number: int) -> SurfaceParams:
+        """Parameters of the ``[surface<number>]`` group."""
+        numbers = self.numbers or list(range(len(self.surfaces)))
+        try:
+            return self.surfaces[numbers.index(number)]
+        except ValueError:
+            raise KeyError("no [surface%d] group (have %s)" % (
+                number, ", ".join("surface%d" % n for n in numbers))) from None
+
+
+def load_dewarper_config(path: str) -> DewarperConfig:
+    """Parse a ``config_dewarper.txt``."""
+    cfg = DSConfig.read(path)
+    numbers = sorted(int(g[len("surface"):] or 0) for g in cfg.group_names("surface"))
+    surfaces = [SurfaceParams.from_group(cfg.groups["surface%d" % n]) for n in numbers]
+    if not surfaces:
+        raise ValueError("%s defines no [surfaceN] groups" % path)
+    out_w = int(cfg.property("output-width", surfaces[0].width))
+    out_h = int(cfg.property("output-height", surfaces[0].height))
+    for s in surfaces:
+        if s.projection_type not in PROJECTION_NAMES:
+            raise ValueError("unsupported projection-type %d" % s.projection_type)
+    return DewarperConfig(out_w, out_h, surfaces, numbers)
+
+
+def _rotate(x, y, z, pitch, yaw, roll, inverse: bool = False):
+    """Apply yaw . pitch . roll (or its inverse); angles in degrees.
+
+    Written out element-wise so every argument may be an array: the fitter
+    evaluates many candidate parameter sets in one broadcast call.
+    """
+    p, yw, r = np.radians(pitch), np.radians(yaw), np.radians(roll)
+    if inverse:
+        p, yw, r = -p, -yw, -r
+    steps = [("z", r), ("x", p), ("z", yw)]
+    if inverse:
+        steps.reverse()
+    for axis, angle in steps:
+        c, s = np.cos(angle), np.sin(angle)
+        if axis == "z":
+            x, y = c * x - s * y, s * x + c * y
+        else:
+            y, z = c * y - s * z, s * y + c * z
+    return x, y, z
+
+
+def _surface_scale(projection_type: int, height, top, bottom):
+    """Output focal length (surface pixels per unit of the row mapping)."""
+    if projection_type == PROJECTION_VERTRADCYL:
+        return height / (np.tan(top) - np.tan(bottom))
+    return height / (top - bottom)
+
+
+def project_points(projection_type: int, width, height, top_angle, bottom_angle,
+                   pitch, yaw, roll, focal_length, u, v, src_w: int, src_h: int):
+    """Map surface pixel coordinates ``(u, v)`` to fisheye pixel coordinates.
+
+    ``u``/``v`` are in surface units (0..width, 0..height); all arguments
+    except ``projection_type`` broadcast.
+    """
+    top = np.radians(top_angle)
+    bottom = np.radians(bottom_angle)
+    f_out = _surface_scale(projection_type, height, top, bottom)
+    if projection_type == PROJECTION_VERTRADCYL:
+        azimuth = (u - width / 2.0) / f_out
+        elevation = np.arctan(np.tan(top) - v / f_out)
+    else:
+        azimuth = np.arctan((u - width / 2.0) / f_out)
+        elevation = top - v / f_out
+    cos_el = np.cos(elevation)
+    x, y, z = _rotate(np.sin(azimuth) * cos_el, -np.sin(elevation),
+                      np.cos(azimuth) * cos_el, pitch, yaw, roll)
+    theta = np.arccos(np.clip(z, -1.0, 1.0))
+    phi = np.arctan2(y, x)
+    r = focal_length * theta
+    return src_w / 2.0 + r * np.cos(phi) - 0.5, src_h / 2.0 + r * np.sin(phi) - 0.5
+
+
+def unproject_points(projection_type: int, width, height, top_angle, bottom_angle,
+                     pitch, yaw, roll, focal_length, x, y, src_w: int, src_h: int):
+    """Inverse of :func:`project_points`: fisheye pixels to surface units."""
+    dx = x + 0.5 - src_w / 2.0
+    dy = y + 0.5 - src_h / 2.0
+    theta = np.hypot(dx, dy) / focal_length
+    phi = np.arctan2(dy, dx)
+    sin_t = np.sin(theta)
+    vx, vy, vz = _rotate(sin_t * np.cos(phi), sin_t * np.sin(phi), np.cos(theta),
+                         pitch, yaw, roll, inverse=True)
+    elevation = -np.arcsin(np.clip(vy, -1.0, 1.0))
+    azimuth = np.arctan2(vx, vz)
+    top = np.radians(top_angle)
+    bottom = np.radians(bottom_angle)
+    f_out = _surface_scale(projection_type, height, top, bottom)
+    if projection_type == PROJECTION_VERTRADCYL:
+        u = azimuth * f_out + width / 2.0
+        v = (np.tan(top) - np.tan(elevation)) * f_out
+    else:
+        u = np.tan(azimuth) * f_out + width / 2.0
+        v = (top - elevation) * f_out
+    return u, v
+
+
+def compute_maps(params: SurfaceParams, src_w: int, src_h: int,
+                 out_w: int, out_h: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Source pixel coordinates (map_x, map_y) for every output pixel."""
+    if params.top_angle <= params.bottom_angle:
+        raise ValueError("top-angle must be greater than bottom-angle")
+    # Sample at the centre of each output pixel, in surface coordinates.
+    u = (np.arange(out_w, dtype=np.float64) + 0.5) * (params.width / out_w)
+    v = (np.arange(out_h, dtype=np.float64) + 0.5) * (params.height / out_h)
+    map_x, map_y = project_points(
+        params.projection_type, params.width, params.height,
+        params.top_angle, params.bottom_angle, params.pitch, params.yaw,
+        params.roll, params.focal_length,
+        u[np.newaxis, :], v[:, np.newaxis], src_w, src_h)
+    return map_x.astype(np.float32), map_y.astype(np.float32)
+
+
+class RemapTable:
+    """Bilinear remap in gather form.
+
+    ``index`` holds, per output pixel, the flat index of the top-left tap
+    in the source frame padded by one black pixel on every side; ``weights``
+    holds the fractional x/y offsets. Out-of-view pixels point at the
+    padding with zero weights, so they come out black without a mask.
+    """
+
+    def __init__(self, index: np.ndarray, weights: np.ndarray,
+                 src_w: int, src_h: int):
+        self.index = index
+        self.weights = weights
+        self.src_w = src_w
+        self.src_h = src_h
+        self._padded: Optional[np.ndarray] = None
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.index.shape
+
+    @classmethod
+    def from_maps(cls, map_x: np.ndarray, map_y: np.ndarray,
+                  src_w: int, src_h: int) -> "RemapTable":
+        pw = src_w + 2
+        # Shift into padded coordinates.
+        px = map_x.astype(np.float64) + 1.0
+        py = map_y.astype(np.float64) + 1.0
+        valid = (px >= 0.0) & (px <= src_w + 1.0) & (py >= 0.0) & (py <= src_h + 1.0)
+        x0 = np.clip(np.floor(px), 0, src_w).astype(np.int64)
+        y0 = np.clip(np.floor(py), 0, src_h).astype(np.int64)
+        fx = np.where(valid, np.clip(px - x0, 0.0, 1.0), 0.0)
+        fy = np.where(valid, np.clip(py - y0, 0.0, 1.0), 0.0)
+        index = np.where(valid, y0 * pw + x0, 0).astype(np.int32)
+        weights = np.stack([fx, fy]).astype(np.float32)
+        return cls(index, weights, src_w, src_h)
+
+    @property
+    def coverage(self) -> float:
+        """Fraction of output pixels that sample the source frame."""
+        return float(np.count_nonzero(self.index) / self.index.size)
+
+    def apply(self, frame: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Dewarp ``frame`` (H, W) or (H, W, C); returns (out_h, out_w[, C])."""
+        if frame.shape[0] != self.src_h or frame.shape[1] != self.src_w:
+            raise ValueError("frame is %dx%d, table expects %dx%d" % (
+                frame.shape[1], frame.shape[0], self.src_w, self.src_h))
+        channels = frame.shape[2:]
+        padded = self._padded
+        if (padded is None or padded.shape[2:] != channels
+                or padded.dtype != frame.dtype):
+            padded = self._padded = np.zeros(
+                (self.src_h + 2, self.src_w + 2) + channels, dtype=frame.dtype)
+        padded[1:-1, 1:-1] = frame
+        flat = padded.reshape((-1,) + channels)
+        pw = self.src_w + 2
+        idx = self.index
+        fx, fy = self.weights
+        if channels:
+            fx = fx[..., np.newaxis]
+            fy = fy[..., np.newaxis]
+        p00 = flat[idx].astype(np.float32)
+        p01 = flat[idx + 1].astype(np.float32)
+        p10 = flat[idx + pw].astype(np.float32)
+        p11 = flat[idx + pw + 1].astype(np.float32)
+        top = p00 + (p01 - p00) * fx
+        bottom = p10 + (p11 - p10) * fx
+        result = top + (bottom - top) * fy
+        if out is None:
+            out = np.empty(result.shape, dtype=frame.dtype)
+        if np.issubdtype(out.dtype, np.integer):
+            np.rint(result, out=result)
+        out[...] = result
+        return out
+
+
+def params_key(params: SurfaceParams, src_w: int, src_h: int,
+               out_w: int, out_h: int) -> str:
+    payload = json.dumps([TABLE_VERSION, asdict(params), src_w, src_h, out_w, out_h],
+                         sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:20]
+
+
+class RemapCache:
+    """Remap tables keyed by parameter hash, in memory and on disk."""
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._tables: Dict[str, RemapTable] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, params: SurfaceParams, src_w: int, src_h: int,
+            out_w: int, out_h: int) -> RemapTable:
+        key = params_key(params, src_w, src_h, out_w, out_h)
+        table = self._tables.get(key)
+        if table is not None:
+            self.hits += 1
+            return table
+        table = self._load(key, src_w, src_h)
+        if table is None:
+            self.misses += 1
+            table = RemapTable.from_maps(
+                *compute_maps(params, src_w, src_h, out_w, out_h), src_w, src_h)
+            self._store(key, table)
+        else:
+            self.hits += 1
+        self._tables[key] = table
+        return table
+
+    def _paths(self, key: str) -> Tuple[str, str]:
+        base = os.path.join(self.cache_dir, key)
+        return base + ".index.npy", base + ".weights.npy"
+
+    def _load(self, key: str, src_w: int, src_h: int) -> Optional[RemapTable]:
+        if not self.cache_dir:
+            return None
+        index_path, weights_path = self._paths(key)
+        if not (os.path.exists(index_path) and os.path.exists(weights_path)):
+            return None
+        return RemapTable(np.load(index_path, mmap_mode="r"),
+                          np.load(weights_path, mmap_mode="r"), src_w, src_h)
+
+    def _store(self, key: str, table: RemapTable) -> None:
+        if not self.cache_dir:
+            return
+        for path, array in zip(self._paths(key), (table.index, table.weights)):
+            tmp = path + ".tmp.npy"
+            np.save(tmp, array)
+            os.replace(tmp, path)
+
+
+class Dewarper:
+    """Dewarp frames into all surfaces of a dewarper config."""
+
+    def __init__(self, config: DewarperConfig, src_w: int, src_h: int,
+                 cache: Optional[RemapCache] = None):
+        self.src_w = src_w
+        self.src_h = src_h
+        self.cache = cache or RemapCache()
+        self.config = config
+        self.tables: List[RemapTable] = []
+        self.reload(config)
+
+    @classmethod
+    def from_file(cls, path: str, src_w: int, src_h: int,
+                  cache_dir: Optional[str] = None) -> "Dewarper":
+        return cls(load_dewarper_config(path), src_w, src_h, RemapCache(cache_dir))
+
+    def reload(self, config: DewarperConfig) -> None:
+        """Switch to new parameters; unchanged surfaces reuse cached tables."""
+        self.config = config
+        self.tables = [self.cache.get(s, self.src_w, self.src_h,
+                                      config.output_width, config.output_height)
+                       for s in config.surfaces]
+
+    def dewarp(self, frame: np.ndarray,
+               surfaces: Optional[Sequence[int]] = None) -> List[np.ndarray]:
+        """Dewarp ``frame`` into every surface (or only those listed)."""
+        indices = range(len(self.tables)) if surfaces is None else surfaces
+        return [self.tables[i].apply(frame) for i in indices]
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Validate a config_dewarper.txt on the CPU.")
+    parser.add_argument("config")
+    parser.add_argument("--src-size", default="3840x2160",
+                        help="input frame size WxH (default 3840x2160)")
+    parser.add_argument("--cache-dir", default=os.path.expanduser("~/.cache/iva/dewarp"))
+    parser.add_argument("--image", help="fisheye frame to dewarp (needs OpenCV)")
+    parser.add_argument("--out-prefix", default="surface")
+    args = parser.parse_args(argv)
+
+    src_w, src_h = (int(v) for v in args.src_size.lower().split("x"))
+    if args.image:
+        import cv2
+        frame = cv2.imread(args.image)
+        if frame is None:
+            parser.error("cannot read %s" % args.image)
+        src_h, src_w = frame.shape[:2]
+    dewarper = Dewarper.from_file(args.config, src_w, src_h, args.cache_dir)
+    for s, table in zip(dewarper.config.surfaces, dewarper.tables):
+        print("surface %d %-10s %dx%d coverage=%.1f%%" % (
+            s.surface_index, PROJECTION_NAMES[s.projection_type],
+            table.shape[1], table.shape[0], 100 * table.coverage))
+    if args.image:
+        for i, surface in enumerate(dewarper.dewarp(frame)):
+            cv2.imwrite("%s%d.png" % (args.out_prefix, i), surface)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,321 @@
+"""Fit ``config_dewarper.txt`` surface parameters from correspondences.
+
+Tuning ``focal-length``, ``top-angle``/``bottom-angle`` and
+``pitch``/``yaw``/``roll`` by rerunning the section 9 pipeline is slow
+trial and error. This tool takes correspondences marked on one sample
+fisheye frame and fits the free parameters:
+
+* point correspondences – a fisheye pixel and the surface pixel (in output
+  resolution) where it should land;
+* line correspondences – fisheye pixels along something straight in the
+  scene (a door frame, a shelf edge); the fit makes them collinear in the
+  surface, and exactly vertical for lines flagged ``vertical``.
+
+The objective uses the same projection functions as the remap tables in
+:mod:`iva.dewarp`, evaluated for a whole population of candidate parameter
+sets in one broadcast numpy call. A vectorised random search seeds a
+Nelder-Mead refinement; a preview of the fitted surface is rendered
+through :class:`iva.dewarp.RemapCache`, so repeated runs reuse the table.
+
+Correspondences are JSON::
+
+    {"src_size": [1280, 1280], "surface": 0,
+     "free": ["focal-length", "pitch", "yaw"],
+     "points": [{"fisheye": [612, 140], "surface": [480, 300]}],
+     "lines": [{"fisheye": [[700, 300], [720, 380], [735, 450]], "vertical": true}]}
+
+and ``python -m iva.dewarp_fit corr.json --config config_dewarper.txt``
+prints a ready ``[surfaceN]`` section (or writes it with ``--write``).
+"""
+
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import set_key
+from .dewarp import (PROJECTION_VERTRADCYL, DewarperConfig, RemapCache,
+                     SurfaceParams, load_dewarper_config, unproject_points)
+
+# Config key -> SurfaceParams field, in a fixed order.
+FITTABLE = {
+    "focal-length": "focal_length",
+    "top-angle": "top_angle",
+    "bottom-angle": "bottom_angle",
+    "pitch": "pitch",
+    "yaw": "yaw",
+    "roll": "roll",
+}
+
+DEFAULT_BOUNDS = {
+    "focal-length": (50.0, 5000.0),
+    "top-angle": (-89.0, 89.0),
+    "bottom-angle": (-89.0, 89.0),
+    "pitch": (-180.0, 180.0),
+    "yaw": (-180.0, 180.0),
+    "roll": (-180.0, 180.0),
+}
+
+# Cost added per unit of bound or top/bottom-angle ordering violation.
+PENALTY = 1e6
+
+
+@dataclass
+class Correspondences:
+    src_size: Tuple[int, int]
+    points_fisheye: np.ndarray = field(default_factory=lambda: np.zeros((0, 2)))
+    points_surface: np.ndarray = field(default_factory=lambda: np.zeros((0, 2)))
+    lines: List[np.ndarray] = field(default_factory=list)
+    vertical: List[bool] = field(default_factory=list)
+
+    @classmethod
+    def from_json(cls, d: Dict) -> "Correspondences":
+        points = d.get("points", [])
+        lines = d.get("lines", [])
+        for line in lines:
+            if len(line["fisheye"]) < 2 + (not line.get("vertical", False)):
+                raise ValueError("a line needs 3 points (2 if vertical)")
+        return cls(
+            src_size=tuple(d["src_size"]),
+            points_fisheye=np.array([p["fisheye"] for p in points], dtype=float).reshape(-1, 2),
+            points_surface=np.array([p["surface"] for p in points], dtype=float).reshape(-1, 2),
+            lines=[np.array(l["fisheye"], dtype=float) for l in lines],
+            vertical=[bool(l.get("vertical", False)) for l in lines],
+        )
+
+
+class SurfaceFit:
+    """Residual model for one surface with a chosen set of free parameters."""
+
+    def __init__(self, base: SurfaceParams, corr: Correspondences,
+                 out_size: Tuple[int, int], free: Sequence[str],
+                 bounds: Optional[Dict[str, Tuple[float, float]]] = None):
+        unknown = [k for k in free if k not in FITTABLE]
+        if unknown:
+            raise ValueError("cannot fit %s" % ", ".join(unknown))
+        if not len(corr.points_fisheye) and not corr.lines:
+            raise ValueError("no correspondences given")
+        self.base = base
+        self.corr = corr
+        self.out_w, self.out_h = out_size
+        self.free = list(free)
+        bounds = dict(DEFAULT_BOUNDS, **(bounds or {}))
+        self.lower = np.array([bounds[k][0] for k in self.free])
+        self.upper = np.array([bounds[k][1] for k in self.free])
+        self.evaluations = 0
+
+    def x0(self) -> np.ndarray:
+        return np.array([getattr(self.base, FITTABLE[k]) for k in self.free])
+
+    def params(self, x: Sequence[float]) -> SurfaceParams:
+        return self.base.replace(**{FITTABLE[k]: float(v) for k, v in zip(self.free, x)})
+
+    def _unproject(self, values: Dict[str, np.ndarray], pts: np.ndarray):
+        b = self.base
+        u, v = unproject_points(
+            b.projection_type, b.width, b.height,
+            values["top_angle"], values["bottom_angle"], values["pitch"],
+            values["yaw"], values["roll"], values["focal_length"],
+            pts[:, 0], pts[:, 1], *self.corr.src_size)
+        # Surface units -> output pixels.
+        return u * (self.out_w / b.width), v * (self.out_h / b.height)
+
+    def cost(self, population: np.ndarray) -> np.ndarray:
+        """Sum of squared residuals (output pixels) for each row of ``population``."""
+        population = np.atleast_2d(population)
+        k = population.shape[0]
+        self.evaluations += k
+        values = {f: np.full((k, 1), float(getattr(self.base, f)))
+                  for f in FITTABLE.values()}
+        for i, key in enumerate(self.free):
+            values[FITTABLE[key]] = population[:, i:i + 1]
+        cost = np.zeros(k)
+        # Keep candidates inside the bounds and top above bottom.
+        cost += PENALTY * np.sum(np.maximum(self.lower - population, 0)
+                                 + np.maximum(population - self.upper, 0), axis=1)
+        order = np.maximum(values["bottom_angle"] - values["top_angle"] + 1.0, 0)[:, 0]
+        cost += PENALTY * order
+
+        corr = self.corr
+        if len(corr.points_fisheye):
+            x, y = self._unproject(values, corr.points_fisheye)
+            dx = x - corr.points_surface[:, 0]
+            if self.base.projection_type == PROJECTION_VERTRADCYL:
+                # Cylinder columns wrap around every 2*pi of azimuth.
+                top = np.radians(values["top_angle"])
+                bottom = np.radians(values["bottom_angle"])
+                period = (2 * np.pi * self.base.height / (np.tan(top) - np.tan(bottom))
+                          * (self.out_w / self.base.width))
+                dx = (dx + period / 2) % period - period / 2
+            dy = y - corr.points_surface[:, 1]
+            cost += np.sum(dx * dx + dy * dy, axis=1)
+        for pts, vertical in zip(corr.lines, corr.vertical):
+            x, y = self._unproject(values, pts)
+            if vertical:
+                cost += np.sum((x - x.mean(axis=1, keepdims=True)) ** 2, axis=1)
+            else:
+                cost += _collinearity(x, y)
+        return np.where(np.isfinite(cost), cost, np.inf)
+
+    def fit(self, samples: int = 2048, iterations: int = 400,
+            spread: Optional[Sequence[float]] = None, seed: int = 0) -> "FitResult":
+        """Random search around the current values, then Nelder-Mead."""
+        rng = np.random.default_rng(seed)
+        x0 = self.x0()
+        if spread is None:
+            spread = np.minimum((self.upper - self.lower) / 4, np.maximum(np.abs(x0) * 0.5, 10.0))
+        population = x0 + rng.normal(size=(samples, len(x0))) * np.asarray(spread)
+        population = np.vstack([x0, np.clip(population, self.lower, self.upper)])
+        costs = self.cost(population)
+        start = population[int(np.argmin(costs))]
+        best, best_cost = _nelder_mead(self.cost, start, iterations)
+        initial = float(self.cost(x0)[0])
+        return FitResult(self.params(best), float(best_cost), initial,
+                         self.evaluations, self._count())
+
+    def _count(self) -> int:
+        return len(self.corr.points_fisheye) + sum(len(l) for l in self.corr.lines)
+
+
+def _collinearity(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Squared distances to the total-least-squares line, per candidate row."""
+    xc = x - x.mean(axis=1, keepdims=True)
+    yc = y - y.mean(axis=1, keepdims=True)
+    sxx = np.sum(xc * xc, axis=1)
+    syy = np.sum(yc * yc, axis=1)
+    sxy = np.sum(xc * yc, axis=1)
+    # Smallest eigenvalue of the 2x2 scatter matrix.
+    return (sxx + syy) / 2 - np.sqrt(((sxx - syy) / 2) ** 2 + sxy * sxy)
+
+
+def _nelder_mead(f, x0: np.ndarray, iterations: int,
+                 step: float = 0.05, tol: float = 1e-9) -> Tuple[np.ndarray, float]:
+    """Minimise ``f`` (which takes a population) from ``x0``."""
+    n = len(x0)
+    simplex = np.vstack([x0] + [x0 + np.eye(n)[i] * (step * abs(x0[i]) or step)
+                                for i in range(n)])
+    values = f(simplex)
+    for _ in range(iterations):
+        order = np.argsort(values)
+        simplex, values = simplex[order], values[order]
+        if abs(values[-1] - values[0]) <= tol * (abs(values[0]) + tol):
+            break
+        centroid = simplex[:-1].mean(axis=0)
+        worst = simplex[-1]
+        # Reflection, expansion and both contractions in one population call.
+        trial = np.vstack([centroid + (centroid - worst),
+                           centroid + 2 * (centroid - worst),
+                           centroid + 0.5 * (centroid - worst),
+                           centroid - 0.5 * (centroid - worst)])
+        tv = f(trial)
+        if tv[0] < values[0]:
+            pick = 1 if tv[1] < tv[0] else 0
+        elif tv[0] < values[-2]:
+            pick = 0
+        elif min(tv[2], tv[3]) < values[-1]:
+            pick = 2 if tv[2] < tv[3] else 3
+        else:
+            simplex[1:] = simplex[0] + 0.5 * (simplex[1:] - simplex[0])
+            values[1:] = f(simplex[1:])
+            continue
+        simplex[-1], values[-1] = trial[pick], tv[pick]
+    i = int(np.argmin(values))
+    return simplex[i], values[i]
+
+
+@dataclass
+class FitResult:
+    params: SurfaceParams
+    cost: float
+    initial_cost: float
+    evaluations: int
+    observations: int
+
+    @property
+    def rms(self) -> float:
+        """Root-mean-square residual in output pixels."""
+        return float(np.sqrt(self.cost / max(self.observations, 1)))
+
+
+def format_surface(params: SurfaceParams, index: int) -> str:
+    """A ``[surfaceN]`` section ready to paste into config_dewarper.txt."""
+    lines = ["[surface%d]" % index]
+    for key, value in surface_keys(params):
+        lines.append("%s=%s" % (key, value))
+    return "\n".join(lines) + "\n"
+
+
+def _number(value: float) -> str:
+    # Micro-degree / micro-pixel precision: rounding must not undo the fit.
+    return ("%.6f" % value).rstrip("0").rstrip(".")
+
+
+def surface_keys(params: SurfaceParams) -> List[Tuple[str, str]]:
+    return [
+        ("projection-type", str(params.projection_type)),
+        ("surface-index", str(params.surface_index)),
+        ("width", str(params.width)),
+        ("height", str(params.height)),
+        ("top-angle", _number(params.top_angle)),
+        ("bottom-angle", _number(params.bottom_angle)),
+        ("pitch", _number(params.pitch)),
+        ("yaw", _number(params.yaw)),
+        ("roll", _number(params.roll)),
+        ("focal-length", _number(params.focal_length)),
+    ]
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Fit dewarper surface parameters to correspondences.")
+    parser.add_argument("correspondences", help="JSON correspondence file")
+    parser.add_argument("--config", required=True, help="config_dewarper.txt to start from")
+    parser.add_argument("--surface", type=int, help="N of the [surfaceN] group to fit (overrides JSON)")
+    parser.add_argument("--free", help="comma-separated keys to fit (overrides JSON)")
+    parser.add_argument("--samples", type=int, default=2048)
+    parser.add_argument("--write", action="store_true",
+                        help="update the config file in place")
+    parser.add_argument("--image", help="sample fisheye frame for a preview (needs OpenCV)")
+    parser.add_argument("--preview", default="fit_preview.png")
+    parser.add_argument("--cache-dir")
+    args = parser.parse_args(argv)
+
+    with open(args.correspondences) as fp:
+        spec = json.load(fp)
+    corr = Correspondences.from_json(spec)
+    surface = args.surface if args.surface is not None else int(spec.get("surface", 0))
+    free = args.free.split(",") if args.free else spec.get(
+        "free", ["focal-length", "pitch", "yaw", "roll"])
+    config: DewarperConfig = load_dewarper_config(args.config)
+    try:
+        base = config.surface(surface)
+    except KeyError as exc:
+        parser.error(exc.args[0])
+    fit = SurfaceFit(base, corr,
+                     (config.output_width, config.output_height), free)
+    result = fit.fit(samples=args.samples)
+    print("# rms %.2f px (was %.2f px), %d evaluations" % (
+        result.rms, np.sqrt(result.initial_cost / max(result.observations, 1)),
+        result.evaluations))
+    print(format_surface(result.params, surface), end="")
+
+    if args.write:
+        for key, value in surface_keys(result.params):
+            set_key(args.config, "surface%d" % surface, key, value)
+    if args.image:
+        import cv2
+        frame = cv2.imread(args.image)
+        if frame is None:
+            parser.error("cannot read %s" % args.image)
+        table = RemapCache(args.cache_dir).get(
+            result.params, frame.shape[1], frame.shape[0],
+            config.output_width, config.output_height)
+        cv2.imwrite(args.preview, table.apply(frame))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,346 @@
+"""Device memory budget of a ``deepstream-app`` pipeline, before running it.
+
+Section 11.5 asks how frame buffer use (the ``fb`` column of
+``nvidia-smi dmon``) changes at 16 and 32 streams, and the only answer in
+the lab is to run the pipeline and watch. :func:`estimate` adds up the
+large device allocations implied by the config instead:
+
+* decoder surfaces per stream (DPB plus output surfaces and
+  ``num-extra-surfaces``), NV12 at the source resolution;
+* the nvstreammux output pool (``buffer-pool-size`` batched NV12 buffers);
+* per GIE: engine weights (engine file size when known), the TensorRT
+  ``workspace-size`` when the config sets one, the converted input
+  tensors and activations for its batch size;
+* tracker (``tracker-width`` x ``tracker-height`` per stream), tiler and
+  OSD RGBA buffers;
+* a fixed CUDA/TensorRT context.
+
+The constants are rough. :class:`Calibration` fits ``observed = base +
+scale * estimate`` to peak ``fb`` values read from ``smi.log`` files, and
+:func:`max_streams` reports how many streams fit a given GPU memory size
+with the calibrated model::
+
+    python -m iva.gpumem source4_720p_dec_infer-resnet_tracker_sgie_tiled_display_int8.txt \\
+        --observed smi.log@4 --streams 16 32 --gpu-memory 4096 8192 16384
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from .config import DSConfig
+
+MIB = 1 << 20
+
+CUDA_CONTEXT_MIB = 300.0   # CUDA context, cuDNN/cuBLAS and TensorRT runtime
+DECODE_SURFACES = 20       # H.264 DPB (16) plus output surfaces per decoder
+MUX_POOL = 4               # nvstreammux buffer-pool-size default
+INFER_POOL = 2             # converted input surfaces held by nvinfer
+TILER_POOL = 4
+OSD_POOL = 4
+ACTIVATIONS_PER_INPUT = 8  # activation elements per input element, order of magnitude
+SURFACE_PITCH_ALIGN = 256
+
+# nvinfer network-mode -> bytes per element.
+PRECISION_BYTES = {0: 4, 1: 1, 2: 2}
+DEFAULT_INPUT_DIMS = {"primary": (3, 368, 640), "secondary": (3, 224, 224)}
+
+SCALE_FIXED = "fixed"
+SCALE_STREAM = "per-stream"
+SCALE_BATCH = "per-batch"
+
+
+@dataclass
+class Component:
+    name: str
+    mib: float
+    scaling: str
+
+
+@dataclass
+class Estimate:
+    streams: int
+    batch_size: int
+    components: List[Component]
+
+    @property
+    def total_mib(self) -> float:
+        return sum(c.mib for c in self.components)
+
+    def table(self) -> str:
+        lines = ["%-38s %-10s %9.1f MiB" % (c.name, c.scaling, c.mib) for c in self.components]
+        lines.append("%-38s %-10s %9.1f MiB" % ("total", "", self.total_mib))
+        return "\n".join(lines)
+
+
+def _align(value: int, to: int) -> int:
+    return (value + to - 1) // to * to
+
+
+def nv12_bytes(width: int, height: int) -> int:
+    return _align(width, SURFACE_PITCH_ALIGN) * _align(height, 2) * 3 // 2
+
+
+def rgba_bytes(width: int, height: int) -> int:
+    return _align(width * 4, SURFACE_PITCH_ALIGN) * height
+
+
+def _resolve(base_path: Optional[str], value: str) -> str:
+    if os.path.isabs(value) or not base_path:
+        return value
+    return os.path.normpath(os.path.join(os.path.dirname(base_path), value))
+
+
+def _enabled(cfg: DSConfig, group: str) -> bool:
+    return cfg.get_bool(group, "enable", True)
+
+
+def _gie_components(cfg: DSConfig, group: str, role: str,
+                    batch_override: Optional[int]) -> List[Component]:
+    config_file = cfg.get(group, "config-file")
+    gie = None
+    if config_file and os.path.exists(_resolve(cfg.path, config_file)):
+        gie = DSConfig.read(_resolve(cfg.path, config_file))
+
+    def prop(key, default=None):
+        value = cfg.get(group, key)
+        if value is None and gie is not None:
+            value = gie.property(key)
+        return default if value is None else value
+
+    batch = batch_override or int(prop("batch-size", 1))
+    precision = PRECISION_BYTES.get(int(prop("network-mode", 0)), 4)
+    dims_text = prop("input-dims") or prop("uff-input-dims")
+    if dims_text:
+        dims = tuple(int(v) for v in dims_text.split(";")[:3])
+    else:
+        dims = DEFAULT_INPUT_DIMS[role]
+    elements = dims[0] * dims[1] * dims[2]
+
+    # Weights: the serialized engine, else the model scaled to the precision.
+    weights = 0.0
+    for key, ratio in (("model-engine-file", 1.0), ("model-file", precision / 4.0),
+                       ("onnx-file", precision / 4.0), ("uff-file", precision / 4.0)):
+        path = prop(key)
+        base = gie.path if gie is not None and cfg.get(group, key) is None else cfg.path
+        if path and os.path.exists(_resolve(base, path)):
+            weights = os.path.getsize(_resolve(base, path)) * ratio / MIB
+            break
+
+    name = group
+    comps = [Component("%s engine weights" % name, weights, SCALE_FIXED)]
+    # nvinfer's workspace-size is in MiB; the execution context may use all of it.
+    workspace = prop("workspace-size")
+    if workspace:
+        comps.append(Component("%s workspace" % name, float(workspace), SCALE_FIXED))
+    return comps + [
+        Component("%s input tensors (b=%d)" % (name, batch),
+                  INFER_POOL * batch * elements * 4 / MIB, SCALE_BATCH),
+        Component("%s activations (b=%d)" % (name, batch),
+                  batch * elements * ACTIVATIONS_PER_INPUT * precision / MIB, SCALE_BATCH),
+    ]
+
+
+def estimate(cfg: DSConfig, streams: Optional[int] = None,
+             source_size: Tuple[int, int] = (1280, 720)) -> Estimate:
+    """Expected device memory of the pipeline described by ``cfg``.
+
+    With ``streams`` the source count is overridden and, as the lab
+    instructs, the nvstreammux and primary GIE batch sizes follow it.
+    """
+    configured = 0
+    extra_surfaces = 0
+    for group in cfg.group_names("source"):
+        if _enabled(cfg, group):
+            n = cfg.get_int(group, "num-sources", 1)
+            configured += n
+            extra_surfaces = max(extra_surfaces, cfg.get_int(group, "num-extra-surfaces", 0))
+    n_streams = streams or configured or 1
+    batch = n_streams if streams else cfg.get_int("streammux", "batch-size", n_streams)
+
+    sw, sh = source_size
+    comps = [Component("cuda/tensorrt context", CUDA_CONTEXT_MIB, SCALE_FIXED)]
+    comps.append(Component(
+        "decoder surfaces (%d x %dx%d)" % (DECODE_SURFACES + extra_surfaces, sw, sh),
+        n_streams * (DECODE_SURFACES + extra_surfaces) * nv12_bytes(sw, sh) / MIB,
+        SCALE_STREAM))
+
+    mw = cfg.get_int("streammux", "width", sw)
+    mh = cfg.get_int("streammux", "height", sh)
+    pool = cfg.get_int("streammux", "buffer-pool-size", MUX_POOL)
+    comps.append(Component("streammux pool (%d x b=%d)" % (pool, batch),
+                           pool * batch * nv12_bytes(mw, mh) / MIB, SCALE_BATCH))
+
+    if cfg.has_group("primary-gie") and _enabled(cfg, "primary-gie"):
+        comps.extend(_gie_components(cfg, "primary-gie", "primary", batch if streams else None))
+    for group in cfg.group_names("secondary-gie"):
+        if _enabled(cfg, group):
+            comps.extend(_gie_components(cfg, group, "secondary", None))
+
+    if cfg.has_group("tracker") and _enabled(cfg, "tracker"):
+        tw = cfg.get_int("tracker", "tracker-width", 640)
+        th = cfg.get_int("tracker", "tracker-height", 368)
+        comps.append(Component("tracker (%dx%d)" % (tw, th),
+                               n_streams * 2 * nv12_bytes(tw, th) / MIB, SCALE_STREAM))
+
+    tiled = cfg.has_group("tiled-display") and _enabled(cfg, "tiled-display")
+    if tiled:
+        tw = cfg.get_int("tiled-display", "width", 1280)
+        th = cfg.get_int("tiled-display", "height", 720)
+        comps.append(Component("tiler (%dx%d)" % (tw, th),
+                               TILER_POOL * rgba_bytes(tw, th) / MIB, SCALE_FIXED))
+    if cfg.has_group("osd") and _enabled(cfg, "osd"):
+        if tiled:
+            osd = OSD_POOL * rgba_bytes(tw, th)
+            scaling = SCALE_FIXED
+        else:
+            osd = OSD_POOL * batch * rgba_bytes(mw, mh)
+            scaling = SCALE_BATCH
+        comps.append(Component("osd rgba buffers", osd / MIB, scaling))
+    return Estimate(n_streams, batch, comps)
+
+
+# -- calibration -----------------------------------------------------------
+
+def read_fb(path: str) -> List[int]:
+    """The ``fb`` column (MiB) of an ``nvidia-smi dmon`` log."""
+    values = []
+    column = None
+    with open(path) as fp:
+        for line in fp:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "#":
+                if "fb" in fields and column is None:
+                    column = fields.index("fb") - 1
+                continue
+            if column is None or len(fields) <= column:
+                continue
+            try:
+                values.append(int(fields[column]))
+            except ValueError:
+                continue
+    return values
+
+
+def peak_fb(path: str) -> int:
+    values = read_fb(path)
+    if not values:
+        raise ValueError("no fb samples in %s" % path)
+    return max(values)
+
+
+@dataclass
+class Calibration:
+    """``observed = base_mib + scale * estimate``."""
+
+    base_mib: float = 0.0
+    scale: float = 1.0
+
+    def apply(self, estimate_mib: float) -> float:
+        return self.base_mib + self.scale * estimate_mib
+
+    @classmethod
+    def fit(cls, points: Sequence[Tuple[float, float]]) -> "Calibration":
+        """Least squares over ``(estimate_mib, observed_mib)`` pairs.
+
+        One point only shifts the base; two or more also fit the scale.
+        Memory cannot shrink as the estimate grows, so a fitted scale of
+        zero or less (noisy or inconsistent logs) falls back to the shift.
+        """
+        if not points:
+            return cls()
+        offset = sum(o - e for e, o in points) / len(points)
+        if len(points) == 1 or len({round(e, 3) for e, _ in points}) == 1:
+            return cls(offset, 1.0)
+        n = len(points)
+        mean_e = sum(e for e, _ in points) / n
+        mean_o = sum(o for _, o in points) / n
+        cov = sum((e - mean_e) * (o - mean_o) for e, o in points)
+        var = sum((e - mean_e) ** 2 for e, _ in points)
+        scale = cov / var
+        if scale <= 0:
+            return cls(offset, 1.0)
+        return cls(mean_o - scale * mean_e, scale)
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as fp:
+            json.dump({"base_mib": self.base_mib, "scale": self.scale}, fp, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "Calibration":
+        with open(path) as fp:
+            return cls(**json.load(fp))
+
+
+def max_streams(cfg: DSConfig, memory_mib: float, calibration: Optional[Calibration] = None,
+                headroom: float = 0.1, limit: int = 256,
+                source_size: Tuple[int, int] = (1280, 720)) -> int:
+    """Largest stream count whose calibrated estimate fits ``memory_mib``."""
+    calibration = calibration or Calibration()
+    budget = memory_mib * (1.0 - headroom)
+    best = 0
+    for n in range(1, limit + 1):
+        if calibration.apply(estimate(cfg, n, source_size).total_mib) > budget:
+            break
+        best = n
+    return best
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Estimate device memory of a deepstream-app config.")
+    parser.add_argument("config")
+    parser.add_argument("--streams", type=int, nargs="*", default=[],
+                        help="also estimate these stream counts")
+    parser.add_argument("--source-size", default="1280x720")
+    parser.add_argument("--observed", action="append", default=[], metavar="SMI_LOG[@STREAMS]",
+                        help="nvidia-smi dmon log recorded with this config")
+    parser.add_argument("--calibration", help="load calibration JSON")
+    parser.add_argument("--save-calibration", help="write the fitted calibration")
+    parser.add_argument("--gpu-memory", type=int, nargs="*", default=[4096, 8192, 16384, 32768],
+                        metavar="MIB")
+    parser.add_argument("--headroom", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    cfg = DSConfig.read(args.config)
+    size = tuple(int(v) for v in args.source_size.lower().split("x"))
+
+    if args.calibration:
+        calibration = Calibration.load(args.calibration)
+    else:
+        points = []
+        for spec in args.observed:
+            path, _, n = spec.partition("@")
+            est = estimate(cfg, int(n) if n else None, size).total_mib
+            points.append((est, float(peak_fb(path))))
+            print("observed %-30s estimate %8.1f MiB  fb %8.1f MiB" % (spec, est, points[-1][1]))
+        calibration = Calibration.fit(points)
+    if args.save_calibration:
+        calibration.save(args.save_calibration)
+    print("calibration: base %+.1f MiB, scale %.3f\n" % (calibration.base_mib, calibration.scale))
+
+    base = estimate(cfg, None, size)
+    print("%d stream(s), batch %d:" % (base.streams, base.batch_size))
+    print(base.table())
+    print("calibrated %.1f MiB\n" % calibration.apply(base.total_mib))
+    for n in args.streams:
+        est = estimate(cfg, n, size)
+        print("%3d streams: estimate %8.1f MiB, calibrated %8.1f MiB"
+              % (n, est.total_mib, calibration.apply(est.total_mib)))
+    if args.streams:
+        print()
+    limit = 256
+    for mem in args.gpu_memory:
+        n = max_streams(cfg, mem, calibration, args.headroom, limit, size)
+        print("%6d MiB GPU: up to %s streams (%.0f%% headroom)"
+              % (mem, "%d+" % n if n == limit else n, args.headroom * 100))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
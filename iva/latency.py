@@ -0,0 +1,145 @@
+"""End-to-end per-frame latency from decode to sink or message broker.
+
+The section 11.4 trace shows one decoder-to-next-pad gap for one buffer.
+:class:`FrameLatencyTracker` instead stamps every frame at each pipeline
+stage (decoder, nvstreammux, nvinfer, tracker, SGIEs, OSD, sink or
+msgbroker), correlates the stamps by ``(source_id, pts)`` and, when the
+frame reaches the last stage, feeds three kinds of distributions into a
+:class:`iva.metrics.MetricsRegistry`:
+
+* ``e2e`` – first stage to last stage, overall and per source
+  (``e2e/source=3``);
+* ``<stage>-><next>`` – the gap between consecutive stages;
+* ``glass`` – wall-clock capture time (``ntp_timestamp``) to last stage,
+  when the source provides capture time.
+
+Before nvstreammux each branch carries one source, so the stage probe is
+given its ``source_id``; from nvstreammux on, buffers are batches and the
+probe walks the batch metadata to stamp every frame inside it.
+
+Stage probes run on different streaming threads (each decoder branch,
+then the mux, inference and sink threads), so the in-flight table is
+locked. The distributions are only written when a frame completes, from
+the last stage's thread, and are observed after the lock is released.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from .metrics import LatencyHistogram, MetricsRegistry
+
+DEFAULT_STAGES = ("decoder", "streammux", "pgie", "tracker", "sgie", "osd", "sink")
+
+# Frames stamped but not yet completed; older ones are assumed dropped.
+MAX_IN_FLIGHT = 8192
+
+FrameKey = Tuple[int, int]
+
+
+class FrameLatencyTracker:
+    """Collect per-frame stage timestamps and report latency distributions."""
+
+    def __init__(self, stages: Sequence[str] = DEFAULT_STAGES,
+                 registry: Optional[MetricsRegistry] = None,
+                 per_source: bool = True):
+        if len(stages) < 2:
+            raise ValueError("need at least two stages")
+        self.stages = tuple(stages)
+        self._index = {s: i for i, s in enumerate(self.stages)}
+        self.registry = registry or MetricsRegistry()
+        self.per_source = per_source
+        self._frames: "OrderedDict[FrameKey, list]" = OrderedDict()
+        self._glass: Dict[FrameKey, int] = {}
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.dropped = 0
+
+    def mark(self, stage: str, source_id: int, pts: int,
+             now_ns: Optional[int] = None, ntp_timestamp: int = 0) -> None:
+        """Stamp frame ``(source_id, pts)`` as it reaches ``stage``."""
+        idx = self._index[stage]
+        now_ns = now_ns if now_ns is not None else time.monotonic_ns()
+        key = (source_id, pts)
+        last = idx == len(self.stages) - 1
+        with self._lock:
+            stamps = self._frames.get(key)
+            if stamps is None:
+                if len(self._frames) >= MAX_IN_FLIGHT:
+                    old, _ = self._frames.popitem(last=False)
+                    self._glass.pop(old, None)
+                    self.dropped += 1
+                stamps = self._frames[key] = [None] * len(self.stages)
+            if stamps[idx] is None:
+                stamps[idx] = now_ns
+            if ntp_timestamp:
+                self._glass[key] = ntp_timestamp
+            if not last:
+                return
+            del self._frames[key]
+            ntp = self._glass.pop(key, None)
+            self.completed += 1
+        self._complete(key, stamps, ntp)
+
+    def _complete(self, key: FrameKey, stamps: list, ntp: Optional[int]) -> None:
+        hist = self.registry.histogram
+        present = [(self.stages[i], t) for i, t in enumerate(stamps) if t is not None]
+        for (a, ta), (b, tb) in zip(present, present[1:]):
+            hist("%s->%s" % (a, b)).observe((tb - ta) / 1e9)
+        e2e = (present[-1][1] - present[0][1]) / 1e9
+        hist("e2e").observe(e2e)
+        if self.per_source:
+            hist("e2e/source=%d" % key[0]).observe(e2e)
+        if ntp:
+            # Capture time is wall clock; compare against wall clock now.
+            hist("glass").observe(max(0.0, (time.time_ns() - ntp) / 1e9))
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """Summaries (count, mean, p50/p90/p99, max) of every distribution."""
+        return {name: h.summary() for name, h in self.registry.histograms.items()}
+
+    def histogram(self, name: str = "e2e") -> LatencyHistogram:
+        return self.registry.histogram(name)
+
+    # -- GStreamer glue ----------------------------------------------------
+
+    def stage_probe(self, stage: str, source_id: Optional[int] = None):
+        """Buffer probe that stamps ``stage`` for every frame in the buffer.
+
+        Pass ``source_id`` for probes upstream of nvstreammux; leave it
+        ``None`` downstream, where frames are read from the batch metadata.
+        """
+        from gi.repository import Gst
+
+        if source_id is not None:
+            def probe(pad, info, u_data=None):
+                buf = info.get_buffer()
+                if buf is not None:
+                    self.mark(stage, source_id, buf.pts)
+                return Gst.PadProbeReturn.OK
+            return probe
+
+        import pyds
+
+        def batch_probe(pad, info, u_data=None):
+            buf = info.get_buffer()
+            if buf is None:
+                return Gst.PadProbeReturn.OK
+            now_ns = time.monotonic_ns()
+            batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(buf))
+            l_frame = batch_meta.frame_meta_list
+            while l_frame is not None:
+                frame = pyds.NvDsFrameMeta.cast(l_frame.data)
+                self.mark(stage, frame.pad_index, frame.buf_pts, now_ns,
+                          frame.ntp_timestamp)
+                l_frame = l_frame.next
+            return Gst.PadProbeReturn.OK
+        return batch_probe
+
+    def attach(self, pad, stage: str, source_id: Optional[int] = None) -> int:
+        """Add :meth:`stage_probe` to ``pad``; returns the probe id."""
+        from gi.repository import Gst
+
+        return pad.add_probe(Gst.PadProbeType.BUFFER,
+                             self.stage_probe(stage, source_id))
@@ -0,0 +1,231 @@
+"""Plain-Python mirror of the DeepStream per-frame metadata.
+
+The C apps in the lab read ``NvDsFrameMeta`` inside
+``osd_sink_pad_buffer_probe``; everything in this package works on the
+lighter :class:`FrameMeta` / :class:`ObjectMeta` pair below so that it can
+run without a GPU, without GStreamer and without the pyds bindings.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Union
+
+# Class ids of the 4-class resnet10 primary detector (deepstream-test1/2).
+PGIE_CLASS_ID_VEHICLE = 0
+PGIE_CLASS_ID_BICYCLE = 1
+PGIE_CLASS_ID_PERSON = 2
+PGIE_CLASS_ID_ROADSIGN = 3
+
+CLASS_LABELS = ("Vehicle", "TwoWheeler", "Person", "RoadSign")
+
+# Label names of the deepstream-test2 secondary classifiers by gie-unique-id
+# (dstest2_sgie1/2/3_config.txt: Secondary_CarColor, _CarMake, _VehicleTypes).
+DSTEST2_CLASSIFIERS = {2: "color", 3: "make", 4: "type"}
+
+# gie-unique-id -> label name, or one name per output layer (label_id) of a
+# multi-label classifier.
+ClassifierNames = Mapping[int, Union[str, Sequence[str]]]
+
+# nvtracker leaves untracked objects with UNTRACKED_OBJECT_ID (0xFFFFFFFFFFFFFFFF);
+# we keep it as -1 so ids fit in a signed 64-bit column.
+UNTRACKED_OBJECT_ID = -1
+
+
+@dataclass
+class ObjectMeta:
+    """One detected object, as found in ``frame_meta->obj_params``."""
+
+    class_id: int
+    left: float
+    top: float
+    width: float
+    height: float
+    confidence: float = 0.0
+    object_id: int = UNTRACKED_OBJECT_ID
+    # Secondary classifier results keyed by classifier name, e.g.
+    # {"color": "red", "make": "ford", "type": "sedan"}.
+    labels: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def footpoint(self):
+        """Bottom-centre of the box, the usual anchor for zone tests."""
+        return (self.left + self.width / 2.0, self.top + self.height)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {
+            "class_id": self.class_id,
+            "object_id": self.object_id,
+            "confidence": self.confidence,
+            "rect": [self.left, self.top, self.width, self.height],
+        }
+        if self.labels:
+            d["labels"] = dict(self.labels)
+        return d
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "ObjectMeta":
+        left, top, width, height = d["rect"]
+        return cls(
+            class_id=int(d["class_id"]),
+            left=float(left),
+            top=float(top),
+            width=float(width),
+            height=float(height),
+            confidence=float(d.get("confidence", 0.0)),
+            object_id=int(d.get("object_id", UNTRACKED_OBJECT_ID)),
+            labels=dict(d.get("labels", {})),
+        )
+
+
+@dataclass
+class FrameMeta:
+    """Metadata of one frame of one source after inference.
+
+    ``pts`` is the buffer presentation timestamp and ``ntp_timestamp`` the
+    wall-clock capture time, both in nanoseconds like GStreamer clock times.
+    """
+
+    source_id: int
+    frame_num: int
+    pts: int
+    ntp_timestamp: int = 0
+    width: int = 0
+    height: int = 0
+    objects: List[ObjectMeta] = field(default_factory=list)
+
+    def count(self, class_id: int) -> int:
+        return sum(1 for o in self.objects if o.class_id == class_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source_id": self.source_id,
+            "frame_num": self.frame_num,
+            "pts": self.pts,
+            "ntp_timestamp": self.ntp_timestamp,
+            "width": self.width,
+            "height": self.height,
+            "objects": [o.to_dict() for o in self.objects],
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "FrameMeta":
+        return cls(
+            source_id=int(d["source_id"]),
+            frame_num=int(d["frame_num"]),
+            pts=int(d["pts"]),
+            ntp_timestamp=int(d.get("ntp_timestamp", 0)),
+            width=int(d.get("width", 0)),
+            height=int(d.get("height", 0)),
+            objects=[ObjectMeta.from_dict(o) for o in d.get("objects", [])],
+        )
+
+
+def frames_from_pyds(batch_meta, classifier_names: Optional[ClassifierNames] = None
+                     ) -> Iterator[FrameMeta]:
+    """Convert a pyds ``NvDsBatchMeta`` into :class:`FrameMeta` objects.
+
+    Meant to be called from a buffer probe with
+    ``pyds.gst_buffer_get_nvds_batch_meta(hash(buf))``. pyds is imported
+    lazily so the rest of the package does not depend on it.
+
+    Secondary classifier results are keyed by ``classifier_names`` (e.g.
+    :data:`DSTEST2_CLASSIFIERS`), see :func:`label_key`.
+    """
+    import pyds
+
+    l_frame = batch_meta.frame_meta_list
+    while l_frame is not None:
+        frame = pyds.NvDsFrameMeta.cast(l_frame.data)
+        objects = []
+        l_obj = frame.obj_meta_list
+        while l_obj is not None:
+            obj = pyds.NvDsObjectMeta.cast(l_obj.data)
+            rect = obj.rect_params
+            object_id = obj.object_id
+            if object_id >= 1 << 63:
+                object_id = UNTRACKED_OBJECT_ID
+            objects.append(ObjectMeta(
+                class_id=obj.class_id,
+                left=rect.left,
+                top=rect.top,
+                width=rect.width,
+                height=rect.height,
+                confidence=obj.confidence,
+                object_id=object_id,
+                labels=_classifier_labels(pyds, obj, classifier_names or {}),
+            ))
+            l_obj = l_obj.next
+        yield FrameMeta(
+            source_id=frame.pad_index,
+            frame_num=frame.frame_num,
+            pts=frame.buf_pts,
+            ntp_timestamp=frame.ntp_timestamp,
+            width=frame.source_frame_width,
+            height=frame.source_frame_height,
+            objects=objects,
+        )
+        l_frame = l_frame.next
+
+
+def label_key(names: ClassifierNames, unique_id: int, label_id: int = 0) -> str:
+    """``ObjectMeta.labels`` key of output ``label_id`` of classifier ``unique_id``.
+
+    A configured sequence names each output layer; a single name is used
+    as is for output 0 and as ``name.<label_id>`` for the others. Unnamed
+    classifiers fall back to ``sgie<unique_id>`` like
+    :meth:`iva.crop_batcher.CropBatcher.from_config`.
+    """
+    name = names.get(unique_id)
+    if name is None:
+        name = "sgie%d" % unique_id
+    elif not isinstance(name, str):
+        if label_id < len(name):
+            return name[label_id]
+        name = name[0]
+    return name if label_id == 0 else "%s.%d" % (name, label_id)
+
+
+def _classifier_labels(pyds, obj, names: ClassifierNames) -> Dict[str, str]:
+    labels = {}
+    l_cls = obj.classifier_meta_list
+    while l_cls is not None:
+        cls_meta = pyds.NvDsClassifierMeta.cast(l_cls.data)
+        l_label = cls_meta.label_info_list
+        while l_label is not None:
+            info = pyds.NvDsLabelInfo.cast(l_label.data)
+            labels[label_key(names, cls_meta.unique_component_id, info.label_id)] = \
+                info.result_label
+            l_label = l_label.next
+        l_cls = l_cls.next
+    return labels
+
+
+def class_label(class_id: int, default: Optional[str] = None) -> str:
+    if 0 <= class_id < len(CLASS_LABELS):
+        return CLASS_LABELS[class_id]
+    return default if default is not None else str(class_id)
+
+
+def meta_probe(*consumers, classifier_names: Optional[ClassifierNames] = None):
+    """Build a GStreamer buffer probe that feeds :class:`FrameMeta` to consumers.
+
+    Install it the way the lab installs ``osd_sink_pad_buffer_probe``::
+
+        osd_sink_pad.add_probe(Gst.PadProbeType.BUFFER,
+                               meta_probe(recorder, classifier_names=DSTEST2_CLASSIFIERS))
+
+    Each consumer is a callable taking one :class:`FrameMeta`.
+    """
+    import pyds
+    from gi.repository import Gst
+
+    def probe(pad, info, u_data=None):
+        buf = info.get_buffer()
+        if buf is None:
+            return Gst.PadProbeReturn.OK
+        batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(buf))
+        for frame in frames_from_pyds(batch_meta, classifier_names):
+            for consumer in consumers:
+                consumer(frame)
+        return Gst.PadProbeReturn.OK
+
+    return probe
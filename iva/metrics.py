@@ -0,0 +1,359 @@
+"""Per-element latency histograms and a Prometheus-style exporter.
+
+Section 11 of the lab measures performance three separate ways (the
+``sink_bin_buf_probe`` fps printf, ``nvidia-smi dmon`` and
+``GST_DEBUG=GST_SCHEDULING:7``). This module gives one surface instead:
+:func:`instrument_pipeline` puts a probe on the sink and src pad of each
+element, the pair of probes measures how long every buffer spends inside
+the element, and the latencies land in a fixed-bucket
+:class:`LatencyHistogram` per element. :class:`MetricsServer` serves the
+whole :class:`MetricsRegistry` as Prometheus text on ``/metrics`` and as
+JSON on ``/metrics.json``.
+
+Histograms take no locks. Every histogram has a single writer (the
+streaming thread that runs the element's src pad probe) and readers only
+copy the bucket list, so a scrape may be one observation behind but never
+blocks the pipeline. The in-flight entry stamps of an element are written
+from its sink pad threads (one per request pad on ``nvstreammux``) and
+read from its src pad thread, so :class:`ElementStats` holds a lock just
+long enough to store or pop a stamp; the histogram is updated after it is
+released. Stamps are keyed by ``(input, pts)`` – the sink pad index, or
+the source of each frame in a batch – so sources with equal timestamps do
+not overwrite each other's stamps.
+"""
+
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Upper bucket bounds in seconds; a final +Inf bucket is implied.
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+# Entry timestamps waiting for their exit probe; bounds memory when an
+# element drops buffers (e.g. a leaky queue) instead of passing them on.
+# Past the bound the oldest stamps are evicted first.
+MAX_IN_FLIGHT = 4096
+
+# (input index, buffer key): see :func:`buffer_key`.
+StampKey = Tuple[int, int]
+
+
+class LatencyHistogram:
+    """Fixed-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        if other.buckets != self.buckets:
+            raise ValueError("cannot merge histograms with different buckets")
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Estimate the ``q`` quantile by interpolating inside its bucket."""
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lo + (hi - lo) * (rank - seen) / c, self.max)
+            seen += c
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class ElementStats:
+    """Latency histogram and throughput counter of one pipeline element."""
+
+    def __init__(self, name: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.latency = LatencyHistogram(buckets)
+        self.buffers = 0
+        self.started = time.monotonic()
+        # Insertion ordered: the first key is the oldest stamp.
+        self._in_flight: Dict[StampKey, int] = {}
+        self._lock = threading.Lock()
+
+    def enter(self, key: StampKey, now_ns: Optional[int] = None) -> None:
+        now_ns = now_ns if now_ns is not None else time.monotonic_ns()
+        with self._lock:
+            in_flight = self._in_flight
+            in_flight.pop(key, None)
+            while len(in_flight) >= MAX_IN_FLIGHT:
+                del in_flight[next(iter(in_flight))]
+            in_flight[key] = now_ns
+
+    def exit(self, keys: Iterable[StampKey], now_ns: Optional[int] = None) -> None:
+        """One buffer leaves; ``keys`` are the stamps it carries (one per
+        frame of a batch). Called from the src pad thread only."""
+        now_ns = now_ns if now_ns is not None else time.monotonic_ns()
+        with self._lock:
+            entered = [self._in_flight.pop(key, None) for key in keys]
+        self.buffers += 1
+        for t in entered:
+            if t is not None:
+                self.latency.observe((now_ns - t) / 1e9)
+
+    @property
+    def fps(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.buffers / elapsed if elapsed > 0 else 0.0
+
+
+class MetricsRegistry:
+    """All element statistics of one process."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.elements: Dict[str, ElementStats] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    def element(self, name: str) -> ElementStats:
+        stats = self.elements.get(name)
+        if stats is None:
+            stats = self.elements.setdefault(name, ElementStats(name, self.buckets))
+        return stats
+
+    def histogram(self, name: str) -> LatencyHistogram:
+        """A free-standing named histogram, exported next to the elements."""
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms.setdefault(name, LatencyHistogram(self.buckets))
+        return hist
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Python API: per-element latency summary plus buffer count and fps."""
+        out = {}
+        for name, stats in list(self.elements.items()):
+            summary = stats.latency.summary()
+            summary["buffers"] = stats.buffers
+            summary["fps"] = stats.fps
+            out[name] = summary
+        for name, hist in list(self.histograms.items()):
+            out[name] = hist.summary()
+        return out
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        lines.append("# HELP iva_element_latency_seconds Time a buffer spends inside an element.")
+        lines.append("# TYPE iva_element_latency_seconds histogram")
+        for name, stats in sorted(self.elements.items()):
+            _render_histogram(lines, "iva_element_latency_seconds",
+                              'element="%s"' % name, stats.latency)
+        lines.append("# HELP iva_element_buffers_total Buffers pushed out of an element.")
+        lines.append("# TYPE iva_element_buffers_total counter")
+        for name, stats in sorted(self.elements.items()):
+            lines.append('iva_element_buffers_total{element="%s"} %d'
+                         % (name, stats.buffers))
+        if self.histograms:
+            lines.append("# HELP iva_latency_seconds Named latency distributions.")
+            lines.append("# TYPE iva_latency_seconds histogram")
+            for name, hist in sorted(self.histograms.items()):
+                _render_histogram(lines, "iva_latency_seconds",
+                                  'name="%s"' % name, hist)
+        return "\n".join(lines) + "\n"
+
+
+def _render_histogram(lines, metric, labels, hist: LatencyHistogram) -> None:
+    counts = list(hist.counts)
+    cumulative = 0
+    for bound, c in zip(hist.buckets, counts):
+        cumulative += c
+        lines.append('%s_bucket{%s,le="%g"} %d' % (metric, labels, bound, cumulative))
+    cumulative += counts[-1]
+    lines.append('%s_bucket{%s,le="+Inf"} %d' % (metric, labels, cumulative))
+    lines.append("%s_sum{%s} %.9f" % (metric, labels, hist.sum))
+    lines.append("%s_count{%s} %d" % (metric, labels, cumulative))
+
+
+def buffer_key(buf) -> int:
+    """Key that follows a buffer through an element: its pts, else its address."""
+    pts = buf.pts
+    # GST_CLOCK_TIME_NONE is 2**64 - 1.
+    return pts if pts != 0xFFFFFFFFFFFFFFFF else hash(buf)
+
+
+def _pad_index(pad) -> int:
+    """N of a ``sink_N`` request pad, 0 for an always pad."""
+    suffix = pad.get_name().rpartition("_")[2]
+    return int(suffix) if suffix.isdigit() else 0
+
+
+def _batch_keys(buf) -> Optional[List[StampKey]]:
+    """``(pad_index, buf_pts)`` of every frame of a DeepStream batch, if any."""
+    try:
+        import pyds
+    except ImportError:
+        return None
+    batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(buf))
+    if batch_meta is None:
+        return None
+    keys = []
+    l_frame = batch_meta.frame_meta_list
+    while l_frame is not None:
+        frame = pyds.NvDsFrameMeta.cast(l_frame.data)
+        keys.append((frame.pad_index, frame.buf_pts))
+        l_frame = l_frame.next
+    return keys
+
+
+def instrument_element(element, registry: MetricsRegistry) -> bool:
+    """Attach entry/exit probes to ``element``; False if it has no sink+src pair.
+
+    The sink pad probes stamp each buffer on the way in under ``(sink pad
+    index, pts)``, the src pad probe looks the stamp up on the way out.
+    Every sink pad is probed, including request pads (``nvstreammux`` has
+    ``sink_%u`` only) and ones requested after this call. A muxer's output
+    batch is matched frame by frame through its batch metadata
+    (``pad_index``, ``buf_pts``), so every input frame gets a latency
+    sample; without metadata the output pts is looked up on every input
+    seen so far.
+    """
+    from gi.repository import Gst
+
+    src = element.get_static_pad("src")
+    if src is None and element.srcpads:
+        src = element.srcpads[0]
+    sinks = list(element.sinkpads)
+    pads_requested = element.get_pad_template("sink_%u") is not None
+    if src is None or not (sinks or pads_requested):
+        return False
+    stats = registry.element(element.get_name())
+    inputs = set()
+
+    def probe_sink(pad):
+        index = _pad_index(pad) if pads_requested else 0
+        inputs.add(index)
+
+        def on_enter(pad, info):
+            buf = info.get_buffer()
+            if buf is not None:
+                stats.enter((index, buffer_key(buf)))
+            return Gst.PadProbeReturn.OK
+        pad.add_probe(Gst.PadProbeType.BUFFER, on_enter)
+
+    def on_exit(pad, info):
+        buf = info.get_buffer()
+        if buf is not None:
+            keys = _batch_keys(buf) if pads_requested else None
+            if keys is None:
+                key = buffer_key(buf)
+                keys = [(index, key) for index in list(inputs)]
+            stats.exit(keys)
+        return Gst.PadProbeReturn.OK
+
+    def on_pad_added(_element, pad):
+        if pad.get_direction() == Gst.PadDirection.SINK:
+            probe_sink(pad)
+
+    for sink in sinks:
+        probe_sink(sink)
+    element.connect("pad-added", on_pad_added)
+    src.add_probe(Gst.PadProbeType.BUFFER, on_exit)
+    return True
+
+
+def instrument_pipeline(pipeline, registry: Optional[MetricsRegistry] = None,
+                        elements: Optional[Sequence[str]] = None) -> MetricsRegistry:
+    """Instrument every element of ``pipeline`` (or only the named ones)."""
+    from gi.repository import Gst
+
+    registry = registry or MetricsRegistry()
+    it = pipeline.iterate_recurse()
+    while True:
+        result, element = it.next()
+        if result == Gst.IteratorResult.RESYNC:
+            it.resync()
+            continue
+        if result != Gst.IteratorResult.OK:
+            break
+        if elements is None or element.get_name() in elements:
+            instrument_element(element, registry)
+    return registry
+
+
+class MetricsServer:
+    """Serve a registry on ``http://host:port/metrics`` from a daemon thread."""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1",
+                 port: int = 9464):
+        self.registry = registry
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = registry_ref.render_prometheus().encode()
+                    ctype = "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(registry_ref.snapshot()).encode()
+                    ctype = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self):
+        return self._httpd.server_address
+
+    def start(self) -> "MetricsServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        name="iva-metrics", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,320 @@
+"""Build the lab's GStreamer pipelines with a selectable output stage.
+
+Every lab pipeline ends in the same annotate-and-encode tail::
+
+    nvvidconv ! "video/x-raw(memory:NVMM), format=RGBA" ! nvosd
+      ! nvvidconv ! "video/x-raw, format=RGBA" ! videoconvert
+      ! "video/x-raw, format=NV12" ! x264enc ! qtmux ! filesink
+
+which copies every frame from GPU to CPU and encodes it in software even
+when only the metadata is wanted. :class:`PipelineBuilder` produces the
+same pipelines as ``gst-launch-1.0`` descriptions with one of three
+output modes:
+
+* ``file`` – the tail above, one output file per source (via
+  ``nvstreamdemux`` when there are several sources, as in section 7);
+* ``headless`` – no OSD, no conversion, no encoder: inference output goes
+  straight to ``fakesink`` (or to ``nvmsgconv ! nvmsgbroker`` when a
+  broker is configured);
+* ``audit`` – headless, plus a branch per source that annotates and
+  encodes only 1 in ``audit_every`` frames for audit clips. The selection
+  is a counting drop probe (:func:`every_nth_probe`) that
+  :meth:`PipelineBuilder.build` attaches to the ``auditN`` queues, so
+  audit pipelines have to be built in-process, not run by
+  ``gst-launch-1.0``.
+
+For ``deepstream-app`` configs, :func:`make_app_config_headless` applies
+the same idea: sinks become ``type=1`` (FakeSink), OSD and tiler are
+disabled.
+"""
+
+import os
+import shlex
+import sys
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence
+
+from .config import DSConfig, set_key
+
+OUTPUT_FILE = "file"
+OUTPUT_HEADLESS = "headless"
+OUTPUT_AUDIT = "audit"
+OUTPUT_MODES = (OUTPUT_FILE, OUTPUT_HEADLESS, OUTPUT_AUDIT)
+
+NVMM_NV12 = '"video/x-raw(memory:NVMM), format=NV12"'
+NVMM_RGBA = '"video/x-raw(memory:NVMM), format=RGBA"'
+
+# deepstream-app [sinkN] type values.
+APP_SINK_FAKE = 1
+
+
+def is_live(location: str) -> bool:
+    return location.startswith(("rtsp://", "rtsps://"))
+
+
+def decode_chain(location: str, latency_ms: int = 200) -> str:
+    """``filesrc ! ... ! nvdec_h264`` for an elementary stream or MP4 file.
+
+    ``rtsp://`` locations get ``rtspsrc`` with a jitter buffer of
+    ``latency_ms`` instead (see :mod:`iva.sources` for sizing it).
+    """
+    if is_live(location):
+        return ("rtspsrc location=%s latency=%d protocols=tcp ! rtph264depay ! "
+                "h264parse ! nvdec_h264" % (shlex.quote(location), latency_ms))
+    ext = os.path.splitext(location)[1].lower()
+    src = "filesrc location=%s" % shlex.quote(location)
+    if ext in (".h264", ".264"):
+        return "%s ! h264parse ! nvdec_h264" % src
+    if ext in (".mp4", ".mov"):
+        return "%s ! qtdemux ! h264parse ! nvdec_h264" % src
+    return "%s ! decodebin" % src
+
+
+def every_nth_probe(n: int):
+    """Buffer probe that passes the first of every ``n`` buffers and drops the rest.
+
+    Unlike ``videorate max-rate`` it does not depend on timestamps, so the
+    1-in-N ratio holds for live sources, files played faster than real
+    time and streams with pts gaps alike.
+    """
+    from gi.repository import Gst
+
+    if n < 1:
+        raise ValueError("n must be >= 1")
+    seen = [0]
+
+    def probe(pad, info, u_data=None):
+        keep = seen[0] % n == 0
+        seen[0] += 1
+        return Gst.PadProbeReturn.OK if keep else Gst.PadProbeReturn.DROP
+    return probe
+
+
+def annotate_encode_chain(location: str, font_size: int = 15) -> str:
+    """The lab's nvosd + x264 + MP4 tail."""
+    return ("nvvidconv ! %s ! nvosd font-size=%d ! nvvidconv ! "
+            '"video/x-raw, format=RGBA" ! videoconvert ! '
+            '"video/x-raw, format=NV12" ! x264enc ! qtmux ! filesink location=%s'
+            % (NVMM_RGBA, font_size, shlex.quote(location)))
+
+
+@dataclass
+class PipelineBuilder:
+    sources: List[str] = field(default_factory=list)
+    pgie_config: Optional[str] = None
+    sgie_configs: Sequence[str] = ()
+    tracker: Optional[str] = None  # low-level tracker library path
+    width: int = 1280
+    height: int = 720
+    output: str = OUTPUT_FILE
+    # Output file, or pattern with %d for per-source outputs.
+    out_location: str = "out_%d.mp4"
+    audit_every: int = 30
+    fps: int = 30
+    font_size: int = 15
+    msgconv_config: Optional[str] = None
+    msgbroker_proto_lib: Optional[str] = None
+    msgbroker_conn_str: Optional[str] = None
+    # Keep the SGIEs unloaded until iva.startup.LazySgieLoader starts them.
+    lazy_sgie: bool = False
+
+    def __post_init__(self):
+        if self.output not in OUTPUT_MODES:
+            raise ValueError("output must be one of %s" % ", ".join(OUTPUT_MODES))
+
+    def add_source(self, location: str) -> "PipelineBuilder":
+        self.sources.append(location)
+        return self
+
+    def _out(self, index: int) -> str:
+        if "%" in self.out_location:
+            return self.out_location % index
+        if len(self.sources) == 1:
+            return self.out_location
+        base, ext = os.path.splitext(self.out_location)
+        return "%s_%d%s" % (base, index, ext)
+
+    def _infer_chain(self) -> List[str]:
+        chain = []
+        if self.pgie_config:
+            chain.append("nvinfer name=pgie config-file-path=%s" % shlex.quote(self.pgie_config))
+        if self.tracker:
+            chain.append("nvtracker ll-lib-file=%s" % shlex.quote(self.tracker))
+        if self.lazy_sgie and self.sgie_configs:
+            # Frames bypass the SGIEs (sink_0) until the valve opens and the
+            # selector is switched to sink_1.
+            sgies = " ! ".join(
+                "nvinfer name=sgie%d config-file-path=%s" % (i, shlex.quote(cfg))
+                for i, cfg in enumerate(self.sgie_configs))
+            chain.append(
+                "tee name=lazy lazy. ! queue ! sgie_sel.sink_0 "
+                "lazy. ! valve name=sgie_valve drop=true ! queue name=sgie_queue ! %s ! "
+                "sgie_sel.sink_1 input-selector name=sgie_sel sync-streams=false" % sgies)
+            return chain
+        for cfg in self.sgie_configs:
+            chain.append("nvinfer config-file-path=%s" % shlex.quote(cfg))
+        return chain
+
+    def _metadata_sink(self) -> str:
+        if self.msgbroker_proto_lib:
+            parts = ["nvmsgconv"]
+            if self.msgconv_config:
+                parts[0] += " config=%s" % shlex.quote(self.msgconv_config)
+            broker = "nvmsgbroker proto-lib=%s sync=false" % shlex.quote(
+                self.msgbroker_proto_lib)
+            if self.msgbroker_conn_str:
+                broker += " conn-str=%s" % shlex.quote(self.msgbroker_conn_str)
+            parts.append(broker)
+            return " ! ".join(parts)
+        return "fakesink sync=false async=false"
+
+    def _tail(self, index: int) -> str:
+        """Output chain for one stream of frames."""
+        if self.output == OUTPUT_FILE:
+            return annotate_encode_chain(self._out(index), self.font_size)
+        # build() drops all but 1 in audit_every buffers at this queue.
+        return "queue name=audit%d leaky=downstream max-size-buffers=2 ! %s" % (
+            index, annotate_encode_chain(self._out(index), self.font_size))
+
+    @staticmethod
+    def source_description(location: str) -> str:
+        """Decode branch of one source, up to (not including) its mux pad."""
+        return "%s ! queue" % decode_chain(location)
+
+    def describe(self, with_sources: bool = True) -> str:
+        """The pipeline as a ``gst-launch-1.0`` description.
+
+        With ``with_sources=False`` the decode branches are left out and
+        the caller links :meth:`source_description` bins to ``mux``
+        request pads itself (batch size still follows ``sources``).
+        """
+        if not self.sources:
+            raise ValueError("no sources")
+        n = len(self.sources)
+        parts = ["nvstreammux name=mux batch-size=%d width=%d height=%d"
+                 % (n, self.width, self.height)]
+        if any(is_live(s) for s in self.sources):
+            # Don't let a camera that stops sending hold back the batch.
+            parts[0] += " live-source=1 batched-push-timeout=%d" % (1000000 // self.fps)
+        parts.extend(self._infer_chain())
+        head = " ! ".join(parts)
+
+        if self.output == OUTPUT_HEADLESS:
+            desc = head + " ! " + self._metadata_sink()
+        elif self.output == OUTPUT_AUDIT:
+            # Metadata leaves every frame; annotated video only 1-in-N.
+            desc = "%s ! tee name=t t. ! queue ! %s" % (head, self._metadata_sink())
+            if n == 1:
+                desc += " t. ! " + self._tail(0)
+            else:
+                desc += " t. ! queue ! nvstreamdemux name=demux"
+                for i in range(n):
+                    desc += " demux.src_%d ! %s ! %s" % (i, NVMM_NV12, self._tail(i))
+        elif n == 1:
+            desc = head + " ! " + self._tail(0)
+        else:
+            desc = head + " ! nvstreamdemux name=demux"
+            for i in range(n):
+                desc += " demux.src_%d ! %s ! queue ! %s" % (i, NVMM_NV12, self._tail(i))
+
+        if with_sources:
+            for i, location in enumerate(self.sources):
+                desc += " %s ! mux.sink_%d" % (self.source_description(location), i)
+        return desc
+
+    def build(self):
+        """Parse :meth:`describe` into a ``Gst.Pipeline`` (with audit probes)."""
+        import gi
+        gi.require_version("Gst", "1.0")
+        from gi.repository import Gst
+
+        Gst.init(None)
+        pipeline = Gst.parse_launch(self.describe())
+        if self.output == OUTPUT_AUDIT:
+            for i in range(len(self.sources)):
+                pipeline.get_by_name("audit%d" % i).get_static_pad("sink").add_probe(
+                    Gst.PadProbeType.BUFFER, every_nth_probe(self.audit_every))
+        return pipeline
+
+
+def run(pipeline) -> int:
+    """Play ``pipeline`` until EOS or an error; 0 on EOS."""
+    from gi.repository import Gst
+
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if msg.type == Gst.MessageType.ERROR:
+        err, _ = msg.parse_error()
+        print("error: %s" % err.message)
+        return 1
+    return 0
+
+
+def make_app_config_headless(path: str) -> List[str]:
+    """Switch a ``deepstream-app`` config to metadata-only output in place.
+
+    Every enabled ``[sinkN]`` becomes a FakeSink, ``[osd]`` and
+    ``[tiled-display]`` are disabled. Message-broker sinks (``type=6``)
+    are left alone. Returns the groups that were changed.
+    """
+    cfg = DSConfig.read(path)
+    changed = []
+    for group in cfg.group_names("sink"):
+        if cfg.get_bool(group, "enable", True) and cfg.get_int(group, "type", 0) != 6:
+            set_key(path, group, "type", APP_SINK_FAKE)
+            set_key(path, group, "sync", 0)
+            changed.append(group)
+    for group in ("osd", "tiled-display"):
+        if cfg.has_group(group) and cfg.get_bool(group, "enable", True):
+            set_key(path, group, "enable", 0)
+            changed.append(group)
+    return changed
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Print (or run) a lab pipeline with a chosen output mode.")
+    parser.add_argument("sources", nargs="+")
+    parser.add_argument("--pgie", help="primary nvinfer config")
+    parser.add_argument("--sgie", action="append", default=[])
+    parser.add_argument("--tracker", help="low-level tracker library")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--headless", action="store_const", dest="output",
+                      const=OUTPUT_HEADLESS, help="metadata only, no OSD or encoding")
+    mode.add_argument("--audit", type=int, metavar="N",
+                      help="headless plus annotated clips of 1 in N frames")
+    parser.add_argument("--lazy-sgie", action="store_true",
+                        help="bypass the SGIEs until iva.startup.LazySgieLoader starts them")
+    parser.add_argument("--out", default="out_%d.mp4")
+    parser.add_argument("--run", action="store_true", help="run with gst-launch-1.0")
+    args = parser.parse_args(argv)
+
+    output = args.output or OUTPUT_FILE
+    if args.audit:
+        output = OUTPUT_AUDIT
+    builder = PipelineBuilder(
+        sources=list(args.sources), pgie_config=args.pgie,
+        sgie_configs=args.sgie, tracker=args.tracker, width=args.width,
+        height=args.height, output=output, out_location=args.out,
+        audit_every=args.audit or 30, lazy_sgie=args.lazy_sgie)
+    desc = builder.describe()
+    if not args.run:
+        if output == OUTPUT_AUDIT:
+            print("note: the auditN queues need build()'s 1-in-%d probe; use --run"
+                  % builder.audit_every, file=sys.stderr)
+        print("gst-launch-1.0 " + desc)
+        return 0
+    if output == OUTPUT_AUDIT:
+        return run(builder.build())
+    import subprocess
+    return subprocess.call("gst-launch-1.0 " + desc, shell=True)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
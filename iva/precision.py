@@ -0,0 +1,437 @@
+"""FP32 / FP16 / INT8 comparison and INT8 calibration cache management.
+
+The section 4 configs build INT8 engines (``network-mode=1`` with
+``int8-calib-file=.../cal_trt4.bin``; the test1 log prints "Using INT8
+data type") without ever checking what INT8 costs in accuracy. This
+harness runs the same recorded input tensors through each precision of a
+model, parses the outputs with the DetectNet parser
+(:mod:`iva.detectnet`), matches every variant's detections against FP32
+(:func:`iva.thresholds.match`) and times each batch size.
+
+Backends are pluggable: anything with ``load(model, precision,
+calibration)`` returning a session with ``run(batch) -> {blob: array}``
+and ``calibrate(batches) -> {tensor: scale}``. :class:`NumpyBackend` is a
+CPU stand-in: a small DetectNet-shaped network whose FP16 and INT8
+variants emulate TensorRT rounding (fp16 casts; symmetric per-tensor
+activation and per-channel weight quantization using the calibration
+scales). Its accuracy numbers are meaningful; its timings only exercise
+the harness, since emulated INT8 is not faster on a CPU.
+
+Calibration caches use TensorRT's text format (a header line, then
+``tensor: <big-endian float32 scale as hex>``) and are kept per model
+version by :class:`CalibrationStore`: a cache is only valid for the model
+file it was computed from, so it is filed under the model's content hash
+and :meth:`CalibrationStore.install` points ``int8-calib-file`` at the
+matching one.
+"""
+
+import importlib
+import json
+import os
+import shutil
+import struct
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .bench import file_hash
+from .config import DSConfig, set_key
+from .detectnet import blob_names, parse
+from .startup import _resolve
+from .thresholds import Detections, match
+
+PRECISIONS = ("fp32", "fp16", "int8")
+CALIBRATION_HEADER = "TRT-5105-EntropyCalibration2"
+
+
+# -- calibration caches -----------------------------------------------------
+
+def read_calibration(path: str) -> Dict[str, float]:
+    scales = {}
+    with open(path) as fp:
+        for line in fp:
+            name, sep, value = line.rstrip("\n").rpartition(":")
+            if not sep:
+                continue  # header
+            value = value.strip()
+            scales[name.strip()] = struct.unpack(">f", bytes.fromhex(value.zfill(8)))[0]
+    return scales
+
+
+def write_calibration(path: str, scales: Dict[str, float],
+                      header: str = CALIBRATION_HEADER) -> None:
+    with open(path, "w") as fp:
+        fp.write(header + "\n")
+        for name, scale in scales.items():
+            fp.write("%s: %s\n" % (name, struct.pack(">f", scale).hex()))
+
+
+@dataclass
+class CacheEntry:
+    model: str
+    model_hash: str
+    path: str
+    created: float
+    frames: int
+    calibrator: str
+
+
+class CalibrationStore:
+    """Calibration caches filed as ``root/<model name>/<hash prefix>/calibration.bin``."""
+
+    FILE = "calibration.bin"
+    META = "meta.json"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _dir(self, model: str, model_hash: str) -> str:
+        return os.path.join(self.root, os.path.basename(model), model_hash[:16])
+
+    def get(self, model: str) -> Optional[CacheEntry]:
+        """The cache for the current contents of ``model``, if any."""
+        model_hash = file_hash(model)
+        if model_hash is None:
+            return None
+        meta = os.path.join(self._dir(model, model_hash), self.META)
+        if not os.path.exists(meta):
+            return None
+        with open(meta) as fp:
+            return CacheEntry(**json.load(fp))
+
+    def put(self, model: str, scales: Dict[str, float], frames: int,
+            calibrator: str = "max-abs") -> CacheEntry:
+        model_hash = file_hash(model)
+        if model_hash is None:
+            raise FileNotFoundError(model)
+        directory = os.path.abspath(self._dir(model, model_hash))
+        os.makedirs(directory, exist_ok=True)
+        entry = CacheEntry(os.path.abspath(model), model_hash,
+                           os.path.join(directory, self.FILE), time.time(), frames, calibrator)
+        write_calibration(entry.path, scales)
+        with open(os.path.join(directory, self.META), "w") as fp:
+            json.dump(entry.__dict__, fp, indent=2)
+        return entry
+
+    def versions(self, model: str) -> List[CacheEntry]:
+        """Every stored version for this model name, newest first."""
+        base = os.path.join(self.root, os.path.basename(model))
+        entries = []
+        for name in os.listdir(base) if os.path.isdir(base) else ():
+            meta = os.path.join(base, name, self.META)
+            if os.path.exists(meta):
+                with open(meta) as fp:
+                    entries.append(CacheEntry(**json.load(fp)))
+        return sorted(entries, key=lambda e: e.created, reverse=True)
+
+    def prune(self, model: str, keep: int = 3) -> List[str]:
+        """Drop all but the newest ``keep`` versions; never the current one."""
+        current = file_hash(model)
+        removed = []
+        for entry in self.versions(model)[keep:]:
+            if entry.model_hash != current:
+                shutil.rmtree(os.path.dirname(entry.path))
+                removed.append(entry.path)
+        return removed
+
+    def install(self, config_path: str) -> Tuple[str, str]:
+        """Point the config's ``int8-calib-file`` at the cache for its model.
+
+        Returns ``(cache path, status)``: ``ok`` (already pointing there),
+        ``installed``, or ``missing`` (calibrate first).
+        """
+        model = config_model(config_path)
+        entry = self.get(model) if model else None
+        if entry is None:
+            return "", "missing"
+        cfg = DSConfig.read(config_path)
+        current = cfg.property("int8-calib-file")
+        if current and os.path.abspath(_resolve(config_path, current)) == entry.path:
+            return entry.path, "ok"
+        set_key(config_path, "property" if cfg.has_group("property") else "",
+                "int8-calib-file", entry.path)
+        return entry.path, "installed"
+
+
+def config_model(config_path: str) -> Optional[str]:
+    cfg = DSConfig.read(config_path)
+    for key in ("model-file", "uff-file", "onnx-file"):
+        value = cfg.property(key)
+        if value:
+            return _resolve(config_path, value)
+    return None
+
+
+# -- NumPy stand-in backend -------------------------------------------------
+
+def _fp16(x: np.ndarray) -> np.ndarray:
+    return x.astype(np.float16).astype(np.float32)
+
+
+def _fake_quant(x: np.ndarray, scale: float) -> np.ndarray:
+    return np.clip(np.round(x / scale), -127, 127).astype(np.float32) * scale
+
+
+def _quant_weights(w: np.ndarray) -> np.ndarray:
+    scale = np.maximum(np.abs(w).max(axis=1, keepdims=True), 1e-12) / 127.0
+    return np.round(w / scale) * scale
+
+
+class NumpyModel:
+    """DetectNet-shaped stand-in: 16x16 pooling, a hidden 1x1 layer, cov and bbox heads."""
+
+    INPUT = "input_1"
+    HIDDEN = "hidden"
+
+    def __init__(self, weights: Dict[str, np.ndarray], bbox_blob: str = "conv2d_bbox",
+                 cov_blob: str = "conv2d_cov/Sigmoid"):
+        self.w = {k: np.asarray(v, np.float32) for k, v in weights.items()}
+        self.bbox_blob = bbox_blob
+        self.cov_blob = cov_blob
+
+    @classmethod
+    def random(cls, classes: int = 4, hidden: int = 32, seed: int = 0) -> "NumpyModel":
+        rng = np.random.default_rng(seed)
+        return cls({
+            # Hidden units fire on bright patches; coverage stays low on background.
+            "w1": rng.normal(1.0, 0.5, (hidden, 3)), "b1": rng.normal(-0.8, 0.1, hidden),
+            "wc": np.abs(rng.normal(0, 0.5, (classes, hidden))), "bc": rng.normal(-3.0, 0.3, classes),
+            # Positive offsets: every box extends around its grid cell.
+            "wb": np.abs(rng.normal(0, 0.05, (4 * classes, hidden))),
+            "bb": rng.normal(0.6, 0.05, 4 * classes),
+        })
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyModel":
+        with np.load(path) as data:
+            return cls(dict(data))
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as fp:
+            np.savez(fp, **self.w)
+
+    def forward(self, x: np.ndarray, precision: str = "fp32",
+                scales: Optional[Dict[str, float]] = None,
+                observe: Optional[Dict[str, float]] = None) -> Dict[str, np.ndarray]:
+        n, c, h, w = x.shape
+        gh, gw = h // 16, w // 16
+        x = x[:, :, :gh * 16, :gw * 16].reshape(n, c, gh, 16, gw, 16).mean(axis=(3, 5))
+        w1, wc, wb = self.w["w1"], self.w["wc"], self.w["wb"]
+        if precision == "fp16":
+            x, w1, wc, wb = _fp16(x), _fp16(w1), _fp16(wc), _fp16(wb)
+        elif precision == "int8":
+            x = _fake_quant(x, scales[self.INPUT])
+            w1, wc, wb = _quant_weights(w1), _quant_weights(wc), _quant_weights(wb)
+        if observe is not None:
+            observe[self.INPUT] = max(observe.get(self.INPUT, 0.0), float(np.abs(x).max()))
+        hid = np.maximum(np.einsum("oc,nchw->nohw", w1, x) + self.w["b1"][None, :, None, None], 0)
+        if precision == "fp16":
+            hid = _fp16(hid)
+        elif precision == "int8":
+            hid = _fake_quant(hid, scales[self.HIDDEN])
+        if observe is not None:
+            observe[self.HIDDEN] = max(observe.get(self.HIDDEN, 0.0), float(hid.max()))
+        logits = np.einsum("oc,nchw->nohw", wc, hid) + self.w["bc"][None, :, None, None]
+        bbox = np.einsum("oc,nchw->nohw", wb, hid) + self.w["bb"][None, :, None, None]
+        cov = 1.0 / (1.0 + np.exp(-logits))
+        if precision == "fp16":
+            cov, bbox = _fp16(cov), _fp16(bbox)
+        return {self.cov_blob: cov.astype(np.float32), self.bbox_blob: bbox.astype(np.float32)}
+
+
+class NumpySession:
+    def __init__(self, model: NumpyModel, precision: str, scales: Optional[Dict[str, float]]):
+        if precision == "int8" and not scales:
+            raise ValueError("int8 needs a calibration table")
+        self.model = model
+        self.precision = precision
+        self.scales = scales
+
+    def run(self, batch: np.ndarray) -> Dict[str, np.ndarray]:
+        return self.model.forward(batch, self.precision, self.scales)
+
+    def calibrate(self, batches: Iterable[np.ndarray]) -> Dict[str, float]:
+        """Max-abs activation ranges over ``batches``, as per-tensor scales."""
+        amax: Dict[str, float] = {}
+        for batch in batches:
+            self.model.forward(batch, "fp32", observe=amax)
+        return {name: max(v, 1e-8) / 127.0 for name, v in amax.items()}
+
+
+class NumpyBackend:
+    """Loads ``.npz`` weights (see :meth:`NumpyModel.save`), or a seeded random model."""
+
+    name = "numpy"
+
+    def load(self, model: str, precision: str, calibration: Optional[Dict[str, float]] = None):
+        net = NumpyModel.load(model) if os.path.exists(model) else NumpyModel.random()
+        return NumpySession(net, precision, calibration)
+
+
+def load_backend(spec: str):
+    """``numpy`` or ``package.module:Class``."""
+    if spec == "numpy":
+        return NumpyBackend()
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+# -- inputs -----------------------------------------------------------------
+
+def synthetic_frames(n: int = 32, height: int = 368, width: int = 640, seed: int = 0,
+                     scale: float = 0.0039215697906911373) -> np.ndarray:
+    """``[n, 3, height, width]`` preprocessed frames with bright box-shaped objects."""
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(0, 60, (n, 3, height, width)).astype(np.float32)
+    for f in frames:
+        for _ in range(rng.integers(2, 8)):
+            w, h = rng.integers(32, 160, 2)
+            x, y = rng.integers(0, width - w), rng.integers(0, height - h)
+            f[:, y:y + h, x:x + w] = rng.integers(120, 255, (3, 1, 1))
+    return frames * scale
+
+
+def load_frames(path: str, scale: float = 0.0039215697906911373) -> np.ndarray:
+    """Recorded tensors: ``[N, 3, H, W]`` float as-is, ``[N, H, W, 3]`` uint8 scaled."""
+    data = np.load(path)
+    if data.dtype == np.uint8:
+        data = data.transpose(0, 3, 1, 2).astype(np.float32) * scale
+    return data
+
+
+# -- comparison -------------------------------------------------------------
+
+def _batches(frames: np.ndarray, size: int) -> Iterable[np.ndarray]:
+    for i in range(0, len(frames), size):
+        yield frames[i:i + size]
+
+
+def _detections(outputs: List[Dict[str, np.ndarray]], bbox_blob: str, cov_blob: str,
+                thresholds, index: Dict[Tuple[int, int], int]) -> Detections:
+    frame, cls, conf, boxes = [], [], [], []
+    k = 0
+    for out in outputs:
+        for objs in parse(out[cov_blob], out[bbox_blob], thresholds):
+            fi = index.setdefault((0, k), len(index))
+            frame.append(np.full(len(objs), fi, np.int64))
+            cls.append(objs.class_id)
+            conf.append(objs.confidence)
+            boxes.append(objs.boxes)
+            k += 1
+    return Detections(np.concatenate(frame), np.concatenate(cls), np.concatenate(conf),
+                      np.concatenate(boxes).reshape(-1, 4), sorted(index, key=index.get))
+
+
+def compare(backend, model: str, frames: np.ndarray,
+            precisions: Sequence[str] = PRECISIONS, batch_sizes: Sequence[int] = (1, 2, 4, 8),
+            thresholds=0.2, store: Optional[CalibrationStore] = None,
+            calibration_frames: int = 16, repeats: int = 3,
+            blobs: Tuple[str, str] = ("conv2d_bbox", "conv2d_cov/Sigmoid")) -> List[Dict[str, object]]:
+    """One row per precision: output error and detection agreement vs FP32, latency per batch."""
+    bbox_blob, cov_blob = blobs
+    scales = None
+    if "int8" in precisions:
+        entry = store.get(model) if store else None
+        if entry is not None:
+            scales = read_calibration(entry.path)
+        else:
+            scales = backend.load(model, "fp32").calibrate(_batches(frames[:calibration_frames], 8))
+            if store is not None and os.path.exists(model):
+                store.put(model, scales, min(calibration_frames, len(frames)))
+
+    index: Dict[Tuple[int, int], int] = {}
+    reference = None
+    rows = []
+    for precision in ("fp32",) + tuple(p for p in precisions if p != "fp32"):
+        session = backend.load(model, precision, scales if precision == "int8" else None)
+        outputs = [session.run(b) for b in _batches(frames, max(batch_sizes))]
+        dets = _detections(outputs, bbox_blob, cov_blob, thresholds, index)
+        cov = np.concatenate([o[cov_blob] for o in outputs])
+        row: Dict[str, object] = {"precision": precision, "detections": len(dets)}
+        if reference is None:
+            reference = (cov, dets)
+        else:
+            ref_cov, ref_dets = reference
+            tp = match(dets, ref_dets, 0.5)
+            row.update(cov_max_abs_err=round(float(np.abs(cov - ref_cov).max()), 5),
+                       cov_mean_abs_err=round(float(np.abs(cov - ref_cov).mean()), 6),
+                       agree_precision=round(float(tp.mean()) if len(tp) else 1.0, 4),
+                       agree_recall=round(float(tp.sum()) / max(len(ref_dets), 1), 4))
+        latency = {}
+        for size in batch_sizes:
+            batch = frames[:size]
+            if len(batch) < size:
+                continue
+            times = []
+            for _ in range(repeats):
+                t = time.perf_counter()
+                session.run(batch)
+                times.append(time.perf_counter() - t)
+            best = float(np.median(times))
+            latency[str(size)] = {"batch_ms": round(best * 1e3, 3),
+                                  "per_frame_ms": round(best * 1e3 / size, 3)}
+        row["latency"] = latency
+        if precision in precisions:
+            rows.append(row)
+    return rows
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare FP32/FP16/INT8 variants of a detector.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("compare")
+    p.add_argument("model", help="model file (.npz for the numpy backend)")
+    p.add_argument("--backend", default="numpy", help="numpy or module:Class")
+    p.add_argument("--frames", help=".npy tensors; synthetic frames when omitted")
+    p.add_argument("--count", type=int, default=32, help="synthetic frame count")
+    p.add_argument("--batch", type=int, nargs="*", default=[1, 2, 4, 8])
+    p.add_argument("--precision", nargs="*", default=list(PRECISIONS), choices=PRECISIONS)
+    p.add_argument("--threshold", type=float, default=0.2)
+    p.add_argument("--config", help="nvinfer config: take output-blob-names from it")
+    p.add_argument("--store", help="calibration store directory")
+    p = sub.add_parser("install", help="point int8-calib-file at the stored cache")
+    p.add_argument("store")
+    p.add_argument("configs", nargs="+")
+    p = sub.add_parser("versions", help="list stored caches for a model")
+    p.add_argument("store")
+    p.add_argument("model")
+    p.add_argument("--prune", type=int, metavar="KEEP")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "install":
+        store = CalibrationStore(args.store)
+        missing = 0
+        for path in args.configs:
+            cache, status = store.install(path)
+            missing += status == "missing"
+            print("%-8s %s %s" % (status, path, cache))
+        return 1 if missing else 0
+    if args.cmd == "versions":
+        store = CalibrationStore(args.store)
+        current = file_hash(args.model)
+        for entry in store.versions(args.model):
+            print("%s %s frames=%d %s" % ("*" if entry.model_hash == current else " ",
+                                          entry.model_hash[:16], entry.frames, entry.path))
+        if args.prune is not None:
+            for path in store.prune(args.model, args.prune):
+                print("removed", path)
+        return 0
+
+    frames = load_frames(args.frames) if args.frames else synthetic_frames(args.count)
+    blobs = ("conv2d_bbox", "conv2d_cov/Sigmoid")
+    if args.config:
+        blobs = blob_names(DSConfig.read(args.config).property("output-blob-names"))
+    store = CalibrationStore(args.store) if args.store else None
+    rows = compare(load_backend(args.backend), args.model, frames, args.precision,
+                   args.batch, args.threshold, store, blobs=blobs)
+    for row in rows:
+        print(json.dumps(row))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
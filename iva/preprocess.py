@@ -0,0 +1,417 @@
+"""Batched preprocessing: NV12/RGBA/RGB frames to normalized planar tensors.
+
+Section 4.1: nvinfer performs "format conversion, scaling, mean
+subtraction" to produce float planar RGB/BGR input, ``y =
+net-scale-factor * (x - offsets)``. The CPU path (:mod:`iva.cpu_infer`)
+and the dsexample path need the same. :class:`Preprocessor` does it for a
+whole batch in a handful of array operations:
+
+* the output batch ``[batch, C, H, W]`` is allocated once and reused;
+* sampling positions for every item come from per-axis tables turned
+  into flat gather indices (cached for whole frames), so resize, ROI crop
+  (SGIE 224x224 object crops) and letterboxing (``maintain-aspect-ratio``)
+  are one ``take`` per bilinear tap for the whole batch; RGBA pixels move
+  as 32-bit words and are blended in float from uint8 channel views of
+  the gathered words;
+* NV12 is resized *before* colour conversion – only output pixels are
+  converted – and the BT.601 matrix, ``net-scale-factor`` and ``offsets``
+  are folded into a single per-channel affine map, so conversion, scaling
+  and mean subtraction are one multiply-add.
+
+``python -m iva.preprocess`` benchmarks it against per-frame
+resize/convert/normalize calls (OpenCV when importable).
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# BT.601 limited range, as NVIDIA decoders output: rows R, G, B over (Y-16, U-128, V-128).
+NV12_TO_RGB = np.array([[1.164, 0.0, 1.596],
+                        [1.164, -0.392, -0.813],
+                        [1.164, 2.017, 0.0]], np.float32)
+
+
+def _axis(src_len: int, start: np.ndarray, length: np.ndarray, dst_len: int,
+          offset: np.ndarray, content: np.ndarray):
+    """Bilinear taps along one axis for K items: ``(i0, i1, w1, valid)`` each ``[K, dst_len]``.
+
+    Item k samples source ``[start, start + length)`` into output
+    positions ``[offset, offset + content)``; other positions are padding.
+    Taps are clamped to the item's own span, so a crop never blends in
+    pixels from outside its ROI.
+    """
+    d = np.arange(dst_len, dtype=np.float32)[None, :]
+    step = (length / content)[:, None]
+    pos = start[:, None] + (d - offset[:, None] + 0.5) * step - 0.5
+    valid = (d >= offset[:, None]) & (d < (offset + content)[:, None])
+    lo = np.clip(start, 0, src_len - 1)[:, None]
+    hi = np.clip(start + length - 1, 0, src_len - 1)[:, None]
+    hi = np.maximum(hi, lo)
+    pos = np.clip(pos, lo, hi)
+    i0 = np.floor(pos).astype(np.intp)
+    i1 = np.minimum(i0 + 1, np.ceil(hi).astype(np.intp))
+    return i0, i1, (pos - i0).astype(np.float32), valid
+
+
+class Preprocessor:
+    """Reusable batch preprocessor for one network input shape.
+
+    ``offsets`` and ``scale`` follow the nvinfer keys; ``bgr`` is
+    ``model-color-format=1``. With ``letterbox`` the aspect ratio is kept
+    and the rest padded with ``pad`` (a pixel value, normalized like the
+    image); ``center=False`` pads right/bottom as nvinfer does.
+    """
+
+    def __init__(self, height: int, width: int, batch: int, scale: float = 1.0,
+                 offsets: Sequence[float] = (0.0, 0.0, 0.0), bgr: bool = False,
+                 letterbox: bool = False, center: bool = False, pad: float = 0.0,
+                 interpolation: str = "bilinear"):
+        self.height, self.width = height, width
+        self.batch = batch
+        self.scale = float(scale)
+        self.offsets = np.asarray(offsets, np.float32)[:3]
+        self.bgr = bgr
+        self.letterbox = letterbox
+        self.center = center
+        self.pad = pad
+        if interpolation not in ("bilinear", "nearest"):
+            raise ValueError("interpolation must be bilinear or nearest")
+        self.bilinear = interpolation == "bilinear"
+        self.out = np.empty((batch, 3, height, width), np.float32)
+        order = [2, 1, 0] if bgr else [0, 1, 2]
+        self.order = order
+        # Fused affine maps: out_c = gain_c * value + bias_c. ``order`` only
+        # picks the source channel; like nvinfer, offsets[c] belongs to
+        # network channel c (the blue mean first for BGR models).
+        self.gain = np.full(3, self.scale, np.float32)
+        self.bias = -self.offsets * self.scale
+        self.pad_value = (pad - self.offsets) * self.scale
+        # NV12: out_c = sum_j m[c, j] * yuv_j + bias_c, clipped to the normalized [0, 255].
+        m = NV12_TO_RGB[order] * self.scale
+        self.nv12_matrix = m
+        self.nv12_bias = self.bias - m @ np.array([16.0, 128.0, 128.0], np.float32)
+        self.nv12_lo = (0.0 - self.offsets) * self.scale
+        self.nv12_hi = (255.0 - self.offsets) * self.scale
+        self._tables: Dict[tuple, "_Taps"] = {}
+        self._buffers: Dict[str, np.ndarray] = {}
+
+    # -- geometry ----------------------------------------------------------
+
+    def _geometry(self, rois: np.ndarray):
+        """Content placement per item: ``(oy, ox, ch, cw)`` arrays."""
+        k = len(rois)
+        if not self.letterbox:
+            return (np.zeros(k, np.float32), np.zeros(k, np.float32),
+                    np.full(k, self.height, np.float32), np.full(k, self.width, np.float32))
+        ratio = np.minimum(self.width / rois[:, 2], self.height / rois[:, 3])
+        cw = np.maximum(1, np.round(rois[:, 2] * ratio)).astype(np.float32)
+        ch = np.maximum(1, np.round(rois[:, 3] * ratio)).astype(np.float32)
+        if self.center:
+            return (np.floor((self.height - ch) / 2), np.floor((self.width - cw) / 2), ch, cw)
+        return np.zeros(k, np.float32), np.zeros(k, np.float32), ch, cw
+
+    def _taps(self, rois: np.ndarray, f: np.ndarray, src_h: int, src_w: int,
+              frame_elems: int, row_elems: int, row0: int = 0, sub: int = 1) -> "_Taps":
+        """Flat gather indices and weights for ``rois`` (left, top, w, h) of frames ``f``.
+
+        The plane of frame ``i`` starts at row ``row0`` of a flat array with
+        ``frame_elems`` elements per frame and ``row_elems`` per row;
+        ``sub=2`` addresses the half-resolution NV12 chroma plane, whose
+        sample centres sit between luma pairs (``c = (l + 0.5) / 2 - 0.5``).
+        """
+        oy, ox, ch, cw = self._geometry(rois)
+        y0, y1, wy, vy = _axis(src_h // sub, rois[:, 1] / sub, rois[:, 3] / sub,
+                               self.height, oy, ch)
+        x0, x1, wx, vx = _axis(src_w // sub, rois[:, 0] / sub, rois[:, 2] / sub,
+                               self.width, ox, cw)
+        base = (f.astype(np.intp) * frame_elems)[:, None] + row0 * row_elems
+        valid = (vy[:, :, None] & vx[:, None, :]) if self.letterbox else None
+        if not self.bilinear:
+            rows = (base + np.where(wy >= 0.5, y1, y0) * row_elems)[:, :, None]
+            return _Taps([rows + np.where(wx >= 0.5, x1, x0)[:, None, :]], valid=valid)
+        r0 = (base + y0 * row_elems)[:, :, None]
+        r1 = (base + y1 * row_elems)[:, :, None]
+        c0, c1 = x0[:, None, :], x1[:, None, :]
+        return _Taps([r0 + c0, r0 + c1, r1 + c0, r1 + c1],
+                     wx[:, None, :], wy[:, :, None], valid)
+
+    def _cached(self, key: tuple, make) -> "_Taps":
+        taps = self._tables.get(key)
+        if taps is None:
+            taps = self._tables[key] = make()
+        return taps
+
+    # -- public ------------------------------------------------------------
+
+    def transforms(self, rois: np.ndarray) -> np.ndarray:
+        """``[K, 6]`` (left, top, sx, sy, ox, oy): source x = left + (x - ox) * sx."""
+        rois = np.asarray(rois, np.float32).reshape(-1, 4)
+        oy, ox, ch, cw = self._geometry(rois)
+        return np.stack([rois[:, 0], rois[:, 1], rois[:, 2] / cw, rois[:, 3] / ch, ox, oy], axis=1)
+
+    def run(self, frames: np.ndarray, fmt: str = "rgba", rois: Optional[np.ndarray] = None,
+            frame_index: Optional[np.ndarray] = None,
+            out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Preprocess a batch; returns a view of the reused output buffer.
+
+        ``frames`` is ``[N, H, W, 4]`` (rgba), ``[N, H, W, 3]`` (rgb) or
+        ``[N, H * 3 // 2, W]`` (nv12), all uint8. Without ``rois`` each
+        frame is one item; with ``rois`` (``[K, 4]`` left, top, width,
+        height) each ROI of ``frames[frame_index[k]]`` is one item. The
+        view is overwritten by the next call; pass ``out`` (``[K, 3, H,
+        W]`` float32) to write somewhere else, e.g. a slice of a larger
+        batch being assembled from several calls.
+        """
+        frames = np.ascontiguousarray(frames)
+        if fmt not in ("rgba", "rgb", "nv12"):
+            raise ValueError("unknown format %r" % fmt)
+        if frames.ndim == (2 if fmt == "nv12" else 3):
+            frames = frames[None]
+        n = len(frames)
+        src_h = frames.shape[1] * 2 // 3 if fmt == "nv12" else frames.shape[1]
+        src_w = frames.shape[2]
+        if rois is None:
+            k = n
+            f = np.arange(n)
+            full = np.tile(np.array([[0, 0, src_w, src_h]], np.float32), (n, 1))
+        else:
+            rois = np.asarray(rois, np.float32).reshape(-1, 4)
+            k = len(rois)
+            f = np.zeros(k, np.intp) if frame_index is None else np.asarray(frame_index, np.intp)
+        if k > self.batch:
+            raise ValueError("%d items for a batch of %d" % (k, self.batch))
+        if out is None:
+            out = self.out[:k]
+        elif out.shape != (k, 3, self.height, self.width):
+            raise ValueError("out has shape %s for %d items" % (out.shape, k))
+
+        def taps(name, *args, **kw):
+            if rois is None:
+                return self._cached((name, fmt, n, src_h, src_w),
+                                    lambda: self._taps(full, f, src_h, src_w, *args, **kw))
+            return self._taps(rois, f, src_h, src_w, *args, **kw)
+
+        if fmt == "rgba":
+            # One 32-bit gather moves a whole pixel; the channels are then
+            # strided uint8 views of the gathered words.
+            flat = frames.view(np.uint32).reshape(-1)
+            t = taps("pix", src_h * src_w, src_w)
+            pix = [np.take(flat, i).view(np.uint8).reshape(k, self.height, self.width, 4)
+                   for i in t.index]
+            for c, src_c in enumerate(self.order):
+                t.blend([p[..., src_c] for p in pix], out[:, c], self._tmp(k))
+                out[:, c] *= self.gain[c]
+                out[:, c] += self.bias[c]
+        elif fmt == "rgb":
+            flat = frames.reshape(-1, 3)
+            t = taps("pix", src_h * src_w, src_w)
+            pix = [np.take(flat, i, axis=0) for i in t.index]
+            for c, src_c in enumerate(self.order):
+                t.blend([p[..., src_c] for p in pix], out[:, c], self._tmp(k))
+                out[:, c] *= self.gain[c]
+                out[:, c] += self.bias[c]
+        else:
+            luma_flat = frames.reshape(-1)
+            t = taps("y", frames[0].size, src_w)
+            # Interleaved U/V pairs gathered as one 16-bit value.
+            chroma_flat = frames.view(np.uint16).reshape(-1)
+            ct = taps("uv", frames[0].size // 2, src_w // 2, row0=src_h, sub=2)
+            luma = self._luma(k)
+            t.blend([np.take(luma_flat, i) for i in t.index], luma, self._tmp(k))
+            uv = [np.take(chroma_flat, i).view(np.uint8).reshape(k, self.height, self.width, 2)
+                  for i in ct.index]
+            u, v = self._chroma(k)
+            ct.blend([p[..., 0] for p in uv], u, self._tmp(k))
+            ct.blend([p[..., 1] for p in uv], v, self._tmp(k))
+            m = self.nv12_matrix
+            tmp = self._tmp(k)
+            for c in range(3):
+                oc = out[:, c]
+                np.multiply(luma, m[c, 0], out=oc)
+                for plane, coef in ((u, m[c, 1]), (v, m[c, 2])):
+                    if coef:
+                        np.multiply(plane, coef, out=tmp)
+                        oc += tmp
+                oc += self.nv12_bias[c]
+                lo, hi = sorted((self.nv12_lo[c], self.nv12_hi[c]))
+                np.clip(oc, lo, hi, out=oc)
+        if t.valid is not None:
+            invalid = ~t.valid
+            for c in range(3):
+                np.copyto(out[:, c], self.pad_value[c], where=invalid)
+        return out
+
+    def _scratch(self, name: str, k: int, count: int = 1):
+        buf = self._buffers.get(name)
+        if buf is None:
+            buf = self._buffers[name] = np.empty((count, self.batch, self.height, self.width),
+                                                 np.float32)
+        return [b[:k] for b in buf]
+
+    def _tmp(self, k: int) -> np.ndarray:
+        return self._scratch("tmp", k)[0]
+
+    def _luma(self, k: int) -> np.ndarray:
+        return self._scratch("luma", k)[0]
+
+    def _chroma(self, k: int):
+        return self._scratch("chroma", k, 2)
+
+
+class _Taps:
+    """Gather indices (one for nearest, four for bilinear) and separable blend weights.
+
+    Bilinear taps are ordered top-left, top-right, bottom-left,
+    bottom-right; ``wx`` is ``[K, 1, W]`` and ``wy`` ``[K, H, 1]``.
+    """
+
+    def __init__(self, index: List[np.ndarray], wx: Optional[np.ndarray] = None,
+                 wy: Optional[np.ndarray] = None, valid: Optional[np.ndarray] = None):
+        self.index = index
+        self.wx, self.wy = wx, wy
+        self.valid = valid
+        self.bilinear = wx is not None
+
+    def blend(self, samples: List[np.ndarray], out: np.ndarray, tmp: np.ndarray) -> None:
+        """Bilinear blend of uint8 samples into float ``out``."""
+        if not self.bilinear:
+            out[...] = samples[0]
+            return
+        s00, s01, s10, s11 = samples
+        np.subtract(s01, s00, out=out, dtype=np.float32)
+        out *= self.wx
+        out += s00
+        np.subtract(s11, s10, out=tmp, dtype=np.float32)
+        tmp *= self.wx
+        tmp += s10
+        tmp -= out
+        tmp *= self.wy
+        out += tmp
+
+
+# -- reference and benchmark ------------------------------------------------
+
+def _cv2():
+    try:
+        import cv2
+    except ImportError:
+        return None
+    return cv2
+
+
+def naive(frames: Sequence[np.ndarray], height: int, width: int, scale: float,
+          offsets: Sequence[float], fmt: str = "rgba", bgr: bool = False) -> np.ndarray:
+    """Per-frame conversion, resize and normalization, one library call at a time.
+
+    Uses OpenCV (bilinear) when importable, else NumPy nearest-neighbour.
+    With ``bgr`` the channels are reversed before ``offsets`` apply.
+    """
+    cv2 = _cv2()
+    out = []
+    for frame in frames:
+        if fmt == "nv12":
+            if cv2 is not None:
+                rgb = cv2.cvtColor(frame, cv2.COLOR_YUV2RGB_NV12)
+            else:
+                rgb = _nv12_to_rgb(frame)
+        else:
+            rgb = frame[..., :3]
+        if cv2 is not None:
+            rgb = cv2.resize(rgb, (width, height), interpolation=cv2.INTER_LINEAR)
+        else:
+            ys = np.arange(height) * rgb.shape[0] // height
+            xs = np.arange(width) * rgb.shape[1] // width
+            rgb = rgb[ys[:, None], xs]
+        if bgr:
+            rgb = rgb[..., ::-1]
+        x = rgb.astype(np.float32)
+        x -= np.asarray(offsets, np.float32)[:3]
+        x *= scale
+        out.append(x.transpose(2, 0, 1))
+    return np.stack(out)
+
+
+def _nv12_to_rgb(frame: np.ndarray) -> np.ndarray:
+    h = frame.shape[0] * 2 // 3
+    y = frame[:h].astype(np.float32) - 16
+    uv = frame[h:].reshape(h // 2, -1, 2).astype(np.float32) - 128
+    uv = uv.repeat(2, axis=0).repeat(2, axis=1)
+    yuv = np.stack([y, uv[..., 0], uv[..., 1]], axis=-1)
+    return np.clip(yuv @ NV12_TO_RGB.T, 0, 255).astype(np.uint8)
+
+
+def synthetic(n: int, height: int = 720, width: int = 1280, fmt: str = "rgba",
+              seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if fmt == "nv12":
+        return rng.integers(16, 236, (n, height * 3 // 2, width), dtype=np.uint8)
+    return rng.integers(0, 256, (n, height, width, 4 if fmt == "rgba" else 3), dtype=np.uint8)
+
+
+def bench(batch: int = 8, src: Tuple[int, int] = (720, 1280), dst: Tuple[int, int] = (368, 640),
+          repeats: int = 5, crops: int = 16, bgr: bool = False) -> List[Dict[str, object]]:
+    scale = 0.0039215697906911373
+    offsets = (0.0, 0.0, 0.0)
+    # Compare like with like: the naive path is bilinear only with OpenCV.
+    interpolation = "bilinear" if _cv2() is not None else "nearest"
+    rows = []
+
+    def best(fn):
+        times = []
+        for _ in range(repeats):
+            t = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t)
+        return min(times) * 1e3
+
+    for fmt in ("rgba", "nv12"):
+        frames = synthetic(batch, src[0], src[1], fmt)
+        pre = Preprocessor(dst[0], dst[1], batch, scale, offsets, bgr=bgr,
+                           interpolation=interpolation)
+        fused = best(lambda: pre.run(frames, fmt))
+        ref = best(lambda: naive(frames, dst[0], dst[1], scale, offsets, fmt, bgr))
+        rows.append({"case": "%s %dx%d -> %dx%d x%d" % (fmt, src[1], src[0], dst[1], dst[0], batch),
+                     "interpolation": interpolation,
+                     "batched_ms": round(fused, 2), "naive_ms": round(ref, 2),
+                     "speedup": round(ref / fused, 1)})
+
+    # SGIE crops: many object ROIs from one mux batch into 224x224.
+    rng = np.random.default_rng(1)
+    frames = synthetic(batch, src[0], src[1], "rgba")
+    wh = rng.uniform(40, 400, (crops, 2))
+    xy = rng.uniform(0, 1, (crops, 2)) * (np.array([src[1], src[0]]) - wh)
+    rois = np.concatenate([xy, wh], axis=1).astype(np.float32)
+    fidx = rng.integers(0, batch, crops)
+    pre = Preprocessor(224, 224, crops, scale, offsets, bgr=bgr, letterbox=True,
+                       interpolation=interpolation)
+    fused = best(lambda: pre.run(frames, "rgba", rois, fidx))
+
+    def per_crop():
+        return naive([frames[i, int(t):int(t + h), int(l):int(l + w)]
+                      for i, (l, t, w, h) in zip(fidx, rois)], 224, 224, scale, offsets,
+                     bgr=bgr)
+    ref = best(per_crop)
+    rows.append({"case": "rgba %d crops -> 224x224 letterbox" % crops,
+                 "interpolation": interpolation, "batched_ms": round(fused, 2), "naive_ms": round(ref, 2),
+                 "speedup": round(ref / fused, 1)})
+    return rows
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Benchmark batched preprocessing.")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--crops", type=int, default=32)
+    parser.add_argument("--bgr", action="store_true", help="model-color-format=1")
+    args = parser.parse_args(argv)
+    for row in bench(args.batch, crops=args.crops, bgr=args.bgr):
+        print(json.dumps(row))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
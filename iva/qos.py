@@ -0,0 +1,581 @@
+"""Per-stream QoS classes and load shedding under overload.
+
+Section 11.5 keeps adding streams and asks "Are we still able to achieve
+30 frames per second?". Past capacity the answer is no for every stream at
+once: queues fill and each stream loses the same share of frames.
+:class:`OverloadController` decides who pays instead:
+
+* every source has a :class:`StreamPolicy`: ``critical`` streams are
+  guaranteed their fps with full inference, ``best-effort`` streams can be
+  degraded down to ``min_fps``, lowest ``priority`` first;
+* a best-effort stream degrades along a :func:`ladder` of
+  :class:`Level` steps, mildest first: drop its SGIEs, raise its
+  inference interval (1, 2, 4 – the nvinfer ``interval`` key, per
+  stream), then halve its decode fps down to ``min_fps``;
+* the controller is driven by measured queue latency: every ``period``
+  seconds it takes the ``quantile`` of the latencies observed since the
+  last decision. Above ``high_ms`` (or with a critical stream short of
+  its fps) it sheds load, as estimated by :meth:`Level.cost`, taking
+  steps from the least degraded streams of the lowest priority. With
+  frames reported through :meth:`~OverloadController.observe_frame` it
+  sheds down to just under the work delivered while the queue was backed
+  up, i.e. the measured capacity; without, about ``shed_share`` of the
+  load, more the further over ``high_ms`` and twice as much for every
+  period that does not improve. Below ``low_ms`` for
+  ``recover_after`` seconds it gives back up to ``restore_share`` per
+  period, most important streams first, but not past the load at which
+  it last had to shed (a ceiling that rises slowly while it stays calm).
+
+The controller acts through :meth:`OverloadController.admit`,
+:meth:`~OverloadController.infer` and :meth:`~OverloadController.classify`
+(per-frame gates for :class:`iva.cpu_infer.CpuInfer` and
+:class:`iva.crop_batcher.CropBatcher`), through
+:meth:`~OverloadController.drop_probe` on the nvstreammux sink pads of a
+GStreamer pipeline (decode fps; nvinfer's ``interval`` and the SGIEs are
+per element there, not per stream), or through an ``apply`` callback.
+On the GStreamer path build the controller with ``fps_only=True`` so its
+ladder only has the steps the probe can act on, and give nvstreammux the
+:meth:`~OverloadController.mux_properties`: a dropped buffer leaves its
+batch slot empty, and the mux only pushes a short batch after
+``batched-push-timeout`` – one frame interval with ``live-source=1``
+instead of stalling every stream.
+``python -m iva.qos`` runs a simulated overloaded box with and without it.
+"""
+
+import bisect
+import heapq
+import math
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from .metrics import LatencyHistogram
+
+CRITICAL = "critical"
+BEST_EFFORT = "best-effort"
+QOS_CLASSES = (CRITICAL, BEST_EFFORT)
+
+QUEUE_BUCKETS = (0.005, 0.01, 0.02, 0.033, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0, 2.0)
+
+# A critical stream below this share of its fps counts as missing its SLA.
+SLA_FPS_SHARE = 0.95
+
+# Relative work of a frame the detector skips (interval) and of the SGIEs on
+# an inferred frame's objects, per detector frame; they size shed/restore steps.
+SKIP_COST = 0.1
+SGIE_COST = 0.45
+
+# Restores stop at this share of the estimated load that last overloaded.
+CEILING_MARGIN = 0.95
+
+# Latency quantile below this share of the last one: earlier shedding is working.
+IMPROVING = 0.9
+
+
+@dataclass
+class StreamPolicy:
+    source_id: int
+    qos: str = BEST_EFFORT
+    fps: float = 30.0
+    min_fps: float = 1.0  # best-effort floor; critical streams keep ``fps``
+    priority: int = 0  # among best-effort streams, higher sheds later
+    sgie: bool = True  # whether the stream runs the SGIEs at all
+
+    def __post_init__(self):
+        if self.qos not in QOS_CLASSES:
+            raise ValueError("qos must be one of %s" % ", ".join(QOS_CLASSES))
+
+    @property
+    def critical(self) -> bool:
+        return self.qos == CRITICAL
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"source_id": self.source_id, "qos": self.qos, "fps": self.fps,
+                "min_fps": self.min_fps, "priority": self.priority, "sgie": self.sgie}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, object]) -> "StreamPolicy":
+        return cls(int(d["source_id"]), str(d.get("qos", BEST_EFFORT)),
+                   float(d.get("fps", 30.0)), float(d.get("min_fps", 1.0)),
+                   int(d.get("priority", 0)), bool(d.get("sgie", True)))
+
+
+@dataclass(frozen=True)
+class Level:
+    """What a stream runs: decode ``fps``, nvinfer ``interval`` and SGIEs on/off."""
+
+    fps: float
+    interval: int = 0
+    sgie: bool = True
+
+    def cost(self, skip: float = SKIP_COST, sgie: float = SGIE_COST) -> float:
+        """Estimated work per second, in detector frames."""
+        per_frame = (1.0 + (sgie if self.sgie else 0.0) + skip * self.interval) / (self.interval + 1)
+        return self.fps * per_frame
+
+
+def ladder(policy: StreamPolicy, intervals: Sequence[int] = (1, 2, 4),
+           fps_only: bool = False) -> List[Level]:
+    """Degradation steps of a stream, mildest first; critical streams have one.
+
+    ``fps_only`` keeps the SGIEs and the interval and only lowers fps, for
+    pipelines where nothing but frame dropping is per stream.
+    """
+    levels = [Level(policy.fps, 0, policy.sgie)]
+    if policy.critical:
+        return levels
+    sgie = policy.sgie
+    interval = 0
+    if not fps_only:
+        if policy.sgie:
+            levels.append(Level(policy.fps, 0, False))
+        levels.extend(Level(policy.fps, i, False) for i in intervals)
+        sgie = False
+        interval = intervals[-1] if intervals else 0
+    fps = policy.fps / 2
+    while fps > policy.min_fps:
+        levels.append(Level(fps, interval, sgie))
+        fps /= 2
+    if policy.min_fps < policy.fps:
+        levels.append(Level(policy.min_fps, interval, sgie))
+    return levels
+
+
+@dataclass
+class Change:
+    source_id: int
+    at: float
+    level: int
+    reason: str
+
+
+@dataclass
+class _StreamState:
+    policy: StreamPolicy
+    steps: List[Level]
+    level: int = 0
+    credit: float = 0.0
+    admitted: int = 0
+    delivered: int = 0
+    window_delivered: int = 0
+    fps: float = 0.0  # delivered fps over the last period
+
+
+class OverloadController:
+    """Shed and restore per-stream work from measured queue latency."""
+
+    def __init__(self, policies: Sequence[StreamPolicy], high_ms: float = 100.0,
+                 low_ms: float = 40.0, quantile: float = 0.95, period: float = 1.0,
+                 recover_after: float = 3.0, intervals: Sequence[int] = (1, 2, 4),
+                 shed_share: float = 0.1, restore_share: float = 0.05,
+                 skip_cost: float = SKIP_COST, sgie_cost: float = SGIE_COST,
+                 fps_only: bool = False,
+                 apply: Optional[Callable[[int, Level], None]] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.high = high_ms / 1e3
+        self.low = low_ms / 1e3
+        self.quantile = quantile
+        self.period = period
+        self.recover_after = recover_after
+        self.intervals = tuple(intervals)
+        self.shed_share = shed_share
+        self.restore_share = restore_share
+        self.skip_cost = skip_cost
+        self.sgie_cost = sgie_cost
+        self.fps_only = fps_only
+        self.apply = apply
+        self.clock = clock
+        self.streams: Dict[int, _StreamState] = {}
+        self.changes: List[Change] = []
+        self.latency = LatencyHistogram(QUEUE_BUCKETS)
+        self.window = LatencyHistogram(QUEUE_BUCKETS)
+        self.last_quantile = 0.0
+        self.saturated = False
+        self._snapshot: Optional[Tuple[List[int], float]] = None
+        self._last_step: Optional[float] = None
+        self._calm_since: Optional[float] = None
+        self._overloaded = 0
+        self._ceiling = math.inf
+        self._changed_at: Optional[float] = None
+        for policy in policies:
+            self.add(policy)
+
+    def add(self, policy: StreamPolicy) -> None:
+        self.streams[policy.source_id] = _StreamState(
+            policy, ladder(policy, self.intervals, self.fps_only))
+
+    def remove(self, source_id: int) -> None:
+        self.streams.pop(source_id, None)
+
+    def level(self, source_id: int) -> Level:
+        state = self.streams[source_id]
+        return state.steps[state.level]
+
+    # -- measurements ------------------------------------------------------
+
+    def observe(self, latency: float) -> None:
+        """One queue latency in seconds, e.g. buffer time in the inference queue."""
+        self.window.observe(latency)
+        self.latency.observe(latency)
+
+    def observe_histogram(self, hist: LatencyHistogram) -> None:
+        """Take the observations ``hist`` gained since the last call.
+
+        For a histogram that is filled elsewhere, such as
+        ``FrameLatencyTracker.histogram("streammux->pgie")`` or a queue
+        element's :class:`iva.metrics.ElementStats`. Any bucket layout
+        works: each bucket is counted in the :data:`QUEUE_BUCKETS` bucket
+        holding its upper bound, which errs on the slow side. The window
+        max is the upper bound of the slowest bucket that gained
+        observations (``hist.max`` only for its overflow bucket).
+        """
+        counts = list(hist.counts)
+        prev, prev_sum = self._snapshot or ([0] * len(counts), 0.0)
+        if len(prev) != len(counts):
+            prev, prev_sum = [0] * len(counts), 0.0  # a different histogram
+        self._snapshot = (counts, hist.sum)
+        top = 0.0
+        for i, (c, p) in enumerate(zip(counts, prev)):
+            if c <= p:
+                continue
+            bound = hist.buckets[i] if i < len(hist.buckets) else hist.max
+            j = bisect.bisect_left(QUEUE_BUCKETS, bound)
+            for h in (self.window, self.latency):
+                h.counts[j] += c - p
+                h.count += c - p
+            top = min(bound, hist.max) if hist.max else bound
+        added_sum = hist.sum - prev_sum
+        for h in (self.window, self.latency):
+            h.sum += added_sum
+            h.max = max(h.max, top)
+
+    def observe_frame(self, source_id: int) -> None:
+        """A frame of ``source_id`` left the pipeline (for the fps SLA)."""
+        state = self.streams.get(source_id)
+        if state is not None:
+            state.delivered += 1
+            state.window_delivered += 1
+
+    # -- gates -------------------------------------------------------------
+
+    def admit(self, source_id: int) -> bool:
+        """Whether the next decoded frame of ``source_id`` enters the pipeline."""
+        state = self.streams.get(source_id)
+        if state is None:
+            return True
+        # Evenly spaced: keep level.fps out of every policy.fps frames.
+        state.credit += state.steps[state.level].fps / state.policy.fps
+        if state.credit < 1.0 - 1e-9:
+            return False
+        state.credit -= 1.0
+        state.admitted += 1
+        return True
+
+    def infer(self, source_id: int) -> bool:
+        """Whether the last admitted frame is inferred (nvinfer ``interval``)."""
+        state = self.streams.get(source_id)
+        if state is None:
+            return True
+        return (state.admitted - 1) % (state.steps[state.level].interval + 1) == 0
+
+    def classify(self, source_id: int) -> bool:
+        """Whether the SGIEs run on objects of ``source_id``."""
+        state = self.streams.get(source_id)
+        return state is None or state.steps[state.level].sgie
+
+    def drop_probe(self, source_id: int):
+        """Buffer probe for the nvstreammux sink pad of ``source_id``; drops unadmitted frames.
+
+        Needs ``fps_only=True``: the SGIE and interval steps of the full
+        ladder would shed nothing through a probe. Set the mux up with
+        :meth:`mux_properties` so dropped frames do not hold batches back.
+        """
+        if not self.fps_only:
+            raise ValueError("drop_probe needs an OverloadController(fps_only=True)")
+        from gi.repository import Gst
+
+        def probe(pad, info, u_data=None):
+            return Gst.PadProbeReturn.OK if self.admit(source_id) else Gst.PadProbeReturn.DROP
+        return probe
+
+    def mux_properties(self) -> Dict[str, object]:
+        """nvstreammux settings for :meth:`drop_probe`.
+
+        With frames dropped before the mux a batch never fills; a live mux
+        pushes what it has after ``batched-push-timeout``, set here to one
+        frame interval of the fastest stream so shedding costs no latency.
+        """
+        fps = max((st.policy.fps for st in self.streams.values()), default=30.0)
+        return {
+            "live-source": 1,
+            "batch-size": len(self.streams),
+            "batched-push-timeout": int(1e6 / fps),  # microseconds
+        }
+
+    # -- control -----------------------------------------------------------
+
+    def _set(self, state: _StreamState, level: int, now: float, reason: str) -> None:
+        state.level = level
+        self._changed_at = now
+        self.changes.append(Change(state.policy.source_id, now, level, reason))
+        if self.apply is not None:
+            self.apply(state.policy.source_id, state.steps[level])
+
+    def _cost(self, state: _StreamState, level: int) -> float:
+        return state.steps[level].cost(self.skip_cost, self.sgie_cost)
+
+    def _throughput(self) -> Optional[float]:
+        """Work delivered over the last period (``observe_frame``), as :meth:`Level.cost`."""
+        if not any(st.delivered for st in self.streams.values()):
+            return None
+        return sum(st.fps * self._cost(st, st.level) / st.steps[st.level].fps
+                   for st in self.streams.values())
+
+    def _sla_short(self) -> List[int]:
+        return [sid for sid, s in self.streams.items()
+                if s.policy.critical and s.delivered and s.fps < SLA_FPS_SHARE * s.policy.fps]
+
+    def step(self, now: Optional[float] = None) -> List[Change]:
+        """Decide once per ``period``; returns the level changes made."""
+        now = self.clock() if now is None else now
+        if self._last_step is None:
+            self._last_step = now
+            return []
+        elapsed = now - self._last_step
+        if elapsed < self.period:
+            return []
+        self._last_step = now
+        for state in self.streams.values():
+            state.fps = state.window_delivered / elapsed
+            state.window_delivered = 0
+        q = self.window.quantile(self.quantile) if self.window.count else 0.0
+        prev, self.last_quantile = self.last_quantile, q
+        self.window = LatencyHistogram(QUEUE_BUCKETS)
+        made: List[Change] = []
+
+        short = self._sla_short()
+        total = sum(self._cost(st, st.level) for st in self.streams.values())
+        tag = "p%d %.0f ms" % (round(self.quantile * 100), q * 1e3)
+        if q > self.high or (short and q > self.low):
+            self._calm_since = None
+            capacity = self._throughput()
+            if capacity is not None and self._changed_at is not None and \
+                    self._changed_at > now - elapsed - q:
+                # Frames of this period were admitted under older levels;
+                # measure again once they are through.
+                return made
+            if capacity is not None:
+                # While the queue is backed up, delivered work is what the box
+                # can do: shed down to just under it.
+                self._ceiling = capacity
+                amount = total - CEILING_MARGIN * capacity
+                if short and amount <= 0:
+                    amount = self.shed_share * total
+            else:
+                if self._overloaded and q < IMPROVING * prev:
+                    # The last steps are draining the queue; wait for them.
+                    return made
+                # Without delivery counts: shed more the further over
+                # ``high_ms``, twice as much each period it does not improve.
+                self._overloaded += 1
+                amount = self.shed_share * total * (1 + math.log2(max(q / self.high, 1.0))) \
+                    * 2 ** min(self._overloaded - 1, 8)
+                if self._overloaded == 1:
+                    self._ceiling = total
+            reason = tag if q > self.high else "critical %s below fps" % ",".join(map(str, short))
+            saved = 0.0
+            while saved < amount:
+                candidates = [st for st in self.streams.values() if st.level < len(st.steps) - 1]
+                if not candidates:
+                    break
+                # Lowest priority first; among equals the least degraded, so
+                # streams of one priority degrade together.
+                victim = min(candidates, key=lambda st: (st.policy.priority, st.level,
+                                                         st.policy.source_id))
+                saved += self._cost(victim, victim.level) - self._cost(victim, victim.level + 1)
+                self._set(victim, victim.level + 1, now, "shed: " + reason)
+                made.append(self.changes[-1])
+            self.saturated = saved < amount
+            return made
+
+        self.saturated = False
+        self._overloaded = 0
+        if q >= self.low:
+            self._calm_since = None
+            return made
+        if self._calm_since is None:
+            self._calm_since = now
+        if now - self._calm_since < self.recover_after:
+            return made
+        # Calm long enough: give back up to ``restore_share`` of the load per
+        # period, most important streams first, staying under the load that
+        # last caused overload.
+        added = 0.0
+        while True:
+            degraded = [st for st in self.streams.values() if st.level > 0]
+            if not degraded:
+                break
+            best = max(degraded, key=lambda st: (st.policy.priority, st.level,
+                                                 -st.policy.source_id))
+            more = self._cost(best, best.level - 1) - self._cost(best, best.level)
+            if (made and added + more > self.restore_share * total) or \
+                    total + added + more > CEILING_MARGIN * self._ceiling:
+                break
+            added += more
+            self._set(best, best.level - 1, now, "restore: " + tag)
+            made.append(self.changes[-1])
+        if not made and any(st.level for st in self.streams.values()):
+            # Blocked by the ceiling for a whole recovery period: probe higher.
+            self._ceiling *= 1 + self.restore_share
+            self._calm_since = now
+        return made
+
+    def report(self) -> List[Dict[str, object]]:
+        rows = []
+        for sid, s in sorted(self.streams.items()):
+            level = s.steps[s.level]
+            rows.append({"source_id": sid, "qos": s.policy.qos, "priority": s.policy.priority,
+                         "level": s.level, "fps": level.fps, "interval": level.interval,
+                         "sgie": level.sgie, "delivered_fps": round(s.fps, 2)})
+        return rows
+
+
+# -- simulation ------------------------------------------------------------
+
+@dataclass
+class SimResult:
+    """Per-stream outcome of :func:`simulate`."""
+
+    policies: Dict[int, StreamPolicy]
+    seconds: float
+    delivered: Dict[int, int] = field(default_factory=dict)
+    inferred: Dict[int, int] = field(default_factory=dict)
+    classified: Dict[int, int] = field(default_factory=dict)
+    dropped: Dict[int, int] = field(default_factory=dict)
+    latency: Dict[int, LatencyHistogram] = field(default_factory=dict)
+    changes: int = 0
+
+    def rows(self, sla_ms: float) -> List[Dict[str, object]]:
+        span = self.seconds
+        rows = []
+        for sid, p in sorted(self.policies.items()):
+            fps = self.delivered.get(sid, 0) / span
+            p95 = self.latency[sid].quantile(0.95) * 1e3 if sid in self.latency else 0.0
+            row = {"source_id": sid, "qos": p.qos, "fps": round(fps, 2),
+                   "infer_fps": round(self.inferred.get(sid, 0) / span, 2),
+                   "sgie_fps": round(self.classified.get(sid, 0) / span, 2),
+                   "dropped": self.dropped.get(sid, 0), "p95_ms": round(p95, 1)}
+            if p.critical:
+                row["sla_ok"] = fps >= SLA_FPS_SHARE * p.fps and p95 <= sla_ms
+            rows.append(row)
+        return rows
+
+
+def simulate(num_streams: int = 16, num_critical: int = 4, overload: float = 1.5,
+             seconds: float = 60.0, controlled: bool = True, fps: float = 30.0,
+             max_queue: float = 0.3, warmup: float = 10.0, seed: int = 0,
+             **controller_kwargs) -> Tuple[SimResult, Optional[OverloadController]]:
+    """One inference queue shared by all streams, ``overload`` times over capacity.
+
+    Frames cost 1.0 (detector) or 0.1 (skipped by the interval) plus 0.15
+    per object when the SGIEs run; the server works FIFO and, like a
+    ``leaky`` queue, drops frames that would wait more than ``max_queue``
+    seconds. Without the controller every stream loses the same share.
+    Statistics start after ``warmup`` seconds.
+    """
+    rng = random.Random(seed)
+    objects_per_frame = 3.0
+    full = 1.0 + 0.15 * objects_per_frame
+    capacity = num_streams * fps * full / overload
+    policies = {i: StreamPolicy(i, CRITICAL if i < num_critical else BEST_EFFORT, fps,
+                                priority=i % 2)
+                for i in range(num_streams)}
+    sim = {"t": 0.0}
+    controller = OverloadController(policies.values(), clock=lambda: sim["t"],
+                                    **controller_kwargs) if controlled else None
+    result = SimResult(policies, seconds - warmup)
+    for sid in policies:
+        result.latency[sid] = LatencyHistogram(QUEUE_BUCKETS)
+
+    arrivals = [(rng.uniform(0, 1 / fps), sid, 0) for sid in policies]
+    heapq.heapify(arrivals)
+    done: List[Tuple[float, int, float]] = []
+    busy_until = 0.0
+    while arrivals and arrivals[0][0] < seconds:
+        t, sid, num = heapq.heappop(arrivals)
+        heapq.heappush(arrivals, (t + 1 / fps + rng.gauss(0, 1e-4), sid, num + 1))
+        sim["t"] = t
+        # Completions up to now feed the controller, as a sink probe would.
+        while done and done[0][0] <= t:
+            finish, dsid, latency = heapq.heappop(done)
+            if controller is not None:
+                controller.observe(latency)
+                controller.observe_frame(dsid)
+            if finish >= warmup:
+                result.delivered[dsid] = result.delivered.get(dsid, 0) + 1
+                result.latency[dsid].observe(latency)
+        if controller is not None:
+            result.changes += len(controller.step(t))
+            if not controller.admit(sid):
+                continue
+        infer = controller is None or controller.infer(sid)
+        classify = infer and (controller is None or controller.classify(sid))
+        objects = int(rng.expovariate(1.0 / objects_per_frame))
+        work = (1.0 if infer else 0.1) + (0.15 * objects if classify else 0.0)
+        start = max(t, busy_until)
+        if start - t > max_queue:
+            if t >= warmup:
+                result.dropped[sid] = result.dropped.get(sid, 0) + 1
+            continue
+        busy_until = start + work / capacity
+        heapq.heappush(done, (busy_until, sid, busy_until - t))
+        if t >= warmup:
+            result.inferred[sid] = result.inferred.get(sid, 0) + infer
+            result.classified[sid] = result.classified.get(sid, 0) + classify
+    return result, controller
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description="Simulate per-stream QoS load shedding on an overloaded box.")
+    parser.add_argument("--streams", type=int, default=16)
+    parser.add_argument("--critical", type=int, default=4)
+    parser.add_argument("--overload", type=float, default=1.5,
+                        help="offered load relative to capacity")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--high-ms", type=float, default=100.0)
+    parser.add_argument("--low-ms", type=float, default=40.0)
+    parser.add_argument("--sla-ms", type=float, default=200.0)
+    parser.add_argument("--no-control", action="store_true", help="baseline only")
+    parser.add_argument("--fps-only", action="store_true",
+                        help="shed by frame dropping only, as drop_probe does")
+    args = parser.parse_args(argv)
+
+    modes = [False] if args.no_control else [False, True]
+    for controlled in modes:
+        result, controller = simulate(args.streams, args.critical, args.overload, args.seconds,
+                                      controlled, high_ms=args.high_ms, low_ms=args.low_ms,
+                                      fps_only=args.fps_only)
+        rows = result.rows(args.sla_ms)
+        critical = [r for r in rows if r["qos"] == CRITICAL]
+        best = [r for r in rows if r["qos"] == BEST_EFFORT]
+        print(json.dumps({
+            "controller": controlled, "overload": args.overload,
+            "critical_sla_ok": sum(r["sla_ok"] for r in critical), "critical": len(critical),
+            "critical_fps": round(sum(r["fps"] for r in critical) / max(len(critical), 1), 2),
+            "best_effort_fps": round(sum(r["fps"] for r in best) / max(len(best), 1), 2),
+            "changes": result.changes}))
+        for row in rows:
+            print("  " + json.dumps(row))
+        if controller is not None:
+            for row in controller.report():
+                print("  " + json.dumps(row))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,251 @@
+"""Record per-frame detection metadata once, replay it many times.
+
+Re-running ``deepstream-test2-app`` just to regenerate detections spends
+almost all of its time in decode and inference. A recording made with
+:class:`MetaRecorder` (for example from :func:`iva.meta.meta_probe`) can
+be streamed back by :class:`ReplaySource` at real-time, at any multiple of
+real-time, or as fast as the consumers can take it.
+
+The recording is JSON lines, one :meth:`FrameMeta.to_dict` per line after
+a small header line; ``.gz`` paths are compressed transparently.
+"""
+
+import gzip
+import json
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from .meta import FrameMeta
+
+FORMAT_NAME = "iva-meta"
+FORMAT_VERSION = 1
+
+Consumer = Callable[[FrameMeta], object]
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class MetaRecorder:
+    """Append :class:`FrameMeta` records to a recording file.
+
+    Instances are callables so they can be passed straight to
+    :func:`iva.meta.meta_probe` as a consumer.
+    """
+
+    def __init__(self, path: str, **header):
+        self.path = path
+        self.frames = 0
+        self._fp = _open(path, "w")
+        header.update(format=FORMAT_NAME, version=FORMAT_VERSION,
+                      created=time.time())
+        self._fp.write(json.dumps(header) + "\n")
+
+    def write(self, frame: FrameMeta) -> None:
+        self._fp.write(json.dumps(frame.to_dict(), separators=(",", ":")))
+        self._fp.write("\n")
+        self.frames += 1
+
+    __call__ = write
+
+    def close(self) -> None:
+        if not self._fp.closed:
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(path: str) -> dict:
+    with _open(path, "r") as fp:
+        header = json.loads(fp.readline())
+    if header.get("format") != FORMAT_NAME:
+        raise ValueError("%s is not an %s recording" % (path, FORMAT_NAME))
+    if header.get("version", 0) > FORMAT_VERSION:
+        raise ValueError("%s: unsupported recording version %s"
+                         % (path, header.get("version")))
+    return header
+
+
+def read_frames(path: str) -> Iterator[FrameMeta]:
+    """Yield the recorded frames of ``path`` in recording order."""
+    read_header(path)
+    with _open(path, "r") as fp:
+        fp.readline()
+        for line in fp:
+            if line.strip():
+                yield FrameMeta.from_dict(json.loads(line))
+
+
+def frame_time(frame: FrameMeta) -> int:
+    """Timeline used for pacing: capture time if known, else the pts."""
+    return frame.ntp_timestamp or frame.pts
+
+
+@dataclass
+class ReplayStats:
+    frames: int = 0
+    objects: int = 0
+    elapsed: float = 0.0
+    # Recorded timeline covered by the replay, in seconds.
+    media_time: float = 0.0
+    # Largest amount a frame was delivered after its due time, in seconds.
+    max_lag: float = 0.0
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def speedup(self) -> float:
+        """Achieved multiple of real-time."""
+        return self.media_time / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class ReplaySource:
+    """Stream recorded metadata back into probe or broker consumers.
+
+    ``speed`` is the multiple of real-time (``1.0`` real-time, ``100.0``
+    for 100x); ``None`` or ``0`` replays as fast as possible. ``loops``
+    repeats the recording with timestamps and frame numbers shifted forward
+    so downstream consumers see one continuous, monotonic stream.
+    ``preload`` parses the whole recording up front so JSON decoding does
+    not count against the consumers in max-speed runs.
+    """
+
+    def __init__(self, recording: Union[str, Iterable[FrameMeta]],
+                 speed: Optional[float] = 1.0, loops: int = 1,
+                 preload: bool = False,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        if loops < 1:
+            raise ValueError("loops must be >= 1")
+        self._recording = recording
+        self.speed = speed or None
+        self.loops = loops
+        self._clock = clock
+        self._sleep = sleep
+        self._frames: Optional[List[FrameMeta]] = None
+        if preload or loops > 1 or not isinstance(recording, str):
+            self._frames = list(self._load())
+        self.stats = ReplayStats()
+
+    def _load(self) -> Iterable[FrameMeta]:
+        if isinstance(self._recording, str):
+            return read_frames(self._recording)
+        return self._recording
+
+    def _timeline(self) -> Iterator[FrameMeta]:
+        if self._frames is None:
+            yield from self._load()
+            return
+        frames = self._frames
+        if not frames:
+            return
+        times = [frame_time(f) for f in frames]
+        span = max(times) - min(times)
+        # One extra frame interval so loop N+1 starts after loop N ends.
+        span += _frame_interval(frames)
+        last_frame = {}
+        for f in frames:
+            last_frame[f.source_id] = max(last_frame.get(f.source_id, -1),
+                                          f.frame_num)
+        for loop in range(self.loops):
+            if loop == 0:
+                yield from frames
+                continue
+            shift = span * loop
+            for f in frames:
+                yield FrameMeta(
+                    source_id=f.source_id,
+                    frame_num=f.frame_num + (last_frame[f.source_id] + 1) * loop,
+                    pts=f.pts + shift,
+                    ntp_timestamp=f.ntp_timestamp + shift if f.ntp_timestamp else 0,
+                    width=f.width,
+                    height=f.height,
+                    objects=f.objects,
+                )
+
+    def frames(self) -> Iterator[FrameMeta]:
+        """Yield frames paced according to ``speed``, updating :attr:`stats`."""
+        stats = self.stats = ReplayStats()
+        start = self._clock()
+        t0 = None
+        last_t = None
+        for frame in self._timeline():
+            t = frame_time(frame)
+            if t0 is None:
+                t0 = t
+            if self.speed is not None:
+                due = start + (t - t0) / 1e9 / self.speed
+                now = self._clock()
+                if due > now:
+                    self._sleep(due - now)
+                else:
+                    stats.max_lag = max(stats.max_lag, now - due)
+            stats.frames += 1
+            stats.objects += len(frame.objects)
+            last_t = t
+            yield frame
+            stats.elapsed = self._clock() - start
+        if t0 is not None:
+            stats.media_time = (last_t - t0) / 1e9
+        stats.elapsed = self._clock() - start
+
+    def run(self, *consumers: Consumer) -> ReplayStats:
+        """Replay the whole recording into ``consumers`` and return the stats."""
+        for frame in self.frames():
+            for consumer in consumers:
+                consumer(frame)
+        return self.stats
+
+
+def _frame_interval(frames: List[FrameMeta]) -> int:
+    """Median gap between consecutive frames of the same source (ns)."""
+    by_source: Dict[int, List[int]] = {}
+    for f in frames:
+        by_source.setdefault(f.source_id, []).append(frame_time(f))
+    gaps = []
+    for times in by_source.values():
+        times.sort()
+        gaps.extend(b - a for a, b in zip(times, times[1:]) if b > a)
+    return sorted(gaps)[len(gaps) // 2] if gaps else 0
+
+
+def record(frames: Iterable[FrameMeta], path: str, **header) -> int:
+    """Write ``frames`` to ``path``; returns the number of frames written."""
+    with MetaRecorder(path, **header) as recorder:
+        for frame in frames:
+            recorder.write(frame)
+    return recorder.frames
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Replay a metadata recording and report throughput.")
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="multiple of real-time; 0 for max speed")
+    parser.add_argument("--loops", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    source = ReplaySource(args.recording, speed=args.speed, loops=args.loops,
+                          preload=True)
+    stats = source.run()
+    print("frames=%d objects=%d elapsed=%.3fs fps=%.1f speedup=%.1fx"
+          % (stats.frames, stats.objects, stats.elapsed, stats.fps,
+             stats.speedup))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,730 @@
+"""Shard sources across pipeline worker processes and GPUs.
+
+Section 1.3 promises scaling over GPUs and containers, but the lab runs
+one process on GPU 0. :class:`Orchestrator` spreads N sources over K
+workers (one pipeline process per GPU, or simulated workers per CPU):
+
+* placement is longest-processing-time first: streams sorted by cost, each
+  to the worker with the lowest resulting load relative to its capacity;
+* stream cost is measured, not assumed – workers report how busy they are
+  and how many frames and objects each stream produced, and the busy time
+  is split over streams by that work (an EWMA smooths it);
+* a worker above ``saturation`` gives up the stream that best brings it
+  back under ``target`` to the least loaded worker, as long as that worker
+  stays unsaturated or the move lowers the higher of the two loads, with
+  a per-stream ``cooldown`` so streams do not bounce;
+* metadata from all workers is merged by :class:`OrderedMerger` into one
+  stream ordered by capture time, using per-input watermarks.
+
+Workers speak one protocol over multiprocessing queues (``assign`` /
+``stop`` in, ``frame`` / ``stats`` out). :class:`ProcessWorker` runs either
+:func:`pipeline_worker` (a headless :class:`iva.pipeline.PipelineBuilder`
+pipeline pinned with ``CUDA_VISIBLE_DEVICES``) or :func:`simulated_worker`;
+:class:`SimulatedWorker` runs the same simulation in-process on a manual
+clock for tests.
+"""
+
+import heapq
+import itertools
+import multiprocessing
+import os
+import queue
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from .meta import FrameMeta, ObjectMeta
+from .replay import frame_time
+
+NS = 10**9
+
+# Below any timestamp: the watermark of an input that has reported nothing.
+NO_WATERMARK = -(1 << 63)
+
+# Work units of one object relative to one frame, when splitting busy time.
+OBJECT_WEIGHT = 0.05
+
+
+@dataclass
+class StreamSpec:
+    source_id: int
+    location: str = ""
+    fps: float = 30.0
+    cost: float = 0.1  # fraction of one worker at ``fps``; measured once running
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"source_id": self.source_id, "location": self.location,
+                "fps": self.fps, "cost": self.cost}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, object]) -> "StreamSpec":
+        return cls(int(d["source_id"]), str(d.get("location", "")),
+                   float(d.get("fps", 30.0)), float(d.get("cost", 0.1)))
+
+
+@dataclass
+class WorkerStats:
+    """One report: busy fraction and per-stream work over ``elapsed`` seconds."""
+
+    worker_id: int
+    busy: float
+    elapsed: float
+    frames: Dict[int, int] = field(default_factory=dict)
+    objects: Dict[int, int] = field(default_factory=dict)
+    watermark: int = 0
+
+    def to_dict(self) -> Dict[str, object]:
+        return {"worker_id": self.worker_id, "busy": self.busy, "elapsed": self.elapsed,
+                "frames": self.frames, "objects": self.objects, "watermark": self.watermark}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, object]) -> "WorkerStats":
+        return cls(int(d["worker_id"]), float(d["busy"]), float(d["elapsed"]),
+                   {int(k): int(v) for k, v in d["frames"].items()},
+                   {int(k): int(v) for k, v in d["objects"].items()},
+                   int(d.get("watermark", 0)))
+
+
+# -- ordered merge ---------------------------------------------------------
+
+class OrderedMerger:
+    """Merge per-input streams into one stream ordered by ``key``.
+
+    Each input's watermark is what it reports through :meth:`advance` or,
+    with ``lateness_ns`` set, the newest key it pushed minus that; items at
+    or below the minimum watermark of all active inputs are
+    released. An input silent for ``idle_timeout`` seconds stops holding
+    the others back. Items older than what was already released are late:
+    they are counted and handed to ``on_late`` instead.
+    """
+
+    def __init__(self, key: Callable[[object], int] = frame_time,
+                 lateness_ns: Optional[int] = None,
+                 idle_timeout: float = 2.0, clock: Callable[[], float] = time.monotonic,
+                 on_late: Optional[Callable[[object], None]] = None):
+        self.key = key
+        self.lateness_ns = lateness_ns
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.on_late = on_late
+        self._heap: List[Tuple[int, int, object]] = []
+        self._seq = itertools.count()
+        self._watermarks: Dict[Hashable, int] = {}
+        self._active: Dict[Hashable, float] = {}
+        self.released_until = NO_WATERMARK
+        self.released = 0
+        self.late = 0
+
+    def add_input(self, input_id: Hashable) -> None:
+        self._watermarks.setdefault(input_id, NO_WATERMARK)
+        self._active[input_id] = self.clock()
+
+    def remove_input(self, input_id: Hashable) -> None:
+        self._watermarks.pop(input_id, None)
+        self._active.pop(input_id, None)
+
+    def push(self, input_id: Hashable, item, t: Optional[int] = None) -> None:
+        if t is None:
+            t = self.key(item)
+        if t < self.released_until:
+            self.late += 1
+            if self.on_late is not None:
+                self.on_late(item)
+            return
+        heapq.heappush(self._heap, (t, next(self._seq), item))
+        if self.lateness_ns is not None:
+            wm = t - self.lateness_ns
+            if wm > self._watermarks.get(input_id, NO_WATERMARK):
+                self._watermarks[input_id] = wm
+        self._active[input_id] = self.clock()
+
+    def advance(self, input_id: Hashable, watermark: int) -> None:
+        """The input promises nothing older than ``watermark`` will follow."""
+        if watermark > self._watermarks.get(input_id, NO_WATERMARK):
+            self._watermarks[input_id] = watermark
+        self._active[input_id] = self.clock()
+
+    def watermark(self) -> Optional[int]:
+        now = self.clock()
+        active = [self._watermarks[i] for i, seen in self._active.items()
+                  if now - seen < self.idle_timeout]
+        if not active:
+            return None
+        return min(active)
+
+    def pop_ready(self) -> List[object]:
+        wm = self.watermark()
+        if wm is None:
+            # Every input is idle: nothing will arrive to reorder against.
+            return self.flush()
+        out = []
+        heap = self._heap
+        while heap and heap[0][0] <= wm:
+            t, _, item = heapq.heappop(heap)
+            out.append(item)
+        if out:
+            self.released_until = max(self.released_until, t)
+            self.released += len(out)
+        return out
+
+    def flush(self) -> List[object]:
+        out = []
+        heap = self._heap
+        while heap:
+            t, _, item = heapq.heappop(heap)
+            out.append(item)
+            self.released_until = max(self.released_until, t)
+        self.released += len(out)
+        return out
+
+    @property
+    def pending(self) -> int:
+        return len(self._heap)
+
+
+# -- simulated workload ----------------------------------------------------
+
+class SimulatedEngine:
+    """Frames and busy time of a worker running ``streams``.
+
+    ``true_costs`` is each source's real cost (fraction of one worker at
+    its fps); the engine saturates when their sum exceeds ``capacity``
+    and then slows every stream down proportionally, like a GPU would.
+    Frames carry capture time minus a random output delay up to
+    ``max_delay`` seconds, so merged outputs need reordering.
+    """
+
+    def __init__(self, worker_id: int, capacity: float = 1.0,
+                 true_costs: Optional[Dict[int, float]] = None,
+                 objects_per_frame: float = 3.0, max_delay: float = 0.2, seed: int = 0):
+        self.worker_id = worker_id
+        self.capacity = capacity
+        self.true_costs = true_costs or {}
+        self.objects_per_frame = objects_per_frame
+        self.max_delay = max_delay
+        self.rng = random.Random(seed * 1000 + worker_id)
+        self.streams: Dict[int, StreamSpec] = {}
+        self._due: Dict[int, float] = {}
+        self._frame_num: Dict[int, int] = {}
+
+    def assign(self, streams: Sequence[StreamSpec]) -> None:
+        self.streams = {s.source_id: s for s in streams}
+        self._due = {sid: self._due.get(sid, 0.0) for sid in self.streams}
+
+    def load(self) -> float:
+        return sum(self.true_costs.get(sid, s.cost) for sid, s in self.streams.items()) / self.capacity
+
+    def tick(self, now_ns: int, dt: float) -> Tuple[List[FrameMeta], WorkerStats]:
+        load = self.load()
+        slowdown = max(1.0, load)
+        frames: List[FrameMeta] = []
+        stats = WorkerStats(self.worker_id, busy=min(1.0, load), elapsed=dt)
+        for sid, spec in self.streams.items():
+            self._due[sid] += dt * spec.fps / slowdown
+            n = int(self._due[sid])
+            self._due[sid] -= n
+            stats.frames[sid] = n
+            stats.objects[sid] = 0
+            for k in range(n):
+                num = self._frame_num.get(sid, 0)
+                self._frame_num[sid] = num + 1
+                captured = now_ns - int((n - k) * NS / spec.fps) - int(
+                    self.rng.uniform(0, self.max_delay) * NS)
+                count = int(self.rng.expovariate(1.0 / self.objects_per_frame)) \
+                    if self.objects_per_frame else 0
+                objects = [ObjectMeta(self.rng.randrange(4), 100.0, 100.0, 50.0, 50.0, 0.9, i)
+                           for i in range(count)]
+                stats.objects[sid] += count
+                frames.append(FrameMeta(sid, num, int(num * NS / spec.fps), captured,
+                                        1280, 720, objects))
+        frames.sort(key=frame_time)
+        stats.watermark = now_ns - int(self.max_delay * NS) - int(NS / 5)
+        return frames, stats
+
+
+class Worker:
+    """Interface shared by in-process and process workers."""
+
+    worker_id: int
+    capacity: float
+
+    def assign(self, streams: Sequence[StreamSpec]) -> None:
+        raise NotImplementedError
+
+    def poll(self) -> Tuple[List[FrameMeta], List[WorkerStats]]:
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        pass
+
+
+class SimulatedWorker(Worker):
+    """In-process simulated worker on the orchestrator's clock.
+
+    Call :meth:`advance` to move simulated time; :meth:`poll` returns what
+    was produced since the last poll.
+    """
+
+    def __init__(self, worker_id: int, capacity: float = 1.0,
+                 true_costs: Optional[Dict[int, float]] = None, **engine_kwargs):
+        self.worker_id = worker_id
+        self.capacity = capacity
+        self.engine = SimulatedEngine(worker_id, capacity, true_costs, **engine_kwargs)
+        self._frames: List[FrameMeta] = []
+        self._stats: List[WorkerStats] = []
+
+    def assign(self, streams: Sequence[StreamSpec]) -> None:
+        self.engine.assign(streams)
+
+    def advance(self, now_ns: int, dt: float) -> None:
+        frames, stats = self.engine.tick(now_ns, dt)
+        self._frames.extend(frames)
+        self._stats.append(stats)
+
+    def poll(self) -> Tuple[List[FrameMeta], List[WorkerStats]]:
+        frames, stats = self._frames, self._stats
+        self._frames, self._stats = [], []
+        return frames, stats
+
+
+def simulated_worker(worker_id: int, gpu_id: Optional[int], ctrl, out,
+                     options: Dict[str, object]) -> None:
+    """Child process body running a :class:`SimulatedEngine` in real time."""
+    engine = SimulatedEngine(worker_id, float(options.get("capacity", 1.0)),
+                             options.get("true_costs"), seed=int(options.get("seed", 0)))
+    interval = float(options.get("report_interval", 0.5))
+    last = time.monotonic()
+    while True:
+        try:
+            cmd, arg = ctrl.get(timeout=interval)
+        except queue.Empty:
+            cmd = None
+        if cmd == "stop":
+            return
+        if cmd == "assign":
+            engine.assign([StreamSpec.from_dict(d) for d in arg])
+        now = time.monotonic()
+        frames, stats = engine.tick(time.time_ns(), now - last)
+        last = now
+        for frame in frames:
+            out.put(("frame", worker_id, frame.to_dict()))
+        out.put(("stats", worker_id, stats.to_dict()))
+
+
+def pipeline_worker(worker_id: int, gpu_id: Optional[int], ctrl, out,
+                    options: Dict[str, object]) -> None:
+    """Child process body running a headless DeepStream pipeline.
+
+    The pipeline is built once, from the first non-empty ``assign``; later
+    assigns only add or remove the source bins of migrated streams on a
+    running nvstreammux, as in DeepStream's runtime source add/delete
+    sample, so the other streams keep flowing. Busy time is the time
+    buffers spend in the primary nvinfer (only the PGIE is instrumented:
+    nvinfer elements run concurrently, so their latencies do not add up
+    to busy time).
+    """
+    if gpu_id is not None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(gpu_id)
+    import gi
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst
+
+    from .meta import meta_probe
+    from .metrics import MetricsRegistry, instrument_element
+    from .pipeline import OUTPUT_HEADLESS, PipelineBuilder
+
+    Gst.init(None)
+    interval = float(options.get("report_interval", 1.0))
+    pipeline = None
+    registry = MetricsRegistry()
+    # source_id -> (source bin, mux sink pad, mux pad index)
+    bins: Dict[int, Tuple[object, object, int]] = {}
+    pad_source: Dict[int, int] = {}
+    counts: Dict[int, List[int]] = {}
+
+    def on_frame(frame: FrameMeta) -> None:
+        sid = pad_source.get(frame.source_id)
+        if sid is None:
+            return  # a frame of a source removed since it was batched
+        frame.source_id = sid
+        frame.ntp_timestamp = frame.ntp_timestamp or time.time_ns()
+        c = counts.setdefault(sid, [0, 0])
+        c[0] += 1
+        c[1] += len(frame.objects)
+        out.put(("frame", worker_id, frame.to_dict()))
+
+    def add_source(spec: StreamSpec) -> None:
+        index = min(set(range(len(bins) + 1)) - {i for _, _, i in bins.values()})
+        source_bin = Gst.parse_bin_from_description(
+            PipelineBuilder.source_description(spec.location), True)
+        source_bin.set_name("source%d" % spec.source_id)
+        pipeline.add(source_bin)
+        mux_pad = pipeline.get_by_name("mux").get_request_pad("sink_%d" % index)
+        source_bin.get_static_pad("src").link(mux_pad)
+        bins[spec.source_id] = (source_bin, mux_pad, index)
+        pad_source[index] = spec.source_id
+        source_bin.sync_state_with_parent()
+
+    def remove_source(source_id: int) -> None:
+        source_bin, mux_pad, index = bins.pop(source_id)
+        pad_source.pop(index, None)
+        source_bin.set_state(Gst.State.NULL)
+        mux_pad.send_event(Gst.Event.new_flush_stop(False))
+        pipeline.get_by_name("mux").release_request_pad(mux_pad)
+        pipeline.remove(source_bin)
+
+    last = time.monotonic()
+    busy_before = 0.0
+    while True:
+        try:
+            cmd, arg = ctrl.get(timeout=interval)
+        except queue.Empty:
+            cmd = None
+        if cmd == "stop":
+            if pipeline is not None:
+                pipeline.set_state(Gst.State.NULL)
+            return
+        if cmd == "assign":
+            streams = {s.source_id: s for s in map(StreamSpec.from_dict, arg)}
+            if pipeline is None and streams:
+                builder = PipelineBuilder(
+                    sources=[s.location for s in streams.values()],
+                    pgie_config=options.get("pgie_config"),
+                    sgie_configs=options.get("sgie_configs", ()),
+                    tracker=options.get("tracker"), output=OUTPUT_HEADLESS)
+                pipeline = Gst.parse_launch(builder.describe(with_sources=False))
+                pgie = pipeline.get_by_name("pgie")
+                if pgie is not None:
+                    instrument_element(pgie, registry)
+                for sink in pipeline.iterate_sinks():
+                    sink.get_static_pad("sink").add_probe(
+                        Gst.PadProbeType.BUFFER, meta_probe(on_frame))
+                for spec in streams.values():
+                    add_source(spec)
+                pipeline.set_state(Gst.State.PLAYING)
+            elif pipeline is not None:
+                for sid in [sid for sid in bins if sid not in streams]:
+                    remove_source(sid)
+                for sid, spec in streams.items():
+                    if sid not in bins:
+                        add_source(spec)
+                if streams:
+                    pipeline.get_by_name("mux").set_property("batch-size", len(streams))
+        now = time.monotonic()
+        elapsed, last = now - last, now
+        busy_total = sum(e.latency.sum for e in registry.elements.values())
+        stats = WorkerStats(worker_id, min(1.0, (busy_total - busy_before) / max(elapsed, 1e-9)),
+                            elapsed, {sid: c[0] for sid, c in counts.items()},
+                            {sid: c[1] for sid, c in counts.items()},
+                            time.time_ns() - int(options.get("max_delay", 1.0) * NS))
+        busy_before = busy_total
+        counts.clear()
+        out.put(("stats", worker_id, stats.to_dict()))
+
+
+class ProcessWorker(Worker):
+    """A worker process (``target`` is :func:`pipeline_worker` or :func:`simulated_worker`)."""
+
+    def __init__(self, worker_id: int, out: "multiprocessing.Queue", gpu_id: Optional[int] = None,
+                 capacity: float = 1.0, target: Callable = simulated_worker, **options):
+        self.worker_id = worker_id
+        self.gpu_id = gpu_id
+        self.capacity = capacity
+        self._ctrl = multiprocessing.Queue()
+        options.setdefault("capacity", capacity)
+        self._process = multiprocessing.Process(
+            target=target, args=(worker_id, gpu_id, self._ctrl, out, options),
+            name="iva-worker-%d" % worker_id, daemon=True)
+        self._process.start()
+
+    def assign(self, streams: Sequence[StreamSpec]) -> None:
+        self._ctrl.put(("assign", [s.to_dict() for s in streams]))
+
+    def poll(self) -> Tuple[List[FrameMeta], List[WorkerStats]]:
+        return [], []  # outputs arrive on the shared queue, see ProcessPool
+
+    def stop(self) -> None:
+        self._ctrl.put(("stop", None))
+        self._process.join(timeout=5.0)
+        if self._process.is_alive():
+            self._process.terminate()
+
+
+class ProcessPool:
+    """Worker processes sharing one output queue, one per GPU or CPU."""
+
+    def __init__(self, count: int, target: Callable = simulated_worker,
+                 gpu_ids: Optional[Sequence[int]] = None, **options):
+        self.out = multiprocessing.Queue()
+        self.workers = [
+            ProcessWorker(i, self.out, gpu_ids[i] if gpu_ids else None, target=target,
+                          **options)
+            for i in range(count)]
+
+    def drain(self, max_items: int = 100000) -> Tuple[List[Tuple[int, FrameMeta]],
+                                                       List[WorkerStats]]:
+        frames, stats = [], []
+        for _ in range(max_items):
+            try:
+                kind, worker_id, payload = self.out.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "frame":
+                frames.append((worker_id, FrameMeta.from_dict(payload)))
+            else:
+                stats.append(WorkerStats.from_dict(payload))
+        return frames, stats
+
+    def stop(self) -> None:
+        for w in self.workers:
+            w.stop()
+
+
+# -- orchestration ---------------------------------------------------------
+
+@dataclass
+class Migration:
+    source_id: int
+    src: int
+    dst: int
+    at: float
+    reason: str
+
+
+class Orchestrator:
+    """Place streams on workers, track their cost, migrate, merge outputs."""
+
+    def __init__(self, workers: Sequence[Worker], saturation: float = 0.9,
+                 target: float = 0.75, cost_alpha: float = 0.3, cooldown: float = 10.0,
+                 lateness_ns: Optional[int] = None, idle_timeout: float = 2.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.workers: Dict[int, Worker] = {w.worker_id: w for w in workers}
+        self.saturation = saturation
+        self.target = target
+        self.cost_alpha = cost_alpha
+        self.cooldown = cooldown
+        self.clock = clock
+        self.streams: Dict[int, StreamSpec] = {}
+        self.placement: Dict[int, int] = {}
+        self.busy: Dict[int, float] = {w: 0.0 for w in self.workers}
+        self.migrations: List[Migration] = []
+        self._moved_at: Dict[int, float] = {}
+        self._measured = set()
+        self.merger = OrderedMerger(lateness_ns=lateness_ns, idle_timeout=idle_timeout,
+                                    clock=clock)
+        for wid in self.workers:
+            self.merger.add_input(wid)
+
+    # placement
+    def load(self, worker_id: int) -> float:
+        """Estimated load from measured stream costs, relative to capacity."""
+        total = sum(self.streams[s].cost for s, w in self.placement.items() if w == worker_id)
+        return total / self.workers[worker_id].capacity
+
+    def assigned(self, worker_id: int) -> List[StreamSpec]:
+        return [self.streams[s] for s, w in sorted(self.placement.items()) if w == worker_id]
+
+    def place(self, streams: Sequence[StreamSpec]) -> Dict[int, int]:
+        """LPT placement of new streams; returns source_id -> worker_id."""
+        touched = set()
+        for spec in sorted(streams, key=lambda s: -s.cost):
+            self.streams[spec.source_id] = spec
+            wid = min(self.workers, key=lambda w: (
+                self.load(w) + spec.cost / self.workers[w].capacity, w))
+            self.placement[spec.source_id] = wid
+            touched.add(wid)
+        for wid in touched:
+            self.workers[wid].assign(self.assigned(wid))
+        return dict(self.placement)
+
+    def remove(self, source_id: int) -> None:
+        wid = self.placement.pop(source_id, None)
+        self.streams.pop(source_id, None)
+        self._measured.discard(source_id)
+        if wid is not None:
+            self.workers[wid].assign(self.assigned(wid))
+
+    # measurement
+    def observe(self, stats: WorkerStats) -> None:
+        """Fold a worker report into the per-stream cost estimates."""
+        self.busy[stats.worker_id] = stats.busy
+        work = {sid: n + OBJECT_WEIGHT * stats.objects.get(sid, 0)
+                for sid, n in stats.frames.items() if self.placement.get(sid) == stats.worker_id}
+        total = sum(work.values())
+        if total <= 0 or stats.elapsed <= 0:
+            return
+        capacity = self.workers[stats.worker_id].capacity
+        for sid, w in work.items():
+            spec = self.streams[sid]
+            achieved = stats.frames[sid] / stats.elapsed
+            if achieved <= 0:
+                continue
+            # Busy share at the achieved rate, scaled up to the nominal fps.
+            cost = stats.busy * capacity * (w / total) * (spec.fps / achieved)
+            if sid in self._measured:
+                spec.cost += self.cost_alpha * (cost - spec.cost)
+            else:
+                # The first measurement replaces the placement guess outright,
+                # so rebalancing never acts on a half-updated estimate.
+                spec.cost = cost
+                self._measured.add(sid)
+        if stats.watermark:
+            self.merger.advance(stats.worker_id, stats.watermark)
+
+    def rebalance(self) -> List[Migration]:
+        now = self.clock()
+        moves = []
+        for wid in sorted(self.workers, key=lambda w: -self.busy[w]):
+            if self.busy[wid] < self.saturation and self.load(wid) < self.saturation:
+                continue
+            cap = self.workers[wid].capacity
+            excess = self.load(wid) - self.target
+            candidates = [s for s in self.assigned(wid)
+                          if now - self._moved_at.get(s.source_id, -1e18) >= self.cooldown]
+            if len(self.assigned(wid)) < 2 or not candidates:
+                continue
+            # The stream whose cost best matches the excess, smallest first on ties.
+            candidates.sort(key=lambda s: (abs(s.cost / cap - excess), s.cost))
+            for spec in candidates:
+                dst = min((w for w in self.workers if w != wid),
+                          key=lambda w: self.load(w) + spec.cost / self.workers[w].capacity,
+                          default=None)
+                if dst is None:
+                    break
+                src_after = self.load(wid) - spec.cost / cap
+                dst_after = self.load(dst) + spec.cost / self.workers[dst].capacity
+                # Take the move if the destination stays unsaturated, or if it
+                # at least lowers the higher of the two loads: when every
+                # worker is near its limit that is still relief.
+                if dst_after >= self.saturation and max(src_after, dst_after) >= self.load(wid):
+                    continue
+                self.placement[spec.source_id] = dst
+                self._moved_at[spec.source_id] = now
+                self.workers[wid].assign(self.assigned(wid))
+                self.workers[dst].assign(self.assigned(dst))
+                move = Migration(spec.source_id, wid, dst, now,
+                                 "busy %.2f load %.2f" % (self.busy[wid], self.load(wid)))
+                self.migrations.append(move)
+                moves.append(move)
+                self.busy[wid] = 0.0  # wait for a fresh report before moving more
+                break
+        return moves
+
+    # outputs
+    def ingest(self, worker_id: int, frames: Sequence[FrameMeta]) -> None:
+        for frame in frames:
+            self.merger.push(worker_id, frame)
+
+    def step(self) -> List[FrameMeta]:
+        """Poll in-process workers, update costs, rebalance; return ordered output."""
+        for wid, worker in self.workers.items():
+            frames, stats = worker.poll()
+            self.ingest(wid, frames)
+            for s in stats:
+                self.observe(s)
+        self.rebalance()
+        return self.merger.pop_ready()
+
+    def step_pool(self, pool: ProcessPool) -> List[FrameMeta]:
+        """Same as :meth:`step` for workers in a :class:`ProcessPool`."""
+        frames, stats = pool.drain()
+        for wid, frame in frames:
+            self.merger.push(wid, frame)
+        for s in stats:
+            self.observe(s)
+        self.rebalance()
+        return self.merger.pop_ready()
+
+    def report(self) -> List[Dict[str, object]]:
+        return [{"worker_id": wid, "capacity": w.capacity, "busy": round(self.busy[wid], 3),
+                 "load": round(self.load(wid), 3),
+                 "streams": [s.source_id for s in self.assigned(wid)]}
+                for wid, w in sorted(self.workers.items())]
+
+
+def simulate(num_streams: int = 12, num_workers: int = 3, seconds: float = 60.0,
+             dt: float = 0.5, seed: int = 0) -> Tuple[Orchestrator, Dict[str, int]]:
+    """Run the orchestrator against :class:`SimulatedWorker` instances.
+
+    Streams start with a uniform cost guess; their true costs vary by up
+    to 4x, so the initial placement can be unbalanced. Once measurements
+    arrive, workers that end up past ``saturation`` shed streams; a
+    placement that happens to stay under it is left alone.
+    """
+    rng = random.Random(seed)
+    true_costs = {i: rng.uniform(0.05, 0.45) * num_workers * 3 / num_streams
+                  for i in range(num_streams)}
+    sim = {"t": 0.0}
+    clock = lambda: sim["t"]  # noqa: E731
+    workers = [SimulatedWorker(w, 1.0, true_costs, seed=seed) for w in range(num_workers)]
+    orch = Orchestrator(workers, clock=clock, cooldown=5.0)
+    orch.place([StreamSpec(i, cost=0.1) for i in range(num_streams)])
+    out_of_order = 0
+    last = NO_WATERMARK
+    emitted = 0
+    while sim["t"] < seconds:
+        sim["t"] += dt
+        now_ns = int(sim["t"] * NS)
+        for w in workers:
+            w.advance(now_ns, dt)
+        for frame in orch.step():
+            t = frame_time(frame)
+            out_of_order += t < last
+            last = max(last, t)
+            emitted += 1
+    return orch, {"emitted": emitted, "out_of_order": out_of_order,
+                  "late": orch.merger.late, "migrations": len(orch.migrations)}
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Shard streams over simulated (or real pipeline) workers.")
+    parser.add_argument("--streams", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--processes", action="store_true",
+                        help="run simulated workers as separate processes in real time")
+    parser.add_argument("--pgie", help="run real pipelines with this primary config")
+    parser.add_argument("--gpus", type=int, nargs="*", help="GPU id per worker")
+    parser.add_argument("sources", nargs="*", help="stream locations for --pgie")
+    args = parser.parse_args(argv)
+
+    if not args.processes and not args.pgie:
+        orch, summary = simulate(args.streams, args.workers, args.seconds)
+        for row in orch.report():
+            print(row)
+        for m in orch.migrations:
+            print("t=%6.1fs move source %d: worker %d -> %d (%s)" % (m.at, m.source_id, m.src,
+                                                                      m.dst, m.reason))
+        print(summary)
+        return 0
+
+    if args.pgie:
+        pool = ProcessPool(args.workers, pipeline_worker, args.gpus, pgie_config=args.pgie)
+        specs = [StreamSpec(i, loc) for i, loc in enumerate(args.sources)]
+    else:
+        rng = random.Random(0)
+        costs = {i: rng.uniform(0.05, 0.3) for i in range(args.streams)}
+        pool = ProcessPool(args.workers, simulated_worker, true_costs=costs)
+        specs = [StreamSpec(i) for i in range(args.streams)]
+    orch = Orchestrator(pool.workers)
+    orch.place(specs)
+    emitted = 0
+    deadline = time.monotonic() + args.seconds
+    try:
+        while time.monotonic() < deadline:
+            emitted += len(orch.step_pool(pool))
+            time.sleep(0.1)
+    finally:
+        pool.stop()
+    for row in orch.report():
+        print(row)
+    print("emitted=%d late=%d migrations=%d" % (emitted, orch.merger.late, len(orch.migrations)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
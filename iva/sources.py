@@ -0,0 +1,543 @@
+"""Live IP camera sources with reconnect, jitter sizing and health metrics.
+
+The lab only reads files; live cameras disconnect, stall and flap.
+:class:`SourceManager` runs every camera in its own :class:`LiveSource`
+thread, so one bad camera never blocks the others:
+
+* a lost or stalled connection (no frame for ``stall_timeout``) is closed
+  and reopened after an exponential :class:`Backoff` with jitter;
+* arrival times are compared against pts to estimate network jitter
+  (RFC 3550 style, :class:`JitterEstimator`), and every reconnect opens the
+  stream with a jitter-buffer latency sized from that estimate;
+* :class:`SourceHealth` counts frames, reconnects, errors, fps and jitter;
+* :meth:`SourceManager.next_batch` assembles batches from whichever
+  sources have frames and returns after ``batch_timeout`` even when a
+  source is down – the same contract as nvstreammux with ``live-source=1``
+  and ``batched-push-timeout`` (see :meth:`SourceManager.mux_properties`).
+
+Connectors open the actual stream: :class:`GstRtspConnector` pulls H.264
+access units from ``rtspsrc`` through an appsink; :class:`SocketConnector`
+reads the simple framed TCP protocol served by
+:class:`LoopbackCameraServer`, a local stand-in camera that can be made
+to drop clients or stall on demand.
+"""
+
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+NS = 10**9
+
+STATE_CONNECTING = "connecting"
+STATE_PLAYING = "playing"
+STATE_BACKOFF = "backoff"
+STATE_STOPPED = "stopped"
+
+Frame = Tuple[int, bytes]  # (pts ns, access unit)
+
+
+class Backoff:
+    """Exponential backoff with full-range jitter, capped at ``maximum``."""
+
+    def __init__(self, initial: float = 0.5, factor: float = 2.0,
+                 maximum: float = 30.0, jitter: float = 0.2,
+                 rng: Optional[random.Random] = None):
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+        self._rng = rng or random.Random()
+        self.attempt = 0
+
+    def next_delay(self) -> float:
+        base = min(self.maximum, self.initial * self.factor ** self.attempt)
+        self.attempt += 1
+        spread = base * self.jitter
+        return max(0.0, base + self._rng.uniform(-spread, spread))
+
+    def reset(self) -> None:
+        self.attempt = 0
+
+
+class JitterEstimator:
+    """Interarrival jitter: ``J += (|D| - J) / 16`` as in RFC 3550."""
+
+    def __init__(self):
+        self.jitter_ns = 0.0
+        self.samples = 0
+        self._prev: Optional[Tuple[int, int]] = None
+
+    def update(self, pts: int, arrival_ns: int) -> None:
+        if self._prev is not None:
+            prev_pts, prev_arrival = self._prev
+            d = (arrival_ns - prev_arrival) - (pts - prev_pts)
+            self.jitter_ns += (abs(d) - self.jitter_ns) / 16.0
+            self.samples += 1
+        self._prev = (pts, arrival_ns)
+
+    def reset_stream(self) -> None:
+        """Forget the last packet (pts restarts after a reconnect)."""
+        self._prev = None
+
+    def recommended_latency_ms(self, k: float = 4.0, floor_ms: int = 50,
+                               ceiling_ms: int = 2000) -> int:
+        """Jitter-buffer latency covering ``k`` times the measured jitter."""
+        return int(min(ceiling_ms, max(floor_ms, k * self.jitter_ns / 1e6)))
+
+
+@dataclass
+class SourceHealth:
+    source_id: int
+    uri: str
+    state: str = STATE_CONNECTING
+    frames: int = 0
+    dropped: int = 0
+    connects: int = 0
+    reconnects: int = 0
+    errors: int = 0
+    last_error: str = ""
+    last_frame: float = 0.0
+    connected_since: float = 0.0
+    jitter_ms: float = 0.0
+    latency_ms: int = 0
+    _recent: Deque[float] = field(default_factory=lambda: deque(maxlen=60), repr=False)
+
+    @property
+    def fps(self) -> float:
+        if len(self._recent) < 2:
+            return 0.0
+        span = self._recent[-1] - self._recent[0]
+        return (len(self._recent) - 1) / span if span > 0 else 0.0
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "source_id": self.source_id, "uri": self.uri, "state": self.state,
+            "frames": self.frames, "dropped": self.dropped,
+            "connects": self.connects, "reconnects": self.reconnects,
+            "errors": self.errors, "last_error": self.last_error,
+            "fps": round(self.fps, 2), "jitter_ms": round(self.jitter_ms, 2),
+            "latency_ms": self.latency_ms,
+            "seconds_since_frame": (round(time.monotonic() - self.last_frame, 3)
+                                    if self.last_frame else None),
+        }
+
+
+# -- connectors ------------------------------------------------------------
+
+class Session:
+    def read(self, timeout: float) -> Optional[Frame]:
+        """Next frame, None on timeout; raises ``ConnectionError`` when lost."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        raise NotImplementedError
+
+
+class Connector:
+    def open(self, uri: str, latency_ms: int) -> Session:
+        raise NotImplementedError
+
+
+class GstRtspConnector(Connector):
+    """``rtspsrc ! rtph264depay ! h264parse ! appsink`` per session."""
+
+    def __init__(self, protocols: str = "tcp"):
+        import gi
+        gi.require_version("Gst", "1.0")
+        from gi.repository import Gst
+
+        Gst.init(None)
+        self._Gst = Gst
+        self.protocols = protocols
+
+    def open(self, uri: str, latency_ms: int) -> Session:
+        Gst = self._Gst
+        pipeline = Gst.parse_launch(
+            'rtspsrc location="%s" latency=%d protocols=%s ! rtph264depay ! '
+            'h264parse config-interval=-1 ! video/x-h264,stream-format=byte-stream,alignment=au ! '
+            'appsink name=sink sync=false max-buffers=8 drop=true'
+            % (uri, latency_ms, self.protocols))
+        if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            pipeline.set_state(Gst.State.NULL)
+            raise ConnectionError("cannot start %s" % uri)
+        return _GstSession(Gst, pipeline)
+
+
+class _GstSession(Session):
+    def __init__(self, Gst, pipeline):
+        self._Gst = Gst
+        self._pipeline = pipeline
+        self._sink = pipeline.get_by_name("sink")
+        self._bus = pipeline.get_bus()
+
+    def read(self, timeout: float) -> Optional[Frame]:
+        Gst = self._Gst
+        msg = self._bus.pop_filtered(Gst.MessageType.ERROR | Gst.MessageType.EOS)
+        if msg is not None:
+            if msg.type == Gst.MessageType.ERROR:
+                err, _ = msg.parse_error()
+                raise ConnectionError(err.message)
+            raise ConnectionError("end of stream")
+        sample = self._sink.emit("try-pull-sample", int(timeout * Gst.SECOND))
+        if sample is None:
+            return None
+        buf = sample.get_buffer()
+        ok, info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return None
+        try:
+            return buf.pts, bytes(info.data)
+        finally:
+            buf.unmap(info)
+
+    def close(self) -> None:
+        self._pipeline.set_state(self._Gst.State.NULL)
+
+
+_FRAME_HEADER = struct.Struct("!QI")  # pts ns, payload length
+
+
+class SocketConnector(Connector):
+    """Client for :class:`LoopbackCameraServer` (``tcp://host:port``)."""
+
+    def open(self, uri: str, latency_ms: int) -> Session:
+        if not uri.startswith("tcp://"):
+            raise ValueError("SocketConnector needs a tcp:// uri")
+        host, _, port = uri[len("tcp://"):].rpartition(":")
+        try:
+            sock = socket.create_connection((host, int(port)), timeout=2.0)
+        except OSError as e:
+            raise ConnectionError(str(e)) from e
+        return _SocketSession(sock)
+
+
+class _SocketSession(Session):
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._buf = bytearray()
+
+    def _fill(self, n: int, deadline: float) -> bool:
+        while len(self._buf) < n:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._sock.settimeout(remaining)
+            try:
+                chunk = self._sock.recv(65536)
+            except socket.timeout:
+                return False
+            except OSError as e:
+                raise ConnectionError(str(e)) from e
+            if not chunk:
+                raise ConnectionError("camera closed the connection")
+            self._buf += chunk
+        return True
+
+    def read(self, timeout: float) -> Optional[Frame]:
+        deadline = time.monotonic() + timeout
+        if not self._fill(_FRAME_HEADER.size, deadline):
+            return None
+        pts, length = _FRAME_HEADER.unpack_from(self._buf)
+        if not self._fill(_FRAME_HEADER.size + length, deadline):
+            return None
+        payload = bytes(self._buf[_FRAME_HEADER.size:_FRAME_HEADER.size + length])
+        del self._buf[:_FRAME_HEADER.size + length]
+        return pts, payload
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+class LoopbackCameraServer:
+    """Local stand-in camera serving framed payloads at ``fps`` over TCP.
+
+    :meth:`drop_clients` simulates a network cut, :meth:`stall` a camera
+    that keeps the connection but stops sending, and ``jitter`` adds
+    random send delay (seconds) to every frame.
+    """
+
+    def __init__(self, fps: float = 30.0, payload_size: int = 2000,
+                 jitter: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.fps = fps
+        self.payload = bytes(payload_size)
+        self.jitter = jitter
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen()
+        self._clients: List[socket.socket] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stall_until = 0.0
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def uri(self) -> str:
+        host, port = self._listener.getsockname()
+        return "tcp://%s:%d" % (host, port)
+
+    def start(self) -> "LoopbackCameraServer":
+        for target in (self._accept_loop, self._send_loop):
+            t = threading.Thread(target=target, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def _accept_loop(self) -> None:
+        self._listener.settimeout(0.2)
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(conn)
+
+    def _send_loop(self) -> None:
+        interval = 1.0 / self.fps
+        rng = random.Random(1)
+        start = time.monotonic()
+        n = 0
+        while not self._stop.is_set():
+            due = start + n * interval
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if self.jitter:
+                time.sleep(rng.uniform(0, self.jitter))
+            if time.monotonic() >= self._stall_until:
+                packet = _FRAME_HEADER.pack(int(n * interval * NS), len(self.payload)) + self.payload
+                with self._lock:
+                    for c in list(self._clients):
+                        try:
+                            c.sendall(packet)
+                        except OSError:
+                            self._clients.remove(c)
+            n += 1
+
+    def drop_clients(self) -> None:
+        with self._lock:
+            for c in self._clients:
+                try:
+                    c.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                c.close()
+            self._clients.clear()
+
+    def stall(self, seconds: float) -> None:
+        self._stall_until = time.monotonic() + seconds
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.drop_clients()
+        self._listener.close()
+        for t in self._threads:
+            t.join(timeout=1.0)
+
+
+# -- sources and manager ---------------------------------------------------
+
+class LiveSource:
+    """One camera: connect, read, detect stalls, back off, reconnect.
+
+    The backoff only resets once a connection has stayed up for
+    ``healthy_after`` seconds, so a camera that accepts, sends a frame and
+    drops again keeps backing off instead of reconnecting at the initial
+    delay forever.
+    """
+
+    def __init__(self, source_id: int, uri: str, connector: Connector,
+                 on_frame: Callable[[int, int, bytes], None],
+                 stall_timeout: float = 3.0, backoff: Optional[Backoff] = None,
+                 initial_latency_ms: int = 200, healthy_after: float = 10.0):
+        self.source_id = source_id
+        self.uri = uri
+        self.connector = connector
+        self.on_frame = on_frame
+        self.stall_timeout = stall_timeout
+        self.healthy_after = healthy_after
+        self.backoff = backoff or Backoff()
+        self.jitter = JitterEstimator()
+        self.health = SourceHealth(source_id, uri, latency_ms=initial_latency_ms)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="source-%d" % self.source_id,
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.health.state = STATE_STOPPED
+
+    def _run(self) -> None:
+        health = self.health
+        while not self._stop.is_set():
+            health.state = STATE_CONNECTING
+            try:
+                session = self.connector.open(self.uri, health.latency_ms)
+            except (ConnectionError, OSError) as e:
+                self._failed(str(e))
+                continue
+            health.connects += 1
+            if health.connects > 1:
+                health.reconnects += 1
+            health.connected_since = time.monotonic()
+            health.state = STATE_PLAYING
+            self.jitter.reset_stream()
+            try:
+                self._read_loop(session)
+            except ConnectionError as e:
+                self._failed(str(e))
+            finally:
+                session.close()
+
+    def _read_loop(self, session: Session) -> None:
+        health = self.health
+        last = time.monotonic()
+        while not self._stop.is_set():
+            frame = session.read(timeout=min(0.5, self.stall_timeout))
+            now = time.monotonic()
+            if frame is None:
+                if now - last > self.stall_timeout:
+                    raise ConnectionError("stalled for %.1fs" % (now - last))
+                continue
+            last = now
+            pts, payload = frame
+            self.jitter.update(pts, time.monotonic_ns())
+            health.frames += 1
+            health.last_frame = now
+            health._recent.append(now)
+            health.jitter_ms = self.jitter.jitter_ns / 1e6
+            if self.backoff.attempt and now - health.connected_since >= self.healthy_after:
+                self.backoff.reset()
+            self.on_frame(self.source_id, pts, payload)
+
+    def _failed(self, error: str) -> None:
+        health = self.health
+        health.errors += 1
+        health.last_error = error
+        health.state = STATE_BACKOFF
+        # Size the next jitter buffer from what was measured; with no
+        # samples yet (the connect itself failed) keep the current latency.
+        if self.jitter.samples:
+            health.latency_ms = self.jitter.recommended_latency_ms()
+        self._stop.wait(self.backoff.next_delay())
+
+
+class SourceManager:
+    """A set of live sources feeding per-source queues and a batch assembler."""
+
+    def __init__(self, connector: Optional[Connector] = None, queue_depth: int = 4,
+                 batch_timeout: float = 0.04, stall_timeout: float = 3.0,
+                 backoff_factory: Callable[[], Backoff] = Backoff,
+                 healthy_after: float = 10.0):
+        self.connector = connector
+        self.queue_depth = queue_depth
+        self.batch_timeout = batch_timeout
+        self.stall_timeout = stall_timeout
+        self.healthy_after = healthy_after
+        self.backoff_factory = backoff_factory
+        self.sources: Dict[int, LiveSource] = {}
+        self._queues: Dict[int, Deque[Tuple[int, bytes]]] = {}
+        self._cond = threading.Condition()
+
+    def add(self, uri: str, connector: Optional[Connector] = None) -> int:
+        connector = connector or self.connector
+        if connector is None:
+            connector = SocketConnector() if uri.startswith("tcp://") else GstRtspConnector()
+        source_id = len(self.sources)
+        self._queues[source_id] = deque()
+        self.sources[source_id] = LiveSource(
+            source_id, uri, connector, self._on_frame,
+            stall_timeout=self.stall_timeout, backoff=self.backoff_factory(),
+            healthy_after=self.healthy_after)
+        return source_id
+
+    def _on_frame(self, source_id: int, pts: int, payload: bytes) -> None:
+        with self._cond:
+            q = self._queues[source_id]
+            if len(q) >= self.queue_depth:
+                q.popleft()
+                self.sources[source_id].health.dropped += 1
+            q.append((pts, payload))
+            self._cond.notify_all()
+
+    def start(self) -> None:
+        for source in self.sources.values():
+            source.start()
+
+    def stop(self) -> None:
+        for source in self.sources.values():
+            source._stop.set()
+        for source in self.sources.values():
+            source.stop()
+
+    def next_batch(self, max_size: Optional[int] = None,
+                   timeout: Optional[float] = None) -> List[Tuple[int, int, bytes]]:
+        """Up to one frame per source, ``(source_id, pts, payload)``.
+
+        Returns as soon as every source has contributed, or after
+        ``timeout`` (default ``batch_timeout``) with whatever arrived – a
+        dead source delays a batch by at most the timeout.
+        """
+        max_size = max_size or len(self.sources)
+        deadline = time.monotonic() + (self.batch_timeout if timeout is None else timeout)
+        with self._cond:
+            while True:
+                ready = [sid for sid, q in self._queues.items() if q]
+                remaining = deadline - time.monotonic()
+                if len(ready) >= max_size or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            for sid in ready[:max_size]:
+                pts, payload = self._queues[sid].popleft()
+                batch.append((sid, pts, payload))
+        return batch
+
+    def health(self) -> List[Dict[str, object]]:
+        return [s.health.as_dict() for s in self.sources.values()]
+
+    def render_prometheus(self) -> str:
+        """Per-source health in the text format of :class:`iva.metrics.MetricsServer`."""
+        lines = []
+        gauges = (
+            ("iva_source_up", "1 while the source is delivering frames.", "gauge",
+             lambda h: int(h.state == STATE_PLAYING)),
+            ("iva_source_frames_total", "Frames received.", "counter", lambda h: h.frames),
+            ("iva_source_dropped_total", "Frames dropped because batching lagged.",
+             "counter", lambda h: h.dropped),
+            ("iva_source_reconnects_total", "Successful reconnects.", "counter",
+             lambda h: h.reconnects),
+            ("iva_source_errors_total", "Connection failures and stalls.", "counter",
+             lambda h: h.errors),
+            ("iva_source_fps", "Recent receive rate.", "gauge", lambda h: h.fps),
+            ("iva_source_jitter_seconds", "Interarrival jitter estimate.", "gauge",
+             lambda h: h.jitter_ms / 1e3),
+        )
+        for metric, help_text, kind, value in gauges:
+            lines.append("# HELP %s %s" % (metric, help_text))
+            lines.append("# TYPE %s %s" % (metric, kind))
+            for sid, source in sorted(self.sources.items()):
+                lines.append('%s{source="%d"} %g' % (metric, sid, value(source.health)))
+        return "\n".join(lines) + "\n"
+
+    def mux_properties(self) -> Dict[str, object]:
+        """nvstreammux settings that keep batching going when a source is down."""
+        return {
+            "live-source": 1,
+            "batch-size": len(self.sources),
+            "batched-push-timeout": int(self.batch_timeout * 1e6),  # microseconds
+        }
@@ -0,0 +1,337 @@
+"""Startup profiling and warm start for DeepStream pipelines.
+
+The lab clears ``$HOME/.cache/gstreamer-1.0/`` before every run and lets
+nvinfer rebuild its TensorRT engines, so launching a pipeline costs tens
+of seconds. :func:`profile_startup` splits that time into phases:
+
+* ``registry`` – ``Gst.init``, which scans every plugin directory when the
+  registry cache is missing or stale;
+* ``plugins`` – loading the shared objects of the elements the pipeline
+  uses;
+* ``model-load`` – bringing the pipeline to PAUSED; nvinfer deserializes
+  (or builds) its engine here, per element in ``elements``;
+* ``first-frame`` – from PLAYING to the first buffer reaching a sink.
+
+The warm-start pieces attack each phase:
+
+* :func:`prebuild_registry` writes a registry once; :func:`warm_env`
+  points ``GST_REGISTRY`` at it with ``GST_REGISTRY_UPDATE=no`` so later
+  launches skip the scan;
+* :func:`pin_engines` sets ``model-engine-file`` in nvinfer configs to the
+  engine a previous run serialized, so the engine is loaded, not rebuilt;
+* ``PipelineBuilder(lazy_sgie=True)`` plus :class:`LazySgieLoader` keep
+  the secondary GIEs unloaded until the first vehicle is detected, so
+  the first frame does not wait for them.
+"""
+
+import os
+import platform
+import re
+import shlex
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .config import DSConfig, set_key
+from .meta import PGIE_CLASS_ID_VEHICLE, FrameMeta
+
+PHASES = ("registry", "plugins", "model-load", "first-frame")
+
+# nvinfer network-mode values and the suffix used in serialized engine names.
+NETWORK_MODE_SUFFIX = {0: "fp32", 1: "int8", 2: "fp16"}
+
+
+@dataclass
+class StartupProfile:
+    phases: "OrderedDict[str, float]" = field(default_factory=OrderedDict)
+    plugins: Dict[str, float] = field(default_factory=dict)
+    elements: Dict[str, float] = field(default_factory=dict)
+    warm_registry: bool = False
+
+    @property
+    def total(self) -> float:
+        return sum(self.phases.values())
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "phases": {k: round(v, 4) for k, v in self.phases.items()},
+            "total": round(self.total, 4),
+            "plugins": {k: round(v, 4) for k, v in self.plugins.items()},
+            "elements": {k: round(v, 4) for k, v in self.elements.items()},
+            "warm_registry": self.warm_registry,
+        }
+
+    def report(self) -> str:
+        lines = ["%-12s %8.3fs" % (name, secs) for name, secs in self.phases.items()]
+        lines.append("%-12s %8.3fs" % ("total", self.total))
+        slow = sorted(self.elements.items(), key=lambda kv: -kv[1])[:5]
+        for name, secs in slow:
+            lines.append("  %-22s %8.3fs (to PAUSED)" % (name, secs))
+        return "\n".join(lines)
+
+
+def element_factories(description: str) -> List[str]:
+    """Factory names used in a ``gst-launch-1.0`` description, in order."""
+    names = []
+    for segment in re.split(r"\s!\s", " %s " % description):
+        tokens = shlex.split(segment)
+        # Skip caps filters and pad references (``mux.sink_0``, ``t.``).
+        tokens = [t for t in tokens if "=" not in t and "." not in t and "/" not in t]
+        for token in tokens:
+            if token not in names:
+                names.append(token)
+    return names
+
+
+def profile_startup(description: str, timeout: float = 120.0) -> StartupProfile:
+    """Launch ``description`` once and time each startup phase.
+
+    Call in a fresh process, before anything else initializes GStreamer,
+    or the ``registry`` phase measures nothing.
+    """
+    profile = StartupProfile()
+    registry = os.environ.get("GST_REGISTRY")
+    profile.warm_registry = bool(registry and os.path.exists(registry)
+                                 and os.environ.get("GST_REGISTRY_UPDATE") == "no")
+
+    t0 = time.monotonic()
+    import gi
+    gi.require_version("Gst", "1.0")
+    from gi.repository import Gst
+
+    Gst.init(None)
+    profile.add("registry", time.monotonic() - t0)
+
+    for name in element_factories(description):
+        t = time.monotonic()
+        factory = Gst.ElementFactory.find(name)
+        if factory is not None:
+            factory.load()
+        profile.plugins[name] = time.monotonic() - t
+    profile.add("plugins", sum(profile.plugins.values()))
+
+    t = time.monotonic()
+    pipeline = Gst.parse_launch(description)
+    profile.add("plugins", time.monotonic() - t)
+
+    # Elements reach PAUSED one after another, sinks first; the gap before
+    # each one's state-changed message is its own start-up cost.
+    done: List[Tuple[str, float]] = []
+    bus = pipeline.get_bus()
+    bus.enable_sync_message_emission()
+
+    def on_state(bus, msg):
+        old, new, _ = msg.parse_state_changed()
+        if new == Gst.State.PAUSED and old == Gst.State.READY and msg.src is not pipeline:
+            done.append((msg.src.get_name(), time.monotonic()))
+    handler = bus.connect("sync-message::state-changed", on_state)
+
+    first = threading.Event()
+    for sink in pipeline.iterate_sinks():
+        pad = sink.get_static_pad("sink")
+        if pad is not None:
+            pad.add_probe(Gst.PadProbeType.BUFFER,
+                          lambda pad, info: (first.set(), Gst.PadProbeReturn.REMOVE)[1])
+
+    try:
+        t = time.monotonic()
+        pipeline.set_state(Gst.State.PAUSED)
+        ret, _, _ = pipeline.get_state(int(timeout * Gst.SECOND))
+        if ret == Gst.StateChangeReturn.FAILURE:
+            raise RuntimeError("pipeline failed to reach PAUSED")
+        profile.add("model-load", time.monotonic() - t)
+        prev = t
+        for name, when in done:
+            profile.elements[name] = when - prev
+            prev = when
+
+        t = time.monotonic()
+        pipeline.set_state(Gst.State.PLAYING)
+        if not first.wait(timeout):
+            raise RuntimeError("no frame reached a sink within %.0fs" % timeout)
+        profile.add("first-frame", time.monotonic() - t)
+    finally:
+        bus.disconnect(handler)
+        pipeline.set_state(Gst.State.NULL)
+    return profile
+
+
+# -- warm start ------------------------------------------------------------
+
+def registry_path(cache_dir: Optional[str] = None) -> str:
+    cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".cache", "iva")
+    return os.path.join(cache_dir, "registry.%s.bin" % platform.machine())
+
+
+def prebuild_registry(path: Optional[str] = None) -> str:
+    """Scan the plugins once into ``path`` (run after installing plugins)."""
+    path = path or registry_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    env = dict(os.environ, GST_REGISTRY=path, GST_REGISTRY_UPDATE="yes")
+    subprocess.run(["gst-inspect-1.0", "coreelements"], env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return path
+
+
+def warm_env(path: Optional[str] = None, base: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Environment that reuses a prebuilt registry without rescanning."""
+    env = dict(os.environ if base is None else base)
+    env["GST_REGISTRY"] = path or registry_path()
+    env["GST_REGISTRY_UPDATE"] = "no"
+    # Scanning in-process is cheaper than forking a scanner if it happens anyway.
+    env["GST_REGISTRY_FORK"] = "no"
+    return env
+
+
+def _resolve(config_path: str, value: str) -> str:
+    if os.path.isabs(value):
+        return value
+    return os.path.normpath(os.path.join(os.path.dirname(config_path), value))
+
+
+def serialized_engine_path(config_path: str) -> Optional[str]:
+    """Where nvinfer writes the engine it builds for this config.
+
+    nvinfer names it ``<model>_b<batch-size>_<precision>.engine`` next to
+    the model file (``model-file``, ``uff-file`` or ``onnx-file``).
+    """
+    cfg = DSConfig.read(config_path)
+    model = None
+    for key in ("model-file", "uff-file", "onnx-file"):
+        model = cfg.property(key)
+        if model:
+            break
+    if not model:
+        return None
+    batch = int(cfg.property("batch-size", "1"))
+    mode = NETWORK_MODE_SUFFIX.get(int(cfg.property("network-mode", "0")), "fp32")
+    return "%s_b%d_%s.engine" % (_resolve(config_path, model), batch, mode)
+
+
+def pin_engines(config_paths: Sequence[str]) -> List[Tuple[str, str, str]]:
+    """Point each nvinfer config's ``model-engine-file`` at an existing engine.
+
+    Returns ``(config, engine, status)`` with status ``ok`` (already set to
+    an existing file), ``pinned`` (set now) or ``missing`` (no engine yet:
+    run the pipeline once cold, then pin again).
+    """
+    results = []
+    for path in config_paths:
+        cfg = DSConfig.read(path)
+        current = cfg.property("model-engine-file")
+        if current and os.path.exists(_resolve(path, current)):
+            results.append((path, _resolve(path, current), "ok"))
+            continue
+        engine = serialized_engine_path(path)
+        if engine and os.path.exists(engine):
+            rel = os.path.relpath(engine, os.path.dirname(os.path.abspath(path)))
+            set_key(path, "property", "model-engine-file", rel)
+            results.append((path, engine, "pinned"))
+        else:
+            results.append((path, engine or "", "missing"))
+    return results
+
+
+class LazySgieLoader:
+    """Start the secondary GIEs of a ``lazy_sgie`` pipeline on the first vehicle.
+
+    ``PipelineBuilder(lazy_sgie=True)`` routes frames around the SGIE
+    chain through an ``input-selector`` and puts a closed ``valve`` in
+    front of it. This loader locks the SGIE elements in NULL (their
+    engines are not loaded) until a frame with one of ``trigger_class_ids``
+    passes, then starts them on a worker thread, opens the valve and
+    switches the selector over. Frames keep flowing without secondary
+    labels meanwhile.
+
+    Create it after ``build()`` and before setting the pipeline to PLAYING.
+    """
+
+    def __init__(self, pipeline, trigger_class_ids: Sequence[int] = (PGIE_CLASS_ID_VEHICLE,)):
+        self.pipeline = pipeline
+        self.trigger_class_ids = set(trigger_class_ids)
+        self.elements = [pipeline.get_by_name("sgie_queue")]
+        i = 0
+        while pipeline.get_by_name("sgie%d" % i) is not None:
+            self.elements.append(pipeline.get_by_name("sgie%d" % i))
+            i += 1
+        if self.elements[0] is None or len(self.elements) < 2:
+            raise ValueError("pipeline was not built with lazy_sgie=True")
+        for element in self.elements:
+            element.set_locked_state(True)
+        self.triggered = False
+        self.load_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def attach(self) -> None:
+        """Watch the metadata entering the lazy tee."""
+        from gi.repository import Gst
+
+        from .meta import meta_probe
+
+        pad = self.pipeline.get_by_name("lazy").get_static_pad("sink")
+        pad.add_probe(Gst.PadProbeType.BUFFER, meta_probe(self.on_frame))
+
+    def on_frame(self, frame: FrameMeta) -> None:
+        if self.triggered:
+            return
+        if not any(o.class_id in self.trigger_class_ids for o in frame.objects):
+            return
+        with self._lock:
+            if self.triggered:
+                return
+            self.triggered = True
+        threading.Thread(target=self.load, daemon=True).start()
+
+    __call__ = on_frame
+
+    def load(self) -> None:
+        """Start the SGIE chain (engine load happens here) and switch to it."""
+        t = time.monotonic()
+        for element in reversed(self.elements):
+            element.set_locked_state(False)
+            element.sync_state_with_parent()
+        self.load_seconds = time.monotonic() - t
+        self.pipeline.get_by_name("sgie_valve").set_property("drop", False)
+        selector = self.pipeline.get_by_name("sgie_sel")
+        selector.set_property("active-pad", selector.get_static_pad("sink_1"))
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Profile and warm up pipeline startup.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("profile", help="time the startup phases of a pipeline")
+    p.add_argument("description", help="gst-launch-1.0 description (quoted)")
+    p.add_argument("--warm", action="store_true", help="use the prebuilt registry")
+    p.add_argument("--registry")
+    p.add_argument("--json", action="store_true")
+    w = sub.add_parser("warm", help="prebuild the registry and pin nvinfer engines")
+    w.add_argument("configs", nargs="*", help="nvinfer config files")
+    w.add_argument("--registry")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "warm":
+        print("registry: %s" % prebuild_registry(args.registry))
+        status = 0
+        for config, engine, state in pin_engines(args.configs):
+            print("%-8s %s -> %s" % (state, config, engine))
+            status |= state == "missing"
+        return status
+
+    if args.warm:
+        os.environ.update(warm_env(args.registry))
+    profile = profile_startup(args.description)
+    print(json.dumps(profile.as_dict(), indent=2) if args.json else profile.report())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
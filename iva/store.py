@@ -0,0 +1,362 @@
+"""Append-only columnar store for detection and classification metadata.
+
+Detections are written as Arrow IPC segments under hour partitions::
+
+    root/
+      2019-11-02/14/
+        manifest.jsonl              one line per segment, with its zone maps
+        tracks.jsonl                one line per segment: its object ids
+        seg-000017.arrow
+
+Both index files are append-only: adding a segment appends one line to
+each file of its partition, so the cost of a flush does not grow with the
+size of the store. A torn last line left by a crash is skipped on load,
+and the segment it describes is simply not visible.
+
+A query first narrows to the partitions overlapping its time range, then
+drops every segment whose min/max zone map excludes the predicate, then
+uses the tracker-id index when an ``object_id`` is given; only the
+surviving segments are memory-mapped and filtered.
+
+Requires ``pyarrow``.
+"""
+
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .meta import FrameMeta
+from .replay import frame_time
+
+MANIFEST = "manifest.jsonl"
+TRACK_INDEX = "tracks.jsonl"
+
+NS_PER_HOUR = 3600 * 10**9
+
+# Columns with a zone map; ``labels`` columns are strings and are not mapped.
+ZONE_MAP_COLUMNS = ("ts", "source_id", "class_id", "object_id", "confidence")
+
+SCHEMA = pa.schema([
+    ("ts", pa.int64()),
+    ("source_id", pa.int32()),
+    ("frame_num", pa.int64()),
+    ("object_id", pa.int64()),
+    ("class_id", pa.int16()),
+    ("confidence", pa.float32()),
+    ("left", pa.float32()),
+    ("top", pa.float32()),
+    ("width", pa.float32()),
+    ("height", pa.float32()),
+])
+
+LABEL_PREFIX = "label_"
+
+
+def partition_of(ts: int) -> str:
+    """Hour partition name (``YYYY-MM-DD/HH``, UTC) of a nanosecond timestamp."""
+    return time.strftime("%Y-%m-%d/%H", time.gmtime(ts // 10**9))
+
+
+@dataclass
+class Segment:
+    id: int
+    path: str
+    partition: str
+    rows: int
+    zone_map: Dict[str, List[float]]
+    labels: List[str] = field(default_factory=list)
+
+    def may_contain(self, column: str, lo=None, hi=None) -> bool:
+        """False when the zone map proves no row has ``lo <= column <= hi``."""
+        bounds = self.zone_map.get(column)
+        if bounds is None:
+            return True
+        cmin, cmax = bounds
+        if lo is not None and cmax < lo:
+            return False
+        if hi is not None and cmin > hi:
+            return False
+        return True
+
+
+class DetectionStore:
+    """A directory of Arrow IPC segments plus its manifest and indexes."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.segments: List[Segment] = []
+        self.tracks: Dict[int, List[int]] = {}
+        for partition in sorted(_partitions(root)):
+            part_dir = os.path.join(root, partition)
+            segments = [Segment(**s) for s in _read_jsonl(os.path.join(part_dir, MANIFEST))]
+            self.segments.extend(segments)
+            known = {s.id for s in segments}
+            for entry in _read_jsonl(os.path.join(part_dir, TRACK_INDEX)):
+                if entry["segment"] in known:
+                    for object_id in entry["object_ids"]:
+                        self.tracks.setdefault(object_id, []).append(entry["segment"])
+        self.segments.sort(key=lambda s: s.id)
+        for ids in self.tracks.values():
+            ids.sort()
+
+    # -- writing -----------------------------------------------------------
+
+    def append_table(self, table: pa.Table, partition: str) -> Segment:
+        """Write ``table`` as a new segment of ``partition`` and index it."""
+        seg_id = max(s.id for s in self.segments) + 1 if self.segments else 0
+        rel = os.path.join(partition, "seg-%06d.arrow" % seg_id)
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+
+        zone_map = {}
+        for name in ZONE_MAP_COLUMNS:
+            mm = pc.min_max(table.column(name)).as_py()
+            if mm["min"] is not None:
+                zone_map[name] = [mm["min"], mm["max"]]
+        segment = Segment(
+            id=seg_id, path=rel, partition=partition, rows=table.num_rows,
+            zone_map=zone_map,
+            labels=[n[len(LABEL_PREFIX):] for n in table.column_names
+                    if n.startswith(LABEL_PREFIX)],
+        )
+        object_ids = [o for o in pc.unique(table.column("object_id")).to_pylist() if o >= 0]
+        # Tracks first: a track entry without its manifest line is ignored.
+        part_dir = os.path.join(self.root, partition)
+        _append_jsonl(os.path.join(part_dir, TRACK_INDEX),
+                      {"segment": seg_id, "object_ids": object_ids})
+        _append_jsonl(os.path.join(part_dir, MANIFEST), segment.__dict__)
+        for object_id in object_ids:
+            self.tracks.setdefault(object_id, []).append(seg_id)
+        self.segments.append(segment)
+        return segment
+
+    def writer(self, **kwargs) -> "StoreWriter":
+        return StoreWriter(self, **kwargs)
+
+    def columns(self) -> List[str]:
+        """Every column a query can return: the fixed schema plus seen labels."""
+        labels = sorted({label for s in self.segments for label in s.labels})
+        return list(SCHEMA.names) + [LABEL_PREFIX + label for label in labels]
+
+    # -- reading -----------------------------------------------------------
+
+    def plan(self, start: Optional[int] = None, end: Optional[int] = None,
+             source_id: Optional[int] = None, class_id: Optional[int] = None,
+             object_id: Optional[int] = None,
+             min_confidence: Optional[float] = None,
+             labels: Optional[Dict[str, str]] = None) -> List[Segment]:
+        """Return the segments a query with these predicates has to read."""
+        candidates: Iterable[Segment] = self.segments
+        if object_id is not None:
+            wanted = set(self.tracks.get(object_id, ()))
+            candidates = [s for s in candidates if s.id in wanted]
+        if start is not None or end is not None:
+            lo = partition_of(start) if start is not None else None
+            hi = partition_of(end) if end is not None else None
+            candidates = [s for s in candidates
+                          if (lo is None or s.partition >= lo)
+                          and (hi is None or s.partition <= hi)]
+        checks = [("ts", start, end)]
+        if source_id is not None:
+            checks.append(("source_id", source_id, source_id))
+        if class_id is not None:
+            checks.append(("class_id", class_id, class_id))
+        if object_id is not None:
+            checks.append(("object_id", object_id, object_id))
+        if min_confidence is not None:
+            checks.append(("confidence", min_confidence, None))
+        label_keys = set(labels or ())
+        return [s for s in candidates
+                if all(s.may_contain(c, lo, hi) for c, lo, hi in checks)
+                and label_keys.issubset(s.labels)]
+
+    def query(self, start: Optional[int] = None, end: Optional[int] = None,
+              source_id: Optional[int] = None, class_id: Optional[int] = None,
+              object_id: Optional[int] = None,
+              min_confidence: Optional[float] = None,
+              labels: Optional[Dict[str, str]] = None,
+              columns: Optional[Sequence[str]] = None) -> pa.Table:
+        """Rows matching all given predicates; ``start``/``end`` are ns, inclusive.
+
+        ``labels`` matches secondary classifier results, e.g.
+        ``{"color": "red", "type": "sedan"}``. Unknown ``columns`` raise
+        ``ValueError`` whether or not any row matches.
+        """
+        if columns is not None:
+            known = set(self.columns())
+            unknown = [c for c in columns if c not in known]
+            if unknown:
+                raise ValueError("unknown column(s): %s" % ", ".join(unknown))
+        tables = []
+        for segment in self.plan(start, end, source_id, class_id, object_id,
+                                 min_confidence, labels):
+            table = self._read(segment)
+            mask = None
+            for expr in _predicates(table, start, end, source_id, class_id,
+                                    object_id, min_confidence, labels):
+                mask = expr if mask is None else pc.and_(mask, expr)
+            if mask is not None:
+                table = table.filter(mask)
+            if table.num_rows:
+                tables.append(table)
+        if not tables:
+            return _empty_table(columns)
+        result = pa.concat_tables(tables, promote_options="default")
+        if columns is not None:
+            # A label none of the surviving segments carries is all null.
+            for name in columns:
+                if name not in result.column_names:
+                    result = result.append_column(
+                        name, pa.nulls(result.num_rows, pa.string()))
+            result = result.select(list(columns))
+        return result
+
+    def _read(self, segment: Segment) -> pa.Table:
+        source = pa.memory_map(os.path.join(self.root, segment.path), "r")
+        return pa.ipc.open_file(source).read_all()
+
+
+def _predicates(table, start, end, source_id, class_id, object_id,
+                min_confidence, labels):
+    if start is not None:
+        yield pc.greater_equal(table["ts"], start)
+    if end is not None:
+        yield pc.less_equal(table["ts"], end)
+    if source_id is not None:
+        yield pc.equal(table["source_id"], source_id)
+    if class_id is not None:
+        yield pc.equal(table["class_id"], class_id)
+    if object_id is not None:
+        yield pc.equal(table["object_id"], object_id)
+    if min_confidence is not None:
+        yield pc.greater_equal(table["confidence"], min_confidence)
+    for key, value in (labels or {}).items():
+        yield pc.fill_null(pc.equal(table[LABEL_PREFIX + key], value), False)
+
+
+def _empty_table(columns):
+    if columns is None:
+        return SCHEMA.empty_table()
+    fields = [SCHEMA.field(c) if c in SCHEMA.names else pa.field(c, pa.string())
+              for c in columns]
+    return pa.schema(fields).empty_table()
+
+
+def _partitions(root: str) -> Iterable[str]:
+    """``YYYY-MM-DD/HH`` directories under ``root`` that hold a manifest."""
+    for day in os.listdir(root):
+        day_dir = os.path.join(root, day)
+        if not os.path.isdir(day_dir):
+            continue
+        for hour in os.listdir(day_dir):
+            if os.path.exists(os.path.join(day_dir, hour, MANIFEST)):
+                yield day + "/" + hour
+
+
+def _read_jsonl(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path) as fp:
+        for line in fp:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue  # torn write
+    return entries
+
+
+def _append_jsonl(path: str, obj) -> None:
+    with open(path, "ab+") as fp:
+        # Terminate a torn last line so it does not swallow this one.
+        if fp.tell() and (fp.seek(-1, os.SEEK_END), fp.read(1))[1] != b"\n":
+            fp.write(b"\n")
+        fp.write(json.dumps(obj, separators=(",", ":")).encode() + b"\n")
+        fp.flush()
+        os.fsync(fp.fileno())
+
+
+class StoreWriter:
+    """Buffer :class:`FrameMeta` rows and flush them as store segments.
+
+    A writer is a consumer callable, so it plugs into the probe output path
+    (``meta_probe(store.writer())``) or a :class:`iva.replay.ReplaySource`.
+    A segment is cut when ``segment_rows`` rows are buffered or when the
+    hour partition changes; call :meth:`close` to flush the tail.
+    """
+
+    def __init__(self, store: DetectionStore, segment_rows: int = 65536):
+        self.store = store
+        self.segment_rows = segment_rows
+        self._partition: Optional[str] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        self._cols: Dict[str, list] = {name: [] for name in SCHEMA.names}
+        self._labels: Dict[str, list] = {}
+        self._rows = 0
+
+    def write(self, frame: FrameMeta) -> None:
+        ts = frame_time(frame)
+        partition = partition_of(ts)
+        if partition != self._partition:
+            self.flush()
+            self._partition = partition
+        cols = self._cols
+        for obj in frame.objects:
+            cols["ts"].append(ts)
+            cols["source_id"].append(frame.source_id)
+            cols["frame_num"].append(frame.frame_num)
+            cols["object_id"].append(obj.object_id)
+            cols["class_id"].append(obj.class_id)
+            cols["confidence"].append(obj.confidence)
+            cols["left"].append(obj.left)
+            cols["top"].append(obj.top)
+            cols["width"].append(obj.width)
+            cols["height"].append(obj.height)
+            for key, value in obj.labels.items():
+                column = self._labels.get(key)
+                if column is None:
+                    column = self._labels[key] = [None] * self._rows
+                column.append(value)
+            self._rows += 1
+            for column in self._labels.values():
+                if len(column) < self._rows:
+                    column.append(None)
+        if self._rows >= self.segment_rows:
+            self.flush()
+
+    __call__ = write
+
+    def flush(self) -> Optional[Segment]:
+        if not self._rows:
+            return None
+        arrays = [pa.array(self._cols[f.name], type=f.type) for f in SCHEMA]
+        names = list(SCHEMA.names)
+        for key in sorted(self._labels):
+            arrays.append(pa.array(self._labels[key], type=pa.string())
+                          .dictionary_encode())
+            names.append(LABEL_PREFIX + key)
+        table = pa.Table.from_arrays(arrays, names=names)
+        self._reset()
+        return self.store.append_table(table, self._partition)
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
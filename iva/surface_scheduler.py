@@ -0,0 +1,176 @@
+"""Forward only active dewarped surfaces into the inference batch.
+
+The section 9 pipeline feeds all four dewarped surfaces into
+``nvstreammux ... batch-size=4`` whether or not anything is in view. For
+ceiling fisheye cameras most surfaces are empty most of the time.
+:class:`SurfaceScheduler` keeps a per-surface activity clock, fed by
+recent detections (:meth:`SurfaceScheduler.observe`, a metadata consumer)
+and by a cheap motion score (:class:`SurfaceMotion`). Active surfaces are
+forwarded every frame; a surface with no activity for ``idle_after``
+seconds drops to one probe frame every ``probe_every`` frames, staggered
+so idle surfaces do not all probe on the same frame. Any detection or
+motion on a probe frame makes the surface active again.
+
+On the CPU path pass :meth:`SurfaceScheduler.select` to
+:meth:`iva.dewarp.Dewarper.dewarp` so idle surfaces are not even
+dewarped. In a GStreamer pipeline that gives each surface its own
+nvstreammux sink pad, :meth:`SurfaceScheduler.drop_probe` drops the
+buffers of surfaces that are not selected. The mux then never fills a
+``batch-size=4`` batch on its own; configure it with
+:meth:`SurfaceScheduler.mux_properties` so it pushes the short batch after
+one frame interval instead of holding every frame back.
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .dewarp import RemapTable
+from .meta import FrameMeta
+
+
+@dataclass
+class SurfaceState:
+    last_active: float = float("-inf")
+    forwarded: int = 0
+    skipped: int = 0
+    motion: float = 0.0
+
+
+class SurfaceScheduler:
+    """Per-surface activity tracking and batch selection."""
+
+    def __init__(self, num_surfaces: int, idle_after: float = 2.0,
+                 probe_every: int = 15, min_objects: int = 1,
+                 motion_threshold: float = 4.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.surfaces = [SurfaceState() for _ in range(num_surfaces)]
+        self.idle_after = idle_after
+        self.probe_every = max(1, probe_every)
+        self.min_objects = min_objects
+        self.motion_threshold = motion_threshold
+        self._clock = clock
+        self._selected: List[int] = list(range(num_surfaces))
+
+    # -- activity signals --------------------------------------------------
+
+    def mark_active(self, surface: int, now: Optional[float] = None) -> None:
+        self.surfaces[surface].last_active = self._clock() if now is None else now
+
+    def report_detections(self, surface: int, num_objects: int,
+                          now: Optional[float] = None) -> None:
+        if num_objects >= self.min_objects:
+            self.mark_active(surface, now)
+
+    def report_motion(self, surface: int, score: float,
+                      now: Optional[float] = None) -> None:
+        self.surfaces[surface].motion = score
+        if score >= self.motion_threshold:
+            self.mark_active(surface, now)
+
+    def observe(self, frame: FrameMeta) -> None:
+        """Metadata consumer; ``frame.source_id`` is the surface index."""
+        if 0 <= frame.source_id < len(self.surfaces):
+            self.report_detections(frame.source_id, len(frame.objects))
+
+    __call__ = observe
+
+    # -- selection ---------------------------------------------------------
+
+    def is_active(self, surface: int, now: Optional[float] = None) -> bool:
+        now = self._clock() if now is None else now
+        return now - self.surfaces[surface].last_active < self.idle_after
+
+    def select(self, frame_num: int, now: Optional[float] = None) -> List[int]:
+        """Surfaces to forward for ``frame_num``: active ones plus due probes."""
+        now = self._clock() if now is None else now
+        selected = []
+        for i, state in enumerate(self.surfaces):
+            if (now - state.last_active < self.idle_after
+                    or (frame_num + i) % self.probe_every == 0):
+                selected.append(i)
+                state.forwarded += 1
+            else:
+                state.skipped += 1
+        self._selected = selected
+        return selected
+
+    @property
+    def selected(self) -> List[int]:
+        """Result of the last :meth:`select` call."""
+        return self._selected
+
+    def savings(self) -> float:
+        """Fraction of surface-frames kept out of the inference batch."""
+        forwarded = sum(s.forwarded for s in self.surfaces)
+        skipped = sum(s.skipped for s in self.surfaces)
+        total = forwarded + skipped
+        return skipped / total if total else 0.0
+
+    def drop_probe(self, surface: int):
+        """Buffer probe for the mux sink pad of ``surface``.
+
+        Drops the buffer unless ``surface`` was in the last :meth:`select`;
+        call :meth:`select` once per frame from an upstream probe, and set
+        :meth:`mux_properties` on the mux so a batch with dropped surfaces
+        is pushed after one frame interval rather than waiting for the
+        default ``batched-push-timeout``.
+        """
+        from gi.repository import Gst
+
+        def probe(pad, info, u_data=None):
+            if surface in self._selected:
+                return Gst.PadProbeReturn.OK
+            return Gst.PadProbeReturn.DROP
+        return probe
+
+    def mux_properties(self, fps: float = 30.0) -> Dict[str, object]:
+        """nvstreammux settings for :meth:`drop_probe`.
+
+        All surfaces of a frame reach the mux together, so a batch that is
+        still short after one frame interval will not fill; push it then.
+        """
+        return {
+            "batch-size": len(self.surfaces),
+            "batched-push-timeout": int(1e6 / fps),  # microseconds
+        }
+
+
+class SurfaceMotion:
+    """Motion score of one surface, measured on the fisheye frame.
+
+    Instead of dewarping the surface, the score samples the source pixels
+    that a sparse grid (every ``step``-th output pixel) of the surface's
+    remap table reads from, and reports the mean absolute difference of
+    that luma sample against the previous call.
+    """
+
+    def __init__(self, table: RemapTable, step: int = 16):
+        pw = table.src_w + 2
+        index = np.asarray(table.index[::step, ::step]).ravel()
+        index = index[index != 0]
+        ys = np.clip(index // pw - 1, 0, table.src_h - 1)
+        xs = np.clip(index % pw - 1, 0, table.src_w - 1)
+        self._ys = ys.astype(np.intp)
+        self._xs = xs.astype(np.intp)
+        self._prev: Optional[np.ndarray] = None
+
+    def score(self, frame: np.ndarray) -> float:
+        """``frame`` is (H, W) luma (e.g. the NV12 Y plane) or (H, W, C).
+
+        A surface whose sampled grid maps to no source pixel scores 0.
+        """
+        if not self._ys.size:
+            return 0.0
+        if frame.ndim == 3:
+            # Green approximates luma well enough for a change score.
+            sample = frame[self._ys, self._xs, 1]
+        else:
+            sample = frame[self._ys, self._xs]
+        sample = sample.astype(np.int16)
+        prev, self._prev = self._prev, sample
+        if prev is None:
+            return 0.0
+        return float(np.abs(sample - prev).mean())
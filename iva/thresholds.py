@@ -0,0 +1,514 @@
+"""Offline tuning of nvinfer ``class-thresholds`` from recorded detections.
+
+Section 4 raises the vehicle entry of ``class-thresholds`` to 0.95, then
+rebuilds and reruns the whole video to see what changed. Instead, record
+the detector output once with every threshold lowered to a floor
+(:func:`permissive_config` writes such a copy of the config; record with
+:class:`iva.replay.MetaRecorder` behind :func:`iva.meta.meta_probe`), and
+any threshold set is then a vectorized mask over one array of
+confidences – milliseconds for a whole video.
+
+With ground-truth labels (a recording in the same format), every detection
+is matched once, greedily in decreasing confidence per frame and class.
+Raising a threshold only drops the lowest-confidence detections, and the
+greedy matching of what remains is unchanged, so precision/recall at any
+threshold are cumulative sums over the sorted detections.
+
+The object metadata is recorded *after* nvinfer clustered the grid
+proposals, and clustering depends on the threshold: at the floor, weak
+proposals join (and shift or merge) clusters that a rerun at 0.95 would
+never form. Results from a metadata recording are therefore an
+approximation of a rerun. For exact results record the raw output tensors
+instead (``output-tensor-meta=1``, see ``--permissive --tensor-meta`` and
+:class:`TensorRecorder`): a ``.npz`` recording is re-thresholded and
+re-clustered per threshold with :func:`iva.detectnet.parse`, the same
+decoding as nvinfer, and costs one parse per grid value instead of one
+mask.
+
+::
+
+    python -m iva.thresholds run.jsonl.gz --labels gt.jsonl.gz \\
+        --pick f1 --write dstest1_pgie_config.txt
+    python -m iva.thresholds run_tensors.npz --labels gt.jsonl.gz --pick f1
+"""
+
+import shutil
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import DSConfig, set_key
+from .detectnet import STRIDE, blob_names, parse
+from .meta import FrameMeta, class_label
+from .replay import read_frames
+
+KEY = "class-thresholds"
+DEFAULT_GRID = np.round(np.arange(0.05, 1.0, 0.05), 2)
+
+
+@dataclass
+class Detections:
+    """Flat arrays of detections; ``frame`` indexes ``(source_id, frame_num)`` pairs."""
+
+    frame: np.ndarray       # int64 frame index
+    class_id: np.ndarray    # int32
+    confidence: np.ndarray  # float32
+    boxes: np.ndarray       # float32 [n, 4] left, top, width, height
+    frames: List[Tuple[int, int]]
+
+    def __len__(self) -> int:
+        return len(self.confidence)
+
+    @classmethod
+    def from_frames(cls, frames: Iterable[FrameMeta],
+                    index: Optional[Dict[Tuple[int, int], int]] = None) -> "Detections":
+        """Flatten frames; pass ``index`` to share frame numbering with another set."""
+        index = {} if index is None else index
+        frame, class_id, confidence, boxes = [], [], [], []
+        for f in frames:
+            key = (f.source_id, f.frame_num)
+            fi = index.setdefault(key, len(index))
+            for o in f.objects:
+                frame.append(fi)
+                class_id.append(o.class_id)
+                confidence.append(o.confidence)
+                boxes.append((o.left, o.top, o.width, o.height))
+        order = sorted(index, key=index.get)
+        return cls(np.asarray(frame, np.int64), np.asarray(class_id, np.int32),
+                   np.asarray(confidence, np.float32),
+                   np.asarray(boxes, np.float32).reshape(-1, 4), order)
+
+    @classmethod
+    def from_recording(cls, path: str, index: Optional[Dict[Tuple[int, int], int]] = None
+                       ) -> "Detections":
+        return cls.from_frames(read_frames(path), index)
+
+    @classmethod
+    def from_tensors(cls, rec: "TensorRecording", thresholds,
+                     index: Optional[Dict[Tuple[int, int], int]] = None,
+                     **parse_kwargs) -> "Detections":
+        """Threshold and cluster raw tensors as nvinfer would at ``thresholds``."""
+        index = {} if index is None else index
+        parsed = parse(rec.cov, rec.bbox, thresholds, **parse_kwargs) if len(rec.frames) else []
+        sx = rec.frame_width / rec.net_width
+        sy = rec.frame_height / rec.net_height
+        frame, class_id, confidence, boxes = [], [], [], []
+        for key, objs in zip(rec.frames, parsed):
+            fi = index.setdefault(key, len(index))
+            frame.append(np.full(len(objs), fi, np.int64))
+            class_id.append(objs.class_id)
+            confidence.append(objs.confidence)
+            boxes.append(objs.boxes * np.float32([sx, sy, sx, sy]))
+        order = sorted(index, key=index.get)
+        if not frame:
+            return cls(np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros(0, np.float32),
+                       np.zeros((0, 4), np.float32), order)
+        return cls(np.concatenate(frame), np.concatenate(class_id).astype(np.int32),
+                   np.concatenate(confidence).astype(np.float32),
+                   np.concatenate(boxes).astype(np.float32).reshape(-1, 4), order)
+
+    @property
+    def num_classes(self) -> int:
+        return int(self.class_id.max()) + 1 if len(self) else 0
+
+
+@dataclass
+class TensorRecording:
+    """Raw DetectNet outputs per frame: ``cov [N, C, H, W]``, ``bbox [N, 4C, H, W]``.
+
+    Boxes parse in network pixels (``net_width`` x ``net_height``) and are
+    scaled to the muxer's ``frame_width`` x ``frame_height``, the space of
+    recorded object metadata and labels.
+    """
+
+    frames: List[Tuple[int, int]]
+    cov: np.ndarray
+    bbox: np.ndarray
+    frame_width: int = 1280
+    frame_height: int = 720
+
+    @property
+    def net_width(self) -> int:
+        return self.cov.shape[3] * STRIDE
+
+    @property
+    def net_height(self) -> int:
+        return self.cov.shape[2] * STRIDE
+
+    @property
+    def num_classes(self) -> int:
+        return self.cov.shape[1]
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(path, frames=np.asarray(self.frames, np.int64).reshape(-1, 2),
+                            cov=self.cov, bbox=self.bbox,
+                            frame_size=np.int64([self.frame_width, self.frame_height]))
+
+    @classmethod
+    def load(cls, path: str) -> "TensorRecording":
+        with np.load(path) as data:
+            width, height = (int(v) for v in data["frame_size"])
+            return cls([tuple(int(v) for v in f) for f in data["frames"]],
+                       data["cov"], data["bbox"], width, height)
+
+
+class TensorRecorder:
+    """Collect PGIE output tensors (``output-tensor-meta=1``) from a buffer probe.
+
+    Install :meth:`probe` after the PGIE and call :meth:`save` at EOS.
+    ``every_n`` keeps one frame in N per source; a ResNet10 frame is about
+    160 KB of float32 before compression.
+    """
+
+    def __init__(self, output_blob_names: Optional[str] = None, frame_width: int = 1280,
+                 frame_height: int = 720, every_n: int = 1):
+        self.bbox_name, self.cov_name = blob_names(output_blob_names)
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.every_n = every_n
+        self.frames: List[Tuple[int, int]] = []
+        self._cov: List[np.ndarray] = []
+        self._bbox: List[np.ndarray] = []
+
+    def add(self, source_id: int, frame_num: int, cov: np.ndarray, bbox: np.ndarray) -> None:
+        if frame_num % self.every_n:
+            return
+        self.frames.append((source_id, frame_num))
+        self._cov.append(np.asarray(cov, np.float32))
+        self._bbox.append(np.asarray(bbox, np.float32))
+
+    def recording(self) -> TensorRecording:
+        return TensorRecording(list(self.frames), np.stack(self._cov), np.stack(self._bbox),
+                               self.frame_width, self.frame_height)
+
+    def save(self, path: str) -> int:
+        if self.frames:
+            self.recording().save(path)
+        return len(self.frames)
+
+    def probe(self):
+        """Buffer probe copying each frame's tensor output meta into the recorder."""
+        import ctypes
+
+        import pyds
+        from gi.repository import Gst
+
+        def layer_array(tensor_meta, i):
+            layer = pyds.get_nvds_LayerInfo(tensor_meta, i)
+            dims = [layer.dims.d[k] for k in range(layer.dims.numDims)]
+            ptr = ctypes.cast(pyds.get_ptr(layer.buffer), ctypes.POINTER(ctypes.c_float))
+            return layer.layerName, np.ctypeslib.as_array(ptr, shape=(int(np.prod(dims)),)) \
+                .reshape(dims).copy()
+
+        def probe(pad, info, u_data=None):
+            buf = info.get_buffer()
+            if buf is None:
+                return Gst.PadProbeReturn.OK
+            batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(buf))
+            l_frame = batch_meta.frame_meta_list
+            while l_frame is not None:
+                frame = pyds.NvDsFrameMeta.cast(l_frame.data)
+                l_user = frame.frame_user_meta_list
+                while l_user is not None:
+                    user_meta = pyds.NvDsUserMeta.cast(l_user.data)
+                    if user_meta.base_meta.meta_type == \
+                            pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META:
+                        tensor_meta = pyds.NvDsInferTensorMeta.cast(user_meta.user_meta_data)
+                        layers = dict(layer_array(tensor_meta, i)
+                                      for i in range(tensor_meta.num_output_layers))
+                        if self.cov_name in layers and self.bbox_name in layers:
+                            self.add(frame.pad_index, frame.frame_num,
+                                     layers[self.cov_name], layers[self.bbox_name])
+                    l_user = l_user.next
+                l_frame = l_frame.next
+            return Gst.PadProbeReturn.OK
+        return probe
+
+
+def threshold_vector(thresholds, num_classes: int) -> np.ndarray:
+    """``thresholds`` as a dense per-class array (a scalar applies to every class)."""
+    if isinstance(thresholds, dict):
+        out = np.zeros(num_classes, np.float32)
+        for c, t in thresholds.items():
+            out[int(c)] = t
+        return out
+    values = np.atleast_1d(np.asarray(thresholds, np.float32))
+    if len(values) < num_classes:
+        # Like a short list in the config: the last value covers the rest.
+        values = np.concatenate([values, np.repeat(values[-1:], num_classes - len(values))])
+    return values
+
+
+def keep_mask(dets: Detections, thresholds) -> np.ndarray:
+    """Detections that survive ``thresholds`` (one per class, or a scalar)."""
+    thr = threshold_vector(thresholds, max(dets.num_classes, np.size(thresholds)))
+    return dets.confidence >= thr[dets.class_id]
+
+
+def counts(dets: Detections, thresholds) -> np.ndarray:
+    """Surviving detections per class."""
+    keep = keep_mask(dets, thresholds)
+    return np.bincount(dets.class_id[keep], minlength=dets.num_classes)
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    ax1, ay1 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx1, by1 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+    iw = np.clip(np.minimum(ax1[:, None], bx1) - np.maximum(a[:, None, 0], b[:, 0]), 0, None)
+    ih = np.clip(np.minimum(ay1[:, None], by1) - np.maximum(a[:, None, 1], b[:, 1]), 0, None)
+    inter = iw * ih
+    union = (a[:, 2] * a[:, 3])[:, None] + b[:, 2] * b[:, 3] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+def match(dets: Detections, labels: Detections, iou: float = 0.5) -> np.ndarray:
+    """True-positive flag per detection (greedy by confidence, per frame and class).
+
+    ``labels`` must share the frame numbering (``Detections.from_*(…, index)``).
+    """
+    tp = np.zeros(len(dets), dtype=bool)
+    if not len(dets) or not len(labels):
+        return tp
+    d_key = dets.frame * 1024 + dets.class_id
+    l_key = labels.frame * 1024 + labels.class_id
+    d_order = np.lexsort((-dets.confidence, d_key))
+    l_order = np.argsort(l_key, kind="stable")
+    d_keys, d_start = np.unique(d_key[d_order], return_index=True)
+    l_keys, l_start = np.unique(l_key[l_order], return_index=True)
+    d_end = np.append(d_start[1:], len(d_order))
+    l_end = np.append(l_start[1:], len(l_order))
+    _, di, li = np.intersect1d(d_keys, l_keys, return_indices=True)
+    for a, b in zip(di, li):
+        d_idx = d_order[d_start[a]:d_end[a]]
+        l_idx = l_order[l_start[b]:l_end[b]]
+        overlap = _iou(dets.boxes[d_idx], labels.boxes[l_idx])
+        taken = np.zeros(len(l_idx), dtype=bool)
+        for r, row in enumerate(overlap):
+            row = np.where(taken, -1.0, row)
+            j = int(row.argmax())
+            if row[j] >= iou:
+                taken[j] = True
+                tp[d_idx[r]] = True
+    return tp
+
+
+@dataclass
+class Curve:
+    """Per-class detection count (and precision/recall with labels) over a threshold grid."""
+
+    class_id: int
+    grid: np.ndarray
+    count: np.ndarray
+    precision: Optional[np.ndarray] = None
+    recall: Optional[np.ndarray] = None
+
+    @property
+    def f1(self) -> Optional[np.ndarray]:
+        if self.precision is None:
+            return None
+        s = self.precision + self.recall
+        return np.where(s > 0, 2 * self.precision * self.recall / np.maximum(s, 1e-12), 0.0)
+
+    def rows(self) -> List[Dict[str, float]]:
+        out = []
+        for i, t in enumerate(self.grid):
+            row = {"class_id": self.class_id, "threshold": round(float(t), 4), "count": int(self.count[i])}
+            if self.precision is not None:
+                row.update(precision=round(float(self.precision[i]), 4),
+                           recall=round(float(self.recall[i]), 4),
+                           f1=round(float(self.f1[i]), 4))
+            out.append(row)
+        return out
+
+
+def curves(dets: Detections, grid: Sequence[float] = DEFAULT_GRID,
+           tp: Optional[np.ndarray] = None, labels: Optional[Detections] = None
+           ) -> Dict[int, Curve]:
+    """One :class:`Curve` per class; pass ``tp`` (from :func:`match`) and ``labels`` for PR."""
+    grid = np.asarray(grid, np.float32)
+    num_classes = max(dets.num_classes, labels.num_classes if labels is not None else 0)
+    gt = (np.bincount(labels.class_id, minlength=num_classes) if labels is not None else None)
+    out = {}
+    for c in range(num_classes):
+        sel = dets.class_id == c
+        conf = dets.confidence[sel]
+        order = np.argsort(-conf, kind="stable")
+        conf = conf[order]
+        # Detections at or above each threshold: a prefix of the sorted list.
+        n = np.searchsorted(-conf, -grid, side="right")
+        curve = Curve(c, grid, n)
+        if tp is not None and gt is not None:
+            cum_tp = np.concatenate([[0], np.cumsum(tp[sel][order])])[n]
+            curve.precision = np.where(n > 0, cum_tp / np.maximum(n, 1), 1.0)
+            curve.recall = cum_tp / gt[c] if gt[c] else np.zeros(len(grid))
+        out[c] = curve
+    return out
+
+
+def tensor_curves(rec: TensorRecording, grid: Sequence[float] = DEFAULT_GRID,
+                  labels: Optional[Detections] = None,
+                  index: Optional[Dict[Tuple[int, int], int]] = None, iou: float = 0.5,
+                  **parse_kwargs) -> Dict[int, Curve]:
+    """Exact :func:`curves` from raw tensors: one parse per grid threshold.
+
+    Every class is evaluated at the same threshold per parse; classes are
+    clustered independently, so that equals evaluating each separately.
+    """
+    grid = np.asarray(grid, np.float32)
+    index = {} if index is None else index
+    num_classes = max(rec.num_classes, labels.num_classes if labels is not None else 0)
+    gt = np.bincount(labels.class_id, minlength=num_classes) if labels is not None else None
+    count = np.zeros((num_classes, len(grid)), np.int64)
+    hits = np.zeros((num_classes, len(grid)), np.int64)
+    for g, t in enumerate(grid):
+        dets = Detections.from_tensors(rec, float(t), index, **parse_kwargs)
+        count[:, g] = np.bincount(dets.class_id, minlength=num_classes)[:num_classes]
+        if labels is not None:
+            tp = match(dets, labels, iou)
+            hits[:, g] = np.bincount(dets.class_id[tp], minlength=num_classes)[:num_classes]
+    out = {}
+    for c in range(num_classes):
+        curve = Curve(c, grid, count[c])
+        if gt is not None:
+            curve.precision = np.where(count[c] > 0, hits[c] / np.maximum(count[c], 1), 1.0)
+            curve.recall = hits[c] / gt[c] if gt[c] else np.zeros(len(grid))
+        out[c] = curve
+    return out
+
+
+def pick(curve: Curve, objective: str = "f1", min_precision: float = 0.9) -> float:
+    """Threshold for one class: best F1, or the lowest reaching ``min_precision``."""
+    if curve.precision is None:
+        raise ValueError("picking a threshold needs labels")
+    if objective == "f1":
+        return round(float(curve.grid[int(np.argmax(curve.f1))]), 4)
+    if objective == "precision":
+        ok = np.nonzero(curve.precision >= min_precision)[0]
+        return round(float(curve.grid[ok[0]] if len(ok) else curve.grid[-1]), 4)
+    raise ValueError("unknown objective %r" % objective)
+
+
+def _group(cfg: DSConfig) -> str:
+    return "property" if cfg.has_group("property") else ""
+
+
+def read_thresholds(path: str) -> List[float]:
+    cfg = DSConfig.read(path)
+    return [float(v) for v in cfg.get_list(_group(cfg), KEY)]
+
+
+def write_thresholds(path: str, thresholds: Sequence[float]) -> None:
+    """Write ``class-thresholds`` (and any ``[class-attrs-N] threshold``) into ``path``."""
+    cfg = DSConfig.read(path)
+    values = [round(float(t), 4) for t in thresholds]
+    set_key(path, _group(cfg), KEY, values)
+    # DeepStream 4.0 per-class groups take precedence over the list.
+    for c, t in enumerate(values):
+        group = "class-attrs-%d" % c
+        if cfg.has_group(group) and cfg.get(group, "threshold") is not None:
+            set_key(path, group, "threshold", t)
+
+
+def permissive_config(src: str, dst: str, floor: float = 0.01,
+                      tensor_meta: bool = False) -> None:
+    """Copy ``src`` to ``dst`` with every class threshold lowered to ``floor``.
+
+    ``tensor_meta`` also sets ``output-tensor-meta=1`` so a
+    :class:`TensorRecorder` can record the raw outputs.
+    """
+    shutil.copyfile(src, dst)
+    cfg = DSConfig.read(dst)
+    n = cfg.get_int(_group(cfg), "num-detected-classes") or len(read_thresholds(dst)) or 4
+    write_thresholds(dst, [floor] * n)
+    if tensor_meta:
+        set_key(dst, _group(cfg), "output-tensor-meta", 1)
+
+
+def _parse_set(text: str) -> List[float]:
+    return [float(v) for v in text.replace(",", ";").split(";") if v.strip()]
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+    import time
+
+    parser = argparse.ArgumentParser(description="Tune class-thresholds on recorded detections.")
+    parser.add_argument("recording", nargs="?",
+                        help="metadata recording made with a permissive config, or a "
+                             ".npz of raw tensors (TensorRecorder) for exact results")
+    parser.add_argument("--labels", help="ground-truth recording (same frames)")
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--grid", type=float, default=0.05, help="threshold step")
+    parser.add_argument("--eval", metavar="T0;T1;..", help="evaluate one threshold set")
+    parser.add_argument("--pick", choices=("f1", "precision"), help="choose per class")
+    parser.add_argument("--min-precision", type=float, default=0.9)
+    parser.add_argument("--write", metavar="CONFIG", help="write chosen/evaluated set back")
+    parser.add_argument("--permissive", nargs=2, metavar=("SRC", "DST"),
+                        help="write a recording config with thresholds at --floor")
+    parser.add_argument("--floor", type=float, default=0.01)
+    parser.add_argument("--tensor-meta", action="store_true",
+                        help="with --permissive: also set output-tensor-meta=1")
+    parser.add_argument("--cluster", choices=("nms", "group"), default="nms",
+                        help="clustering for .npz recordings")
+    args = parser.parse_args(argv)
+
+    if args.permissive:
+        permissive_config(args.permissive[0], args.permissive[1], args.floor,
+                          args.tensor_meta)
+        print("wrote %s with %s=%s" % (args.permissive[1], KEY, args.floor))
+        return 0
+    if not args.recording:
+        parser.error("a recording is required")
+
+    index: Dict[Tuple[int, int], int] = {}
+    tensors = TensorRecording.load(args.recording) if args.recording.endswith(".npz") else None
+    if tensors is not None:
+        for key in tensors.frames:
+            index.setdefault(key, len(index))
+        dets = Detections.from_tensors(tensors, args.floor, index, cluster=args.cluster)
+    else:
+        dets = Detections.from_recording(args.recording, index)
+    labels = Detections.from_recording(args.labels, index) if args.labels else None
+    tp = match(dets, labels, args.iou) if labels is not None else None
+    grid = np.round(np.arange(args.grid, 1.0, args.grid), 4)
+
+    start = time.perf_counter()
+    if tensors is not None:
+        table = tensor_curves(tensors, grid, labels, index, args.iou, cluster=args.cluster)
+    else:
+        table = curves(dets, grid, tp, labels)
+    elapsed = time.perf_counter() - start
+    for curve in table.values():
+        for row in curve.rows():
+            row["class"] = class_label(row["class_id"])
+            print(json.dumps(row))
+    print("%d detections, %d classes x %d thresholds in %.1f ms"
+          % (len(dets), len(table), len(grid), elapsed * 1e3))
+
+    chosen = None
+    if args.eval:
+        chosen = _parse_set(args.eval)
+        start = time.perf_counter()
+        if tensors is not None:
+            per_class = counts(Detections.from_tensors(
+                tensors, threshold_vector(chosen, tensors.num_classes)[:tensors.num_classes],
+                index, cluster=args.cluster), 0.0)
+        else:
+            per_class = counts(dets, chosen)
+        print(json.dumps({"thresholds": chosen, "counts": per_class.tolist(),
+                          "ms": round((time.perf_counter() - start) * 1e3, 3)}))
+    elif args.pick:
+        chosen = [pick(table[c], args.pick, args.min_precision) for c in sorted(table)]
+        print(json.dumps({"picked": chosen, "objective": args.pick}))
+    if args.write:
+        if chosen is None:
+            parser.error("--write needs --eval or --pick")
+        write_thresholds(args.write, chosen)
+        print("updated %s in %s" % (KEY, args.write))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
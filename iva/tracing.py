@@ -0,0 +1,296 @@
+"""Sampled, low-overhead buffer tracing into a binary ring buffer.
+
+``GST_DEBUG="GST_SCHEDULING:7"`` (section 11.4) logs every chain call of
+every buffer, which perturbs the throughput being measured and produces
+gigabytes of text. :class:`SampledTracer` traces only 1 in ``every_n``
+buffers, optionally only for selected ``source_ids``, and stores each
+entry/exit of a sampled buffer as a fixed 24-byte record in a preallocated
+ring. Nothing is written to disk until :meth:`SampledTracer.dump` is
+called, e.g. from the ``SIGUSR1`` handler installed by
+:func:`install_dump_signal`.
+
+The sampling decision is taken once, at the element a buffer first enters
+(the head of its branch, normally the decoder), and remembered by
+``(source_id, pts)`` so every downstream element records the same
+buffers – two cameras that happen to produce the same pts stay apart.
+Elements after ``nvstreammux`` carry frames of every source; they record
+each sampled frame whose pts matches the batch. Probes run on several
+streaming threads, so the ring and the sampling state are locked.
+
+Configure from the environment with ``IVA_TRACE="every=100,sources=0;3,capacity=65536"``
+and read a dump with ``python -m iva.tracing trace.bin``.
+"""
+
+import json
+import os
+import signal
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .metrics import buffer_key
+
+MAGIC = b"IVATRC1\0"
+HEADER = struct.Struct("<8sIIQI")  # magic, record size, capacity, written, names length
+RECORD = struct.Struct("<QQIHBx")  # t_ns, pts, seq, element, event
+
+EVENT_ENTER = 0
+EVENT_EXIT = 1
+
+TraceRecord = namedtuple("TraceRecord", "t_ns pts seq element event")
+
+# Sampled (source_id, pts) keys remembered for downstream elements.
+MAX_SAMPLED_IN_FLIGHT = 1024
+
+
+class TraceRing:
+    """Fixed-capacity ring of :data:`RECORD` entries in one ``bytearray``."""
+
+    def __init__(self, capacity: int = 65536):
+        self.capacity = capacity
+        self.buf = bytearray(capacity * RECORD.size)
+        self.written = 0
+        self._lock = threading.Lock()
+
+    def append(self, t_ns: int, pts: int, seq: int, element: int, event: int) -> None:
+        with self._lock:
+            offset = (self.written % self.capacity) * RECORD.size
+            RECORD.pack_into(self.buf, offset, t_ns, pts & 0xFFFFFFFFFFFFFFFF,
+                             seq & 0xFFFFFFFF, element, event)
+            self.written += 1
+
+    def records(self) -> List[TraceRecord]:
+        """Records still in the ring, oldest first."""
+        return [TraceRecord(*r) for r in RECORD.iter_unpack(self.raw())]
+
+    def raw(self) -> bytes:
+        """Ring contents in chronological order, as packed records."""
+        return self.snapshot()[1]
+
+    def snapshot(self) -> Tuple[int, bytes]:
+        """``(written, raw())`` taken consistently while probes append."""
+        with self._lock:
+            if self.written <= self.capacity:
+                return self.written, bytes(self.buf[:self.written * RECORD.size])
+            split = (self.written % self.capacity) * RECORD.size
+            return self.written, bytes(self.buf[split:] + self.buf[:split])
+
+
+class SampledTracer:
+    """Trace 1 in ``every_n`` buffers (per source) into a :class:`TraceRing`."""
+
+    def __init__(self, every_n: int = 100,
+                 source_ids: Optional[Iterable[int]] = None,
+                 capacity: int = 65536):
+        if every_n < 1:
+            raise ValueError("every_n must be >= 1")
+        self.every_n = every_n
+        self.source_ids = set(source_ids) if source_ids is not None else None
+        self.ring = TraceRing(capacity)
+        self.elements: List[str] = []
+        self._element_ids: Dict[str, int] = {}
+        self._counters: Dict[Optional[int], int] = {}
+        self._sampled: "OrderedDict[Tuple[Optional[int], int], int]" = OrderedDict()
+        self._by_pts: Dict[int, List[int]] = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._dump_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, var: str = "IVA_TRACE") -> Optional["SampledTracer"]:
+        """Build a tracer from ``$IVA_TRACE``; None when the variable is unset."""
+        spec = os.environ.get(var)
+        if not spec:
+            return None
+        kwargs = {}
+        for item in spec.split(","):
+            key, _, value = item.partition("=")
+            key = key.strip()
+            if key == "every":
+                kwargs["every_n"] = int(value)
+            elif key == "sources":
+                kwargs["source_ids"] = [int(v) for v in value.split(";") if v]
+            elif key == "capacity":
+                kwargs["capacity"] = int(value)
+            else:
+                raise ValueError("unknown %s key %r" % (var, key))
+        return cls(**kwargs)
+
+    def element_id(self, name: str) -> int:
+        eid = self._element_ids.get(name)
+        if eid is None:
+            eid = self._element_ids[name] = len(self.elements)
+            self.elements.append(name)
+        return eid
+
+    # -- hot path ----------------------------------------------------------
+
+    def sample(self, key: int, source_id: Optional[int] = None) -> bool:
+        """Head-of-branch decision for one buffer; remembers sampled keys."""
+        if self.source_ids is not None and source_id not in self.source_ids:
+            return False
+        with self._lock:
+            n = self._counters.get(source_id, 0)
+            self._counters[source_id] = n + 1
+            if n % self.every_n:
+                return False
+            self._seq += 1
+            self._forget((source_id, key))
+            self._sampled[(source_id, key)] = self._seq
+            self._by_pts.setdefault(key, []).append(self._seq)
+            if len(self._sampled) > MAX_SAMPLED_IN_FLIGHT:
+                self._forget(next(iter(self._sampled)))
+        return True
+
+    def _forget(self, sampled_key: Tuple[Optional[int], int]) -> None:
+        seq = self._sampled.pop(sampled_key, None)
+        if seq is None:
+            return
+        seqs = self._by_pts[sampled_key[1]]
+        seqs.remove(seq)
+        if not seqs:
+            del self._by_pts[sampled_key[1]]
+
+    def record(self, element: int, key: int, event: int,
+               source_id: Optional[int] = None) -> None:
+        """Record ``event`` for ``key`` if that buffer was sampled upstream.
+
+        Without ``source_id`` (an element shared by all sources) every
+        sampled frame with that pts is recorded.
+        """
+        with self._lock:
+            if source_id is None:
+                seqs = tuple(self._by_pts.get(key, ()))
+            else:
+                seq = self._sampled.get((source_id, key))
+                seqs = (seq,) if seq is not None else ()
+        if seqs:
+            t_ns = time.monotonic_ns()
+            for seq in seqs:
+                self.ring.append(t_ns, key, seq, element, event)
+
+    # -- GStreamer glue ----------------------------------------------------
+
+    def trace_element(self, element, head: bool = False,
+                      source_id: Optional[int] = None) -> bool:
+        """Attach tracing probes to ``element``'s sink and src pads.
+
+        ``head=True`` marks the first element of a branch, where the
+        sampling decision is taken; ``source_id`` names the stream that
+        branch carries so ``source_ids`` filtering can apply and samples
+        of different sources stay apart. Leave it None for elements after
+        the muxer.
+        """
+        from gi.repository import Gst
+
+        sink = element.get_static_pad("sink")
+        src = element.get_static_pad("src")
+        if sink is None and src is None:
+            return False
+        eid = self.element_id(element.get_name())
+
+        def on_enter(pad, info):
+            buf = info.get_buffer()
+            if buf is not None:
+                key = buffer_key(buf)
+                if head:
+                    self.sample(key, source_id)
+                self.record(eid, key, EVENT_ENTER, source_id)
+            return Gst.PadProbeReturn.OK
+
+        def on_exit(pad, info):
+            buf = info.get_buffer()
+            if buf is not None:
+                self.record(eid, buffer_key(buf), EVENT_EXIT, source_id)
+            return Gst.PadProbeReturn.OK
+
+        if sink is not None:
+            sink.add_probe(Gst.PadProbeType.BUFFER, on_enter)
+        if src is not None:
+            src.add_probe(Gst.PadProbeType.BUFFER, on_exit)
+        return True
+
+    # -- dumping -----------------------------------------------------------
+
+    def dump(self, path: str) -> int:
+        """Write the ring to ``path``; returns the number of records written."""
+        with self._dump_lock:
+            names = json.dumps(self.elements).encode()
+            written, raw = self.ring.snapshot()
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as fp:
+                fp.write(HEADER.pack(MAGIC, RECORD.size, self.ring.capacity,
+                                     written, len(names)))
+                fp.write(names)
+                fp.write(raw)
+            os.replace(tmp, path)
+            return len(raw) // RECORD.size
+
+
+def load(path: str) -> Tuple[List[str], List[TraceRecord]]:
+    """Read a dump back as ``(element names, records)``."""
+    with open(path, "rb") as fp:
+        magic, rec_size, _capacity, _written, names_len = HEADER.unpack(
+            fp.read(HEADER.size))
+        if magic != MAGIC or rec_size != RECORD.size:
+            raise ValueError("%s is not an iva trace dump" % path)
+        names = json.loads(fp.read(names_len).decode())
+        data = fp.read()
+    records = [TraceRecord(*r) for r in RECORD.iter_unpack(data)]
+    return names, records
+
+
+def element_latencies(names: Sequence[str],
+                      records: Iterable[TraceRecord]) -> Dict[str, List[float]]:
+    """Pair enter/exit records per (buffer, element) into latencies in seconds."""
+    entered: Dict[Tuple[int, int], int] = {}
+    out: Dict[str, List[float]] = {}
+    for r in records:
+        if r.event == EVENT_ENTER:
+            entered[(r.seq, r.element)] = r.t_ns
+        else:
+            t0 = entered.pop((r.seq, r.element), None)
+            if t0 is not None:
+                out.setdefault(names[r.element], []).append((r.t_ns - t0) / 1e9)
+    return out
+
+
+def install_dump_signal(tracer: SampledTracer, path: str,
+                        signum: int = signal.SIGUSR1) -> None:
+    """Dump ``tracer`` to ``path`` whenever the process receives ``signum``.
+
+    ``path`` may contain ``{time}`` to keep one file per dump.
+    """
+    def handler(_signum, _frame):
+        tracer.dump(path.format(time=int(time.time())))
+
+    signal.signal(signum, handler)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print a sampled trace dump.")
+    parser.add_argument("dump")
+    parser.add_argument("--records", action="store_true",
+                        help="print every record, not only the summary")
+    args = parser.parse_args(argv)
+
+    names, records = load(args.dump)
+    if args.records:
+        for r in records:
+            print("%d.%09d  seq=%-6d pts=%-14d %-5s %s" % (
+                r.t_ns // 10**9, r.t_ns % 10**9, r.seq, r.pts,
+                "enter" if r.event == EVENT_ENTER else "exit", names[r.element]))
+    for name, lat in sorted(element_latencies(names, records).items()):
+        lat.sort()
+        print("%-24s n=%-6d p50=%.3fms p99=%.3fms max=%.3fms" % (
+            name, len(lat), lat[len(lat) // 2] * 1e3,
+            lat[min(len(lat) - 1, int(len(lat) * 0.99))] * 1e3, lat[-1] * 1e3))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
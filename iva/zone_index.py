@@ -0,0 +1,293 @@
+"""Spatial indexes for hit-testing footpoints against many zone polygons.
+
+Testing every object against every polygon (:class:`iva.analytics.PolygonZones`,
+or :func:`iva.clip_recorder._inside` per object) costs objects x zones x
+edges per frame, which does not scale to dozens of ROIs on hundreds of
+cameras. Both indexes here are built once per camera and answer a whole
+frame of footpoints in one vectorized call:
+
+* :class:`GridZoneIndex` (exact) – a uniform grid over the zones' bounds.
+  Each cell lists the zones that cover it completely and, for zones whose
+  border passes through it, the polygon edges crossing the cell plus
+  whether the cell's reference point is inside. A point inside a
+  "border" cell is then inside iff the reference point is, XOR an odd
+  number of those few edges cross the segment between them. Points lying
+  exactly on a border may resolve either way.
+* :class:`RasterZoneIndex` (approximate) – zone membership rasterized into
+  bit-packed masks at tracker resolution; a query is one gather and an
+  unpack. Exact up to the raster step at zone borders.
+
+Both offer ``contains(xs, ys) -> [n, zones]`` (the interface
+:class:`iva.analytics.AnalyticsEngine` expects) and
+``pairs(xs, ys) -> (point_index, zone_index)``.
+``python -m iva.zone_index`` benchmarks them against brute force at 10,
+100 and 1000 zones.
+"""
+
+import math
+import time
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from .analytics import PolygonZones, Zone, points_in_polygon
+
+# Offset of a cell's reference point from its corner, in cells; irrational
+# enough that it never lands exactly on a polygon edge or vertex.
+_REF = 0.5 + 1.0 / (2 * math.pi * 97)
+
+
+def _ranges(starts: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenated ``arange(start, start + count)``; returns (indices, owner)."""
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(counts)), counts)
+    if total == 0:
+        return np.zeros(0, np.int64), owner
+    first = np.cumsum(counts) - counts
+    idx = np.arange(total) - np.repeat(first, counts) + np.repeat(starts, counts)
+    return idx, owner
+
+
+def _csr(rows: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    ptr = np.zeros(len(rows) + 1, np.int64)
+    ptr[1:] = np.cumsum([len(r) for r in rows])
+    data = np.fromiter((v for r in rows for v in r), np.int64, int(ptr[-1]))
+    return ptr, data
+
+
+def _segment_hits_boxes(x1, y1, x2, y2, bx0, by0, bx1, by1) -> np.ndarray:
+    """Whether segment (x1,y1)-(x2,y2) intersects each axis-aligned box (Liang–Barsky)."""
+    dx, dy = x2 - x1, y2 - y1
+    t0 = np.zeros(len(bx0))
+    t1 = np.ones(len(bx0))
+    ok = np.ones(len(bx0), dtype=bool)
+    for p, q0, q1 in ((dx, bx0 - x1, bx1 - x1), (dy, by0 - y1, by1 - y1)):
+        if p == 0:
+            ok &= (q0 <= 0) & (q1 >= 0)
+            continue
+        a, b = q0 / p, q1 / p
+        lo, hi = np.minimum(a, b), np.maximum(a, b)
+        t0 = np.maximum(t0, lo)
+        t1 = np.minimum(t1, hi)
+    return ok & (t0 <= t1)
+
+
+def _bounds(zones: Sequence[Zone]) -> Tuple[float, float, float, float]:
+    pts = np.array([p for z in zones for p in z.polygon], dtype=np.float64)
+    return pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max()
+
+
+class GridZoneIndex:
+    """Exact uniform-grid index over zone polygons."""
+
+    def __init__(self, zones: Sequence[Zone], cell: float = 0.0):
+        self.zones = list(zones)
+        n_zones = len(self.zones)
+        if not n_zones:
+            raise ValueError("no zones")
+        x0, y0, x1, y1 = _bounds(self.zones)
+        if not cell:
+            # About 16 cells per zone keeps border lists short.
+            cell = math.sqrt(max(1.0, (x1 - x0) * (y1 - y0)) / (16 * n_zones))
+            cell = min(128.0, max(4.0, cell))
+        self.cell = float(cell)
+        self.x0, self.y0 = x0, y0
+        self.gw = max(1, int(math.ceil((x1 - x0) / cell)) + 1)
+        self.gh = max(1, int(math.ceil((y1 - y0) / cell)) + 1)
+        n_cells = self.gw * self.gh
+
+        interior: List[List[int]] = [[] for _ in range(n_cells)]
+        entries: Dict[Tuple[int, int], List[Tuple[float, float, float, float]]] = {}
+        for zi, zone in enumerate(self.zones):
+            poly = np.asarray(zone.polygon, dtype=np.float64)
+            cx0, cy0 = self._cell_xy(poly[:, 0].min(), poly[:, 1].min())
+            cx1, cy1 = self._cell_xy(poly[:, 0].max(), poly[:, 1].max())
+            gx, gy = np.meshgrid(np.arange(cx0, cx1 + 1), np.arange(cy0, cy1 + 1))
+            gx, gy = gx.ravel(), gy.ravel()
+            bx0 = x0 + gx * cell
+            by0 = y0 + gy * cell
+            border = np.zeros(len(gx), dtype=bool)
+            for k in range(len(poly)):
+                ex1, ey1 = poly[k]
+                ex2, ey2 = poly[(k + 1) % len(poly)]
+                hit = _segment_hits_boxes(ex1, ey1, ex2, ey2, bx0, by0, bx0 + cell, by0 + cell)
+                border |= hit
+                for c in np.nonzero(hit)[0]:
+                    key = (int(gy[c] * self.gw + gx[c]), zi)
+                    entries.setdefault(key, []).append((ex1, ey1, ex2, ey2))
+            # Cells the border misses are wholly inside or outside.
+            whole = ~border
+            inside = points_in_polygon(bx0[whole] + cell / 2, by0[whole] + cell / 2, zone.polygon)
+            for c in np.nonzero(whole)[0][inside]:
+                interior[int(gy[c] * self.gw + gx[c])].append(zi)
+
+        self.int_ptr, self.int_zone = _csr(interior)
+        keys = sorted(entries)
+        per_cell: List[List[int]] = [[] for _ in range(n_cells)]
+        for e, (c, _) in enumerate(keys):
+            per_cell[c].append(e)
+        self.bnd_ptr, self.bnd_entry = _csr(per_cell)
+        self.entry_zone = np.array([z for _, z in keys], np.int64)
+        cells = np.array([c for c, _ in keys], np.int64)
+        self.entry_rx = x0 + (cells % self.gw + _REF) * cell
+        self.entry_ry = y0 + (cells // self.gw + _REF) * cell
+        self.entry_ref_inside = np.zeros(len(keys), dtype=bool)
+        for zi, zone in enumerate(self.zones):
+            m = self.entry_zone == zi
+            if m.any():
+                self.entry_ref_inside[m] = points_in_polygon(
+                    self.entry_rx[m], self.entry_ry[m], zone.polygon)
+        # Edges crossing each entry's cell, stored contiguously in entry order.
+        self.edge_ptr = np.zeros(len(keys) + 1, np.int64)
+        self.edge_ptr[1:] = np.cumsum([len(entries[k]) for k in keys])
+        self.edges = np.array([e for k in keys for e in entries[k]], np.float64).reshape(-1, 4)
+
+    def _cell_xy(self, x: float, y: float) -> Tuple[int, int]:
+        return (min(self.gw - 1, max(0, int((x - self.x0) // self.cell))),
+                min(self.gh - 1, max(0, int((y - self.y0) // self.cell))))
+
+    def pairs(self, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        xs = np.asarray(xs, np.float64)
+        ys = np.asarray(ys, np.float64)
+        cx = np.floor((xs - self.x0) / self.cell).astype(np.int64)
+        cy = np.floor((ys - self.y0) / self.cell).astype(np.int64)
+        valid = (cx >= 0) & (cx < self.gw) & (cy >= 0) & (cy < self.gh)
+        pts = np.nonzero(valid)[0]
+        cells = cy[pts] * self.gw + cx[pts]
+
+        # Cells wholly inside a zone.
+        starts = self.int_ptr[cells]
+        idx, owner = _ranges(starts, self.int_ptr[cells + 1] - starts)
+        in_pts, in_zones = pts[owner], self.int_zone[idx]
+
+        # Border cells: parity of cell edges crossed between reference point and point.
+        starts = self.bnd_ptr[cells]
+        idx, owner = _ranges(starts, self.bnd_ptr[cells + 1] - starts)
+        if len(idx):
+            entry = self.bnd_entry[idx]
+            bpts = pts[owner]
+            estart = self.edge_ptr[entry]
+            eidx, eowner = _ranges(estart, self.edge_ptr[entry + 1] - estart)
+            e = self.edges[eidx]
+            px, py = xs[bpts][eowner], ys[bpts][eowner]
+            rx, ry = self.entry_rx[entry][eowner], self.entry_ry[entry][eowner]
+            o1 = (rx - px) * (e[:, 1] - py) - (ry - py) * (e[:, 0] - px)
+            o2 = (rx - px) * (e[:, 3] - py) - (ry - py) * (e[:, 2] - px)
+            o3 = (e[:, 2] - e[:, 0]) * (py - e[:, 1]) - (e[:, 3] - e[:, 1]) * (px - e[:, 0])
+            o4 = (e[:, 2] - e[:, 0]) * (ry - e[:, 1]) - (e[:, 3] - e[:, 1]) * (rx - e[:, 0])
+            cross = ((o1 > 0) != (o2 > 0)) & ((o3 > 0) != (o4 > 0))
+            parity = np.bincount(eowner, weights=cross, minlength=len(entry)).astype(np.int64) & 1
+            inside = self.entry_ref_inside[entry] ^ parity.astype(bool)
+            in_pts = np.concatenate([in_pts, bpts[inside]])
+            in_zones = np.concatenate([in_zones, self.entry_zone[entry][inside]])
+        return in_pts, in_zones
+
+    def contains(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        out = np.zeros((len(xs), len(self.zones)), dtype=bool)
+        p, z = self.pairs(xs, ys)
+        out[p, z] = True
+        return out
+
+
+class RasterZoneIndex:
+    """Zone membership rasterized at ``scale`` of a ``width`` x ``height`` frame."""
+
+    def __init__(self, zones: Sequence[Zone], width: int, height: int, scale: float = 0.5):
+        self.zones = list(zones)
+        self.scale = scale
+        self.w = max(1, int(round(width * scale)))
+        self.h = max(1, int(round(height * scale)))
+        nbytes = (len(self.zones) + 7) // 8
+        bits = np.zeros((self.h * self.w, nbytes * 8), dtype=bool)
+        for zi, zone in enumerate(self.zones):
+            poly = np.asarray(zone.polygon) * scale
+            px0 = max(0, int(np.floor(poly[:, 0].min())))
+            px1 = min(self.w - 1, int(np.ceil(poly[:, 0].max())))
+            py0 = max(0, int(np.floor(poly[:, 1].min())))
+            py1 = min(self.h - 1, int(np.ceil(poly[:, 1].max())))
+            if px0 > px1 or py0 > py1:
+                continue
+            gx, gy = np.meshgrid(np.arange(px0, px1 + 1), np.arange(py0, py1 + 1))
+            # Pixel centres, back in frame coordinates.
+            inside = points_in_polygon((gx.ravel() + 0.5) / scale, (gy.ravel() + 0.5) / scale,
+                                       zone.polygon)
+            bits[(gy.ravel() * self.w + gx.ravel())[inside], zi] = True
+        self.masks = np.packbits(bits, axis=1)  # [pixels, nbytes]
+
+    def contains(self, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+        px = np.floor(np.asarray(xs) * self.scale).astype(np.int64)
+        py = np.floor(np.asarray(ys) * self.scale).astype(np.int64)
+        valid = (px >= 0) & (px < self.w) & (py >= 0) & (py < self.h)
+        rows = np.where(valid, py * self.w + px, 0)
+        out = np.unpackbits(self.masks[rows], axis=1)[:, :len(self.zones)].astype(bool)
+        out[~valid] = False
+        return out
+
+    def pairs(self, xs: np.ndarray, ys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return np.nonzero(self.contains(xs, ys))
+
+
+def random_zones(n: int, width: int = 1280, height: int = 720, seed: int = 0,
+                 vertices: int = 6) -> List[Zone]:
+    """Random star-shaped polygons sized so ``n`` of them roughly tile the frame."""
+    rng = np.random.default_rng(seed)
+    radius = math.sqrt(width * height / n) * 0.7
+    zones = []
+    for i in range(n):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        angles = np.sort(rng.uniform(0, 2 * math.pi, vertices))
+        r = rng.uniform(0.4, 1.0, vertices) * radius
+        zones.append(Zone("z%d" % i, tuple(zip(cx + r * np.cos(angles),
+                                                cy + r * np.sin(angles)))))
+    return zones
+
+
+def bench(zone_counts: Sequence[int] = (10, 100, 1000), points: int = 500,
+          repeats: int = 5, width: int = 1280, height: int = 720) -> List[Dict[str, float]]:
+    """Time one frame of ``points`` footpoints per method; check agreement."""
+    rng = np.random.default_rng(1)
+    xs = rng.uniform(0, width, points)
+    ys = rng.uniform(0, height, points)
+    rows = []
+    for n in zone_counts:
+        zones = random_zones(n, width, height)
+        t = time.perf_counter()
+        grid = GridZoneIndex(zones)
+        build_grid = time.perf_counter() - t
+        t = time.perf_counter()
+        raster = RasterZoneIndex(zones, width, height)
+        build_raster = time.perf_counter() - t
+        brute = PolygonZones(zones)
+        row = {"zones": n, "points": points, "grid_build_s": round(build_grid, 3),
+               "raster_build_s": round(build_raster, 3)}
+        results = {}
+        for name, index in (("brute", brute), ("grid", grid), ("raster", raster)):
+            best = float("inf")
+            for _ in range(repeats):
+                t = time.perf_counter()
+                results[name] = index.contains(xs, ys)
+                best = min(best, time.perf_counter() - t)
+            row[name + "_ms"] = round(best * 1e3, 3)
+        row["grid_exact"] = bool((results["grid"] == results["brute"]).all())
+        row["raster_agreement"] = round(float((results["raster"] == results["brute"]).mean()), 5)
+        row["speedup_grid"] = round(row["brute_ms"] / row["grid_ms"], 1)
+        row["speedup_raster"] = round(row["brute_ms"] / row["raster_ms"], 1)
+        rows.append(row)
+    return rows
+
+
+def main(argv=None) -> int:
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Benchmark zone indexes against brute force.")
+    parser.add_argument("--zones", type=int, nargs="*", default=[10, 100, 1000])
+    parser.add_argument("--points", type=int, default=500)
+    args = parser.parse_args(argv)
+    for row in bench(args.zones, args.points):
+        print(json.dumps(row))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,128 @@
+import json
+import queue
+import socket
+import time
+
+import pytest
+
+from iva.aggregate import (NS, Aggregator, LineBroker, WindowedCounts, format_timestamp,
+                           iter_json_objects, parse_payload, parse_timestamp)
+
+T0 = 1_700_000_040 * NS  # a minute boundary
+
+
+def ev(seconds, node="a", sensor="cam0", cls="Vehicle", oid="1"):
+    return (T0 + int(seconds * NS), node, sensor, cls, oid)
+
+
+def test_timestamps_round_trip():
+    ts = parse_timestamp("2023-11-14T22:14:00.123Z")
+    assert ts == T0 + 123 * 10**6
+    assert format_timestamp(ts) == "2023-11-14T22:14:00.123Z"
+    assert parse_timestamp("2023-11-14T22:14:00Z") == T0
+
+
+def test_parse_full_and_minimal_schema():
+    full = {"@timestamp": "2023-11-14T22:14:00.000Z", "sensor": {"id": "CAM_1"},
+            "object": {"id": "7", "vehicle": {"make": "x"}}}
+    assert parse_payload(full, "n1") == [(T0, "n1", "CAM_1", "vehicle", "7")]
+    minimal = {"@timestamp": "2023-11-14T22:14:00.000Z", "sensorId": 3,
+               "objects": ["5|1|2|3|4|Person", "6|1|2|3|4"]}
+    assert parse_payload(minimal, "n2") == [(T0, "n2", "3", "Person", "5"),
+                                            (T0, "n2", "3", "", "6")]
+
+
+def test_iter_json_objects_keeps_an_incomplete_tail():
+    text = '{"a": 1}\n{\n  "b": 2\n},{"c":'
+    objects, used = iter_json_objects(text)
+    assert objects == [{"a": 1}, {"b": 2}]
+    assert text[used:] == '{"c":'
+
+
+def test_merge_releases_in_event_time_order_up_to_the_watermark():
+    now = [0.0]
+    agg = Aggregator(lateness=2.0, idle_timeout=5.0, clock=lambda: now[0])
+    out = []
+    agg.consumers.append(out.append)
+    agg.ingest("a", [ev(10, "a"), ev(11, "a")])
+    agg.ingest("b", [ev(9, "b"), ev(12, "b")])
+    # Watermarks a=9s, b=10s: only events at or before 9s are safe.
+    assert agg.advance() == 1
+    agg.ingest("a", [ev(20, "a")])
+    agg.ingest("b", [ev(19, "b")])
+    agg.advance()
+    assert [e[0] for e in out] == [T0 + s * NS for s in (9, 10, 11, 12)]
+    agg.ingest("a", [ev(5, "a")])
+    assert agg.merger.late == 1
+    assert agg.stats()["pending"] == 2
+
+
+def test_idle_node_stops_holding_back_the_merge():
+    now = [0.0]
+    agg = Aggregator(lateness=1.0, idle_timeout=5.0, clock=lambda: now[0])
+    agg.ingest("a", [ev(1, "a")])
+    agg.ingest("b", [ev(2, "b")])
+    now[0] = 3.0
+    agg.ingest("a", [ev(30, "a")])
+    assert agg.advance() == 1  # b's watermark (1s) still holds
+    now[0] = 6.0
+    assert agg.advance() == 1  # b idle: a's watermark (29s) alone
+    assert agg.merger.pending == 1
+
+
+def test_rollups_become_final_once_the_watermark_passes_the_window():
+    now = [0.0]
+    agg = Aggregator(window=60.0, lateness=1.0, clock=lambda: now[0])
+    agg.ingest("a", [ev(10, cls="Vehicle"), ev(20, cls="Vehicle"), ev(30, cls="Person"),
+                     ev(59, cls="Vehicle")])
+    agg.advance()
+    rows = agg.query()
+    assert [(r["class"], r["count"], r["final"]) for r in rows] == [
+        ("Person", 1, False), ("Vehicle", 2, False)]
+    agg.ingest("a", [ev(61, cls="Vehicle")])
+    agg.advance()
+    rows = agg.query(cls="Vehicle")
+    assert [(r["count"], r["final"]) for r in rows] == [(3, True)]
+    assert agg.query(since=T0 + 60 * NS) == []
+
+
+def test_windowed_counts_close_only_ended_windows():
+    counts = WindowedCounts(window=10.0)
+    counts.add(T0 + 1 * NS, "cam0", "Person")
+    counts.add(T0 + 11 * NS, "cam0", "Person")
+    assert counts.close_until(T0 + 10 * NS) == 1
+    assert [(r.window_start, r.final) for r in counts.query()] == [
+        (T0, True), (T0 + 10 * NS, False)]
+
+
+def drain(inbox, want, timeout=2.0):
+    events = []
+    deadline = time.monotonic() + timeout
+    while len(events) < want and time.monotonic() < deadline:
+        try:
+            node, batch = inbox.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        events.extend((node,) + e[1:] for e in batch)
+    return events
+
+
+def test_line_broker_skips_malformed_lines():
+    inbox = queue.Queue()
+    broker = LineBroker(inbox).start()
+    try:
+        good = json.dumps({"@timestamp": "2023-11-14T22:14:00.000Z", "sensorId": "c",
+                           "objects": ["1|0|0|1|1|Person"]})
+        with socket.create_connection(broker.address) as sock:
+            sock.sendall(b'{"node": "n1"}\n' + good.encode() + b"\nnot json\n{\"x\": 1}\n"
+                         + good.encode())  # last line has no newline
+        events = drain(inbox, 2)
+        assert events == [("n1", "n1", "c", "Person", "1")] * 2
+        with socket.create_connection(broker.address) as sock:
+            sock.sendall(b"garbage\n" + good.encode() + b"\n")
+            sock.settimeout(2.0)
+            assert sock.recv(1) == b""  # dropped without a node line
+        assert broker.rejected == 3
+        assert inbox.empty()
+    finally:
+        broker.stop()
@@ -0,0 +1,73 @@
+import pytest
+
+from iva.analytics import NS, AnalyticsEngine
+from iva.meta import FrameMeta, ObjectMeta
+
+ROIS = {"*": {"zones": [{"name": "gate", "polygon": [[0, 0], [100, 0], [100, 100], [0, 100]]}],
+              "lines": [{"name": "stop", "p1": [0, 200], "p2": [400, 200]}]}}
+
+
+def frame(n, *objects, source_id=0):
+    return FrameMeta(source_id=source_id, frame_num=n, pts=n * NS // 10, objects=list(objects))
+
+
+def at(object_id, x, y, class_id=0):
+    """An object whose footpoint is (x, y)."""
+    return ObjectMeta(class_id, x - 5.0, y - 10.0, 10.0, 10.0, object_id=object_id)
+
+
+def test_each_track_is_counted_once():
+    engine = AnalyticsEngine()
+    for n in range(50):
+        engine(frame(n, at(1, 300, 300), at(2, 310, 300, class_id=2),
+                     ObjectMeta(0, 0, 0, 1, 1)))  # untracked: ignored
+    engine(frame(50, at(1, 300, 300), source_id=1))
+    assert engine.streams[0].unique == {0: 1, 2: 1}
+    assert engine.streams[1].unique == {0: 1}
+    assert engine.summary_text(0) == "Vehicle Count=1 Person Count=1"
+
+
+def test_line_crossing_direction():
+    engine = AnalyticsEngine(ROIS)
+    kinds = []
+    engine.listeners.append(lambda e: kinds.append((e.kind, e.direction)))
+    engine(frame(0, at(1, 200, 150), at(2, 200, 260), at(3, 600, 150)))
+    engine(frame(1, at(1, 200, 250), at(2, 200, 190), at(3, 600, 250)))  # 3 misses the segment
+    engine(frame(2, at(1, 200, 200), at(2, 200, 180)))  # on the line: no side
+    engine(frame(3, at(1, 200, 260), at(2, 200, 170)))
+    crossings = engine.streams[0].crossings
+    assert crossings == {("stop", "in", 0): 1, ("stop", "out", 0): 1}
+    assert kinds.count(("cross", "in")) == 1 and kinds.count(("cross", "out")) == 1
+
+
+def test_zone_dwell_entries_exits_and_occupancy():
+    engine = AnalyticsEngine(ROIS, max_age=5, sweep_every=1)
+    engine(frame(0, at(1, 150, 50), at(2, 50, 50)))
+    assert engine.occupancy(0) == {"gate": 1}
+    exits = []
+    engine.listeners.append(lambda e: e.kind == "exit" and exits.append((e.object_id, e.dwell)))
+    for n in range(1, 30):
+        engine(frame(n, at(1, 50, 50), at(2, 50, 50)))
+    assert engine.occupancy(0) == {"gate": 2}
+    engine(frame(30, at(1, 150, 50), at(2, 50, 50)))  # 1 walks out
+    for n in range(31, 37):
+        engine(frame(n, at(1, 150, 50)))  # 2 is gone: swept after max_age frames
+    # Dwell runs from entry to the last sighting inside the zone.
+    assert exits == [(1, pytest.approx(2.8)), (2, pytest.approx(3.0))]
+    stats = engine.streams[0].dwell[("gate", 0)]
+    assert (stats.entries, stats.exits) == (2, 2)
+    assert stats.mean == pytest.approx(2.9) and stats.longest == pytest.approx(3.0)
+    assert engine.occupancy(0) == {"gate": 0}
+    assert len(engine.streams[0].table) == 1
+
+
+def test_swept_slots_are_reused():
+    engine = AnalyticsEngine(max_age=2, sweep_every=1)
+    for n in range(20):
+        engine(frame(n, at(100 + n, 10, 10)))
+    table = engine.streams[0].table
+    assert len(table) <= 3
+    assert table.high <= 4
+    assert engine.streams[0].unique[0] == 20
+    report = engine.report()["0"]
+    assert report["unique"] == {"Vehicle": 20} and report["frames"] == 20
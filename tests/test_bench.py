@@ -0,0 +1,84 @@
+import json
+import sys
+
+import pytest
+
+from iva.bench import (CASES, COUNT_PERF, COUNT_RENDERED, GST_FRAME_PATTERN, PERF_PATTERN,
+                       BenchCase, FrameLog, ShellExecutor, StubExecutor, compare, load_bundle,
+                       run_cases)
+
+
+def test_stub_executor_is_deterministic_per_case_and_seed():
+    a = StubExecutor(seed=1, frames=120).run(CASES["test1"])
+    b = StubExecutor(seed=1, frames=120).run(CASES["test1"])
+    c = StubExecutor(seed=2, frames=120).run(CASES["test1"])
+    assert a.as_dict() == b.as_dict()
+    assert a.fps != c.fps
+    assert a.frames == 120
+    assert set(a.frame_interval_ms) == {"p50", "p90", "p99", "max"}
+    # The median frame interval matches the synthetic rate.
+    assert a.frame_interval_ms["p50"] == pytest.approx(1e3 / a.fps, rel=0.05)
+    assert set(a.config_hashes) == set(CASES["test1"].configs)
+
+
+def test_run_cases_bundle_compares_clean_against_itself():
+    bundle = run_cases(list(CASES), StubExecutor(), repeat=3)
+    assert bundle["executor"] == "StubExecutor"
+    assert set(bundle["cases"]) == set(CASES)
+    assert all(case["runs"] == 3 for case in bundle["cases"].values())
+    assert compare(bundle, bundle) == []
+
+
+def test_compare_flags_slowdown_and_missing_case():
+    base = run_cases(["test1", "mux", "app4"], StubExecutor())
+    new = run_cases(["test1", "mux"], StubExecutor(slowdown={"mux": 1.5}))
+    kinds = {(f.case, f.metric, f.kind) for f in compare(base, new)}
+    assert ("mux", "fps", "regression") in kinds
+    assert ("mux", "interval_p50", "regression") in kinds
+    assert ("app4", "-", "missing") in kinds
+    assert not any(case == "test1" for case, _, _ in kinds)
+
+
+def test_load_bundle_upgrades_version_1(tmp_path):
+    bundle = run_cases(["test1"], StubExecutor())
+    old = json.loads(json.dumps(bundle))
+    old["version"] = 1
+    case = old["cases"]["test1"]
+    case["latency_ms"] = case.pop("frame_interval_ms")
+    path = tmp_path / "old.json"
+    path.write_text(json.dumps(old))
+    loaded = load_bundle(str(path))
+    assert loaded["cases"]["test1"]["frame_interval_ms"] == bundle["cases"]["test1"]["frame_interval_ms"]
+    assert compare(loaded, bundle) == []
+
+
+def test_frame_log_rendered_and_perf_counters():
+    log = FrameLog(GST_FRAME_PATTERN, COUNT_RENDERED)
+    for t, n in ((1.0, 10), (2.0, 40), (3.0, 70)):
+        log.feed("/GstPipeline:pipeline0/GstFPSDisplaySink:bench: last-message = "
+                 "rendered: %d, dropped: 0, current: 30.00, average: 30.00" % n, t)
+    log.feed("/GstPipeline:pipeline0/GstFPSDisplaySink:bench.GstGhostPad:sink: caps = x", 3.5)
+    assert log.frames == 70
+    assert log.fps() == pytest.approx(30.0)
+    assert log.intervals_ms() == pytest.approx([1e3 / 30] * 2)
+
+    log = FrameLog(PERF_PATTERN, COUNT_PERF)
+    log.feed("**PERF: FPS 0 (Avg)\tFPS 1 (Avg)", 0.0)
+    for t in (5.0, 10.0, 15.0):
+        log.feed("**PERF: 30.00 (29.90)\t20.00 (19.90)", t)
+    assert log.frames == 500
+    assert log.fps() == pytest.approx(50.0)
+
+
+def test_shell_executor_counts_printed_frames(tmp_path):
+    script = tmp_path / "app.py"
+    script.write_text("import time\n"
+                      "for i in range(20):\n"
+                      "    print('Frame Number = %d' % i, flush=True)\n"
+                      "    time.sleep(0.005)\n")
+    case = BenchCase(name="fake", section="-", command="%s %s" % (sys.executable, script))
+    res = ShellExecutor(str(tmp_path), timeout=30.0).run(case)
+    assert res.returncode == 0
+    assert res.frames == 20
+    assert res.fps > 0
+    assert res.frame_interval_ms["p50"] >= 4.0
@@ -0,0 +1,107 @@
+from iva.clip_recorder import (NS, AccessUnit, AnnexBClipWriter, ClipRecorder,
+                               ClipRecorderBank, ClipWriter, PrerollBuffer, ZoneEntryRule)
+from iva.meta import FrameMeta, ObjectMeta
+
+FRAME = NS // 10  # 10 fps, a keyframe every second
+
+
+def au(i, size=10):
+    return AccessUnit(i * FRAME, bytes([i % 256]) * size, keyframe=i % 10 == 0)
+
+
+class ListWriter(ClipWriter):
+    opened = []
+
+    def __init__(self, path):
+        self.path = path
+        self.units = []
+        self.closed = False
+        ListWriter.opened.append(self)
+
+    def write(self, unit):
+        self.units.append(unit.pts // FRAME)
+
+    def close(self):
+        self.closed = True
+
+
+def test_ring_starts_and_trims_at_keyframes():
+    ring = PrerollBuffer(max_duration=1.5)
+    for i in range(5, 40):
+        ring.push(au(i))
+    assert ring.units[0].keyframe
+    assert ring.units[0].pts == 30 * FRAME
+    assert ring.duration == 0.9
+    assert ring.bytes == 100
+    assert [u.pts // FRAME for u in ring.since(35 * FRAME)][:1] == [30]
+
+
+def test_ring_is_bounded_by_bytes():
+    ring = PrerollBuffer(max_duration=100.0, max_bytes=150)
+    for i in range(30):
+        ring.push(au(i))
+    assert ring.bytes <= 150
+    assert ring.units[0].keyframe
+
+
+def test_trigger_writes_preroll_and_cuts_after_postroll(tmp_path):
+    ListWriter.opened = []
+    rec = ClipRecorder(str(tmp_path), source_id=2, pre_roll=1.0, post_roll=1.0,
+                       writer_factory=ListWriter, extension=".h264")
+    for i in range(25):
+        rec.push(au(i))
+    rec.trigger(24 * FRAME)  # pre-roll reaches back to frame 14: keyframe 10
+    assert rec.recording
+    rec.trigger(30 * FRAME)  # extends the running clip to frame 40
+    for i in range(25, 50):
+        rec.push(au(i))
+    assert rec.recording  # past the post-roll, waiting for a keyframe
+    rec.push(au(50))
+    assert not rec.recording
+    [writer] = ListWriter.opened
+    assert writer.closed
+    assert writer.units == list(range(10, 50))
+    assert rec.clips == [str(tmp_path / ("clip_src2_%d.h264" % (10 * FRAME)))]
+
+
+def test_annexb_writer_concatenates_access_units(tmp_path):
+    rec = ClipRecorder(str(tmp_path / "clips"), pre_roll=1.0, post_roll=0.0,
+                       writer_factory=AnnexBClipWriter, extension=".h264")
+    for i in range(12):
+        rec.push(au(i, size=2))
+    rec.trigger(11 * FRAME)
+    rec.close()
+    with open(rec.clips[0], "rb") as fp:
+        assert fp.read() == b"".join(bytes([i]) * 2 for i in range(12))
+
+
+def test_zone_entry_fires_once_per_entry():
+    rule = ZoneEntryRule([(0, 0), (100, 0), (100, 100), (0, 100)], class_ids=[0])
+
+    def frame(*objects, source_id=0):
+        return FrameMeta(source_id=source_id, frame_num=0, pts=0, objects=list(objects))
+
+    inside = ObjectMeta(0, 40.0, 40.0, 20.0, 20.0, object_id=1)
+    outside = ObjectMeta(0, 140.0, 40.0, 20.0, 20.0, object_id=1)
+    person = ObjectMeta(2, 40.0, 40.0, 20.0, 20.0, object_id=2)
+    assert not rule(frame(outside, person))
+    assert rule(frame(inside))
+    assert not rule(frame(inside))
+    assert rule(frame(inside, source_id=1))  # same id on another camera
+    assert not rule(frame())
+    assert rule(frame(inside))
+
+
+def test_bank_triggers_the_recorder_of_the_frame_source(tmp_path):
+    ListWriter.opened = []
+    seen = []
+    bank = ClipRecorderBank(str(tmp_path), [lambda f: seen.append(1) or True,
+                                            lambda f: seen.append(2) or False],
+                            pre_roll=0.5, writer_factory=ListWriter)
+    for i in range(5):
+        bank.push(1, au(i))
+    bank(FrameMeta(source_id=1, frame_num=4, pts=4 * FRAME))
+    assert seen == [1, 2]
+    assert bank.recorder(1).recording and not bank.recorder(0).recording
+    bank.close()
+    assert ListWriter.opened[0].closed
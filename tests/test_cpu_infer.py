@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from iva.cpu_infer import PARSERS, CpuInfer, InferConfig
+
+
+def write_config(tmp_path, extra=""):
+    path = tmp_path / "pgie.txt"
+    path.write_text("[property]\n"
+                    "onnx-file=model.onnx\n"
+                    "num-detected-classes=4\n"
+                    "input-dims=3;32;64;0\n"
+                    "output-blob-names=conv2d_bbox;conv2d_cov/Sigmoid\n"
+                    + extra)
+    return str(path)
+
+
+def outputs(score=0.5):
+    cov = np.zeros((1, 4, 2, 4), np.float32)
+    cov[0, :, 1, 1] = score
+    bbox = np.zeros((1, 16, 2, 4), np.float32)
+    bbox[0, :, 1, 1] = 0.5
+    return {"conv2d_cov/Sigmoid": cov, "conv2d_bbox": bbox}
+
+
+def test_short_class_thresholds_cover_remaining_classes(tmp_path):
+    config = InferConfig.from_file(write_config(tmp_path, "class-thresholds=0.2;0.3\n"))
+    assert config.thresholds == pytest.approx([0.2, 0.3, 0.3, 0.3])
+    objs = PARSERS["parse_bbox_custom_resnet"](outputs(0.25), config, config.thresholds)
+    assert [o[0] for o in objs[0]] == [0]
+
+
+def test_long_class_thresholds_are_truncated_and_groups_override(tmp_path):
+    config = InferConfig.from_file(write_config(
+        tmp_path, "class-thresholds=0.2;0.2;0.2;0.2;0.2;0.2\n\n[class-attrs-2]\nthreshold=0.9\n"))
+    assert config.thresholds == pytest.approx([0.2, 0.2, 0.9, 0.2])
+    objs = PARSERS["parse_bbox_custom_resnet"](outputs(), config, config.thresholds)
+    assert sorted(o[0] for o in objs[0]) == [0, 1, 3]
+
+
+def test_unsupported_parse_func_is_a_value_error(tmp_path):
+    config = InferConfig.from_file(write_config(tmp_path, "parse-func=2\n"))
+    with pytest.raises(ValueError, match="parse-func=2"):
+        CpuInfer._parse(SimpleNamespace(config=config), outputs(), 1)
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from iva.crop_batcher import CropBatcher
+from iva.meta import FrameMeta, ObjectMeta
+from iva.preprocess import Preprocessor
+
+
+def mux_batch(sizes_per_frame, start=0, height=120, width=160):
+    """Frames whose pixel values encode (frame, x); objects of the given sizes."""
+    frames = np.zeros((len(sizes_per_frame), height, width, 4), np.uint8)
+    metas = []
+    for i, sizes in enumerate(sizes_per_frame):
+        frames[i, ..., 0] = i + 1
+        metas.append(FrameMeta(source_id=i, frame_num=start, pts=start,
+                               objects=[ObjectMeta(0, 10.0 * j, 5.0, float(s), float(s))
+                                        for j, s in enumerate(sizes)]))
+    return frames, metas
+
+
+class Recorder:
+    def __init__(self):
+        self.batches = []
+        self.done = []
+
+    def run(self, tensor, crops):
+        assert len(tensor) == len(crops)
+        self.batches.append([(c.source_id, c.bucket, float(tensor[k, 0, 0, 0]))
+                             for k, c in enumerate(crops)])
+
+    def frame_done(self, source_id, frame_num):
+        self.done.append((source_id, frame_num))
+
+
+def batcher(rec, **kwargs):
+    kwargs.setdefault("pre", Preprocessor(8, 8, 4, interpolation="nearest"))
+    return CropBatcher(rec.run, 4, on_frame_done=rec.frame_done, **kwargs)
+
+
+def test_frames_are_done_once_their_last_crop_is_classified():
+    rec = Recorder()
+    b = batcher(rec, deadline_ms=10.0, buckets=())
+    frames, metas = mux_batch([[20, 20, 20], [], [20, 20]])
+    assert b.add(frames, metas, now=0.0) == 1
+    assert rec.done == [(1, 0), (0, 0)]  # no crops: done at once; 0 filled the batch
+    assert b.pending_crops(2, 0) == 1 and len(b) == 1
+    assert b.outstanding == {(2, 0): 1}
+    assert b.poll(now=0.005) == 0
+    assert b.poll(now=0.010) == 1
+    assert rec.done[-1] == (2, 0) and b.outstanding == {}
+    # Each crop was cut from its own frame.
+    assert [v for batch in rec.batches for _, _, v in batch] == [1, 1, 1, 3, 3]
+
+
+def test_full_buckets_emit_and_deadline_tops_up_from_nearest_buckets():
+    rec = Recorder()
+    b = batcher(rec, deadline_ms=20.0, buckets=(32, 64, 128))
+    frames, metas = mux_batch([[10, 10, 10, 10, 10], [50, 100], [150]])
+    assert b.add(frames, metas, now=0.0) == 1
+    assert [c[1] for c in rec.batches[0]] == [0, 0, 0, 0]
+    assert b.stats.full == 1
+    assert b.next_deadline() == pytest.approx(0.02)
+    assert b.poll(now=0.02) == 1
+    # Led by the oldest crop's bucket (0), then buckets 1, 2, 3.
+    assert [c[1] for c in rec.batches[1]] == [0, 1, 2, 3]
+    assert b.stats.deadline == 1 and b.next_deadline() is None
+    assert b.stats.as_dict()["mean_fill"] == 1.0
+
+
+def test_class_and_size_filters_like_nvinfer():
+    rec = Recorder()
+    b = batcher(rec, class_ids=[0], min_size=(16, 16))
+    frames, metas = mux_batch([[8, 30]])
+    metas[0].objects.append(ObjectMeta(2, 0.0, 0.0, 40.0, 40.0))
+    metas[0].objects.append(ObjectMeta(0, 150.0, 110.0, 40.0, 40.0))  # clipped to 10x10
+    b.add(frames, metas, now=0.0)
+    assert b.pending_crops(0, 0) == 1
+    assert b.flush() == 1 and rec.done == [(0, 0)]
+
+
+def test_copy_frames_detaches_from_the_mux_buffer():
+    rec = Recorder()
+    b = batcher(rec, copy_frames=True, buckets=())
+    frames, metas = mux_batch([[], [20]])
+    b.add(frames, metas, now=0.0)
+    frames[:] = 0  # the mux buffer is reused
+    b.flush()
+    assert rec.batches == [[(1, 0, 2.0)]]
+
+
+def test_crops_from_several_mux_batches_share_one_engine_call():
+    rec = Recorder()
+    b = batcher(rec, deadline_ms=50.0, buckets=())
+    for n in range(2):
+        frames, metas = mux_batch([[20, 20]], start=n)
+        frames[..., 0] = 10 + n
+        b.add(frames, metas, now=0.001 * n)
+    assert [v for _, _, v in rec.batches[0]] == [10, 10, 11, 11]
+    assert rec.done == [(0, 0), (0, 1)]
+
+
+def test_preprocessor_must_hold_a_batch():
+    with pytest.raises(ValueError, match="preprocessor batch 2 < 4"):
+        CropBatcher(lambda t, c: None, 4, pre=Preprocessor(8, 8, 2))
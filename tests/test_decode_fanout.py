@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+
+from iva.decode_fanout import NS, FrameFanout
+
+
+def test_frames_are_shared_and_returned_to_the_pool():
+    fanout = FrameFanout((2, 2), pool_size=2)
+    fanout.subscribe("a")
+    fanout.subscribe("b")
+    assert fanout.publish(np.ones((2, 2), np.uint8), 0) == 2
+    frames = [fanout.get("a"), fanout.get("b")]
+    assert frames[0] is frames[1]
+    for frame in frames:
+        frame.release()
+    # Both references released: the buffer is reusable.
+    for pts in (1, 2):
+        fanout.publish(np.zeros((2, 2), np.uint8), pts)
+        fanout.get("a").release()
+        fanout.get("b").release()
+
+
+def test_rate_limited_consumer_skips_frames():
+    fanout = FrameFanout((1,), pool_size=4)
+    fanout.subscribe("full")
+    slow = fanout.subscribe("slow", max_fps=10)
+    for i in range(30):
+        fanout.publish(np.zeros(1, np.uint8), i * NS // 30)
+        fanout.get("full").release()
+        frame = fanout.get("slow", timeout=0)
+        if frame is not None:
+            frame.release()
+    assert slow.delivered == 10
+    assert slow.skipped == 20
+
+
+def test_get_after_unsubscribe_returns_none():
+    fanout = FrameFanout((1,))
+    fanout.subscribe("a")
+    fanout.unsubscribe("a")
+    assert fanout.get("a", timeout=0.01) is None
+
+
+def test_unsubscribe_stops_a_running_consumer():
+    fanout = FrameFanout((1,), pool_size=4)
+    fanout.subscribe("a")
+    seen = []
+    errors = []
+    stop = threading.Event()
+
+    def run():
+        try:
+            fanout.run_consumer("a", lambda f: seen.append(f.pts), stop, poll=5.0)
+        except Exception as exc:  # pragma: no cover - the failure being tested
+            errors.append(exc)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    fanout.publish(np.zeros(1, np.uint8), 0)
+    fanout.unsubscribe("a")
+    thread.join(timeout=2.0)
+    assert not thread.is_alive()
+    assert errors == []
+    assert not stop.is_set()
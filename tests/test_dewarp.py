@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from iva.dewarp import (PROJECTION_PUSHBROOM, PROJECTION_VERTRADCYL, Dewarper,
+                        RemapCache, RemapTable, SurfaceParams, compute_maps,
+                        load_dewarper_config, project_points, unproject_points)
+
+SRC_W, SRC_H = 64, 48
+
+
+def surface(projection_type=PROJECTION_VERTRADCYL, **changes):
+    params = SurfaceParams(projection_type, width=32, height=16, top_angle=20.0,
+                           bottom_angle=-20.0, pitch=90.0, yaw=30.0, roll=0.0,
+                           focal_length=15.0)
+    return params.replace(**changes)
+
+
+def write_config(tmp_path, body):
+    path = tmp_path / "config_dewarper.txt"
+    path.write_text("[property]\noutput-width=16\noutput-height=8\n" + body)
+    return str(path)
+
+
+SURFACE = ("projection-type={p}\nwidth=32\nheight=16\ntop-angle=20\nbottom-angle=-20\n"
+           "pitch=90\nyaw={yaw}\nfocal-length=15\n")
+
+
+def test_load_config_orders_surfaces_by_number(tmp_path):
+    config = load_dewarper_config(write_config(
+        tmp_path, "[surface2]\n" + SURFACE.format(p=1, yaw=90)
+        + "[surface0]\n" + SURFACE.format(p=2, yaw=0)))
+    assert (config.output_width, config.output_height) == (16, 8)
+    assert config.numbers == [0, 2]
+    assert config.surface(2).projection_type == PROJECTION_PUSHBROOM
+    assert config.surface(2).yaw == 90.0
+    with pytest.raises(KeyError, match="surface1"):
+        config.surface(1)
+
+
+def test_load_config_rejects_bad_groups(tmp_path):
+    with pytest.raises(ValueError, match="no \\[surfaceN\\]"):
+        load_dewarper_config(write_config(tmp_path, ""))
+    with pytest.raises(ValueError, match="projection-type 7"):
+        load_dewarper_config(write_config(tmp_path, "[surface0]\n" + SURFACE.format(p=7, yaw=0)))
+    with pytest.raises(ValueError, match="focal-length"):
+        load_dewarper_config(write_config(
+            tmp_path, "[surface0]\n" + SURFACE.format(p=1, yaw=0).replace("focal-length=15\n", "")))
+
+
+@pytest.mark.parametrize("projection_type", [PROJECTION_PUSHBROOM, PROJECTION_VERTRADCYL])
+def test_unproject_inverts_project(projection_type):
+    p = surface(projection_type, roll=10.0)
+    u, v = np.meshgrid(np.linspace(1, 31, 7), np.linspace(1, 15, 5))
+    x, y = project_points(p.projection_type, p.width, p.height, p.top_angle,
+                          p.bottom_angle, p.pitch, p.yaw, p.roll, p.focal_length,
+                          u, v, SRC_W, SRC_H)
+    u2, v2 = unproject_points(p.projection_type, p.width, p.height, p.top_angle,
+                              p.bottom_angle, p.pitch, p.yaw, p.roll, p.focal_length,
+                              x, y, SRC_W, SRC_H)
+    np.testing.assert_allclose(u2, u, atol=1e-6)
+    np.testing.assert_allclose(v2, v, atol=1e-6)
+
+
+def test_remap_samples_in_view_pixels_and_blacks_out_the_rest():
+    table = RemapTable.from_maps(
+        np.array([[0.0, 1.5, -5.0]], np.float32), np.array([[0.0, 2.0, 0.0]], np.float32),
+        4, 4)
+    frame = np.arange(16, dtype=np.uint8).reshape(4, 4) * 10
+    out = table.apply(frame)
+    assert out.tolist() == [[0, 95, 0]]
+    rgb = table.apply(np.repeat(frame[..., np.newaxis], 3, axis=2))
+    assert rgb.shape == (1, 3, 3) and rgb[0, 1].tolist() == [95, 95, 95]
+    with pytest.raises(ValueError, match="table expects 4x4"):
+        table.apply(np.zeros((3, 4), np.uint8))
+
+
+def test_top_angle_must_exceed_bottom_angle():
+    with pytest.raises(ValueError, match="top-angle"):
+        compute_maps(surface(top_angle=-30.0), SRC_W, SRC_H, 8, 4)
+
+
+def test_cache_reuses_tables_in_memory_and_on_disk(tmp_path):
+    cache = RemapCache(str(tmp_path))
+    first = cache.get(surface(), SRC_W, SRC_H, 16, 8)
+    assert cache.get(surface(), SRC_W, SRC_H, 16, 8) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.get(surface(yaw=45.0), SRC_W, SRC_H, 16, 8)
+    assert cache.misses == 2
+    reloaded = RemapCache(str(tmp_path))
+    table = reloaded.get(surface(), SRC_W, SRC_H, 16, 8)
+    assert (reloaded.hits, reloaded.misses) == (1, 0)
+    np.testing.assert_array_equal(table.index, first.index)
+    np.testing.assert_array_equal(table.weights, first.weights)
+
+
+def test_dewarper_reload_only_computes_changed_surfaces(tmp_path):
+    config = load_dewarper_config(write_config(
+        tmp_path, "[surface0]\n" + SURFACE.format(p=2, yaw=0)
+        + "[surface1]\n" + SURFACE.format(p=2, yaw=180)))
+    dewarper = Dewarper(config, SRC_W, SRC_H)
+    outs = dewarper.dewarp(np.full((SRC_H, SRC_W, 3), 200, np.uint8))
+    assert [o.shape for o in outs] == [(8, 16, 3)] * 2
+    assert outs[0].max() == 200
+    config.surfaces[1] = config.surfaces[1].replace(yaw=90.0)
+    dewarper.reload(config)
+    assert dewarper.cache.misses == 3
+    assert len(dewarper.dewarp(np.zeros((SRC_H, SRC_W), np.uint8), surfaces=[1])) == 1
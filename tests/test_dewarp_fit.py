@@ -0,0 +1,68 @@
+import json
+
+import numpy as np
+import pytest
+
+from iva.dewarp import (PROJECTION_VERTRADCYL, SurfaceParams, load_dewarper_config,
+                        project_points)
+from iva.dewarp_fit import Correspondences, SurfaceFit, format_surface, main, surface_keys
+
+SRC = (640, 640)
+OUT = (320, 160)
+TRUE = SurfaceParams(PROJECTION_VERTRADCYL, width=320, height=160, top_angle=30.0,
+                     bottom_angle=-30.0, pitch=90.0, yaw=40.0, roll=0.0,
+                     focal_length=180.0, surface_index=1)
+
+
+def observations(params=TRUE):
+    u, v = np.meshgrid(np.linspace(40, 280, 4), np.linspace(20, 140, 3))
+    u, v = u.ravel(), v.ravel()
+    x, y = project_points(params.projection_type, params.width, params.height,
+                          params.top_angle, params.bottom_angle, params.pitch,
+                          params.yaw, params.roll, params.focal_length, u, v, *SRC)
+    return {"src_size": list(SRC),
+            "points": [{"fisheye": [a, b], "surface": [c, d]}
+                       for a, b, c, d in zip(x, y, u, v)]}
+
+
+def test_fit_recovers_perturbed_parameters():
+    corr = Correspondences.from_json(observations())
+    start = TRUE.replace(focal_length=150.0, yaw=55.0)
+    result = SurfaceFit(start, corr, OUT, ["focal-length", "yaw"]).fit(samples=512)
+    assert result.params.focal_length == pytest.approx(180.0, abs=0.05)
+    assert result.params.yaw == pytest.approx(40.0, abs=0.05)
+    assert result.rms < 0.05
+    assert result.cost < result.initial_cost
+
+
+def test_bad_inputs_are_value_errors():
+    corr = Correspondences.from_json(observations())
+    with pytest.raises(ValueError, match="cannot fit width"):
+        SurfaceFit(TRUE, corr, OUT, ["width"])
+    with pytest.raises(ValueError, match="no correspondences"):
+        SurfaceFit(TRUE, Correspondences(SRC), OUT, ["yaw"])
+    with pytest.raises(ValueError, match="3 points"):
+        Correspondences.from_json({"src_size": SRC, "lines": [{"fisheye": [[0, 0], [1, 1]]}]})
+
+
+def test_surface_keys_keep_micro_precision():
+    keys = dict(surface_keys(TRUE.replace(yaw=12.3456789, roll=-0.0000004, pitch=90.0)))
+    assert keys["yaw"] == "12.345679"
+    assert keys["pitch"] == "90"
+    assert float(keys["roll"]) == 0.0
+    assert format_surface(TRUE, 3).startswith("[surface3]\nprojection-type=2\n")
+
+
+def test_main_writes_the_selected_surface(tmp_path, capsys):
+    config = tmp_path / "config_dewarper.txt"
+    groups = ["[property]\noutput-width=%d\noutput-height=%d\n" % OUT]
+    for n, yaw in ((0, 0.0), (1, 55.0)):
+        groups.append(format_surface(TRUE.replace(yaw=yaw, surface_index=n), n))
+    config.write_text("\n".join(groups))
+    corr = tmp_path / "corr.json"
+    corr.write_text(json.dumps(dict(observations(), surface=1, free=["yaw"])))
+    assert main([str(corr), "--config", str(config), "--samples", "256", "--write"]) == 0
+    assert "[surface1]" in capsys.readouterr().out
+    fitted = load_dewarper_config(str(config))
+    assert fitted.surface(1).yaw == pytest.approx(40.0, abs=0.01)
+    assert fitted.surface(0).yaw == 0.0
@@ -0,0 +1,104 @@
+import pytest
+
+from iva.config import DSConfig
+from iva.gpumem import (CUDA_CONTEXT_MIB, MIB, Calibration, estimate, max_streams,
+                        nv12_bytes, peak_fb, read_fb)
+
+APP = """[source0]
+enable=1
+num-sources=2
+num-extra-surfaces=4
+
+[streammux]
+batch-size=2
+width=1280
+height=720
+
+[primary-gie]
+enable=1
+config-file=pgie.txt
+
+[secondary-gie0]
+enable=0
+config-file=missing.txt
+
+[tracker]
+enable=1
+tracker-width=640
+tracker-height=384
+"""
+
+
+def read_app(tmp_path, pgie="network-mode=2\ninput-dims=3;368;640;0\n"):
+    (tmp_path / "pgie.txt").write_text("[property]\nbatch-size=1\nmodel-engine-file=det.engine\n"
+                                       + pgie)
+    (tmp_path / "det.engine").write_bytes(b"\0" * MIB)
+    path = tmp_path / "app.txt"
+    path.write_text(APP)
+    return DSConfig.read(str(path))
+
+
+def test_estimate_adds_up_the_config(tmp_path):
+    est = estimate(read_app(tmp_path))
+    assert (est.streams, est.batch_size) == (2, 2)
+    mib = {c.name: c.mib for c in est.components}
+    assert mib["cuda/tensorrt context"] == CUDA_CONTEXT_MIB
+    assert mib["decoder surfaces (24 x 1280x720)"] == pytest.approx(
+        2 * 24 * nv12_bytes(1280, 720) / MIB)
+    assert mib["primary-gie engine weights"] == pytest.approx(1.0)
+    assert mib["primary-gie input tensors (b=1)"] == pytest.approx(2 * 3 * 368 * 640 * 4 / MIB)
+    assert not any(name.startswith("secondary-gie0") for name in mib)
+    assert "tracker (640x384)" in mib
+    assert est.total_mib == pytest.approx(sum(mib.values()))
+
+
+def test_workspace_size_is_counted_once_per_gie(tmp_path):
+    cfg = read_app(tmp_path, "network-mode=1\nworkspace-size=512\n")
+    mib = {c.name: c.mib for c in estimate(cfg).components}
+    assert mib["primary-gie workspace"] == 512.0
+
+
+def test_stream_override_scales_the_batch(tmp_path):
+    cfg = read_app(tmp_path)
+    two, eight = estimate(cfg, 2), estimate(cfg, 8)
+    assert eight.batch_size == 8
+    assert "primary-gie input tensors (b=8)" in [c.name for c in eight.components]
+    assert eight.total_mib > two.total_mib
+
+
+def test_read_fb_uses_the_header_column(tmp_path):
+    log = tmp_path / "smi.log"
+    log.write_text("# gpu   pwr  gtemp    fb  bar1\n"
+                   "# Idx     W      C    MB    MB\n"
+                   "    0    40     50  1200     5\n"
+                   "    0    41     51   bad     5\n"
+                   "    0    42     52  1800     5\n")
+    assert read_fb(str(log)) == [1200, 1800]
+    assert peak_fb(str(log)) == 1800
+    (tmp_path / "empty.log").write_text("")
+    with pytest.raises(ValueError, match="no fb samples"):
+        peak_fb(str(tmp_path / "empty.log"))
+
+
+def test_calibration_fit():
+    assert Calibration.fit([]) == Calibration()
+    assert Calibration.fit([(1000.0, 1300.0)]) == Calibration(300.0, 1.0)
+    fit = Calibration.fit([(1000.0, 1600.0), (2000.0, 2800.0), (3000.0, 4000.0)])
+    assert (fit.base_mib, fit.scale) == pytest.approx((400.0, 1.2))
+    # Observations that shrink as the estimate grows keep a unit scale.
+    shrinking = Calibration.fit([(1000.0, 2000.0), (2000.0, 1900.0)])
+    assert shrinking.scale == 1.0 and shrinking.base_mib == pytest.approx(450.0)
+
+
+def test_calibration_round_trip(tmp_path):
+    path = str(tmp_path / "cal.json")
+    Calibration(250.0, 1.1).save(path)
+    assert Calibration.load(path) == Calibration(250.0, 1.1)
+
+
+def test_max_streams_fits_the_budget(tmp_path):
+    cfg = read_app(tmp_path)
+    n = max_streams(cfg, 8192, headroom=0.1)
+    assert estimate(cfg, n).total_mib <= 8192 * 0.9 < estimate(cfg, n + 1).total_mib
+    assert max_streams(cfg, 8192, Calibration(2000.0, 1.0)) < n
+    assert max_streams(cfg, 10.0) == 0
@@ -0,0 +1,83 @@
+import sys
+import threading
+
+import pytest
+
+from iva import latency
+from iva.latency import FrameLatencyTracker
+
+MS = 10**6
+
+
+def test_stage_gaps_and_e2e_per_source():
+    tracker = FrameLatencyTracker(stages=("decoder", "pgie", "sink"))
+    for pts in range(10):
+        tracker.mark("decoder", 1, pts, now_ns=pts * 40 * MS)
+        tracker.mark("pgie", 1, pts, now_ns=pts * 40 * MS + 10 * MS)
+        tracker.mark("sink", 1, pts, now_ns=pts * 40 * MS + 30 * MS)
+    report = tracker.report()
+    assert tracker.completed == 10
+    assert report["e2e"]["count"] == 10
+    assert report["e2e"]["max"] == pytest.approx(0.030)
+    assert report["decoder->pgie"]["max"] == pytest.approx(0.010)
+    assert report["pgie->sink"]["max"] == pytest.approx(0.020)
+    assert report["e2e/source=1"]["count"] == 10
+
+
+def test_frames_past_the_in_flight_bound_count_as_dropped(monkeypatch):
+    monkeypatch.setattr(latency, "MAX_IN_FLIGHT", 4)
+    tracker = FrameLatencyTracker(stages=("decoder", "sink"))
+    for pts in range(6):
+        tracker.mark("decoder", 0, pts, now_ns=pts)
+    assert tracker.dropped == 2
+    for pts in range(2, 6):
+        tracker.mark("sink", 0, pts, now_ns=pts + 10)
+    assert tracker.completed == 4
+    assert tracker.histogram("e2e").count == 4
+
+
+def test_concurrent_stage_threads_keep_counts(monkeypatch):
+    # A small bound keeps the decoders evicting the frames the sink is
+    # completing, and frequent thread switches interleave the two.
+    monkeypatch.setattr(latency, "MAX_IN_FLIGHT", 8)
+    old_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    tracker = FrameLatencyTracker(stages=("decoder", "streammux", "sink"))
+    sources, frames = 4, 20000
+    errors = []
+    start = threading.Barrier(sources + 1)
+
+    def decoder(source_id):
+        start.wait()
+        try:
+            for pts in range(frames):
+                tracker.mark("decoder", source_id, pts)
+        except Exception as exc:  # pragma: no cover - the failure being tested
+            errors.append(exc)
+
+    def downstream():
+        start.wait()
+        try:
+            for pts in range(frames):
+                for source_id in range(sources):
+                    tracker.mark("streammux", source_id, pts)
+                    tracker.mark("sink", source_id, pts)
+        except Exception as exc:  # pragma: no cover
+            errors.append(exc)
+
+    threads = [threading.Thread(target=decoder, args=(s,)) for s in range(sources)]
+    threads.append(threading.Thread(target=downstream))
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            t.join()
+    finally:
+        sys.setswitchinterval(old_interval)
+    assert errors == []
+    assert tracker.completed == sources * frames
+    assert tracker.histogram("e2e").count == tracker.completed
+    # Every entry was completed, evicted or is still in flight. A decoder
+    # stamp that lands after its frame completed starts a second entry.
+    created = tracker.completed + tracker.dropped + len(tracker._frames)
+    assert sources * frames <= created <= 2 * sources * frames
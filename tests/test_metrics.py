@@ -0,0 +1,59 @@
+import pytest
+
+from iva import metrics
+from iva.metrics import ElementStats, LatencyHistogram, MetricsRegistry
+
+MS = 10**6
+
+
+def test_histogram_quantiles_and_merge():
+    a, b = LatencyHistogram(), LatencyHistogram()
+    for _ in range(90):
+        a.observe(0.002)
+    for _ in range(10):
+        b.observe(0.2)
+    a.merge(b)
+    assert a.count == 100
+    assert a.quantile(0.5) <= 0.0025
+    assert 0.1 < a.quantile(0.99) <= 0.2
+    assert a.max == pytest.approx(0.2)
+
+
+def test_equal_pts_on_two_inputs_keep_separate_stamps():
+    stats = ElementStats("mux")
+    stats.enter((0, 1000), now_ns=0)
+    stats.enter((1, 1000), now_ns=5 * MS)
+    stats.exit([(0, 1000), (1, 1000)], now_ns=20 * MS)
+    assert stats.buffers == 1
+    assert stats.latency.count == 2
+    assert stats.latency.sum == pytest.approx(0.020 + 0.015)
+    assert stats.latency.max == pytest.approx(0.020)
+
+
+def test_unmatched_exit_counts_throughput_only():
+    stats = ElementStats("queue")
+    stats.exit([(0, 42)], now_ns=MS)
+    assert stats.buffers == 1
+    assert stats.latency.count == 0
+
+
+def test_in_flight_stamps_evict_oldest_first(monkeypatch):
+    monkeypatch.setattr(metrics, "MAX_IN_FLIGHT", 3)
+    stats = ElementStats("leaky")
+    for pts in range(5):
+        stats.enter((0, pts), now_ns=pts * MS)
+    stats.exit([(0, 0), (0, 1), (0, 4)], now_ns=10 * MS)
+    # Stamps 0 and 1 were evicted; only pts 4 has an entry time.
+    assert stats.latency.count == 1
+    assert stats.latency.max == pytest.approx(0.006)
+
+
+def test_prometheus_render_lists_elements_and_named_histograms():
+    registry = MetricsRegistry()
+    registry.element("pgie").enter((0, 1), now_ns=0)
+    registry.element("pgie").exit([(0, 1)], now_ns=3 * MS)
+    registry.histogram("e2e").observe(0.05)
+    text = registry.render_prometheus()
+    assert 'iva_element_latency_seconds_count{element="pgie"} 1' in text
+    assert 'iva_element_buffers_total{element="pgie"} 1' in text
+    assert 'iva_latency_seconds_count{name="e2e"} 1' in text
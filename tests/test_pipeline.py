@@ -0,0 +1,70 @@
+import pytest
+
+from iva.config import DSConfig
+from iva.pipeline import (OUTPUT_AUDIT, OUTPUT_HEADLESS, PipelineBuilder, decode_chain,
+                          make_app_config_headless)
+
+
+def test_decode_chain_by_location():
+    assert decode_chain("a.h264") == "filesrc location=a.h264 ! h264parse ! nvdec_h264"
+    assert "qtdemux" in decode_chain("b.mp4")
+    assert decode_chain("c.mkv").endswith("decodebin")
+    assert decode_chain("rtsp://cam/1", latency_ms=300).startswith(
+        "rtspsrc location=rtsp://cam/1 latency=300")
+
+
+def test_file_output_demuxes_one_encoder_per_source():
+    desc = PipelineBuilder(["a.h264", "b.h264"], pgie_config="pgie.txt",
+                           out_location="out.mp4").describe()
+    assert "nvstreammux name=mux batch-size=2" in desc
+    assert "nvinfer name=pgie config-file-path=pgie.txt ! nvstreamdemux name=demux" in desc
+    assert desc.count("x264enc") == 2
+    assert "location=out_0.mp4" in desc and "location=out_1.mp4" in desc
+    assert desc.endswith("mux.sink_1")
+
+
+def test_headless_output_has_no_osd_or_encoder():
+    desc = PipelineBuilder(["a.h264"], pgie_config="pgie.txt",
+                           output=OUTPUT_HEADLESS).describe()
+    assert "nvosd" not in desc and "x264enc" not in desc
+    assert "nvinfer name=pgie config-file-path=pgie.txt ! fakesink" in desc
+    broker = PipelineBuilder(["a.h264"], output=OUTPUT_HEADLESS,
+                             msgbroker_proto_lib="libkafka.so",
+                             msgbroker_conn_str="host;9092").describe()
+    assert "nvmsgconv ! nvmsgbroker proto-lib=libkafka.so sync=false conn-str='host;9092'" in broker
+
+
+def test_audit_output_encodes_through_named_queues():
+    desc = PipelineBuilder(["rtsp://cam/1", "rtsp://cam/2"], output=OUTPUT_AUDIT,
+                           fps=25).describe(with_sources=False)
+    assert "live-source=1 batched-push-timeout=40000" in desc
+    assert "tee name=t t. ! queue ! fakesink" in desc
+    assert "queue name=audit0" in desc and "queue name=audit1" in desc
+    assert desc.count("x264enc") == 2
+    assert "rtspsrc" not in desc
+
+
+def test_lazy_sgie_routes_through_a_closed_valve():
+    desc = PipelineBuilder(["a.h264"], pgie_config="p.txt", sgie_configs=["s0.txt", "s1.txt"],
+                           lazy_sgie=True, output=OUTPUT_HEADLESS).describe()
+    assert "valve name=sgie_valve drop=true" in desc
+    assert "nvinfer name=sgie0 config-file-path=s0.txt ! nvinfer name=sgie1" in desc
+    assert "input-selector name=sgie_sel" in desc
+
+
+def test_builder_rejects_bad_modes_and_empty_sources():
+    with pytest.raises(ValueError, match="output must be"):
+        PipelineBuilder(["a.h264"], output="screen")
+    with pytest.raises(ValueError, match="no sources"):
+        PipelineBuilder().describe()
+
+
+def test_make_app_config_headless(tmp_path):
+    path = tmp_path / "app.txt"
+    path.write_text("[osd]\nenable=1\n\n[sink0]\nenable=1\ntype=2\nsync=1\n\n"
+                    "[sink1]\nenable=1\ntype=6\n\n[sink2]\nenable=0\ntype=3\n")
+    assert make_app_config_headless(str(path)) == ["sink0", "osd"]
+    cfg = DSConfig.read(str(path))
+    assert (cfg.get_int("sink0", "type"), cfg.get_int("sink0", "sync")) == (1, 0)
+    assert cfg.get_int("sink1", "type") == 6
+    assert not cfg.get_bool("osd", "enable")
@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+from iva.config import DSConfig
+from iva.precision import (CalibrationStore, NumpyBackend, NumpyModel, compare, read_calibration,
+                           synthetic_frames, write_calibration)
+
+
+def test_calibration_cache_round_trip(tmp_path):
+    path = str(tmp_path / "cal.bin")
+    write_calibration(path, {"input_1": 0.0078125, "hidden": 0.5})
+    assert open(path).readline() == "TRT-5105-EntropyCalibration2\n"
+    assert read_calibration(path) == {"input_1": 0.0078125, "hidden": 0.5}
+
+
+@pytest.fixture
+def model(tmp_path):
+    path = str(tmp_path / "det.npz")
+    NumpyModel.random(seed=1).save(path)
+    return path
+
+
+def test_compare_rows_and_int8_agreement(tmp_path, model):
+    frames = synthetic_frames(8, 192, 320, seed=2)
+    store = CalibrationStore(str(tmp_path / "store"))
+    rows = compare(NumpyBackend(), model, frames, batch_sizes=(1, 4), repeats=1, store=store)
+    by = {r["precision"]: r for r in rows}
+    assert list(by) == ["fp32", "fp16", "int8"]
+    assert by["fp32"]["detections"] > 0
+    assert set(by["fp32"]["latency"]) == {"1", "4"}
+    assert by["fp16"]["cov_max_abs_err"] < 1e-2
+    assert by["fp16"]["agree_recall"] >= 0.9
+    assert by["int8"]["cov_max_abs_err"] < 0.1
+    assert by["int8"]["agree_precision"] >= 0.8
+    # The scales were filed for this model and are reused next time.
+    entry = store.get(model)
+    assert entry.frames == 8 and set(read_calibration(entry.path)) == {"input_1", "hidden"}
+    assert compare(NumpyBackend(), model, frames, ("fp32", "int8"), (1,), repeats=1,
+                   store=store)[1]["detections"] == by["int8"]["detections"]
+
+
+def test_int8_session_requires_scales(model):
+    with pytest.raises(ValueError, match="calibration"):
+        NumpyBackend().load(model, "int8")
+
+
+def test_store_files_caches_per_model_version(tmp_path, model):
+    store = CalibrationStore(str(tmp_path / "store"))
+    assert store.get(model) is None
+    first = store.put(model, {"input_1": 0.01}, frames=16)
+    assert store.get(model).path == first.path
+    NumpyModel.random(seed=2).save(model)  # retrained: the old cache no longer applies
+    assert store.get(model) is None
+    second = store.put(model, {"input_1": 0.02}, frames=16)
+    assert [e.path for e in store.versions(model)] == [second.path, first.path]
+    assert store.prune(model, keep=1) == [first.path]
+    assert not os.path.exists(first.path)
+    assert store.prune(model, keep=0) == []  # never the current version
+
+
+def test_install_points_the_config_at_the_cache(tmp_path, model):
+    store = CalibrationStore(str(tmp_path / "store"))
+    config = tmp_path / "pgie.txt"
+    config.write_text("[property]\nmodel-file=det.npz\nnetwork-mode=1\nint8-calib-file=old.bin\n")
+    assert store.install(str(config)) == ("", "missing")
+    entry = store.put(model, {"input_1": 0.01}, frames=4)
+    assert store.install(str(config)) == (entry.path, "installed")
+    assert DSConfig.read(str(config)).property("int8-calib-file") == entry.path
+    assert store.install(str(config)) == (entry.path, "ok")
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+from iva.preprocess import Preprocessor, naive
+
+
+def solid(rgb, fmt, height=8, width=8):
+    pixel = list(rgb) + [255] if fmt == "rgba" else list(rgb)
+    return np.tile(np.array(pixel, np.uint8), (1, height, width, 1))
+
+
+@pytest.mark.parametrize("fmt", ["rgb", "rgba"])
+def test_bgr_offsets_follow_network_channel_order(fmt):
+    # model-color-format=1: offsets[0] is the blue mean, as in nvinfer.
+    pre = Preprocessor(4, 4, 1, offsets=(104, 117, 123), bgr=True)
+    out = pre.run(solid((200, 100, 50), fmt), fmt)
+    assert out[0, :, 0, 0] == pytest.approx([50 - 104, 100 - 117, 200 - 123])
+
+
+def test_bgr_letterbox_padding_uses_network_channel_offsets():
+    pre = Preprocessor(8, 8, 1, offsets=(104, 117, 123), bgr=True, letterbox=True, pad=0.0)
+    out = pre.run(solid((200, 100, 50), "rgb", 4, 8), "rgb")
+    assert out[0, :, -1, 0] == pytest.approx([-104, -117, -123])
+
+
+def test_naive_reference_honours_bgr():
+    frames = solid((200, 100, 50), "rgb")
+    ref = naive(frames, 4, 4, 1.0, (104, 117, 123), "rgb", bgr=True)
+    out = Preprocessor(4, 4, 1, offsets=(104, 117, 123), bgr=True,
+                       interpolation="nearest").run(frames, "rgb")
+    assert np.allclose(ref, out)
+
+
+def nv12_frames(n, height, width, seed=0):
+    """NV12 frames whose chroma is constant over each 2x2 luma block."""
+    rng = np.random.default_rng(seed)
+    frames = np.empty((n, height * 3 // 2, width), np.uint8)
+    frames[:, :height] = rng.integers(30, 220, (n, height, width))
+    frames[:, height:] = rng.integers(100, 156, (n, height // 2, width))
+    return frames
+
+
+def nv12_to_rgb(frames):
+    return np.stack([naive([f], f.shape[0] * 2 // 3, f.shape[1], 1.0, (0, 0, 0), "nv12")[0]
+                     for f in frames]).transpose(0, 2, 3, 1).astype(np.uint8)
+
+
+@pytest.mark.parametrize("bgr", [False, True])
+@pytest.mark.parametrize("letterbox", [False, True])
+def test_rgb_and_rgba_inputs_give_identical_tensors(bgr, letterbox):
+    rng = np.random.default_rng(1)
+    rgba = rng.integers(0, 256, (3, 24, 40, 4), dtype=np.uint8)
+    pre = Preprocessor(16, 16, 3, scale=1 / 255.0, offsets=(10, 20, 30), bgr=bgr,
+                       letterbox=letterbox)
+    expected = pre.run(rgba, "rgba").copy()
+    np.testing.assert_array_equal(pre.run(np.ascontiguousarray(rgba[..., :3]), "rgb"), expected)
+
+
+def test_nv12_matches_rgb_converted_first():
+    frames = nv12_frames(2, 16, 24)
+    pre = Preprocessor(8, 12, 2, offsets=(100, 110, 120), bgr=True, interpolation="nearest")
+    out = pre.run(frames, "nv12").copy()
+    ref = pre.run(nv12_to_rgb(frames), "rgb")
+    # Only the uint8 rounding of the converted reference differs.
+    np.testing.assert_allclose(out, ref, atol=1.01)
+
+
+def test_bilinear_nv12_resizes_before_converting():
+    # With flat chroma, converting after the resize is the same linear map.
+    frames = nv12_frames(1, 16, 24)
+    frames[:, :16] = 60 + frames[:, :16] % 120  # keep the reference clear of 0 and 255
+    frames[:, 16:] = 140
+    pre = Preprocessor(10, 14, 1, interpolation="bilinear")
+    out = pre.run(frames, "nv12").copy()
+    np.testing.assert_allclose(out, pre.run(nv12_to_rgb(frames), "rgb"), atol=1.01)
+
+
+def test_roi_items_equal_preprocessing_the_crops():
+    rng = np.random.default_rng(3)
+    frames = rng.integers(0, 256, (2, 20, 30, 4), dtype=np.uint8)
+    rois = np.array([[4, 2, 10, 8], [0, 0, 30, 20], [12, 6, 6, 12]], np.float32)
+    pre = Preprocessor(8, 8, 4)
+    out = pre.run(frames, "rgba", rois=rois, frame_index=[0, 1, 1]).copy()
+    for k, (x, y, w, h) in enumerate(rois.astype(int)):
+        f = [0, 1, 1][k]
+        crop = np.ascontiguousarray(frames[f, y:y + h, x:x + w])
+        np.testing.assert_allclose(Preprocessor(8, 8, 1).run(crop, "rgba")[0], out[k], atol=1e-4)
+
+
+def test_batch_and_out_validation():
+    pre = Preprocessor(4, 4, 1)
+    with pytest.raises(ValueError, match="2 items for a batch of 1"):
+        pre.run(np.zeros((2, 4, 4, 3), np.uint8), "rgb")
+    with pytest.raises(ValueError, match="unknown format"):
+        pre.run(np.zeros((1, 4, 4, 3), np.uint8), "bgr")
+    dest = np.zeros((2, 3, 4, 4), np.float32)
+    pre.run(np.full((4, 4, 3), 7, np.uint8), "rgb", out=dest[1:])
+    assert (dest[1] == 7).all() and (dest[0] == 0).all()
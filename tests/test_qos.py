@@ -0,0 +1,79 @@
+import pytest
+
+from iva.qos import (BEST_EFFORT, CRITICAL, Level, OverloadController, StreamPolicy, ladder,
+                     simulate)
+
+
+def test_ladder_degrades_sgie_then_interval_then_fps():
+    policy = StreamPolicy(0, fps=30.0, min_fps=5.0)
+    assert ladder(policy) == [Level(30.0, 0, True), Level(30.0, 0, False), Level(30.0, 1, False),
+                              Level(30.0, 2, False), Level(30.0, 4, False),
+                              Level(15.0, 4, False), Level(7.5, 4, False), Level(5.0, 4, False)]
+    assert ladder(policy, fps_only=True) == [Level(30.0), Level(15.0), Level(7.5), Level(5.0)]
+    assert ladder(StreamPolicy(1, CRITICAL)) == [Level(30.0)]
+    costs = [level.cost() for level in ladder(policy)]
+    assert costs == sorted(costs, reverse=True)
+
+
+def test_policy_round_trips_and_rejects_unknown_classes():
+    policy = StreamPolicy(3, CRITICAL, fps=25.0, priority=2, sgie=False)
+    assert StreamPolicy.from_dict(policy.to_dict()) == policy
+    with pytest.raises(ValueError, match="qos must be one of"):
+        StreamPolicy(0, "gold")
+
+
+def test_overload_sheds_lowest_priority_and_calm_restores():
+    now = [0.0]
+    applied = []
+    controller = OverloadController(
+        [StreamPolicy(0, CRITICAL), StreamPolicy(1, priority=1), StreamPolicy(2, priority=0)],
+        recover_after=2.0, apply=lambda sid, level: applied.append(sid),
+        clock=lambda: now[0])
+    controller.step()
+    for t in (1.0, 2.0):
+        now[0] = t
+        for _ in range(20):
+            controller.observe(0.3)
+        controller.step()
+        if t == 1.0:
+            # Priority 0 pays first.
+            assert applied == [2] * len(applied) and applied
+    assert controller.level(0) == Level(30.0)
+    assert controller.streams[1].level > 0 and 0 not in applied
+    shed = {sid: controller.streams[sid].level for sid in (1, 2)}
+    for t in range(3, 12):
+        now[0] = float(t)
+        controller.observe(0.005)
+        controller.step()
+    assert controller.changes[-1].reason.startswith("restore")
+    assert sum(controller.streams[sid].level for sid in (1, 2)) < sum(shed.values())
+
+
+def test_critical_streams_keep_their_sla_under_overload():
+    result, controller = simulate(num_streams=8, num_critical=2, overload=1.5, seconds=40.0,
+                                  warmup=10.0)
+    rows = result.rows(sla_ms=200.0)
+    assert all(r["sla_ok"] for r in rows if r["qos"] == CRITICAL)
+    assert any(controller.streams[sid].level for sid in range(2, 8))
+    baseline, _ = simulate(num_streams=8, num_critical=2, overload=1.5, seconds=40.0,
+                           warmup=10.0, controlled=False)
+    assert not all(r["sla_ok"] for r in baseline.rows(200.0) if r["qos"] == CRITICAL)
+
+
+def test_gates_follow_the_level():
+    controller = OverloadController([StreamPolicy(0, min_fps=7.5)], clock=lambda: 0.0)
+    state = controller.streams[0]
+    state.level = state.steps.index(Level(15.0, 4, False))
+    admitted = [controller.admit(0) for _ in range(30)]
+    assert sum(admitted) == 15 and admitted[:4] == [False, True, False, True]
+    assert not controller.classify(0)
+    assert controller.admit(9) and controller.infer(9) and controller.classify(9)
+
+
+def test_drop_probe_needs_fps_only_and_mux_properties():
+    with pytest.raises(ValueError, match="fps_only=True"):
+        OverloadController([StreamPolicy(0)]).drop_probe(0)
+    controller = OverloadController([StreamPolicy(0, fps=25.0), StreamPolicy(1, BEST_EFFORT)],
+                                    fps_only=True)
+    assert controller.mux_properties() == {"live-source": 1, "batch-size": 2,
+                                           "batched-push-timeout": 33333}
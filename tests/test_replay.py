@@ -0,0 +1,41 @@
+from iva.meta import FrameMeta, ObjectMeta
+from iva.replay import ReplaySource, read_frames, record
+
+NS = 10**9
+INTERVAL = NS // 30
+
+
+def recording(sources=4, frames=30):
+    return [FrameMeta(source_id=s, frame_num=n, pts=n * INTERVAL,
+                      objects=[ObjectMeta(0, 1.0, 2.0, 3.0, 4.0)])
+            for n in range(frames) for s in range(sources)]
+
+
+def test_loops_continue_one_frame_interval_per_source_later():
+    frames = list(ReplaySource(recording(), speed=None, loops=2).frames())
+    assert len(frames) == 2 * 4 * 30
+    first_of_loop2 = frames[4 * 30]
+    assert first_of_loop2.pts == 30 * INTERVAL
+    assert first_of_loop2.frame_num == 30
+    pts = [f.pts for f in frames if f.source_id == 2]
+    assert all(b - a == INTERVAL for a, b in zip(pts, pts[1:]))
+
+
+def test_round_trip_through_a_recording(tmp_path):
+    path = str(tmp_path / "rec.jsonl.gz")
+    assert record(recording(2, 5), path) == 10
+    back = list(read_frames(path))
+    assert [f.to_dict() for f in back] == [f.to_dict() for f in recording(2, 5)]
+
+
+def test_real_time_pacing_sleeps_for_media_time():
+    now = [0.0]
+
+    def sleep(dt):
+        now[0] += dt
+
+    source = ReplaySource(recording(1, 31), speed=2.0, clock=lambda: now[0], sleep=sleep)
+    stats = source.run(lambda frame: None)
+    assert stats.frames == 31
+    assert abs(stats.elapsed - 0.5) < 1e-6
+    assert abs(stats.speedup - 2.0) < 1e-6
@@ -0,0 +1,89 @@
+import time
+
+from iva.sources import Backoff, LiveSource, LoopbackCameraServer, SocketConnector
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def make_source(server, frames, healthy_after=10.0, initial_latency_ms=200):
+    backoff = Backoff(initial=0.02, factor=2.0, maximum=1.0, jitter=0.0)
+    return LiveSource(0, server.uri, SocketConnector(),
+                      lambda sid, pts, payload: frames.append(pts),
+                      stall_timeout=1.0, backoff=backoff,
+                      initial_latency_ms=initial_latency_ms, healthy_after=healthy_after)
+
+
+def test_reconnects_after_drop_and_backoff_grows_while_flapping():
+    server = LoopbackCameraServer(fps=100, payload_size=64).start()
+    frames = []
+    source = make_source(server, frames)
+    source.start()
+    try:
+        for n in range(1, 4):
+            assert wait_for(lambda: source.health.connects == n and len(frames) > 0)
+            frames.clear()
+            server.drop_clients()
+        assert wait_for(lambda: source.health.reconnects >= 3)
+        # Every connection died within healthy_after, so the backoff kept
+        # growing instead of restarting at the initial delay.
+        assert source.backoff.attempt >= 3
+        assert source.health.errors >= 3
+    finally:
+        source.stop()
+        server.stop()
+
+
+def test_backoff_resets_after_healthy_period():
+    server = LoopbackCameraServer(fps=100, payload_size=64).start()
+    frames = []
+    source = make_source(server, frames, healthy_after=0.2)
+    source.start()
+    try:
+        assert wait_for(lambda: len(frames) > 0)
+        server.drop_clients()
+        assert wait_for(lambda: source.health.reconnects == 1)
+        assert source.backoff.attempt >= 1
+        assert wait_for(lambda: source.backoff.attempt == 0)
+    finally:
+        source.stop()
+        server.stop()
+
+
+def test_latency_sized_from_measured_jitter():
+    server = LoopbackCameraServer(fps=10, payload_size=64, jitter=0.08).start()
+    frames = []
+    source = make_source(server, frames)
+    source.start()
+    try:
+        assert wait_for(lambda: len(frames) >= 25)
+        server.drop_clients()
+        assert wait_for(lambda: source.health.errors == 1)
+        expected = source.jitter.recommended_latency_ms()
+        assert source.health.latency_ms == expected
+        assert expected > 50
+    finally:
+        source.stop()
+        server.stop()
+
+
+def test_latency_kept_when_connect_fails_without_samples():
+    server = LoopbackCameraServer(fps=100, payload_size=64)
+    uri = server.uri
+    server.stop()  # nothing listens: every connect is refused
+    backoff = Backoff(initial=0.01, factor=2.0, maximum=0.05, jitter=0.0)
+    source = LiveSource(0, uri, SocketConnector(), lambda *a: None,
+                        backoff=backoff, initial_latency_ms=200)
+    source.start()
+    try:
+        assert wait_for(lambda: source.health.errors >= 3)
+        assert source.health.latency_ms == 200
+        assert source.backoff.attempt >= 3
+    finally:
+        source.stop()
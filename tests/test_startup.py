@@ -0,0 +1,104 @@
+import threading
+
+import pytest
+
+from iva.config import DSConfig
+from iva.meta import FrameMeta, ObjectMeta
+from iva.pipeline import PipelineBuilder
+from iva.startup import (LazySgieLoader, StartupProfile, element_factories, pin_engines,
+                         serialized_engine_path, warm_env)
+
+
+def test_element_factories_skip_caps_properties_and_pad_refs():
+    desc = PipelineBuilder(["a.h264"], pgie_config="pgie.txt").describe()
+    assert element_factories(desc) == [
+        "nvstreammux", "nvinfer", "nvvidconv", "nvosd", "videoconvert", "x264enc",
+        "qtmux", "filesink", "filesrc", "h264parse", "nvdec_h264", "queue"]
+
+
+def test_profile_totals_and_report():
+    profile = StartupProfile()
+    profile.add("registry", 1.0)
+    profile.add("plugins", 0.5)
+    profile.add("plugins", 0.25)
+    profile.elements.update(pgie=3.0, sink=0.1)
+    assert profile.total == 1.75
+    assert profile.as_dict()["phases"] == {"registry": 1.0, "plugins": 0.75}
+    assert profile.report().splitlines()[3].split() == ["pgie", "3.000s", "(to", "PAUSED)"]
+
+
+def test_warm_env_disables_registry_updates():
+    env = warm_env("/tmp/reg.bin", base={"PATH": "/bin"})
+    assert env == {"PATH": "/bin", "GST_REGISTRY": "/tmp/reg.bin",
+                   "GST_REGISTRY_UPDATE": "no", "GST_REGISTRY_FORK": "no"}
+
+
+def write_config(path, extra=""):
+    path.write_text("[property]\nonnx-file=../models/det.onnx\nbatch-size=4\n"
+                    "network-mode=2\n" + extra)
+    return str(path)
+
+
+def test_pin_engines_points_configs_at_serialized_engines(tmp_path):
+    (tmp_path / "configs").mkdir()
+    (tmp_path / "models").mkdir()
+    config = write_config(tmp_path / "configs" / "pgie.txt")
+    engine = serialized_engine_path(config)
+    assert engine == str(tmp_path / "models" / "det.onnx_b4_fp16.engine")
+    assert pin_engines([config]) == [(config, engine, "missing")]
+    open(engine, "wb").close()
+    assert pin_engines([config]) == [(config, engine, "pinned")]
+    assert DSConfig.read(config).property("model-engine-file") == "../models/det.onnx_b4_fp16.engine"
+    assert pin_engines([config]) == [(config, engine, "ok")]
+
+
+class FakeElement:
+    def __init__(self, name, log):
+        self.name = name
+        self.log = log
+        self.props = {}
+        self.locked = False
+
+    def set_locked_state(self, locked):
+        self.locked = locked
+
+    def sync_state_with_parent(self):
+        self.log.append(self.name)
+
+    def set_property(self, key, value):
+        self.props[key] = value
+
+    def get_static_pad(self, name):
+        return name
+
+
+class FakePipeline:
+    def __init__(self, names):
+        self.log = []
+        self.elements = {n: FakeElement(n, self.log) for n in names}
+
+    def get_by_name(self, name):
+        return self.elements.get(name)
+
+
+def test_lazy_loader_starts_sgies_on_the_first_vehicle():
+    pipeline = FakePipeline(["sgie_queue", "sgie0", "sgie1", "sgie_valve", "sgie_sel"])
+    loader = LazySgieLoader(pipeline)
+    assert all(pipeline.elements[n].locked for n in ("sgie_queue", "sgie0", "sgie1"))
+    loaded = threading.Event()
+    loader.load = lambda: (LazySgieLoader.load(loader), loaded.set())
+    loader(FrameMeta(source_id=0, frame_num=0, pts=0, objects=[ObjectMeta(2, 0, 0, 1, 1)]))
+    assert not loader.triggered
+    vehicle = FrameMeta(source_id=0, frame_num=1, pts=1, objects=[ObjectMeta(0, 0, 0, 1, 1)])
+    loader(vehicle)
+    loader(vehicle)
+    assert loaded.wait(2.0)
+    # Downstream first, so the queue never pushes into an unloaded SGIE.
+    assert pipeline.log == ["sgie1", "sgie0", "sgie_queue"]
+    assert pipeline.elements["sgie_valve"].props == {"drop": False}
+    assert pipeline.elements["sgie_sel"].props == {"active-pad": "sink_1"}
+
+
+def test_lazy_loader_needs_a_lazy_pipeline():
+    with pytest.raises(ValueError, match="lazy_sgie"):
+        LazySgieLoader(FakePipeline(["sgie_queue"]))
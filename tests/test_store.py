@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from iva.meta import FrameMeta, ObjectMeta
+from iva.store import MANIFEST, DetectionStore, partition_of
+
+NS = 10**9
+HOUR = 3600 * NS
+T0 = 1_600_000_000 * NS - (1_600_000_000 * NS) % HOUR
+
+
+def frame(ts, source_id=0, objects=()):
+    return FrameMeta(source_id=source_id, frame_num=ts // NS, pts=ts, ntp_timestamp=ts,
+                     objects=list(objects))
+
+
+def obj(object_id, class_id=0, confidence=0.9, **labels):
+    return ObjectMeta(class_id, 10.0, 20.0, 30.0, 40.0, confidence=confidence,
+                      object_id=object_id, labels=labels)
+
+
+def fill(store):
+    with store.writer(segment_rows=4) as writer:
+        for i in range(12):
+            ts = T0 + i * 600 * NS  # two hours, ten minutes apart
+            writer(frame(ts, source_id=i % 2, objects=[
+                obj(i, class_id=i % 3, confidence=0.1 * (i % 10),
+                    **({"color": "red" if i % 4 == 0 else "blue"} if i % 2 == 0 else {}))]))
+
+
+def test_predicates_match_a_full_scan(tmp_path):
+    store = DetectionStore(str(tmp_path))
+    fill(store)
+    everything = store.query()
+    assert everything.num_rows == 12
+    table = store.query(start=T0 + HOUR, source_id=0, min_confidence=0.5)
+    expected = [r for r in everything.to_pylist()
+                if r["ts"] >= T0 + HOUR and r["source_id"] == 0 and r["confidence"] >= 0.5]
+    assert table.to_pylist() == expected
+
+
+def test_plan_prunes_partitions_zone_maps_and_tracks(tmp_path):
+    store = DetectionStore(str(tmp_path))
+    fill(store)
+    assert {s.partition for s in store.segments} == {partition_of(T0), partition_of(T0 + HOUR)}
+    assert len(store.plan(start=T0 + HOUR)) < len(store.segments)
+    assert len(store.plan(object_id=7)) == 1
+    assert store.query(object_id=7)["object_id"].to_pylist() == [7]
+
+
+def test_label_query_and_columns(tmp_path):
+    store = DetectionStore(str(tmp_path))
+    fill(store)
+    red = store.query(labels={"color": "red"}, columns=["object_id", "label_color"])
+    assert red.column_names == ["object_id", "label_color"]
+    assert red["object_id"].to_pylist() == [0, 4, 8]
+    empty = store.query(object_id=999, columns=["ts", "label_color"])
+    assert empty.num_rows == 0 and empty.column_names == ["ts", "label_color"]
+    with pytest.raises(ValueError, match="nope"):
+        store.query(object_id=999, columns=["nope"])
+
+
+def test_reopen_reads_append_only_manifests_and_skips_torn_lines(tmp_path):
+    store = DetectionStore(str(tmp_path))
+    fill(store)
+    ids = [s.id for s in store.segments]
+    manifest = os.path.join(str(tmp_path), partition_of(T0), MANIFEST)
+    with open(manifest, "a") as fp:
+        fp.write('{"id": 99, "pa')
+    reopened = DetectionStore(str(tmp_path))
+    assert [s.id for s in reopened.segments] == ids
+    assert reopened.tracks == store.tracks
+    with reopened.writer() as writer:
+        writer(frame(T0 + 5, objects=[obj(100)]))
+    again = DetectionStore(str(tmp_path))
+    assert [s.id for s in again.segments] == ids + [max(ids) + 1]
+    assert again.query(object_id=100).num_rows == 1
@@ -0,0 +1,54 @@
+import numpy as np
+
+from iva.dewarp import RemapTable
+from iva.meta import FrameMeta, ObjectMeta
+from iva.surface_scheduler import SurfaceMotion, SurfaceScheduler
+
+
+def test_idle_surfaces_probe_staggered():
+    scheduler = SurfaceScheduler(4, idle_after=1.0, probe_every=4, clock=lambda: 100.0)
+    selections = [scheduler.select(n) for n in range(4)]
+    # Each idle surface probes once per cycle, never two on the same frame.
+    assert selections == [[0], [3], [2], [1]]
+    assert scheduler.savings() == 0.75
+
+
+def test_detections_and_motion_keep_a_surface_active():
+    now = [0.0]
+    scheduler = SurfaceScheduler(3, idle_after=2.0, probe_every=100,
+                                 motion_threshold=4.0, clock=lambda: now[0])
+    scheduler(FrameMeta(source_id=1, frame_num=0, pts=0,
+                        objects=[ObjectMeta(0, 0.0, 0.0, 1.0, 1.0)]))
+    scheduler.report_motion(2, 1.0)
+    assert scheduler.select(1) == [1]
+    now[0] = 1.5
+    scheduler.report_motion(2, 5.0)
+    assert scheduler.select(2) == [1, 2]
+    now[0] = 3.0
+    assert scheduler.select(3) == [2]
+    assert scheduler.selected == [2]
+    scheduler(FrameMeta(source_id=7, frame_num=0, pts=0))  # not a surface: ignored
+
+
+def test_mux_properties_push_short_batches_after_one_frame():
+    assert SurfaceScheduler(4).mux_properties(fps=25.0) == {
+        "batch-size": 4, "batched-push-timeout": 40000}
+
+
+def test_motion_score_samples_the_surface_footprint():
+    map_x = np.tile(np.arange(4, dtype=np.float32), (4, 1))
+    table = RemapTable.from_maps(map_x, map_x.T.copy(), 8, 8)
+    motion = SurfaceMotion(table, step=2)
+    frame = np.zeros((8, 8), np.uint8)
+    assert motion.score(frame) == 0.0
+    frame[6:, 6:] = 255  # outside the footprint
+    assert motion.score(frame) == 0.0
+    frame[0, 0] = 40
+    assert motion.score(frame) == 10.0
+
+
+def test_surface_outside_the_frame_scores_zero():
+    off = np.full((2, 2), -10.0, np.float32)
+    motion = SurfaceMotion(RemapTable.from_maps(off, off, 8, 8), step=1)
+    assert motion.score(np.zeros((8, 8, 3), np.uint8)) == 0.0
+    assert motion.score(np.full((8, 8, 3), 255, np.uint8)) == 0.0
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from iva.config import DSConfig
+from iva.meta import FrameMeta, ObjectMeta
+from iva.thresholds import (Detections, TensorRecording, counts, curves, match, permissive_config,
+                            pick, read_thresholds, threshold_vector, write_thresholds)
+
+
+def test_threshold_vector_forms():
+    assert threshold_vector(0.5, 3).tolist() == [0.5, 0.5, 0.5]
+    assert threshold_vector([0.2, 0.4], 4).tolist() == pytest.approx([0.2, 0.4, 0.4, 0.4])
+    assert threshold_vector({2: 0.7}, 3).tolist() == pytest.approx([0.0, 0.0, 0.7])
+
+
+def frames_of(boxes_per_frame):
+    return [FrameMeta(source_id=0, frame_num=n, pts=n,
+                      objects=[ObjectMeta(c, x, 0.0, 10.0, 10.0, confidence=p)
+                               for c, x, p in objs])
+            for n, objs in enumerate(boxes_per_frame)]
+
+
+def random_detections(seed=0, frames=50):
+    rng = np.random.default_rng(seed)
+    return frames_of([[(int(rng.integers(3)), float(rng.uniform(0, 500)), float(rng.uniform()))
+                       for _ in range(int(rng.integers(0, 6)))] for _ in range(frames)])
+
+
+def test_curve_counts_equal_a_mask_per_threshold():
+    dets = Detections.from_frames(random_detections())
+    grid = [0.1, 0.35, 0.5, 0.9]
+    table = curves(dets, grid)
+    for c, curve in table.items():
+        for i, t in enumerate(grid):
+            assert curve.count[i] == counts(dets, [t] * 3)[c]
+
+
+def test_greedy_match_by_confidence_and_precision_recall():
+    index = {}
+    dets = Detections.from_frames(frames_of([[(0, 0.0, 0.9), (0, 1.0, 0.8), (0, 100.0, 0.3)]]),
+                                  index)
+    labels = Detections.from_frames(frames_of([[(0, 0.0, 1.0), (0, 200.0, 1.0)]]), index)
+    tp = match(dets, labels)
+    # The 0.9 detection takes the only overlapping label; 0.8 is a duplicate.
+    assert tp.tolist() == [True, False, False]
+    curve = curves(dets, [0.2, 0.85], tp, labels)[0]
+    assert curve.precision.tolist() == pytest.approx([1 / 3, 1.0])
+    assert curve.recall.tolist() == pytest.approx([0.5, 0.5])
+    assert pick(curve, "f1") == 0.85
+    assert pick(curve, "precision", min_precision=0.9) == 0.85
+    with pytest.raises(ValueError, match="needs labels"):
+        pick(curves(dets, [0.5])[0])
+
+
+def write_config(tmp_path):
+    path = tmp_path / "pgie.txt"
+    path.write_text("[property]\nnum-detected-classes=4\n"
+                    "class-thresholds=0.2;0.2;0.2;0.2\n\n"
+                    "# vehicle override\n[class-attrs-0]\nthreshold=0.95\neps=0.2\n\n"
+                    "[class-attrs-2]\neps=0.3\n")
+    return str(path)
+
+
+def test_write_back_updates_class_attrs_groups(tmp_path):
+    path = write_config(tmp_path)
+    write_thresholds(path, [0.6, 0.45, 0.5, 0.7])
+    cfg = DSConfig.read(path)
+    assert read_thresholds(path) == [0.6, 0.45, 0.5, 0.7]
+    assert cfg.get_float("class-attrs-0", "threshold") == 0.6
+    assert cfg.get("class-attrs-0", "eps") == "0.2"
+    # A group without a threshold keeps deferring to the list.
+    assert cfg.get("class-attrs-2", "threshold") is None
+    assert "# vehicle override" in open(path).read()
+
+
+def test_permissive_config_lowers_every_class(tmp_path):
+    src = write_config(tmp_path)
+    dst = str(tmp_path / "permissive.txt")
+    permissive_config(src, dst, floor=0.01, tensor_meta=True)
+    cfg = DSConfig.read(dst)
+    assert read_thresholds(dst) == [0.01] * 4
+    assert cfg.get_float("class-attrs-0", "threshold") == 0.01
+    assert cfg.get_int("property", "output-tensor-meta") == 1
+    assert read_thresholds(src) == [0.2] * 4
+
+
+def test_tensor_recording_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    rec = TensorRecording([(0, 0), (1, 5)], rng.random((2, 4, 3, 5), np.float32),
+                          rng.random((2, 16, 3, 5), np.float32), 640, 360)
+    path = str(tmp_path / "tensors.npz")
+    rec.save(path)
+    loaded = TensorRecording.load(path)
+    assert loaded.frames == [(0, 0), (1, 5)]
+    assert (loaded.frame_width, loaded.frame_height, loaded.num_classes) == (640, 360, 4)
+    np.testing.assert_array_equal(loaded.cov, rec.cov)
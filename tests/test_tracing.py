@@ -0,0 +1,80 @@
+import pytest
+
+from iva.tracing import EVENT_ENTER, EVENT_EXIT, SampledTracer, element_latencies, load
+
+
+def test_every_nth_buffer_is_sampled_per_source():
+    tracer = SampledTracer(every_n=3)
+    picked = {0: [], 1: []}
+    for pts in range(9):
+        for source_id in (0, 1):
+            if tracer.sample(pts, source_id):
+                picked[source_id].append(pts)
+    assert picked == {0: [0, 3, 6], 1: [0, 3, 6]}
+
+
+def test_source_filter_skips_other_sources():
+    tracer = SampledTracer(every_n=1, source_ids=[1])
+    assert not tracer.sample(0, source_id=0)
+    assert tracer.sample(0, source_id=1)
+
+
+def test_equal_pts_on_two_sources_stay_apart():
+    tracer = SampledTracer(every_n=2)
+    assert tracer.sample(100, source_id=0)
+    tracer.sample(200, source_id=0)
+    tracer.sample(300, source_id=1)
+    assert not tracer.sample(100, source_id=1)
+    eid = tracer.element_id("decoder")
+    tracer.record(eid, 100, EVENT_ENTER, source_id=1)
+    assert tracer.ring.records() == []
+    tracer.record(eid, 100, EVENT_ENTER, source_id=0)
+    assert [r.seq for r in tracer.ring.records()] == [1]
+
+
+def test_shared_element_records_every_sampled_frame_with_the_pts():
+    tracer = SampledTracer(every_n=1)
+    tracer.sample(100, source_id=0)
+    tracer.sample(100, source_id=1)
+    eid = tracer.element_id("pgie")
+    tracer.record(eid, 100, EVENT_ENTER)
+    tracer.record(eid, 100, EVENT_EXIT)
+    assert sorted(r.seq for r in tracer.ring.records()) == [1, 1, 2, 2]
+    assert len(element_latencies(tracer.elements, tracer.ring.records())["pgie"]) == 2
+
+
+def test_ring_keeps_the_newest_records_in_order():
+    tracer = SampledTracer(every_n=1, capacity=4)
+    eid = tracer.element_id("queue")
+    for pts in range(6):
+        tracer.sample(pts, source_id=0)
+        tracer.record(eid, pts, EVENT_ENTER, source_id=0)
+    assert [r.pts for r in tracer.ring.records()] == [2, 3, 4, 5]
+    assert tracer.ring.written == 6
+
+
+def test_dump_round_trip(tmp_path):
+    tracer = SampledTracer(every_n=1, capacity=8)
+    eid = tracer.element_id("nvinfer")
+    tracer.sample(7, source_id=0)
+    tracer.record(eid, 7, EVENT_ENTER, source_id=0)
+    tracer.record(eid, 7, EVENT_EXIT, source_id=0)
+    path = str(tmp_path / "trace.bin")
+    assert tracer.dump(path) == 2
+    names, records = load(path)
+    assert names == ["nvinfer"]
+    assert records == tracer.ring.records()
+    (tmp_path / "junk.bin").write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        load(str(tmp_path / "junk.bin"))
+
+
+def test_from_env(monkeypatch):
+    monkeypatch.delenv("IVA_TRACE", raising=False)
+    assert SampledTracer.from_env() is None
+    monkeypatch.setenv("IVA_TRACE", "every=10,sources=0;3,capacity=16")
+    tracer = SampledTracer.from_env()
+    assert (tracer.every_n, tracer.source_ids, tracer.ring.capacity) == (10, {0, 3}, 16)
+    monkeypatch.setenv("IVA_TRACE", "every=10,bogus=1")
+    with pytest.raises(ValueError, match="bogus"):
+        SampledTracer.from_env()
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from iva.analytics import AnalyticsEngine, PolygonZones, Zone
+from iva.meta import FrameMeta, ObjectMeta
+from iva.zone_index import GridZoneIndex, RasterZoneIndex, random_zones
+
+W, H = 1280, 720
+
+
+def footpoints(n, seed=1):
+    rng = np.random.default_rng(seed)
+    # Include points beyond the frame, where no zone can match.
+    return rng.uniform(-50, W + 50, n), rng.uniform(-50, H + 50, n)
+
+
+@pytest.mark.parametrize("n_zones,cell", [(1, 0.0), (10, 0.0), (100, 0.0), (100, 7.0)])
+def test_grid_matches_brute_force_exactly(n_zones, cell):
+    zones = random_zones(n_zones, W, H, seed=n_zones)
+    xs, ys = footpoints(5000)
+    grid = GridZoneIndex(zones, cell=cell)
+    expected = PolygonZones(zones).contains(xs, ys)
+    assert expected.any()
+    np.testing.assert_array_equal(grid.contains(xs, ys), expected)
+    p, z = grid.pairs(xs, ys)
+    assert sorted(zip(p.tolist(), z.tolist())) == sorted(zip(*np.nonzero(expected)))
+
+
+def test_grid_handles_concave_and_overlapping_zones():
+    zones = [Zone("u", ((0, 0), (300, 0), (300, 300), (200, 300), (200, 100),
+                        (100, 100), (100, 300), (0, 300))),
+             Zone("box", ((50, 50), (250, 50), (250, 250), (50, 250)))]
+    xs, ys = np.meshgrid(np.arange(-10.5, 320, 3.0), np.arange(-10.5, 320, 3.0))
+    xs, ys = xs.ravel(), ys.ravel()
+    np.testing.assert_array_equal(GridZoneIndex(zones, cell=16.0).contains(xs, ys),
+                                  PolygonZones(zones).contains(xs, ys))
+
+
+def test_raster_is_exact_away_from_borders():
+    zones = [Zone("a", ((100, 100), (500, 100), (500, 400), (100, 400)))]
+    raster = RasterZoneIndex(zones, W, H, scale=0.5)
+    xs = np.array([300.0, 101.0, 50.0, -5.0, 2000.0])
+    ys = np.array([250.0, 399.0, 50.0, 10.0, 10.0])
+    assert raster.contains(xs, ys)[:, 0].tolist() == [True, True, False, False, False]
+    zones = random_zones(50, W, H)
+    xs, ys = footpoints(5000)
+    agreement = (RasterZoneIndex(zones, W, H).contains(xs, ys)
+                 == PolygonZones(zones).contains(xs, ys)).mean()
+    assert agreement > 0.99
+
+
+def test_grid_requires_zones():
+    with pytest.raises(ValueError, match="no zones"):
+        GridZoneIndex([])
+
+
+def test_engine_gives_the_same_events_with_the_grid_index():
+    rois = {"*": {"zones": [{"name": z.name, "polygon": [list(p) for p in z.polygon]}
+                            for z in random_zones(20, W, H, seed=3)]}}
+    brute = AnalyticsEngine(rois)
+    grid = AnalyticsEngine(rois, hit_test_factory=GridZoneIndex)
+    rng = np.random.default_rng(4)
+    pos = rng.uniform(0, [W, H], (30, 2))
+    for n in range(60):
+        pos += rng.normal(0, 15, pos.shape)
+        objs = [ObjectMeta(0, x - 5, y - 10, 10, 10, object_id=i) for i, (x, y) in enumerate(pos)]
+        frame = FrameMeta(source_id=0, frame_num=n, pts=n, objects=objs)
+        assert [(e.kind, e.object_id, e.name) for e in brute(frame)] == \
+               [(e.kind, e.object_id, e.name) for e in grid(frame)]
+    assert brute.report() == grid.report()